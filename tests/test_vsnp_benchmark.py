@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_benchmark_methods import BenchmarkMethods
+from vsnp.vsnp_tree_methods import VSNPTreeMethods
+import shutil
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+benchmark_path = os.path.join(test_path, 'files', 'benchmark')
+dependency_path = os.path.join(os.path.dirname(test_path), 'dependencies')
+contig_dict = {'NC_017251.1': 30000, 'NC_017250.1': 20000}
+
+
+def test_reference_details():
+    reference_file, reference_link_path = BenchmarkMethods.reference_details(species_code='suis1',
+                                                                             dependency_path=dependency_path)
+    assert reference_file == 'NC_017251-NC_017250.fasta'
+    assert reference_link_path == 'brucella/suis1/script_dependents'
+
+
+def test_load_contigs():
+    loaded_contig_dict = BenchmarkMethods.load_contigs(reference_fai=os.path.join(
+        dependency_path, 'brucella', 'suis1', 'script_dependents', 'NC_017251-NC_017250.fasta.fai'))
+    assert loaded_contig_dict == {'NC_017251.1': 2107783, 'NC_017250.1': 1207380}
+
+
+def test_load_reference_bases():
+    global reference_seq_dict
+    reference_seq_dict = BenchmarkMethods.load_reference_bases(reference_fasta='not_a_real_file',
+                                                               contig_dict=contig_dict)
+    assert len(reference_seq_dict['NC_017250.1']) == 20000
+    assert set(reference_seq_dict['NC_017251.1']) == {'A', 'C', 'G', 'T'}
+
+
+def test_synthetic_population():
+    global strain_variant_dict
+    strain_variant_dict = BenchmarkMethods.synthetic_population(contig_dict=contig_dict,
+                                                                reference_seq_dict=reference_seq_dict,
+                                                                num_strains=6,
+                                                                snp_density=2000,
+                                                                num_clades=2,
+                                                                deletion_blocks=2,
+                                                                deletion_length=50,
+                                                                defining_positions=[('NC_017251.1', 1500)])
+    assert sorted(strain_variant_dict) == ['SYN-000001', 'SYN-000002', 'SYN-000003', 'SYN-000004', 'SYN-000005',
+                                           'SYN-000006']
+    # The defining SNP is assigned to the first clade
+    first_clade = strain_variant_dict['SYN-000001']['NC_017251.1']
+    assert 1500 in first_clade['snps'] or 1500 in first_clade['insertions']
+    assert 1500 not in strain_variant_dict['SYN-000002']['NC_017251.1']['snps']
+
+
+def test_create_deepvariant_gvcfs():
+    global deepvariant_vcf_dict
+    deepvariant_vcf_dict = BenchmarkMethods.create_synthetic_gvcfs(strain_variant_dict=strain_variant_dict,
+                                                                   contig_dict=contig_dict,
+                                                                   reference_seq_dict=reference_seq_dict,
+                                                                   output_path=os.path.join(benchmark_path,
+                                                                                            'deepvariant'),
+                                                                   variant_caller='deepvariant')
+    assert os.path.isfile(deepvariant_vcf_dict['SYN-000001'])
+    assert deepvariant_vcf_dict['SYN-000001'].endswith('.gvcf.gz')
+
+
+def test_load_synthetic_gvcf():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_multiprocessing(strain_name='SYN-000003',
+                                                  strain_vcf_dict=deepvariant_vcf_dict,
+                                                  qual_cutoff=30)
+    assert best_ref_set_dict['SYN-000003'] == {'NC_017251.1', 'NC_017250.1'}
+    pass_dict, insertion_dict, deletion_dict = \
+        VSNPTreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=parsed_vcf_dict)
+    # Every simulated SNP that is not masked by a deletion must be parsed as a SNP
+    assert 0 < pass_dict['SYN-000003'] <= sum(len(variant_dict['snps']) for variant_dict in
+                                              strain_variant_dict['SYN-000003'].values())
+    assert deletion_dict['SYN-000003'] > 0
+
+
+def test_create_freebayes_gvcfs():
+    global freebayes_vcf_dict
+    freebayes_vcf_dict = BenchmarkMethods.create_synthetic_gvcfs(strain_variant_dict=strain_variant_dict,
+                                                                 contig_dict=contig_dict,
+                                                                 reference_seq_dict=reference_seq_dict,
+                                                                 output_path=os.path.join(benchmark_path, 'freebayes'),
+                                                                 variant_caller='freebayes')
+    assert freebayes_vcf_dict['SYN-000001'].endswith('.gvcf')
+
+
+def test_load_synthetic_vcf():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_vcf(strain_vcf_dict=freebayes_vcf_dict)
+    pass_dict, insertion_dict, deletion_dict = \
+        VSNPTreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=parsed_vcf_dict)
+    assert sorted(parsed_vcf_dict) == sorted(strain_variant_dict)
+    assert pass_dict['SYN-000001'] > 0
+    assert insertion_dict['SYN-000001'] > 0
+
+
+def test_stub_raxml():
+    fasta_file = os.path.join(benchmark_path, 'All_alignment.fasta')
+    with open(fasta_file, 'w') as fasta:
+        fasta.write('>NC_017251-NC_017250\nACGT\n>SYN-000001\nACGA\n>SYN-000002\nACTA\n')
+    species_group_trees = BenchmarkMethods.stub_raxml(group_fasta_dict={'suis1': {'All': fasta_file}},
+                                                      strain_consolidated_ref_dict=dict(),
+                                                      strain_groups=dict(),
+                                                      threads=1,
+                                                      logfile=None)
+    species_group_order_dict = VSNPTreeMethods.parse_tree_order(species_group_trees=species_group_trees)
+    assert sorted(species_group_order_dict['suis1']['All']) == ['NC_017251-NC_017250', 'SYN-000001', 'SYN-000002']
+
+
+def test_instrument_methods():
+    stage_metrics = dict()
+    original_methods = BenchmarkMethods.instrument_methods(method_class=VSNPTreeMethods,
+                                                           stage_metrics=stage_metrics)
+    try:
+        VSNPTreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=dict())
+    finally:
+        BenchmarkMethods.restore_methods(method_class=VSNPTreeMethods,
+                                         original_methods=original_methods)
+    assert stage_metrics['summarise_gvcf_outputs']['calls'] == 1
+    assert stage_metrics['summarise_gvcf_outputs']['peak_rss_mb'] > 0
+    assert vars(VSNPTreeMethods)['summarise_gvcf_outputs'] is original_methods['summarise_gvcf_outputs']
+
+
+def test_write_report():
+    report_file = os.path.join(benchmark_path, 'benchmark.json')
+    BenchmarkMethods.write_report(benchmark_dict={'scales': dict()},
+                                  report_file=report_file)
+    assert os.path.isfile(report_file)
+
+
+def test_remove_benchmark_folder():
+    shutil.rmtree(benchmark_path)
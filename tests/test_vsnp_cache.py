@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_cache_methods import CacheMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+import hashlib
+import shutil
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+cache_test_path = os.path.join(test_path, 'files', 'cache')
+cache_path = os.path.join(cache_test_path, 'cache')
+first_project = os.path.join(cache_test_path, 'first', 'strain')
+second_project = os.path.join(cache_test_path, 'second', 'strain')
+third_project = os.path.join(cache_test_path, 'third', 'strain')
+reads = b'@read\nACGT\n+\nIIII\n'
+
+
+def test_create_files():
+    for strain_folder in (first_project, second_project):
+        os.makedirs(strain_folder, exist_ok=True)
+        with open(os.path.join(strain_folder, 'strain_R1.fastq'), 'wb') as fastq:
+            fastq.write(reads)
+    with open(os.path.join(first_project, 'strain_sorted.bam'), 'wb') as bam:
+        bam.write(b'bam')
+    with open(os.path.join(first_project, 'strain_sorted.bam.bai'), 'wb') as bai:
+        bai.write(b'bai')
+    assert os.path.isfile(os.path.join(second_project, 'strain_R1.fastq'))
+
+
+def test_file_digest():
+    fastq_file = os.path.join(first_project, 'strain_R1.fastq')
+    assert CacheMethods.file_digest(cache_path=cache_path,
+                                    file_path=fastq_file) == hashlib.sha256(reads).hexdigest()
+    # The recorded hash is reused while the file is unchanged
+    CacheMethods.record_digest(cache_path=cache_path,
+                               file_path=fastq_file,
+                               digest='recorded')
+    assert CacheMethods.file_digest(cache_path=cache_path,
+                                    file_path=fastq_file) == 'recorded'
+    CacheMethods.record_digest(cache_path=cache_path,
+                               file_path=fastq_file,
+                               digest=hashlib.sha256(reads).hexdigest())
+
+
+def test_cache_key():
+    global cache_key
+    cache_key = CacheMethods.cache_key(cache_path=cache_path,
+                                       step='mapping',
+                                       strain_name='strain',
+                                       inputs=[os.path.join(first_project, 'strain_R1.fastq')],
+                                       parameters={'reference_mapper': 'bwa'})
+    # The key depends on the contents of the inputs, not their paths
+    assert CacheMethods.cache_key(cache_path=cache_path,
+                                  step='mapping',
+                                  strain_name='strain',
+                                  inputs=[os.path.join(second_project, 'strain_R1.fastq')],
+                                  parameters={'reference_mapper': 'bwa'}) == cache_key
+    assert CacheMethods.cache_key(cache_path=cache_path,
+                                  step='mapping',
+                                  strain_name='strain',
+                                  inputs=[os.path.join(second_project, 'strain_R1.fastq')],
+                                  parameters={'reference_mapper': 'bowtie2'}) != cache_key
+
+
+def test_store_entry():
+    step_outputs = VCFMethods.strain_step_outputs(strain_name='strain',
+                                                  strain_folder=first_project,
+                                                  vcf_path=os.path.join(cache_test_path, 'first', 'vcf_files'))
+    assert CacheMethods.store_entry(cache_path=cache_path,
+                                    key=cache_key,
+                                    step='mapping',
+                                    strain_name='strain',
+                                    strain_folder=first_project,
+                                    outputs=step_outputs['mapping'])
+    # Entries are only stored once
+    assert not CacheMethods.store_entry(cache_path=cache_path,
+                                        key=cache_key,
+                                        step='mapping',
+                                        strain_name='strain',
+                                        strain_folder=first_project,
+                                        outputs=step_outputs['mapping'])
+    stored_bam = os.path.join(CacheMethods.entry_path(cache_path=cache_path,
+                                                      key=cache_key), 'strain_sorted.bam')
+    assert os.path.samefile(stored_bam, os.path.join(first_project, 'strain_sorted.bam'))
+
+
+def test_restore_entry():
+    restored_files = CacheMethods.restore_entry(cache_path=cache_path,
+                                                key=cache_key,
+                                                strain_folder=second_project)
+    assert sorted(os.path.basename(restored_file) for restored_file in restored_files) == \
+        ['strain_sorted.bam', 'strain_sorted.bam.bai']
+    # The restored files are hard links of the files of the first project
+    assert os.path.samefile(os.path.join(first_project, 'strain_sorted.bam'),
+                            os.path.join(second_project, 'strain_sorted.bam'))
+    assert CacheMethods.restore_entry(cache_path=cache_path,
+                                      key='missing',
+                                      strain_folder=second_project) is None
+
+
+def test_restore_entry_failed():
+    # A file that cannot be restored e.g. as the entry was evicted by another project, is treated as a miss
+    os.makedirs(os.path.join(third_project, 'strain_sorted.bam.bai'))
+    assert CacheMethods.restore_entry(cache_path=cache_path,
+                                      key=cache_key,
+                                      strain_folder=third_project) is None
+    # The files that were already restored are removed
+    assert not os.path.isfile(os.path.join(third_project, 'strain_sorted.bam'))
+
+
+def test_cache_stats():
+    stats_dict = CacheMethods.cache_stats(cache_path=cache_path)
+    assert stats_dict['mapping'] == {'entries': 1, 'size': 6, 'hits': 1}
+    assert stats_dict['total'] == stats_dict['mapping']
+
+
+def test_collect_garbage():
+    orphan = CacheMethods.entry_path(cache_path=cache_path,
+                                     key='orphan')
+    os.makedirs(orphan)
+    os.remove(os.path.join(first_project, 'strain_R1.fastq'))
+    garbage_dict = CacheMethods.collect_garbage(cache_path=cache_path,
+                                                max_size=1)
+    assert garbage_dict == {'evicted': 0, 'orphans': 1, 'digests': 1}
+    assert not os.path.isdir(orphan)
+
+
+def test_evict_entries():
+    assert CacheMethods.evict_entries(cache_path=cache_path,
+                                      max_size=0) == [cache_key]
+    assert CacheMethods.cache_stats(cache_path=cache_path)['total']['entries'] == 0
+    # The files hard-linked into the projects are not affected
+    assert os.path.isfile(os.path.join(second_project, 'strain_sorted.bam'))
+
+
+def test_remove_cache_folder():
+    shutil.rmtree(cache_test_path)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_downsample_methods import DownsampleMethods
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+from vsnp.vsnp_qc_methods import QCMethods
+import shutil
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+downsample_path = os.path.join(test_path, 'files', 'downsample')
+strain_folder = os.path.join(downsample_path, 'strain')
+forward_file = os.path.join(strain_folder, 'strain_R1.fastq.gz')
+reverse_file = os.path.join(strain_folder, 'strain_R2.fastq.gz')
+reference_file = os.path.join(downsample_path, 'reference.fasta')
+
+
+def fastq_records(read, count):
+    return [('@read{index}/{read}\n{sequence}\n+\n{quality}\n'.format(index=index,
+                                                                      read=read,
+                                                                      sequence='A' * 100,
+                                                                      quality='I' * 100)).encode()
+            for index in range(count)]
+
+
+def read_names(fastq_file):
+    return [record.split(b'\n')[0].split(b'/')[0] for chunk in FanoutMethods.read_chunks(fastq_file=fastq_file)
+            for record in chunk]
+
+
+def test_create_files():
+    global strain_read_stats_dict
+    os.makedirs(strain_folder, exist_ok=True)
+    strain_read_stats_dict = {'strain': list()}
+    for fastq_file, read in ((forward_file, 1), (reverse_file, 2)):
+        records = fastq_records(read=read, count=2000)
+        with gzip.open(fastq_file, 'wb') as fastq:
+            fastq.write(b''.join(records))
+        stats = QCMethods.empty_stats()
+        QCMethods.update_stats(stats=stats,
+                               data=b''.join(records))
+        strain_read_stats_dict['strain'].append(stats)
+    # A 4 kb reference genome is covered 100 times by the 400 kb of reads
+    with open(reference_file, 'w') as reference:
+        reference.write('>chromosome\n' + 'A' * 3000 + '\n>plasmid\n' + 'A' * 1000 + '\n')
+    assert os.path.isfile(reverse_file)
+
+
+def test_genome_length():
+    assert DownsampleMethods.genome_length(reference_file=reference_file) == 4000
+    # The lengths are read from the faidx index if it exists
+    with open(reference_file + '.fai', 'w') as fai:
+        fai.write('chromosome\t3000\t12\t3000\t3001\nplasmid\t1000\t3022\t1000\t1001\n')
+    assert DownsampleMethods.genome_length(reference_file=reference_file) == 4000
+
+
+def test_total_bases():
+    assert DownsampleMethods.total_bases(stats_list=strain_read_stats_dict['strain']) == 400000
+
+
+def test_downsample_reads():
+    output_files = [os.path.join(downsample_path, 'first_R1.fastq.gz'),
+                    os.path.join(downsample_path, 'first_R2.fastq.gz')]
+    kept_bases = DownsampleMethods.downsample_reads(fastq_files=[forward_file, reverse_file],
+                                                    output_files=output_files,
+                                                    fraction=0.25,
+                                                    chunk_records=300)
+    forward_names = read_names(fastq_file=output_files[0])
+    # Both reads of each retained pair are kept
+    assert forward_names == read_names(fastq_file=output_files[1])
+    assert kept_bases == len(forward_names) * 2 * 100
+    assert 400 < len(forward_names) < 600
+    # The same reads are retained every time
+    repeat_files = [os.path.join(downsample_path, 'repeat_R1.fastq.gz'),
+                    os.path.join(downsample_path, 'repeat_R2.fastq.gz')]
+    DownsampleMethods.downsample_reads(fastq_files=[forward_file, reverse_file],
+                                       output_files=repeat_files,
+                                       fraction=0.25,
+                                       chunk_records=300)
+    assert read_names(fastq_file=repeat_files[0]) == forward_names
+
+
+def test_downsample_strain_reads():
+    strain_coverage_dict, strain_mapping_fastq_dict = \
+        VCFMethods.downsample_strain_reads(strain_fastq_dict={'strain': [forward_file, reverse_file]},
+                                           strain_name_dict={'strain': strain_folder},
+                                           strain_reference_abs_path_dict={'strain': reference_file},
+                                           strain_read_stats_dict=strain_read_stats_dict,
+                                           coverage=50)
+    assert strain_coverage_dict['strain']['estimated'] == 100
+    assert strain_coverage_dict['strain']['fraction'] == 0.5
+    assert 40 < strain_coverage_dict['strain']['effective'] < 60
+    assert strain_mapping_fastq_dict['strain'] == [os.path.join(strain_folder, 'downsampled', 'strain_R1.fastq.gz'),
+                                                   os.path.join(strain_folder, 'downsampled', 'strain_R2.fastq.gz')]
+    # The outputs are recorded as the outputs of the downsample step
+    step_outputs = VCFMethods.strain_step_outputs(strain_name='strain',
+                                                  strain_folder=strain_folder,
+                                                  vcf_path=os.path.join(downsample_path, 'vcf_files'))
+    assert len(ManifestMethods.expand_outputs(outputs=step_outputs['downsample'])) == 3
+
+
+def test_no_downsample():
+    # Strains at or below the requested coverage, and runs without a requested coverage, use the original reads
+    for coverage in (100, None):
+        strain_coverage_dict, strain_mapping_fastq_dict = \
+            VCFMethods.downsample_strain_reads(strain_fastq_dict={'strain': [forward_file, reverse_file]},
+                                               strain_name_dict={'strain': strain_folder},
+                                               strain_reference_abs_path_dict={'strain': reference_file},
+                                               strain_read_stats_dict=strain_read_stats_dict,
+                                               coverage=coverage)
+        assert strain_coverage_dict['strain'] == {'estimated': 100, 'effective': 100}
+        assert strain_mapping_fastq_dict == dict()
+
+
+def test_remove_downsample_folder():
+    shutil.rmtree(downsample_path)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_fanout_methods import FanoutMethods
+import shutil
+import pytest
+import gzip
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+fanout_path = os.path.join(test_path, 'files', 'fanout')
+forward_file = os.path.join(fanout_path, 'strain_R1.fastq.gz')
+reverse_file = os.path.join(fanout_path, 'strain_R2.fastq')
+
+
+def fastq_record(name, sequence):
+    return '@{name}\n{sequence}\n+\n{quality}\n'.format(name=name,
+                                                        sequence=sequence,
+                                                        quality='I' * len(sequence)).encode()
+
+
+class BufferConsumer(object):
+    """
+    Collect the records sent to a consumer, optionally slowly, to exercise the bounded queues
+    """
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        self.chunks += 1
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def consumer(self):
+        return {'files': self.files,
+                'write': self.write,
+                'close': self.close}
+
+    def __init__(self, files, delay=0.0):
+        self.files = files
+        self.delay = delay
+        self.chunks = 0
+        self.data = b''
+        self.closed = False
+
+
+def failing_write(data):
+    raise ValueError('Consumer failed')
+
+
+def test_create_files():
+    global forward_records, reverse_records
+    os.makedirs(fanout_path, exist_ok=True)
+    forward_records = [fastq_record('read{index}/1'.format(index=index), 'ACGT' * (index % 5 + 1))
+                       for index in range(25)]
+    reverse_records = [fastq_record('read{index}/2'.format(index=index), 'TTGCA' * (index % 3 + 1))
+                       for index in range(25)]
+    with gzip.open(forward_file, 'wb') as forward:
+        forward.write(b''.join(forward_records))
+    with open(reverse_file, 'wb') as reverse:
+        reverse.write(b''.join(reverse_records))
+    assert os.path.isfile(forward_file)
+
+
+def test_read_chunks():
+    chunks = list(FanoutMethods.read_chunks(fastq_file=forward_file,
+                                            chunk_records=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert chunks[0][0] == forward_records[0]
+
+
+def test_lockstep_chunks():
+    chunks = list(FanoutMethods.lockstep_chunks(fastq_files=[forward_file, reverse_file],
+                                                chunk_records=10))
+    assert len(chunks) == 3
+    # The paired chunks hold the same read pairs
+    assert chunks[2][0][0].startswith(b'@read20/1')
+    assert chunks[2][1][0].startswith(b'@read20/2')
+
+
+def test_consumer_data_interleaved():
+    chunks = ([forward_records[0], forward_records[1]], [reverse_records[0], reverse_records[1]])
+    assert FanoutMethods.consumer_data(chunks=chunks,
+                                       files=(0, 1)) == b''.join([forward_records[0], reverse_records[0],
+                                                                  forward_records[1], reverse_records[1]])
+    assert FanoutMethods.consumer_data(chunks=chunks,
+                                       files=(1,)) == reverse_records[0] + reverse_records[1]
+
+
+def test_fanout():
+    global slow_consumer
+    interleaved_consumer = BufferConsumer(files=(0, 1))
+    forward_consumer = BufferConsumer(files=(0,))
+    slow_consumer = BufferConsumer(files=(1,),
+                                   delay=0.01)
+    FanoutMethods.fanout(fastq_files=[forward_file, reverse_file],
+                         consumers=[interleaved_consumer.consumer(),
+                                    forward_consumer.consumer(),
+                                    slow_consumer.consumer()],
+                         chunk_records=4,
+                         queue_chunks=1)
+    assert interleaved_consumer.data == b''.join(record for pair in zip(forward_records, reverse_records)
+                                                 for record in pair)
+    assert forward_consumer.data == b''.join(forward_records)
+    # The slow consumer receives every chunk, despite its queue only holding a single chunk
+    assert slow_consumer.data == b''.join(reverse_records)
+    assert slow_consumer.chunks == 7
+    assert interleaved_consumer.closed and forward_consumer.closed and slow_consumer.closed
+
+
+def test_fanout_failed_consumer():
+    forward_consumer = BufferConsumer(files=(0,))
+    with pytest.raises(ValueError):
+        FanoutMethods.fanout(fastq_files=[forward_file],
+                             consumers=[{'files': (0,), 'write': failing_write, 'close': lambda: None},
+                                        forward_consumer.consumer()],
+                             chunk_records=4,
+                             queue_chunks=1)
+    # The other consumers are closed rather than left waiting
+    assert forward_consumer.closed
+
+
+def test_process_consumer():
+    output_file = os.path.join(fanout_path, 'interleaved.fastq')
+    consumer = FanoutMethods.process_consumer(command='cat > {output_file}'.format(output_file=output_file),
+                                              files=(0, 1))
+    FanoutMethods.fanout(fastq_files=[forward_file, reverse_file],
+                         consumers=[consumer])
+    out, err = FanoutMethods.finish_process(consumer=consumer)
+    assert err == ''
+    with open(output_file, 'rb') as interleaved:
+        assert interleaved.read().count(b'\n@read') == 49
+
+
+def test_process_consumer_exits_early():
+    # A process that exits without reading its input does not stop the other consumers
+    consumer = FanoutMethods.process_consumer(command='exit 0',
+                                              files=(0,))
+    forward_consumer = BufferConsumer(files=(0,))
+    FanoutMethods.fanout(fastq_files=[forward_file],
+                         consumers=[consumer, forward_consumer.consumer()],
+                         chunk_records=1)
+    FanoutMethods.finish_process(consumer=consumer)
+    assert forward_consumer.data == b''.join(forward_records)
+
+
+def test_remove_fanout_folder():
+    shutil.rmtree(fanout_path)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_index_methods import IndexMethods
+from vsnp.vsnp_nearest_run import VSNPNearest
+import multiprocessing
+import shutil
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+file_path = os.path.join(test_path, 'files', 'vcf')
+index_path = os.path.join(test_path, 'files', 'index')
+threads = multiprocessing.cpu_count() - 1
+strain_snp_positions = {'strain1': {'NC_017251.1': [100, 200, 300], 'NC_017250.1': [50]},
+                        'strain2': {'NC_017251.1': [100, 200]},
+                        'strain3': {'NC_017250.1': [50, 60]}}
+
+
+def test_index_file():
+    global index_file
+    index_file = IndexMethods.index_file(index_path=index_path,
+                                         reference='NC_017251-NC_017250')
+    assert os.path.basename(index_file) == 'NC_017251-NC_017250_snp_index.npz'
+
+
+def test_load_missing_index():
+    global index_dict
+    index_dict = IndexMethods.load_index(index_file=index_file)
+    assert index_dict['strains'] == list()
+    assert len(index_dict['keys']) == 0
+
+
+def test_update_index():
+    global index_dict
+    index_dict = IndexMethods.update_index(index_dict=index_dict,
+                                           strain_snp_positions=strain_snp_positions)
+    assert index_dict['strains'] == ['strain1', 'strain2', 'strain3']
+    assert index_dict['chromosomes'] == ['NC_017250.1', 'NC_017251.1']
+    assert len(index_dict['keys']) == 5
+    assert index_dict['bits'].shape == (3, 1)
+
+
+def test_write_index():
+    IndexMethods.write_index(index_dict=index_dict,
+                             index_file=index_file)
+    assert os.listdir(index_path) == [os.path.basename(index_file)]
+
+
+def test_load_index():
+    global index_dict
+    index_dict = IndexMethods.load_index(index_file=index_file)
+    assert index_dict['strains'] == ['strain1', 'strain2', 'strain3']
+
+
+def test_query_index():
+    neighbours = IndexMethods.query_index(index_dict=index_dict,
+                                          snp_positions={'NC_017251.1': [100, 200, 400]},
+                                          num_neighbours=2)
+    # Position 400 is not in the index, so it is a difference from every indexed strain
+    assert neighbours == [('strain2', 1), ('strain1', 3)]
+
+
+def test_query_index_exclude():
+    neighbours = IndexMethods.query_index(index_dict=index_dict,
+                                          snp_positions=strain_snp_positions['strain1'],
+                                          num_neighbours=1,
+                                          exclude='strain1')
+    assert neighbours == [('strain2', 2)]
+
+
+def test_update_existing_index():
+    global index_dict
+    # Replace the profile of an indexed strain, and add a strain with positions on a new chromosome
+    index_dict = IndexMethods.update_index(index_dict=index_dict,
+                                           strain_snp_positions={'strain2': {'NC_017251.1': [100]},
+                                                                 'strain4': {'NC_002945.4': [10]}})
+    assert index_dict['strains'] == ['strain1', 'strain3', 'strain2', 'strain4']
+    assert index_dict['chromosomes'] == ['NC_017250.1', 'NC_017251.1', 'NC_002945.4']
+    neighbours = IndexMethods.query_index(index_dict=index_dict,
+                                          snp_positions={'NC_017250.1': [50, 60]},
+                                          num_neighbours=4)
+    assert neighbours == [('strain3', 0), ('strain2', 3), ('strain4', 3), ('strain1', 4)]
+
+
+def test_nearest_run():
+    vsnp_nearest = VSNPNearest(path=file_path,
+                               threads=threads,
+                               debug=False,
+                               variant_caller='deepvariant',
+                               index_path=index_path,
+                               num_neighbours=2,
+                               build=True)
+    vsnp_nearest.main()
+    assert len(IndexMethods.load_index(index_file=index_file)['strains']) == 8
+
+
+def test_nearest_run_query():
+    vsnp_nearest = VSNPNearest(path=file_path,
+                               threads=threads,
+                               debug=False,
+                               variant_caller='deepvariant',
+                               index_path=index_path,
+                               num_neighbours=2)
+    vsnp_nearest.main()
+    with open(vsnp_nearest.report_file, 'r') as report:
+        assert len(report.readlines()) == 11
+
+
+def test_remove_index_folder():
+    shutil.rmtree(index_path)
+
+
+def test_remove_report():
+    os.remove(os.path.join(file_path, 'nearest_strains.tsv'))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+import subprocess
+import shutil
+import pytest
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+manifest_path = os.path.join(test_path, 'files', 'manifest')
+manifest_file = os.path.join(manifest_path, 'manifest.json')
+input_file = os.path.join(manifest_path, 'strain_R1.fastq')
+output_file = os.path.join(manifest_path, 'strain_sorted.bam')
+shard_pattern = os.path.join(manifest_path, 'strain_tfrecord-*.gz')
+
+
+def test_create_files():
+    os.makedirs(manifest_path, exist_ok=True)
+    with open(input_file, 'w') as reads:
+        reads.write('@read\nACGT\n+\nIIII\n')
+    for shard in range(2):
+        with open(os.path.join(manifest_path, 'strain_tfrecord-0000{shard}-of-00002.gz'.format(shard=shard)),
+                  'w') as examples:
+            examples.write('examples')
+    assert os.path.isfile(input_file)
+
+
+def test_file_signature():
+    signature = ManifestMethods.file_signature(file_path=input_file)
+    assert signature['size'] == 18
+    assert ManifestMethods.file_signature(file_path=output_file) is None
+
+
+def test_expand_outputs():
+    outputs = ManifestMethods.expand_outputs(outputs=[input_file, output_file, shard_pattern])
+    # Missing outputs are ignored, and glob patterns match the sharded files
+    assert [os.path.basename(output) for output in outputs] == ['strain_R1.fastq',
+                                                                 'strain_tfrecord-00000-of-00002.gz',
+                                                                 'strain_tfrecord-00001-of-00002.gz']
+
+
+def test_missing_manifest():
+    assert ManifestMethods.read_manifest(manifest_file=manifest_file) == dict()
+
+
+def test_temp_output():
+    temp_file = ManifestMethods.temp_output(output_file=output_file)
+    # The extension is kept, and the temporary file is hidden in the same folder
+    assert temp_file == os.path.join(manifest_path, '.tmp.strain_sorted.bam')
+    # An interrupted step never leaves its output at the final path
+    ManifestMethods.commit_output(temp_file=temp_file,
+                                  output_file=output_file)
+    assert not os.path.isfile(output_file)
+    with open(temp_file, 'w') as bam:
+        bam.write('bam')
+    ManifestMethods.commit_output(temp_file=temp_file,
+                                  output_file=output_file)
+    assert os.path.isfile(output_file)
+    assert not os.path.isfile(temp_file)
+
+
+def test_failed_command():
+    failed_file = os.path.join(manifest_path, 'strain_unmapped.fastq.gz')
+    temp_file = ManifestMethods.temp_output(output_file=failed_file)
+    # The final command of the pipeline succeeds, and the redirection creates the temporary file
+    command = 'printf reads | false | gzip > {temp_file}'.format(temp_file=temp_file)
+    out, err, returncode = ManifestMethods.run_command(command=command)
+    assert returncode
+    assert os.path.isfile(temp_file)
+    with pytest.raises(subprocess.CalledProcessError):
+        ManifestMethods.commit_output(temp_file=temp_file,
+                                      output_file=failed_file,
+                                      returncode=returncode,
+                                      command=command)
+        # The step is only recorded once its outputs are committed
+        ManifestMethods.write_manifest(manifest_file=manifest_file,
+                                       manifest_dict={'unmapped_reads': ManifestMethods.step_record(
+                                           step_signature=ManifestMethods.step_signature(inputs=[input_file],
+                                                                                         parameters=dict()),
+                                           outputs=[failed_file])})
+    assert not os.path.isfile(failed_file)
+    assert not os.path.isfile(temp_file)
+    assert ManifestMethods.read_manifest(manifest_file=manifest_file) == dict()
+
+
+def test_write_manifest():
+    global step_signature
+    step_signature = ManifestMethods.step_signature(inputs=[input_file],
+                                                    parameters={'reference_mapper': 'bwa',
+                                                                'versions': ('samtools 1.9',)})
+    ManifestMethods.write_manifest(manifest_file=manifest_file,
+                                   manifest_dict={'mapping': ManifestMethods.step_record(step_signature=step_signature,
+                                                                                         outputs=[output_file])})
+    # No temporary files are left behind
+    assert sorted(os.listdir(manifest_path)) == ['manifest.json', 'strain_R1.fastq', 'strain_sorted.bam',
+                                                 'strain_tfrecord-00000-of-00002.gz',
+                                                 'strain_tfrecord-00001-of-00002.gz']
+
+
+def test_step_valid():
+    manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+    assert list(manifest_dict['mapping']['outputs']) == [output_file]
+    # The signature is passed through JSON, so tuples compare equal to the lists read from the manifest
+    assert ManifestMethods.step_valid(step_record=manifest_dict['mapping'],
+                                      step_signature=step_signature)
+
+
+def test_step_invalid_parameters():
+    manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+    assert not ManifestMethods.step_valid(step_record=manifest_dict['mapping'],
+                                          step_signature=ManifestMethods.step_signature(
+                                              inputs=[input_file],
+                                              parameters={'reference_mapper': 'bowtie2',
+                                                          'versions': ['samtools 1.9']}))
+    assert not ManifestMethods.step_valid(step_record=None,
+                                          step_signature=step_signature)
+
+
+def test_step_invalid_output():
+    manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+    # Ensure that the modification time changes on file systems with coarse timestamps
+    time.sleep(0.01)
+    with open(output_file, 'a') as bam:
+        bam.write('truncated')
+    assert not ManifestMethods.step_valid(step_record=manifest_dict['mapping'],
+                                          step_signature=step_signature)
+
+
+def test_step_invalid_input():
+    manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+    with open(input_file, 'a') as reads:
+        reads.write('@read2\nACGT\n+\nIIII\n')
+    assert not ManifestMethods.step_valid(step_record=manifest_dict['mapping'],
+                                          step_signature=ManifestMethods.step_signature(
+                                              inputs=[input_file],
+                                              parameters={'reference_mapper': 'bwa',
+                                                          'versions': ['samtools 1.9']}))
+
+
+def test_corrupt_manifest():
+    with open(manifest_file, 'w') as manifest:
+        manifest.write('{"mapping": ')
+    assert ManifestMethods.read_manifest(manifest_file=manifest_file) == dict()
+
+
+def test_remove_outputs():
+    removed_files = ManifestMethods.remove_outputs(outputs=[output_file, shard_pattern])
+    assert len(removed_files) == 3
+    assert ManifestMethods.expand_outputs(outputs=[output_file, shard_pattern]) == list()
+
+
+def test_tool_version():
+    assert ManifestMethods.tool_version(command='not_a_real_tool --version') == 'unknown'
+
+
+def test_strain_step_outputs():
+    step_outputs = VCFMethods.strain_step_outputs(strain_name='strain',
+                                                  strain_folder=manifest_path,
+                                                  vcf_path=os.path.join(manifest_path, 'vcf_files'))
+    assert step_outputs['mapping'] == [output_file, output_file + '.bai']
+    assert step_outputs['make_examples'][0] == os.path.join(manifest_path, 'deepvariant', 'strain_tfrecord-*.gz')
+    assert os.path.join(manifest_path, 'vcf_files', 'strain.gvcf.gz') in step_outputs['freebayes']
+
+
+def test_remove_manifest_folder():
+    shutil.rmtree(manifest_path)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+from vsnp.vsnp_qc_methods import QCMethods
+import shutil
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+qc_path = os.path.join(test_path, 'files', 'qc')
+forward_file = os.path.join(qc_path, 'strain_R1.fastq.gz')
+reverse_file = os.path.join(qc_path, 'strain_R2.fastq.gz')
+forward_qhist = os.path.join(qc_path, 'strain_R1_qchist.csv')
+forward_lhist = os.path.join(qc_path, 'strain_R1_lhist.csv')
+reverse_qhist = os.path.join(qc_path, 'strain_R2_qchist.csv')
+reverse_lhist = os.path.join(qc_path, 'strain_R2_lhist.csv')
+
+
+def fastq_records(read, count):
+    records = list()
+    for index in range(count):
+        length = 50 + index % 7
+        # Cycle through the Phred scores 2 to 41
+        quality = ''.join(chr(33 + 2 + (index + position) % 40) for position in range(length))
+        records.append('@read{index}/{read}\n{sequence}\n+\n{quality}\n'.format(index=index,
+                                                                               read=read,
+                                                                               sequence='A' * length,
+                                                                               quality=quality).encode())
+    return records
+
+
+def test_create_files():
+    global forward_records
+    os.makedirs(qc_path, exist_ok=True)
+    forward_records = fastq_records(read=1, count=100)
+    for fastq_file, read in ((forward_file, 1), (reverse_file, 2)):
+        with gzip.open(fastq_file, 'wb') as fastq:
+            fastq.write(b''.join(fastq_records(read=read, count=100 if read == 1 else 60)))
+    assert os.path.isfile(forward_file)
+
+
+def test_update_stats():
+    stats = QCMethods.empty_stats()
+    QCMethods.update_stats(stats=stats,
+                           data=b''.join(forward_records[:50]))
+    QCMethods.update_stats(stats=stats,
+                           data=b''.join(forward_records[50:]))
+    assert stats['reads'] == 100
+    assert int(stats['length'].sum()) == 100
+    assert int(stats['quality'].sum()) == sum(50 + index % 7 for index in range(100))
+    # No bases have a quality below 2
+    assert int(stats['quality'][:2].sum()) == 0
+    assert stats['quality'].size == 42
+
+
+def test_qc_consumer():
+    global forward_consumer, reverse_consumer
+    forward_consumer = QCMethods.qc_consumer(qual_histo=forward_qhist,
+                                             length_histo=forward_lhist,
+                                             files=(0,))
+    reverse_consumer = QCMethods.qc_consumer(qual_histo=reverse_qhist,
+                                             length_histo=reverse_lhist,
+                                             files=(1,))
+    FanoutMethods.fanout(fastq_files=[forward_file, reverse_file],
+                         consumers=[forward_consumer, reverse_consumer],
+                         chunk_records=16)
+    assert forward_consumer['stats']['reads'] == 100
+    assert reverse_consumer['stats']['reads'] == 60
+    # The histograms are written once all the reads are counted, and no temporary files are left behind
+    assert sorted(os.listdir(qc_path)) == ['strain_R1.fastq.gz', 'strain_R1_lhist.csv', 'strain_R1_qchist.csv',
+                                           'strain_R2.fastq.gz', 'strain_R2_lhist.csv', 'strain_R2_qchist.csv']
+
+
+def test_read_histograms():
+    stats = QCMethods.read_histograms(qual_histo=forward_qhist,
+                                      length_histo=forward_lhist)
+    assert stats['reads'] == 100
+    assert stats['quality'].tolist() == forward_consumer['stats']['quality'].tolist()
+    assert stats['length'].tolist() == forward_consumer['stats']['length'].tolist()
+
+
+def test_summarise_stats():
+    strain_average_quality_dict, strain_qual_over_thirty_dict, strain_avg_read_lengths = \
+        QCMethods.summarise_stats(strain_read_stats_dict={'strain': [forward_consumer['stats'],
+                                                                     reverse_consumer['stats']]})
+    # The values are the same as those parsed from the histograms
+    parsed_quality_dict, parsed_over_thirty_dict = \
+        VCFMethods.parse_quality_histogram(strain_qhist_dict={'strain': [forward_qhist, reverse_qhist]})
+    parsed_read_lengths = \
+        VCFMethods.parse_length_histograms(strain_lhist_dict={'strain': [forward_lhist, reverse_lhist]})
+    assert strain_average_quality_dict == parsed_quality_dict
+    assert strain_qual_over_thirty_dict == parsed_over_thirty_dict
+    assert strain_avg_read_lengths == parsed_read_lengths
+
+
+def test_remove_qc_folder():
+    shutil.rmtree(qc_path)
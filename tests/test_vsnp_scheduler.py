@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_scheduler_methods import SchedulerMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+import threading
+import pytest
+import time
+
+__author__ = 'adamkoziol'
+
+
+class TaskRecorder(object):
+    """
+    Record the start and finish of the tasks, and the peak threads and memory of the running tasks
+    """
+
+    def task(self, name, threads=1, memory=1.0, seconds=0.05):
+        def run():
+            with self.lock:
+                self.order.append(name)
+                self.threads += threads
+                self.memory += memory
+                self.peak_threads = max(self.peak_threads, self.threads)
+                self.peak_memory = max(self.peak_memory, self.memory)
+            time.sleep(seconds)
+            with self.lock:
+                self.threads -= threads
+                self.memory -= memory
+                self.finished.append(name)
+            return name
+        return run
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order = list()
+        self.finished = list()
+        self.threads = 0
+        self.memory = 0.0
+        self.peak_threads = 0
+        self.peak_memory = 0.0
+
+
+def failing_task():
+    raise RuntimeError('Task failed')
+
+
+def test_duplicate_task():
+    task_dict = dict()
+    SchedulerMethods.add_task(task_dict=task_dict,
+                              name='a',
+                              function=TaskRecorder().task(name='a'))
+    with pytest.raises(ValueError):
+        SchedulerMethods.add_task(task_dict=task_dict,
+                                  name='a',
+                                  function=TaskRecorder().task(name='a'))
+
+
+def test_unknown_dependency():
+    task_dict = dict()
+    SchedulerMethods.add_task(task_dict=task_dict,
+                              name='a',
+                              function=TaskRecorder().task(name='a'),
+                              depends=['b'])
+    with pytest.raises(ValueError):
+        SchedulerMethods.run_tasks(task_dict=task_dict,
+                                   threads=2,
+                                   memory=2.0)
+
+
+def test_cycle():
+    task_dict = dict()
+    recorder = TaskRecorder()
+    SchedulerMethods.add_task(task_dict=task_dict, name='a', function=recorder.task(name='a'), depends=['c'])
+    SchedulerMethods.add_task(task_dict=task_dict, name='b', function=recorder.task(name='b'), depends=['a'])
+    SchedulerMethods.add_task(task_dict=task_dict, name='c', function=recorder.task(name='c'), depends=['b'])
+    with pytest.raises(ValueError):
+        SchedulerMethods.run_tasks(task_dict=task_dict,
+                                   threads=2,
+                                   memory=2.0)
+    # No task is started if the graph is invalid
+    assert recorder.order == list()
+
+
+def test_dependency_order():
+    task_dict = dict()
+    recorder = TaskRecorder()
+    for strain in ['s1', 's2']:
+        SchedulerMethods.add_task(task_dict=task_dict, name=strain + ':reference',
+                                  function=recorder.task(name=strain + ':reference'))
+        SchedulerMethods.add_task(task_dict=task_dict, name=strain + ':mapping',
+                                  function=recorder.task(name=strain + ':mapping'),
+                                  depends=[strain + ':reference'])
+        SchedulerMethods.add_task(task_dict=task_dict, name=strain + ':vcf',
+                                  function=recorder.task(name=strain + ':vcf'),
+                                  depends=[strain + ':mapping'])
+    task_results, task_seconds = SchedulerMethods.run_tasks(task_dict=task_dict,
+                                                            threads=4,
+                                                            memory=4.0)
+    assert task_results == {name: name for name in task_dict}
+    assert sorted(task_seconds) == sorted(task_dict)
+    for strain in ['s1', 's2']:
+        assert recorder.finished.index(strain + ':reference') < recorder.order.index(strain + ':mapping')
+        assert recorder.finished.index(strain + ':mapping') < recorder.order.index(strain + ':vcf')
+
+
+def test_resource_budget():
+    task_dict = dict()
+    recorder = TaskRecorder()
+    for index in range(6):
+        SchedulerMethods.add_task(task_dict=task_dict,
+                                  name='task{index}'.format(index=index),
+                                  function=recorder.task(name='task{index}'.format(index=index),
+                                                         threads=2,
+                                                         memory=1.5),
+                                  threads=2,
+                                  memory=1.5)
+    SchedulerMethods.run_tasks(task_dict=task_dict,
+                               threads=4,
+                               memory=3.0)
+    # Two tasks fit the budget at once
+    assert recorder.peak_threads == 4
+    assert recorder.peak_memory == 3.0
+
+
+def test_oversized_task():
+    task_dict = dict()
+    recorder = TaskRecorder()
+    SchedulerMethods.add_task(task_dict=task_dict,
+                              name='large',
+                              function=recorder.task(name='large'),
+                              threads=32,
+                              memory=64.0)
+    SchedulerMethods.add_task(task_dict=task_dict,
+                              name='small',
+                              function=recorder.task(name='small'))
+    task_results = SchedulerMethods.run_tasks(task_dict=task_dict,
+                                              threads=2,
+                                              memory=2.0)[0]
+    # The oversized task runs on its own, and the tasks start in the order in which they were added
+    assert sorted(task_results) == ['large', 'small']
+    assert recorder.order == ['large', 'small']
+    assert recorder.peak_threads == 1
+
+
+def test_failed_task():
+    task_dict = dict()
+    recorder = TaskRecorder()
+    SchedulerMethods.add_task(task_dict=task_dict, name='fail', function=failing_task)
+    SchedulerMethods.add_task(task_dict=task_dict, name='dependent', function=recorder.task(name='dependent'),
+                              depends=['fail'])
+    with pytest.raises(RuntimeError):
+        SchedulerMethods.run_tasks(task_dict=task_dict,
+                                   threads=2,
+                                   memory=2.0)
+    # The tasks that depend on the failed task are not run
+    assert recorder.order == list()
+
+
+def test_strain_step_resources():
+    step_resources = VCFMethods.strain_step_resources(threads=8,
+                                                      variant_caller='freebayes')
+    assert step_resources['mapping']['threads'] == 4
+    assert step_resources['freebayes']['threads'] == 4
+    assert step_resources['reference']['threads'] == 1
+    gpu_resources = VCFMethods.strain_step_resources(threads=8,
+                                                     variant_caller='deepvariant-gpu')
+    # GPU variant calling uses all the threads, so that only one strain is called at a time
+    assert gpu_resources['call_variants']['threads'] == 8
+    assert VCFMethods.strain_step_resources(threads=0,
+                                            variant_caller='freebayes')['mapping']['threads'] == 1
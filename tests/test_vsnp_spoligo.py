@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_spoligo_methods import SpoligoMethods
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from vsnp.vsnp_vcf_methods import VCFMethods
+from Bio import SeqIO
+import random
+import shutil
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+dependency_path = os.path.join(os.path.dirname(test_path), 'dependencies')
+spoligo_file = os.path.join(dependency_path, 'mycobacterium', 'spacers.fasta')
+spoligo_path = os.path.join(test_path, 'files', 'spoligo')
+forward_file = os.path.join(spoligo_path, 'strain_R1.fastq.gz')
+reverse_file = os.path.join(spoligo_path, 'strain_R2.fastq.gz')
+stats_file = os.path.join(spoligo_path, 'strain_stats.txt')
+# Spacers 1-3, 5, 10, and 43 are present in the reads
+binary_code = '1110100001' + '0' * 32 + '1'
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+def mutate(sequence, positions):
+    return ''.join(('A' if base != 'A' else 'C') if index in positions else base
+                   for index, base in enumerate(sequence))
+
+
+def fastq_record(name, sequence):
+    return '@{name}\n{sequence}\n+\n{quality}\n'.format(name=name,
+                                                        sequence=sequence,
+                                                        quality='I' * len(sequence)).encode()
+
+
+def test_create_files():
+    global spacers
+    os.makedirs(spoligo_path, exist_ok=True)
+    spacers = [str(record.seq) for record in SeqIO.parse(spoligo_file, 'fasta')]
+    generator = random.Random(13)
+    reads = list()
+    for index, spacer in enumerate(spacers):
+        if binary_code[index] == '1':
+            # The spacers are found on either strand, with up to one mismatch
+            reads.extend([spacer,
+                          reverse_complement(spacer),
+                          mutate(sequence=spacer, positions={12})])
+        else:
+            # Spacers with two mismatches, or broken by an ambiguous base, are absent
+            reads.extend([mutate(sequence=spacer, positions={3, 20}),
+                          spacer[:10] + 'N' + spacer[11:]])
+    records = list()
+    for index, sequence in enumerate(reads):
+        flank = ''.join(generator.choice('ACGT') for _ in range(40))
+        records.append(fastq_record(name='read{index}'.format(index=index),
+                                    sequence=flank[:20] + sequence + flank[20:]))
+    # The reads are split between the two files
+    with gzip.open(forward_file, 'wb') as forward:
+        forward.write(b''.join(records[::2]))
+    with gzip.open(reverse_file, 'wb') as reverse:
+        reverse.write(b''.join(records[1::2]))
+    assert os.path.isfile(reverse_file)
+
+
+def test_encode_kmer():
+    assert SpoligoMethods.encode_kmer(sequence='ACGT') == 0b00011011
+    assert SpoligoMethods.encode_kmer(sequence='acgt') == 0b00011011
+
+
+def test_hamming_variants():
+    variants = SpoligoMethods.hamming_variants(sequence='ACG')
+    assert len(variants) == 10
+    assert len(set(variants)) == 10
+    assert variants[0] == 'ACG'
+
+
+def test_spacer_table():
+    global spacer_dict
+    spacer_dict = SpoligoMethods.spacer_table(spoligo_file=spoligo_file)
+    assert len(spacer_dict['names']) == 43
+    # Each strand of each 25 bp spacer contributes the spacer and its 75 single-substitution variants
+    assert spacer_dict['kmers'].size == 43 * 2 * 76
+    assert list(spacer_dict['kmers']) == sorted(spacer_dict['kmers'])
+    index = int(spacer_dict['kmers'].searchsorted(SpoligoMethods.encode_kmer(sequence=spacers[4])))
+    assert spacer_dict['spacers'][index] == 4
+
+
+def test_count_spacers():
+    global consumer
+    consumer = SpoligoMethods.spoligo_consumer(spacer_dict=spacer_dict,
+                                               stats_file=stats_file,
+                                               files=(0, 1))
+    FanoutMethods.fanout(fastq_files=[forward_file, reverse_file],
+                         consumers=[consumer],
+                         chunk_records=7)
+    counts = consumer['counts']
+    assert counts['reads'] == 6 * 3 + 37 * 2
+    assert counts['matched'] == 6 * 3
+    assert ''.join('1' if count else '0' for count in counts['spacers'].tolist()) == binary_code
+    assert counts['spacers'][0] == 3
+
+
+def test_parse_spoligo():
+    strain_binary_code_dict, strain_octal_code_dict, strain_hexadecimal_code_dict = \
+        VCFMethods.parse_spoligo(strain_spoligo_stats_dict={'strain': stats_file})
+    assert strain_binary_code_dict['strain'] == binary_code
+    assert strain_octal_code_dict['strain'] == VCFMethods.binary_to_octal(binary_code=binary_code)
+    assert strain_hexadecimal_code_dict['strain'] == VCFMethods.binary_to_hexadecimal(binary_code=binary_code)
+
+
+def test_empty_stats():
+    empty_stats = os.path.join(spoligo_path, 'empty_stats.txt')
+    SpoligoMethods.write_stats(spacer_dict=spacer_dict,
+                               counts=SpoligoMethods.empty_counts(spacer_dict=spacer_dict),
+                               stats_file=empty_stats)
+    strain_binary_code_dict = VCFMethods.parse_spoligo(strain_spoligo_stats_dict={'strain': empty_stats})[0]
+    assert strain_binary_code_dict['strain'] == '0' * 43
+
+
+def test_bait_spacers_full():
+    counts = SpoligoMethods.bait_spacers(fastq_files=[forward_file, reverse_file],
+                                         spacer_dict=spacer_dict,
+                                         stats_file=stats_file,
+                                         genome_length=4411532,
+                                         chunk_records=7)
+    # The reads of this small strain are too few to resolve the absent spacers, so every read is examined
+    assert counts['reads'] == 6 * 3 + 37 * 2
+    assert counts['kmers'] == counts['reads'] * (65 - 25 + 1) - 37 * 25
+    assert SpoligoMethods.read_examined(stats_file=stats_file) == counts['reads']
+    assert VCFMethods.parse_spoligo(strain_spoligo_stats_dict={'strain': stats_file})[0]['strain'] == binary_code
+
+
+def test_bait_spacers_early_stop():
+    counts = SpoligoMethods.bait_spacers(fastq_files=[forward_file, reverse_file],
+                                         spacer_dict=spacer_dict,
+                                         stats_file=stats_file,
+                                         genome_length=100,
+                                         expected_hits=20.0,
+                                         chunk_records=7)
+    # Reading stops after the first chunk of 14 reads in which the k-mers examined reach 20 times the genome length
+    assert 2000 <= counts['kmers'] < 2000 + 14 * 41
+    assert counts['reads'] == 70
+    assert SpoligoMethods.read_examined(stats_file=stats_file) == 70
+
+
+def test_bait_spacers_resolved():
+    counts = SpoligoMethods.bait_spacers(fastq_files=[forward_file, reverse_file],
+                                         spacer_dict=spacer_dict,
+                                         stats_file=stats_file,
+                                         genome_length=4411532,
+                                         min_count=0,
+                                         chunk_records=7)
+    # Every spacer is resolved as present once it reaches the minimum count
+    assert counts['reads'] == 14
+
+
+def test_remove_spoligo_folder():
+    shutil.rmtree(spoligo_path)
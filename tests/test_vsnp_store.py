@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_store_methods import StoreMethods
+from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from vsnp.vsnp_query_run import VSNPQuery
+import multiprocessing
+from contextlib import closing
+from glob import glob
+import shutil
+import os
+
+__author__ = 'adamkoziol'
+
+test_path = os.path.abspath(os.path.dirname(__file__))
+file_path = os.path.join(test_path, 'files', 'vcf')
+store_path = os.path.join(test_path, 'files', 'store')
+store_file = os.path.join(store_path, 'vsnp_store.db')
+threads = multiprocessing.cpu_count() - 1
+
+
+def test_strain_dict():
+    global strain_vcf_dict
+    strain_vcf_dict = VSNPTreeMethods.strain_list(vcf_files=sorted(glob(os.path.join(file_path, 'B13*.gvcf.gz'))))
+    assert sorted(strain_vcf_dict) == ['B13-0234', 'B13-0235', 'B13-0237', 'B13-0238', 'B13-0239']
+
+
+def test_empty_store():
+    assert StoreMethods.stored_strains(store_file=store_file) == dict()
+    assert os.path.isfile(store_file)
+
+
+def test_add_strains():
+    global parsed_vcf_dict
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_multiprocessing(strain_name='B13-0235',
+                                                  strain_vcf_dict=strain_vcf_dict,
+                                                  qual_cutoff=30)
+    added_strains = StoreMethods.add_strains(store_file=store_file,
+                                             strain_parsed_vcf_dict=parsed_vcf_dict,
+                                             strain_best_ref_dict=best_ref_dict,
+                                             strain_best_ref_set_dict=best_ref_set_dict,
+                                             strain_vcf_dict=strain_vcf_dict,
+                                             variant_caller='deepvariant')
+    assert added_strains == ['B13-0235']
+    # Adding the strain again from the same file does not replace it
+    assert StoreMethods.add_strains(store_file=store_file,
+                                    strain_parsed_vcf_dict=parsed_vcf_dict,
+                                    strain_best_ref_dict=best_ref_dict,
+                                    strain_best_ref_set_dict=best_ref_set_dict,
+                                    strain_vcf_dict=strain_vcf_dict,
+                                    variant_caller='deepvariant') == list()
+
+
+def test_stored_strains():
+    stored_strains = StoreMethods.stored_strains(store_file=store_file)
+    assert list(stored_strains) == ['B13-0235']
+    assert sorted(stored_strains['B13-0235']['chromosomes']) == ['NC_017250.1', 'NC_017251.1']
+    assert stored_strains['B13-0235']['source'] == strain_vcf_dict['B13-0235']
+
+
+def test_load_strains():
+    loaded_vcf_dict, best_ref_dict, best_ref_set_dict = StoreMethods.load_strains(store_file=store_file,
+                                                                                  strain_list=['B13-0235'])
+    assert loaded_vcf_dict == parsed_vcf_dict
+    # The chromosomes are loaded in the order in which they were parsed
+    assert list(loaded_vcf_dict['B13-0235']) == list(parsed_vcf_dict['B13-0235'])
+    assert best_ref_set_dict['B13-0235'] == {'NC_017250.1', 'NC_017251.1'}
+    assert loaded_vcf_dict['B13-0235']['NC_017250.1'][8810]['QUAL'] == '70.1'
+    assert loaded_vcf_dict['B13-0235']['NC_017251.1'][78796]['FILTER'] == 'DELETION'
+
+
+def test_load_strains_pass_only():
+    loaded_vcf_dict = StoreMethods.load_strains(store_file=store_file,
+                                                strain_list=['B13-0235'],
+                                                pass_only=True)[0]
+    for ref_chrom, vcf_dict in loaded_vcf_dict['B13-0235'].items():
+        for pos, pos_dict in vcf_dict.items():
+            assert pos_dict['FILTER'] == 'PASS'
+
+
+def test_load_strains_positions():
+    loaded_vcf_dict = StoreMethods.load_strains(store_file=store_file,
+                                                strain_list=['B13-0235'],
+                                                position_dict={'NC_017250.1': {8810, 8811},
+                                                               'NC_017251.1': {78796}})[0]
+    assert sorted(loaded_vcf_dict['B13-0235']['NC_017250.1']) == [8810]
+    assert list(loaded_vcf_dict['B13-0235']['NC_017251.1']) == [78796]
+
+
+def test_query_calls_position():
+    call_list = StoreMethods.query_calls(store_file=store_file,
+                                         chrom='NC_017250.1',
+                                         start=8810)
+    assert [call[:3] for call in call_list] == [('B13-0235', 'NC_017250.1', 8810)]
+    assert call_list[0][5] == '70.1'
+
+
+def test_query_calls_filters():
+    call_list = StoreMethods.query_calls(store_file=store_file,
+                                         strain_list=['B13-0235'],
+                                         filter_list=['DELETION'])
+    assert call_list
+    assert {call[7] for call in call_list} == {'DELETION'}
+    assert StoreMethods.query_calls(store_file=store_file,
+                                    strain_list=['B13-0234']) == list()
+
+
+def test_store_vcf():
+    added_strains = VSNPTreeMethods.store_vcf(store_file=store_file,
+                                              strain_vcf_dict=strain_vcf_dict,
+                                              variant_caller='deepvariant',
+                                              threads=threads,
+                                              chunk_size=2)
+    # The strain that was already in the store is not parsed again
+    assert sorted(added_strains) == ['B13-0234', 'B13-0237', 'B13-0238', 'B13-0239']
+
+
+def test_store_vcf_changed():
+    stored_strains = StoreMethods.stored_strains(store_file=store_file)
+    # Strains stored with another variant caller, or from a since rewritten file, are parsed and replaced
+    with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+        with connection:
+            connection.execute('UPDATE strains SET variant_caller = \'freebayes\' WHERE strain = \'B13-0237\'')
+            connection.execute('UPDATE strains SET signature = \'\' WHERE strain = \'B13-0238\'')
+    added_strains = VSNPTreeMethods.store_vcf(store_file=store_file,
+                                              strain_vcf_dict=strain_vcf_dict,
+                                              variant_caller='deepvariant',
+                                              threads=threads,
+                                              chunk_size=2)
+    assert sorted(added_strains) == ['B13-0237', 'B13-0238']
+    replaced_strains = StoreMethods.stored_strains(store_file=store_file)
+    assert replaced_strains['B13-0237']['variant_caller'] == 'deepvariant'
+    assert replaced_strains['B13-0238']['signature'] == stored_strains['B13-0238']['signature']
+    # The stale calls are removed with the stale strains
+    with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+        assert not connection.execute('SELECT COUNT(*) FROM calls WHERE strain_id NOT IN '
+                                      '(SELECT strain_id FROM strains)').fetchone()[0]
+
+
+def test_load_store_union():
+    union_parsed_dict, union_best_ref_dict, union_best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_union(strain_vcf_dict=strain_vcf_dict,
+                                        variant_caller='deepvariant',
+                                        threads=threads)
+    store_parsed_dict, store_best_ref_dict, store_best_ref_set_dict = \
+        VSNPTreeMethods.load_store_union(store_file=store_file,
+                                         strain_list=list(strain_vcf_dict))
+    assert store_parsed_dict == union_parsed_dict
+    assert store_best_ref_dict == union_best_ref_dict
+    assert store_best_ref_set_dict == union_best_ref_set_dict
+
+
+def test_query_run():
+    global vsnp_query
+    vsnp_query = VSNPQuery(path=file_path,
+                           debug=False,
+                           store_file=store_file,
+                           region='NC_017250.1:8,000-9000',
+                           filters=['PASS'])
+    vsnp_query.main()
+    assert (vsnp_query.chrom, vsnp_query.start, vsnp_query.end) == ('NC_017250.1', 8000, 9000)
+    with open(vsnp_query.report_file, 'r') as report:
+        lines = report.readlines()
+    assert lines[0].split('\t')[:3] == ['Strain', 'Chromosome', 'Position']
+    for line in lines[1:]:
+        assert 8000 <= int(line.split('\t')[2]) <= 9000
+
+
+def test_remove_store_folder():
+    shutil.rmtree(store_path)
+
+
+def test_remove_report():
+    os.remove(vsnp_query.report_file)
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import filer, make_path
 from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from vsnp.vsnp_pool_methods import PoolMethods
 from vsnp.vsnp_tree_run import VSNPTree
 from datetime import datetime
+from ete3 import Tree
 import multiprocessing
 from glob import glob
+import tempfile
 import pytest
 import shutil
+import numpy
 import os
 
 __author__ = 'adamkoziol'
@@ -18,6 +22,7 @@ summary_path = os.path.join(file_path, 'summary_tables')
 fasta_path = os.path.join(file_path, 'alignments')
 report_path = os.path.join(file_path, 'reports')
 logfile = os.path.join(file_path, 'log')
+suis1_fasta = os.path.join(dependency_path, 'brucella', 'suis1', 'script_dependents', 'NC_017251-NC_017250.fasta')
 threads = multiprocessing.cpu_count() - 1
 # Define the start time
 start_time = datetime.now()
@@ -174,6 +179,157 @@ def test_summarise_vcf_outputs():
     assert deletion_dict['13-1950'] == 44802
 
 
+def test_reduced_vcf_pass_only():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_reduced_vcf_multiprocessing(strain_name='B13-0234',
+                                                         strain_vcf_dict=strain_vcf_dict,
+                                                         variant_caller='deepvariant',
+                                                         qual_cutoff=20,
+                                                         position_dict=None)
+    assert best_ref_set_dict['B13-0234'] == {'NC_017250.1', 'NC_017251.1'}
+    assert {pos_dict['FILTER'] for ref_dict in parsed_vcf_dict['B13-0234'].values()
+            for pos_dict in ref_dict.values()} == {'PASS'}
+    assert sorted(parsed_vcf_dict['B13-0234']['NC_017250.1'])[0] == 8810
+
+
+def test_reduced_vcf_positions():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_reduced_vcf_multiprocessing(strain_name='B13-0235',
+                                                         strain_vcf_dict=strain_vcf_dict,
+                                                         variant_caller='deepvariant',
+                                                         qual_cutoff=20,
+                                                         position_dict={'NC_017251.1': {78796, 1000},
+                                                                        'NC_017250.1': {8810}})
+    assert sorted(parsed_vcf_dict['B13-0235']['NC_017251.1']) == [78796]
+    assert parsed_vcf_dict['B13-0235']['NC_017251.1'][78796]['FILTER'] == 'DELETION'
+    assert parsed_vcf_dict['B13-0235']['NC_017250.1'][8810]['QUAL'] == '70.1'
+
+
+def test_positions_in_range():
+    sorted_position_dict = VSNPTreeMethods.sort_positions(position_dict={'NC_017251.1': {30, 10, 20},
+                                                                         'NC_017250.1': set()})
+    assert sorted_position_dict == {'NC_017251.1': [10, 20, 30]}
+    assert VSNPTreeMethods.positions_in_range(sorted_positions=sorted_position_dict['NC_017251.1'],
+                                              start=10,
+                                              end=20) == [10, 20]
+    assert VSNPTreeMethods.positions_in_range(sorted_positions=sorted_position_dict['NC_017251.1'],
+                                              start=11,
+                                              end=19) == []
+
+
+def test_positions_to_regions():
+    regions_file = os.path.join(file_path, 'regions.bed')
+    num_regions = VSNPTreeMethods.positions_to_regions(position_dict={'NC_017251.1': {10, 11, 12, 20},
+                                                                      'NC_017250.1': {5}},
+                                                       regions_file=regions_file)
+    assert num_regions == 3
+    with open(regions_file, 'r') as regions:
+        assert sorted(regions.read().splitlines()) == ['NC_017250.1\t4\t5', 'NC_017251.1\t19\t20',
+                                                       'NC_017251.1\t9\t12']
+    os.remove(regions_file)
+
+
+def test_read_vcf_lines_no_index():
+    # Without a tabix index, the whole file is read, even if a regions file is supplied
+    vcf_lines = list(VSNPTreeMethods.read_vcf_lines(vcf_file=strain_vcf_dict['B13-0235'],
+                                                    regions_file='not_a_real_file'))
+    assert vcf_lines[0].startswith('##fileformat')
+    assert any(line.startswith('NC_017250.1') for line in vcf_lines)
+
+
+def test_gvcf_load_positions():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_multiprocessing(strain_name='B13-0235',
+                                                  strain_vcf_dict=strain_vcf_dict,
+                                                  qual_cutoff=20,
+                                                  position_dict={'NC_017251.1': {78796}})
+    # Only the requested position of the deletion block is retained
+    assert sorted(parsed_vcf_dict['B13-0235']['NC_017251.1']) == [78796]
+    assert parsed_vcf_dict['B13-0235']['NC_017251.1'][78796]['FILTER'] == 'DELETION'
+    # Parsing stops after the final requested position, so the second chromosome is never reached
+    assert 'NC_017250.1' not in parsed_vcf_dict['B13-0235']
+
+
+def test_gvcf_load_union():
+    gvcf_vcf_dict = {strain_name: vcf_file for strain_name, vcf_file in strain_vcf_dict.items()
+                     if strain_name.startswith('B13')}
+    union_parsed_dict, union_best_ref_dict, union_best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_union(strain_vcf_dict=gvcf_vcf_dict,
+                                        variant_caller='deepvariant',
+                                        threads=threads,
+                                        qual_cutoff=20)
+    position_dict = VSNPTreeMethods.union_snp_positions(strain_parsed_vcf_dict=union_parsed_dict)
+    assert union_best_ref_set_dict['B13-0234'] == {'NC_017250.1', 'NC_017251.1'}
+    assert union_parsed_dict['B13-0235']['NC_017250.1'][8810]['QUAL'] == '70.1'
+    for strain_name, ref_dict in union_parsed_dict.items():
+        for ref_chrom, vcf_dict in ref_dict.items():
+            assert set(vcf_dict).issubset(position_dict[ref_chrom])
+
+
+def test_pack_parsed_vcf():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_multiprocessing(strain_name='B13-0235',
+                                                  strain_vcf_dict=strain_vcf_dict,
+                                                  qual_cutoff=20)
+    packed_vcf = VSNPTreeMethods.pack_parsed_vcf(strain_parsed_vcf_dict=parsed_vcf_dict,
+                                                 strain_best_ref_dict=best_ref_dict,
+                                                 strain_best_ref_set_dict=best_ref_set_dict)
+    assert packed_vcf[0] == 'B13-0235'
+    assert VSNPTreeMethods.unpack_parsed_vcf(packed_vcf_list=[packed_vcf]) == \
+        (parsed_vcf_dict, best_ref_dict, best_ref_set_dict)
+
+
+def test_write_packed_vcf():
+    parsed_vcf_dict, best_ref_dict, best_ref_set_dict = \
+        VSNPTreeMethods.load_gvcf_multiprocessing(strain_name='B13-0235',
+                                                  strain_vcf_dict=strain_vcf_dict,
+                                                  qual_cutoff=20)
+    packed_vcf = VSNPTreeMethods.pack_parsed_vcf(strain_parsed_vcf_dict=parsed_vcf_dict,
+                                                 strain_best_ref_dict=best_ref_dict,
+                                                 strain_best_ref_set_dict=best_ref_set_dict)
+    descriptor = VSNPTreeMethods.write_packed_vcf(packed_vcf=packed_vcf,
+                                                  scratch_path=file_path)
+    assert os.path.isfile(descriptor[3])
+    # The outputs restored from the views of the memory-mapped scratch file match the parsed outputs
+    assert VSNPTreeMethods.unpack_parsed_vcf(packed_vcf_list=VSNPTreeMethods.read_packed_vcf(
+        descriptor_list=[descriptor])) == (parsed_vcf_dict, best_ref_dict, best_ref_set_dict)
+    # The scratch file is removed once it has been read
+    assert not os.path.isfile(descriptor[3])
+
+
+def test_load_gvcf_missing_file():
+    scratch_folders = set(glob(os.path.join(tempfile.gettempdir(), 'vsnp_*')))
+    with pytest.raises(FileNotFoundError):
+        VSNPTreeMethods.load_gvcf(strain_vcf_dict={'missing': os.path.join(file_path, 'missing.gvcf.gz')},
+                                  threads=threads)
+    # The scratch files are removed following errors
+    assert set(glob(os.path.join(tempfile.gettempdir(), 'vsnp_*'))) == scratch_folders
+
+
+def test_load_reduced_vcf_shared_pool():
+    gvcf_vcf_dict = {strain_name: vcf_file for strain_name, vcf_file in strain_vcf_dict.items()
+                     if strain_name.startswith('B13')}
+    pool = PoolMethods.create_pool(threads=threads)
+    try:
+        # The same pool is used for consecutive stages with different broadcast variables
+        pass_parsed_dict = VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=gvcf_vcf_dict,
+                                                            variant_caller='deepvariant',
+                                                            threads=threads,
+                                                            qual_cutoff=20,
+                                                            pool=pool)[0]
+        positions_parsed_dict = VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=gvcf_vcf_dict,
+                                                                 variant_caller='deepvariant',
+                                                                 threads=threads,
+                                                                 position_dict={'NC_017250.1': {8810}},
+                                                                 qual_cutoff=20,
+                                                                 pool=pool)[0]
+    finally:
+        pool.close()
+        pool.join()
+    assert sorted(pass_parsed_dict) == sorted(gvcf_vcf_dict)
+    assert sorted(positions_parsed_dict['B13-0235']['NC_017250.1']) == [8810]
+
+
 def test_determine_ref_species():
     global strain_species_dict, strain_best_ref_fasta_dict
     strain_species_dict, strain_best_ref_fasta_dict = \
@@ -240,6 +396,49 @@ def test_load_snp_positions():
     assert ref_snp_positions['NC_017251.1'][50509] == 'A'
 
 
+def test_reference_fasta_files():
+    global reference_fasta_dict
+    reference_fasta_dict = \
+        VSNPTreeMethods.reference_fasta_files(strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                                              strain_best_ref_fasta_dict=strain_best_ref_fasta_dict,
+                                              reference_link_dict=reference_link_dict,
+                                              dependency_path=dependency_path)
+    assert reference_fasta_dict['NC_017251-NC_017250'] == suis1_fasta
+    # Only the index of the NC_002945v4 reference genome is included in the dependencies
+    assert 'NC_002945v4' not in reference_fasta_dict
+
+
+def test_load_fasta_index():
+    fasta_index_dict = VSNPTreeMethods.load_fasta_index(reference_fasta=suis1_fasta)
+    assert fasta_index_dict['NC_017250.1'][0] == 1207380
+    # Create the index of a copy of the FASTA file, and ensure that it matches the samtools faidx index
+    fasta_copy = os.path.join(file_path, 'reference.fasta')
+    shutil.copyfile(src=suis1_fasta,
+                    dst=fasta_copy)
+    assert VSNPTreeMethods.load_fasta_index(reference_fasta=fasta_copy) == fasta_index_dict
+    assert os.path.isfile(fasta_copy + '.fai')
+    os.remove(fasta_copy)
+    os.remove(fasta_copy + '.fai')
+
+
+def test_reference_bases():
+    ref_base_dict = VSNPTreeMethods.reference_bases(reference_fasta=suis1_fasta,
+                                                    position_dict={'NC_017250.1': {16405, 1197913, 1207381},
+                                                                   'NC_017251.1': {50509}})
+    assert ref_base_dict == {'NC_017250.1': {16405: 'C', 1197913: 'T'}, 'NC_017251.1': {50509: 'A'}}
+
+
+def test_load_snp_positions_reference_fasta():
+    fasta_consolidated_ref_snp_positions, fasta_strain_snp_positions, fasta_ref_snp_positions = \
+        VSNPTreeMethods.load_gvcf_snp_positions(strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                                                strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                                                reference_fasta_dict=reference_fasta_dict)
+    # The reference genome sequence matches the REF bases of the gVCF files
+    assert fasta_consolidated_ref_snp_positions == consolidated_ref_snp_positions
+    assert fasta_strain_snp_positions == strain_snp_positions
+    assert fasta_ref_snp_positions == ref_snp_positions
+
+
 def test_determine_groups():
     global strain_groups
     strain_groups = VSNPTreeMethods.determine_groups(strain_snp_positions=strain_snp_positions,
@@ -275,6 +474,16 @@ def test_filter_snps():
         assert sorted(filtered_group_positions['suis1']['Bsuis1-09']['NC_017251.1'])[0] == 8810
 
 
+def test_species_snp_positions():
+    species_positions = VSNPTreeMethods.species_snp_positions(group_positions_set={
+        'suis1': {
+            'All': {'NC_017251.1': {10, 20}, 'NC_017250.1': {5}},
+            'Bsuis1-09': {'NC_017251.1': {20, 30}}
+        }
+    })
+    assert species_positions == {'suis1': {'NC_017251.1': {10, 20, 30}, 'NC_017250.1': {5}}}
+
+
 def test_load_snp_sequence():
     global group_strain_snp_sequence, species_group_best_ref
     group_strain_snp_sequence, species_group_best_ref = \
@@ -322,6 +531,36 @@ def test_remove_identical_calls():
         assert sorted(non_identical_group_positions['suis1']['Bsuis1-09']['NC_017251.1'])[0] == 16405
 
 
+def test_load_group_snp_sequences():
+    group_snp_sequence, group_best_ref, group_positions = \
+        VSNPTreeMethods.load_group_snp_sequences(strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                                                 strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                                                 group_positions_set=group_positions_set,
+                                                 strain_groups=strain_groups,
+                                                 strain_species_dict=strain_species_dict,
+                                                 consolidated_ref_snp_positions=consolidated_ref_snp_positions,
+                                                 threads=threads)
+    # Slicing the group alignments from the species alignments yields the same outputs as processing each group
+    assert group_snp_sequence == non_identical_group_strain_snp_sequence
+    assert group_best_ref == species_group_best_ref
+    assert group_positions == non_identical_group_positions
+
+
+def test_slice_group_snp_sequence():
+    group_snp_seq = VSNPTreeMethods.slice_group_snp_sequence(
+        strain_rows={'strain1': {'chrom': {10: 'A', 20: 'G', 30: 'T'}},
+                     'strain2': {'chrom': {10: 'C', 20: 'G'}}},
+        group_strains=['strain2', 'strain1'],
+        strain_consolidated_ref_dict={'strain1': 'ref', 'strain2': 'ref'},
+        group_positions={'chrom': {30, 10}},
+        consolidated_ref_snp_positions={'ref': {'chrom': {10: 'A', 20: 'G', 30: 'T'}}})
+    # The reference follows the first strain, and only the group positions are included, in sorted order
+    assert list(group_snp_seq) == ['strain2', 'ref', 'strain1']
+    assert group_snp_seq['strain1'] == {'chrom': {10: 'A', 30: 'T'}}
+    assert group_snp_seq['strain2'] == {'chrom': {10: 'C'}}
+    assert list(group_snp_seq['ref']['chrom']) == [10, 30]
+
+
 def test_create_multifasta():
     global group_folders, species_folders, group_fasta_dict
     group_folders, species_folders, group_fasta_dict = \
@@ -335,6 +574,105 @@ def test_create_multifasta():
             assert os.path.getsize(fasta) > 100
 
 
+def test_encode_alignment():
+    global distance_strains, distance_alignment
+    distance_strains, distance_alignment = \
+        VSNPTreeMethods.encode_alignment(group_snp_seq={'ref': {'chrom': {10: 'A', 20: 'G', 30: 'T', 40: 'C'}},
+                                                        'strain1': {'chrom': {10: 'A', 20: 'G', 30: 'T', 40: 'G'}},
+                                                        'strain2': {'chrom': {10: 'C', 20: 'R', 40: 'C'}}},
+                                         group_positions={'chrom': {40, 30, 20, 10}})
+    assert distance_strains == ['ref', 'strain1', 'strain2']
+    # Positions without a sequence are encoded as gaps, as in the multi-FASTA alignments
+    assert distance_alignment[2].tobytes() == b'CR-C'
+
+
+def test_snp_distance_matrix():
+    distances, compared = VSNPTreeMethods.snp_distance_matrix(alignment=distance_alignment)
+    assert distances.tolist() == [[0, 1, 1], [1, 0, 2], [1, 2, 0]]
+    assert compared[0][2] == 2
+    distances, compared = VSNPTreeMethods.snp_distance_matrix(alignment=distance_alignment,
+                                                              gap_mode='count',
+                                                              ambiguity_mode='count',
+                                                              block_size=3)
+    assert distances.tolist() == [[0, 1, 3], [1, 0, 4], [3, 4, 0]]
+    assert compared[0][2] == 4
+
+
+def test_snp_distance_matrix_invalid_mode():
+    with pytest.raises(ValueError):
+        VSNPTreeMethods.snp_distance_matrix(alignment=distance_alignment,
+                                            gap_mode='not_a_mode')
+
+
+def test_create_distance_matrices():
+    species_group_distances = \
+        VSNPTreeMethods.create_distance_matrices(group_strain_snp_sequence=non_identical_group_strain_snp_sequence,
+                                                 group_positions_set=non_identical_group_positions,
+                                                 distance_path=summary_path)
+    assert len(glob(os.path.join(summary_path, '*_snp_distances.tsv'))) == 9
+    assert os.path.isfile(species_group_distances['suis1']['All']['npz'])
+
+
+def test_load_cluster_state():
+    global cluster_path, cluster_state
+    cluster_path = tempfile.mkdtemp(dir=file_path)
+    cluster_state = VSNPTreeMethods.load_cluster_state(cluster_file=os.path.join(cluster_path, 'clusters.json'),
+                                                       thresholds=[2, 0])
+    assert cluster_state['thresholds'] == [0, 2]
+    assert cluster_state['parents'] == {'0': list(), '2': list()}
+
+
+def test_update_clusters():
+    global cluster_state
+    strain_list, alignment = \
+        VSNPTreeMethods.encode_alignment(group_snp_seq={'strain1': {'chrom': {10: 'A', 20: 'G', 30: 'T'}},
+                                                        'strain2': {'chrom': {10: 'A', 20: 'G', 30: 'T'}},
+                                                        'strain3': {'chrom': {10: 'C', 20: 'C', 30: 'T'}}},
+                                         group_positions={'chrom': {10, 20, 30}})
+    cluster_state, metrics = VSNPTreeMethods.update_clusters(cluster_state=cluster_state,
+                                                             strain_list=strain_list,
+                                                             alignment=alignment)
+    assert metrics['new_strains'] == 3
+    assert VSNPTreeMethods.cluster_names(parents=cluster_state['parents']['0']) == [1, 1, 2]
+    assert VSNPTreeMethods.cluster_names(parents=cluster_state['parents']['2']) == [1, 1, 1]
+
+
+def test_update_clusters_incremental():
+    global cluster_state
+    # strain4 links strain3 to the other strains at the 0 SNP threshold
+    strain_list, alignment = \
+        VSNPTreeMethods.encode_alignment(group_snp_seq={'strain4': {'chrom': {10: 'C', 20: 'C', 30: 'T'}},
+                                                        'strain1': {'chrom': {10: 'A', 20: 'G', 30: 'T'}},
+                                                        'strain2': {'chrom': {10: 'A', 20: 'G', 30: 'T'}},
+                                                        'strain3': {'chrom': {10: 'C', 20: 'C', 30: 'T'}}},
+                                         group_positions={'chrom': {10, 20, 30}})
+    cluster_state, metrics = VSNPTreeMethods.update_clusters(cluster_state=cluster_state,
+                                                             strain_list=strain_list,
+                                                             alignment=alignment)
+    # Only the new strain is added, after the previously clustered strains
+    assert metrics['new_strains'] == 1
+    assert cluster_state['strains'] == ['strain1', 'strain2', 'strain3', 'strain4']
+    assert VSNPTreeMethods.cluster_names(parents=cluster_state['parents']['0']) == [1, 1, 2, 2]
+
+
+def test_create_clusters():
+    group_strain_snp_sequence = {'suis1': {'All': {'NC_017251-NC_017250': {'chrom': {10: 'A', 20: 'G'}},
+                                                   'strain1': {'chrom': {10: 'A', 20: 'T'}},
+                                                   'strain2': {'chrom': {10: 'C', 20: 'T'}}}}}
+    for num_runs in range(2):
+        species_group_clusters, species_group_metrics = \
+            VSNPTreeMethods.create_clusters(group_strain_snp_sequence=group_strain_snp_sequence,
+                                            group_positions_set={'suis1': {'All': {'chrom': {10, 20}}}},
+                                            strain_consolidated_ref_dict={'strain1': 'NC_017251-NC_017250',
+                                                                          'strain2': 'NC_017251-NC_017250'},
+                                            thresholds=[1],
+                                            cluster_path=cluster_path)
+    # The second run re-uses the stored clusters
+    assert species_group_metrics['suis1']['All']['new_strains'] == 0
+    with open(species_group_clusters['suis1']['All'], 'r') as cluster_table:
+        assert cluster_table.read() == 'Strain\tCluster_1SNPs\nstrain1\t1\nstrain2\t1\n'
+
+
 def test_run_raxml():
     global species_group_trees
     species_group_trees = VSNPTreeMethods.run_raxml(group_fasta_dict=group_fasta_dict,
@@ -369,6 +707,107 @@ def test_copy_trees():
     assert len(glob(os.path.join(tree_path, '*'))) == 18
 
 
+def test_collapse_identical_sequences():
+    global collapse_path, collapse_fasta_dict, unique_fasta_dict, species_group_identical
+    collapse_path = tempfile.mkdtemp(dir=file_path)
+    collapse_fasta_dict = {'suis1': {'All': os.path.join(collapse_path, 'All_alignment.fasta')}}
+    with open(collapse_fasta_dict['suis1']['All'], 'w') as fasta:
+        fasta.write('>B13-0234\nACGT\n>NC_017251-NC_017250\nACGA\n>B13-0235\nACGA\n>B13-0236\nACTA\n'
+                    '>B13-0237\nACTA\n>B13-0238\nTCTA\n>B13-0239\nGCTA\n')
+    unique_fasta_dict, species_group_identical = \
+        VSNPTreeMethods.collapse_identical_sequences(group_fasta_dict=collapse_fasta_dict,
+                                                     strain_consolidated_ref_dict={'B13-0234': 'NC_017251-NC_017250'})
+    # The reference genome always represents its profile, as it is the outgroup
+    assert species_group_identical['suis1']['All'] == {'NC_017251-NC_017250': ['B13-0235'],
+                                                       'B13-0236': ['B13-0237']}
+    assert os.path.dirname(unique_fasta_dict['suis1']['All']) == os.path.join(collapse_path, 'collapsed')
+    with open(unique_fasta_dict['suis1']['All'], 'r') as fasta:
+        assert fasta.read().count('>') == 5
+    with open(os.path.join(collapse_path, 'All_identical_profiles.tsv'), 'r') as mapping:
+        assert 'B13-0237\tB13-0236\n' in mapping.read()
+
+
+def test_collapse_identical_sequences_min_sequences():
+    # Alignments with too few unique sequences for RAxML are not collapsed
+    small_fasta_dict, small_identical = \
+        VSNPTreeMethods.collapse_identical_sequences(group_fasta_dict=collapse_fasta_dict,
+                                                     strain_consolidated_ref_dict={'B13-0234': 'NC_017251-NC_017250'},
+                                                     min_sequences=6)
+    assert small_identical['suis1']['All'] == dict()
+    with open(small_fasta_dict['suis1']['All'], 'r') as fasta:
+        assert fasta.read().count('>') == 7
+
+
+def test_expand_identical_sequences():
+    collapsed_tree = os.path.join(collapse_path, 'collapsed', 'RAxML_bestTree.suis1_All')
+    with open(collapsed_tree, 'w') as tree:
+        tree.write('((((NC_017251-NC_017250:0.1,B13-0234:0.1):0.1,B13-0236:0.1):0.1,B13-0238:0.1):0.1,B13-0239:0.1);\n')
+    expanded_group_trees = \
+        VSNPTreeMethods.expand_identical_sequences(
+            species_group_trees={'suis1': {'All': {'best_tree': collapsed_tree}}},
+            species_group_identical=species_group_identical,
+            group_fasta_dict=collapse_fasta_dict)
+    assert expanded_group_trees['suis1']['All']['best_tree'] == os.path.join(collapse_path, 'RAxML_bestTree.suis1_All')
+    # Every strain is present in the order parsed from the expanded tree
+    order_dict = VSNPTreeMethods.parse_tree_order(species_group_trees=expanded_group_trees)
+    assert order_dict['suis1']['All'] == ['NC_017251-NC_017250', 'B13-0235', 'B13-0234', 'B13-0236', 'B13-0237',
+                                          'B13-0238', 'B13-0239']
+
+
+def test_state_masks():
+    masks = VSNPTreeMethods.state_masks(alignment=numpy.frombuffer(b'ACGTR-N', dtype=numpy.uint8))
+    assert masks.tolist() == [1, 2, 4, 8, 5, 15, 15]
+
+
+def test_place_strains():
+    tree = Tree('((ref:0.1,strain1:0.1):0.1,(strain2:0.1,strain3:0.1):0.1);')
+    strain_masks = {strain_name: VSNPTreeMethods.state_masks(alignment=numpy.frombuffer(sequence, dtype=numpy.uint8))
+                    for strain_name, sequence in [('ref', b'AAAA'), ('strain1', b'CAAA'), ('strain2', b'CCGA'),
+                                                  ('strain3', b'CCGT'), ('strain4', b'CCGT')]}
+    placements = VSNPTreeMethods.place_strains(tree=tree,
+                                               strain_masks=strain_masks)
+    # The new strain is identical to strain3, so it is attached to the branch of strain3 without any changes
+    assert placements == {'strain4': 0}
+    assert sorted((tree & 'strain4').up.get_leaf_names()) == ['strain3', 'strain4']
+
+
+def test_placement_trees():
+    global placement_path
+    placement_path = tempfile.mkdtemp(dir=file_path)
+    placement_fasta = os.path.join(placement_path, 'All_alignment.fasta')
+    with open(placement_fasta, 'w') as fasta:
+        fasta.write('>ref\nAAAA\n>strain1\nCAAA\n>strain2\nCCGA\n>strain4\nCCGT\n>strain5\nCAAA\n')
+    placement_tree_path = os.path.join(placement_path, 'tree_files')
+    make_path(placement_tree_path)
+    with open(os.path.join(placement_tree_path, 'RAxML_bestTree.suis1_All'), 'w') as tree:
+        tree.write('((ref:0.1,strain1:0.1):0.1,(strain2:0.1,strain3:0.1):0.1);\n')
+    species_group_trees, raxml_fasta_dict, species_group_placements = \
+        VSNPTreeMethods.placement_trees(group_fasta_dict={'suis1': {'All': placement_fasta,
+                                                                    'Bsuis1-01': placement_fasta}},
+                                        tree_path=placement_tree_path)
+    # Groups without a previous tree are created with RAxML
+    assert raxml_fasta_dict == {'suis1': {'Bsuis1-01': placement_fasta}}
+    assert species_group_placements['suis1']['All'] == {'strain4': 1, 'strain5': 0}
+    # strain3 is no longer present, so it is removed from the tree
+    order_dict = VSNPTreeMethods.parse_tree_order(species_group_trees=species_group_trees)
+    assert sorted(order_dict['suis1']['All']) == ['ref', 'strain1', 'strain2', 'strain4', 'strain5']
+
+
+def test_placement_base_tree():
+    placement_tree_path = os.path.join(placement_path, 'tree_files')
+    shutil.copyfile(src=os.path.join(placement_path, 'vSNP_placementTree.suis1_All'),
+                    dst=os.path.join(placement_tree_path, 'vSNP_placementTree.suis1_All'))
+    # The most recent tree is used as the base of subsequent placements
+    os.utime(os.path.join(placement_tree_path, 'RAxML_bestTree.suis1_All'), (0, 0))
+    assert VSNPTreeMethods.placement_base_tree(tree_path=placement_tree_path,
+                                               species='suis1',
+                                               group='All') == os.path.join(placement_tree_path,
+                                                                            'vSNP_placementTree.suis1_All')
+    assert VSNPTreeMethods.placement_base_tree(tree_path=placement_tree_path,
+                                               species='suis1',
+                                               group='Bsuis1-01') is None
+
+
 def test_load_genbank_file():
     global full_best_ref_gbk_dict
     full_best_ref_gbk_dict = VSNPTreeMethods.load_genbank_file(reference_link_path_dict=reference_link_path_dict,
@@ -475,11 +914,35 @@ def test_vsnp_tree_run_deepvariant():
     assert os.path.isfile(os.path.join(deep_variant_path, 'summary_tables', 'suis1_All_sorted_table.xlsx'))
 
 
+def test_vsnp_tree_run_memory_bounded():
+    vsnp_tree = VSNPTree(path=deep_variant_path,
+                         threads=threads,
+                         debug=False,
+                         variant_caller='deepvariant',
+                         filter_positions=False,
+                         memory_bounded=True)
+    vsnp_tree.main()
+    assert os.path.isfile(os.path.join(deep_variant_path, 'summary_tables', 'suis1_Bsuis1-09B_sorted_table.xlsx'))
+    assert os.path.isfile(os.path.join(deep_variant_path, 'alignments', 'suis1', 'All', 'All_alignment.fasta'))
+
+
 def test_remove_species_folders():
     for species_folder in species_folders:
         shutil.rmtree(species_folder)
 
 
+def test_remove_cluster_folder():
+    shutil.rmtree(cluster_path)
+
+
+def test_remove_placement_folder():
+    shutil.rmtree(placement_path)
+
+
+def test_remove_collapse_folder():
+    shutil.rmtree(collapse_path)
+
+
 def test_remove_alignments_folder():
     shutil.rmtree(fasta_path)
 
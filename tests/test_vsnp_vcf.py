@@ -244,6 +244,67 @@ def test_mash_best_ref():
     assert strain_species_dict['13-1950'] == 'af'
 
 
+def test_parse_mash_dist_line():
+    best_ref_dict = dict()
+    ref_matches_dict = dict()
+    species_dict = dict()
+    for line in ['NC_002945v4.fasta\t13-1950\t0.01\t0\t916/1000\n',
+                 'NC_00693c.fasta\t13-1950\t0.2\t0\t20/1000\n',
+                 'NC_00693c.fasta\t13-1941\t0.2\t0\t499/1000\n']:
+        # The query ID of the line is used as the strain name
+        VCFMethods.parse_mash_dist_line(line=line,
+                                        strain_name=None,
+                                        accession_species_dict=accession_species_dict,
+                                        min_matches=500,
+                                        strain_best_ref_dict=best_ref_dict,
+                                        strain_ref_matches_dict=ref_matches_dict,
+                                        strain_species_dict=species_dict)
+    assert best_ref_dict == {'13-1950': 'NC_002945v4.fasta'}
+    assert ref_matches_dict == {'13-1950': 916}
+    assert species_dict == {'13-1950': 'af'}
+
+
+def test_batch_mash_dist_unnamed_sketches():
+    # The sketches created by call_mash_sketch do not have the strain name as their ID, so the strains must be
+    # compared to the reference genomes individually
+    batch_best_ref_dict, batch_ref_matches_dict, batch_species_dict, compared_strains, mash_lines_dict = \
+        VCFMethods.batch_mash_dist(fastq_sketch_dict=fastq_sketch_dict,
+                                   ref_sketch_file=os.path.join(dependency_path, 'mash', 'vsnp_reference.msh'),
+                                   accession_species_dict=accession_species_dict,
+                                   min_matches=500,
+                                   threads=threads,
+                                   logfile=logfile,
+                                   debug_tables=True)
+    assert compared_strains == set()
+    assert batch_best_ref_dict == dict()
+    assert mash_lines_dict == dict()
+
+
+def test_write_mash_table():
+    mash_dist_table = os.path.join(file_path, 'batch_mash.tab')
+    VCFMethods.write_mash_table(mash_lines=['NC_002945v4.fasta\t13-1950\t0.01\t0\t916/1000\n'],
+                                mash_dist_table=mash_dist_table)
+    strain_best_ref_dict = VCFMethods.mash_best_ref(mash_dist_dict={'13-1950': mash_dist_table},
+                                                    accession_species_dict=accession_species_dict,
+                                                    min_matches=500)[0]
+    assert strain_best_ref_dict == {'13-1950': 'NC_002945v4.fasta'}
+    os.remove(mash_dist_table)
+
+
+def test_route_strains():
+    strain_route_dict = VCFMethods.route_strains(strain_names=['B13-0234', '13-1950', 'NC_002695', 'unmatched'],
+                                                 strain_species_dict={'13-1950': 'af',
+                                                                      'B13-0234': 'ab1',
+                                                                      'NC_002695': 'salmonella'},
+                                                 strain_best_ref_dict={'13-1950': 'NC_002945v4.fasta',
+                                                                       'B13-0234': 'NC_00693c.fasta',
+                                                                       'NC_002695': 'AE006468.fasta'})
+    assert strain_route_dict['unmatched'] == ['unmatched']
+    assert strain_route_dict['mapping'] == ['13-1950', 'B13-0234', 'NC_002695']
+    assert strain_route_dict['spoligo'] == ['13-1950']
+    assert strain_route_dict['mlst'] == ['B13-0234']
+
+
 def test_reference_file_paths():
     global reference_link_path_dict, reference_link_dict
     reference_link_path_dict, reference_link_dict = VCFMethods.reference_folder(
@@ -537,6 +598,17 @@ def test_copy_vcf_files():
     assert len(glob(os.path.join(vcf_path, '*.gvcf'))) == 1
 
 
+def test_index_vcf_files():
+    # Index the copies of the .vcf files rather than the originals
+    copied_vcf_dict = {strain_name: os.path.join(vcf_path, os.path.basename(vcf_file))
+                       for strain_name, vcf_file in strain_vcf_dict.items()}
+    strain_indexed_vcf_dict = VCFMethods.index_vcf_files(strain_vcf_dict=copied_vcf_dict,
+                                                         logfile=logfile)
+    for strain_name, indexed_vcf in strain_indexed_vcf_dict.items():
+        assert indexed_vcf.endswith('.gz')
+        assert os.path.isfile(indexed_vcf + '.tbi')
+
+
 def test_consolidate_high_quality_snp_dicts():
     global strain_num_high_quality_snps_dict
     strain_num_high_quality_snps_dict = dict()
@@ -601,6 +673,13 @@ def test_mlst_parse():
     assert strain_mlst_dict['B13-0234']['matches'] == '9'
 
 
+def test_mlst_parse_no_report():
+    # Without any Brucella strains, MLST is not run, and every strain has negative values
+    strain_mlst_dict = VCFMethods.parse_mlst_report(strain_name_dict={'13-1950': file_path},
+                                                    mlst_report=os.path.join(file_path, 'mlst', 'reports', 'mlst.csv'))
+    assert strain_mlst_dict == {'13-1950': {'sequence_type': 'ND', 'matches': 'ND'}}
+
+
 def test_report_create():
     global vcf_report
     vcf_report = VCFMethods.create_vcf_report(
@@ -1,4 +1,10 @@
 #!/usr/bin/env python3
+from vsnp.vsnp_benchmark_run import VSNPBenchmark
+from vsnp.vsnp_cache_methods import default_cache_size
+from vsnp.vsnp_cache_run import VSNPCache
+from vsnp.vsnp_nearest_run import VSNPNearest
+from vsnp.vsnp_pool_methods import PoolMethods
+from vsnp.vsnp_query_run import VSNPQuery
 from vsnp.vsnp_tree_run import VSNPTree
 from vsnp.vsnp_vcf_run import VCF
 from argparse import ArgumentParser, RawTextHelpFormatter
@@ -18,14 +24,36 @@ def vsnp(args):
                    debug=args.debug,
                    reference_mapper=args.referencemapper,
                    variant_caller=args.variantcaller,
-                   matching_hashes=args.matchinghashes)
+                   matching_hashes=args.matchinghashes,
+                   memory=args.memory,
+                   full_spoligo=args.fullspoligo,
+                   cache_path=args.cache,
+                   cache_size=args.cachesize,
+                   coverage=args.coverage)
     vsnp_vcf.main()
-    vsnp_tree = VSNPTree(path=os.path.join(args.path, 'vcf_files'),
-                         threads=args.threads,
-                         debug=args.debug,
-                         filter_positions=args.filterpositions,
-                         variant_caller=args.variantcaller)
-    vsnp_tree.main()
+    # Create the worker pool of the tree creation stages once the VCF stage, which has its own threads and processes,
+    # is complete. The pool is created before the tree stage loads any calls, so the workers are forked from a small
+    # process
+    pool = PoolMethods.create_pool(threads=args.threads)
+    try:
+        vsnp_tree = VSNPTree(path=os.path.join(args.path, 'vcf_files'),
+                             threads=args.threads,
+                             debug=args.debug,
+                             filter_positions=args.filterpositions,
+                             variant_caller=args.variantcaller,
+                             memory_bounded=args.memorybounded,
+                             pool=pool,
+                             collapse_identical=args.collapseidentical,
+                             gap_mode=args.gapmode,
+                             ambiguity_mode=args.ambiguitymode,
+                             cluster_thresholds=args.clusterthresholds,
+                             placement=args.placement,
+                             store_file=args.store)
+        vsnp_tree.main()
+    finally:
+        # Close and join the pool
+        pool.close()
+        pool.join()
 
 
 def vcf(args):
@@ -37,7 +65,12 @@ def vcf(args):
                    debug=args.debug,
                    reference_mapper=args.referencemapper,
                    variant_caller=args.variantcaller,
-                   matching_hashes=args.matchinghashes)
+                   matching_hashes=args.matchinghashes,
+                   memory=args.memory,
+                   full_spoligo=args.fullspoligo,
+                   cache_path=args.cache,
+                   cache_size=args.cachesize,
+                   coverage=args.coverage)
     vsnp_vcf.main()
 
 
@@ -49,10 +82,79 @@ def tree(args):
                          threads=args.threads,
                          debug=args.debug,
                          filter_positions=args.filterpositions,
-                         variant_caller=args.variantcaller)
+                         variant_caller=args.variantcaller,
+                         memory_bounded=args.memorybounded,
+                         collapse_identical=args.collapseidentical,
+                         gap_mode=args.gapmode,
+                         ambiguity_mode=args.ambiguitymode,
+                         cluster_thresholds=args.clusterthresholds,
+                         placement=args.placement,
+                         store_file=args.store)
     vsnp_tree.main()
 
 
+def benchmark(args):
+    """
+    Benchmark the phylogenetic tree creation methods on synthetic gVCF files
+    """
+    vsnp_benchmark = VSNPBenchmark(path=args.path,
+                                   threads=args.threads,
+                                   debug=args.debug,
+                                   variant_caller=args.variantcaller,
+                                   scales=args.scales,
+                                   species=args.species,
+                                   snp_density=args.snpdensity,
+                                   clades=args.clades,
+                                   deletion_blocks=args.deletionblocks,
+                                   deletion_length=args.deletionlength,
+                                   block_length=args.blocklength,
+                                   filter_positions=args.filterpositions,
+                                   memory_bounded=args.memorybounded,
+                                   track_memory=args.trackmemory,
+                                   keep_files=args.keepfiles,
+                                   seed=args.seed,
+                                   collapse_identical=args.collapseidentical)
+    vsnp_benchmark.main()
+
+
+def nearest(args):
+    """
+    Add strains to, or query strains against, the SNP profile indexes of the historical strains
+    """
+    vsnp_nearest = VSNPNearest(path=args.path,
+                               threads=args.threads,
+                               debug=args.debug,
+                               variant_caller=args.variantcaller,
+                               index_path=args.indexpath,
+                               num_neighbours=args.numneighbours,
+                               build=args.build)
+    vsnp_nearest.main()
+
+
+def query(args):
+    """
+    Find calls in the SNP call store shared across projects
+    """
+    vsnp_query = VSNPQuery(path=args.path,
+                           debug=args.debug,
+                           store_file=args.store,
+                           region=args.region,
+                           strains=args.strains,
+                           filters=args.filters)
+    vsnp_query.main()
+
+
+def cache(args):
+    """
+    Report, and collect the garbage of, the cache of sketches, BAM files, and gVCF files shared across projects
+    """
+    vsnp_cache = VSNPCache(path=args.path,
+                           debug=args.debug,
+                           max_size=args.cachesize,
+                           garbage=args.garbage)
+    vsnp_cache.main()
+
+
 def cli():
     parser = ArgumentParser(
         description='vSNP: bacterial validation SNP analysis tool. USDA APHIS Veterinary Services (VS) Mycobacterium '
@@ -69,6 +171,7 @@ def cli():
                                type=str,
                                help='Specify path of folder containing files to be processed')
     parent_parser.add_argument('-t', '--threads',
+                               type=int,
                                default=multiprocessing.cpu_count() - 1,
                                help='Number of threads. Default is the number of cores in the system - 1')
     parent_parser.add_argument('-d', '--debug',
@@ -94,6 +197,30 @@ def cli():
                                default=250,
                                help='Minimum number of matching hashes returned from MASH in order for a query Brucella'
                                     ' strain to be successfully matched to a reference strain. Default is 250')
+    vcf_subparser.add_argument('-mem', '--memory',
+                               type=float,
+                               help='Memory in GB available to the analyses. The per-strain analyses run concurrently '
+                                    'within this budget and the number of threads. Default is the total memory of '
+                                    'the system')
+    vcf_subparser.add_argument('-fs', '--fullspoligo',
+                               action='store_true',
+                               help='Bait the spoligotyping spacer sequences from every read, rather than stopping '
+                                    'once the presence or absence of every spacer is resolved')
+    vcf_subparser.add_argument('-cov', '--coverage',
+                               type=float,
+                               help='Downsample the read pairs of strains with a greater estimated coverage of their '
+                                    'reference genome than this to this coverage before mapping. The original FASTQ '
+                                    'files are not modified. Default is to map every read')
+    vcf_subparser.add_argument('-ca', '--cache',
+                               help='Path of the folder of a cache of MASH sketches, read quality histograms, sorted '
+                                    'BAM files, and freebayes gVCF files shared across projects. Outputs are found '
+                                    'from the contents of the FASTQ files, the reference genome, and the versions of '
+                                    'the tools, and are hard-linked into the project. Default is to not use a cache')
+    vcf_subparser.add_argument('-cs', '--cachesize',
+                               type=float,
+                               default=default_cache_size,
+                               help='Maximum size of the cache in GB. The least recently used entries are evicted. '
+                                    'Default is {size}'.format(size=default_cache_size))
     vcf_subparser.set_defaults(func=vcf)
     # Create a subparser to run the phylogenetic tree creation component of the script
     tree_subparser = subparsers.add_parser(parents=[parent_parser],
@@ -109,6 +236,41 @@ def cli():
                                 default='freebayes',
                                 help='Specify the variant calling software used to create VCF files. '
                                      'Choices are deepvariant and freebayes. Default is freebayes')
+    tree_subparser.add_argument('-mb', '--memorybounded',
+                                action='store_true',
+                                help='Process each species/group in turn, and release its data before the next '
+                                     'one starts. Peak memory is bounded by the largest group rather than the '
+                                     'whole project, but the gVCF files are parsed twice')
+    tree_subparser.add_argument('-ci', '--collapseidentical',
+                                action='store_true',
+                                help='Create the phylogenetic trees from the unique SNP profiles of each group, '
+                                     'and graft strains with identical profiles back onto the trees as '
+                                     'zero-length branches')
+    tree_subparser.add_argument('-gm', '--gapmode',
+                                choices=['ignore', 'count'],
+                                default='ignore',
+                                help='Specify whether positions at which either strain has a \'-\' are ignored or '
+                                     'counted as differences in the SNP distance matrices. Default is ignore')
+    tree_subparser.add_argument('-am', '--ambiguitymode',
+                                choices=['ignore', 'count'],
+                                default='ignore',
+                                help='Specify whether positions at which either strain has an IUPAC ambiguity code '
+                                     'are ignored or counted as differences in the SNP distance matrices. Default is '
+                                     'ignore')
+    tree_subparser.add_argument('-ct', '--clusterthresholds',
+                                nargs='+',
+                                type=int,
+                                help='SNP thresholds at which single-linkage clusters of the strains in each group are '
+                                     'maintained. Strains added in subsequent runs are joined to the existing clusters')
+    tree_subparser.add_argument('-pl', '--placement',
+                                action='store_true',
+                                help='Place new strains onto the trees of previous runs in the tree_files folder by '
+                                     'parsimony rather than creating new trees with RAxML. Run without this option to '
+                                     'rebuild the trees')
+    tree_subparser.add_argument('-st', '--store',
+                                help='Path of the SQLite database of the SNP call store shared across projects. '
+                                     'Strains that are not in the store are added to it, and the calls of all the '
+                                     'strains are loaded from the store rather than parsed from the gVCF files')
     tree_subparser.set_defaults(func=tree)
     # Create a subparser to run the full vSNP pipeline (VCF and subsequent phylogenetic tree creation)
     vsnp_subparser = subparsers.add_parser(parents=[parent_parser],
@@ -130,10 +292,196 @@ def cli():
                                 default=250,
                                 help='Minimum number of matching hashes returned from MASH in order for a query B'
                                      'rucella strain to be successfully matched to a reference strain. Default is 250')
+    vsnp_subparser.add_argument('-mem', '--memory',
+                                type=float,
+                                help='Memory in GB available to the analyses. The per-strain analyses run '
+                                     'concurrently within this budget and the number of threads. Default is the total '
+                                     'memory of the system')
+    vsnp_subparser.add_argument('-fs', '--fullspoligo',
+                                action='store_true',
+                                help='Bait the spoligotyping spacer sequences from every read, rather than stopping '
+                                     'once the presence or absence of every spacer is resolved')
+    vsnp_subparser.add_argument('-cov', '--coverage',
+                                type=float,
+                                help='Downsample the read pairs of strains with a greater estimated coverage of their '
+                                     'reference genome than this to this coverage before mapping. The original FASTQ '
+                                     'files are not modified. Default is to map every read')
+    vsnp_subparser.add_argument('-ca', '--cache',
+                                help='Path of the folder of a cache of MASH sketches, read quality histograms, sorted '
+                                     'BAM files, and freebayes gVCF files shared across projects. Outputs are found '
+                                     'from the contents of the FASTQ files, the reference genome, and the versions of '
+                                     'the tools, and are hard-linked into the project. Default is to not use a cache')
+    vsnp_subparser.add_argument('-cs', '--cachesize',
+                                type=float,
+                                default=default_cache_size,
+                                help='Maximum size of the cache in GB. The least recently used entries are evicted. '
+                                     'Default is {size}'.format(size=default_cache_size))
     vsnp_subparser.add_argument('-f', '--filterpositions',
                                 action='store_false',
                                 help='Do not use the Filtered_Regions.xlsx file to filter SNPs')
+    vsnp_subparser.add_argument('-mb', '--memorybounded',
+                                action='store_true',
+                                help='Process each species/group in turn, and release its data before the next '
+                                     'one starts. Peak memory is bounded by the largest group rather than the '
+                                     'whole project, but the gVCF files are parsed twice')
+    vsnp_subparser.add_argument('-ci', '--collapseidentical',
+                                action='store_true',
+                                help='Create the phylogenetic trees from the unique SNP profiles of each group, '
+                                     'and graft strains with identical profiles back onto the trees as '
+                                     'zero-length branches')
+    vsnp_subparser.add_argument('-gm', '--gapmode',
+                                choices=['ignore', 'count'],
+                                default='ignore',
+                                help='Specify whether positions at which either strain has a \'-\' are ignored or '
+                                     'counted as differences in the SNP distance matrices. Default is ignore')
+    vsnp_subparser.add_argument('-am', '--ambiguitymode',
+                                choices=['ignore', 'count'],
+                                default='ignore',
+                                help='Specify whether positions at which either strain has an IUPAC ambiguity code '
+                                     'are ignored or counted as differences in the SNP distance matrices. Default is '
+                                     'ignore')
+    vsnp_subparser.add_argument('-ct', '--clusterthresholds',
+                                nargs='+',
+                                type=int,
+                                help='SNP thresholds at which single-linkage clusters of the strains in each group are '
+                                     'maintained. Strains added in subsequent runs are joined to the existing clusters')
+    vsnp_subparser.add_argument('-pl', '--placement',
+                                action='store_true',
+                                help='Place new strains onto the trees of previous runs in the tree_files folder by '
+                                     'parsimony rather than creating new trees with RAxML. Run without this option to '
+                                     'rebuild the trees')
+    vsnp_subparser.add_argument('-st', '--store',
+                                help='Path of the SQLite database of the SNP call store shared across projects. '
+                                     'Strains that are not in the store are added to it, and the calls of all the '
+                                     'strains are loaded from the store rather than parsed from the gVCF files')
     vsnp_subparser.set_defaults(func=vsnp)
+    # Create a subparser to benchmark the phylogenetic tree creation component on synthetic gVCF files
+    benchmark_subparser = subparsers.add_parser(parents=[parent_parser],
+                                                name='benchmark',
+                                                description='',
+                                                formatter_class=RawTextHelpFormatter,
+                                                help='Time the phylogenetic tree creation methods on synthetic gVCF '
+                                                     'files of increasing numbers of strains')
+    benchmark_subparser.add_argument('-vc', '--variantcaller',
+                                     choices=['deepvariant', 'freebayes'],
+                                     default='deepvariant',
+                                     help='Specify the style of synthetic gVCF files to create. Choices are '
+                                          'deepvariant and freebayes. Default is deepvariant')
+    benchmark_subparser.add_argument('-s', '--scales',
+                                     nargs='+',
+                                     type=int,
+                                     default=[100, 500, 1000],
+                                     help='Number of strains to simulate in each benchmark run. '
+                                          'Default is 100 500 1000')
+    benchmark_subparser.add_argument('-sp', '--species',
+                                     default='suis1',
+                                     help='Species code of the reference genome used to simulate the strains. '
+                                          'Default is suis1')
+    benchmark_subparser.add_argument('-sd', '--snpdensity',
+                                     type=float,
+                                     default=100,
+                                     help='Number of SNPs per megabase in each strain. Default is 100')
+    benchmark_subparser.add_argument('-c', '--clades',
+                                     type=int,
+                                     default=10,
+                                     help='Number of clades in the simulated population. Default is 10')
+    benchmark_subparser.add_argument('-db', '--deletionblocks',
+                                     type=int,
+                                     default=20,
+                                     help='Number of zero coverage blocks in each strain. Default is 20')
+    benchmark_subparser.add_argument('-dl', '--deletionlength',
+                                     type=int,
+                                     default=500,
+                                     help='Mean length of the zero coverage blocks. Default is 500')
+    benchmark_subparser.add_argument('-bl', '--blocklength',
+                                     type=int,
+                                     default=15,
+                                     help='Mean length of the reference blocks in deepvariant-style gVCF files. '
+                                          'Default is 15')
+    benchmark_subparser.add_argument('-f', '--filterpositions',
+                                     action='store_true',
+                                     help='Filter SNPs based on their proximity to other SNPs')
+    benchmark_subparser.add_argument('-mb', '--memorybounded',
+                                     action='store_true',
+                                     help='Process each species/group in turn, and release its data before the next '
+                                          'one starts. Peak memory is bounded by the largest group rather than the '
+                                          'whole project, but the gVCF files are parsed twice')
+    benchmark_subparser.add_argument('-tm', '--trackmemory',
+                                     action='store_true',
+                                     help='Also record the peak Python heap of each stage with tracemalloc. This slows '
+                                          'down allocation-heavy stages')
+    benchmark_subparser.add_argument('-k', '--keepfiles',
+                                     action='store_true',
+                                     help='Keep the synthetic gVCF files and the tree outputs')
+    benchmark_subparser.add_argument('--seed',
+                                     type=int,
+                                     default=12345,
+                                     help='Random seed to use for the simulation. Default is 12345')
+    benchmark_subparser.add_argument('-ci', '--collapseidentical',
+                                     action='store_true',
+                                     help='Collapse strains with identical SNP profiles before creating the trees')
+    benchmark_subparser.set_defaults(func=benchmark)
+    # Create a subparser to find the closest historical strains with the SNP profile indexes
+    nearest_subparser = subparsers.add_parser(parents=[parent_parser],
+                                              name='nearest',
+                                              description='',
+                                              formatter_class=RawTextHelpFormatter,
+                                              help='Find the closest strains in the SNP profile indexes of historical '
+                                                   'strains')
+    nearest_subparser.add_argument('-i', '--indexpath',
+                                   required=True,
+                                   help='Path of folder containing the SNP profile indexes')
+    nearest_subparser.add_argument('-vc', '--variantcaller',
+                                   choices=['deepvariant', 'freebayes'],
+                                   default='freebayes',
+                                   help='Specify the variant calling software used to create VCF files. '
+                                        'Choices are deepvariant and freebayes. Default is freebayes')
+    nearest_subparser.add_argument('-k', '--numneighbours',
+                                   type=int,
+                                   default=10,
+                                   help='Number of closest strains to report for each strain. Default is 10')
+    nearest_subparser.add_argument('-b', '--build',
+                                   action='store_true',
+                                   help='Add the strains to the SNP profile indexes rather than finding their '
+                                        'closest strains')
+    nearest_subparser.set_defaults(func=nearest)
+    # Create a subparser to find calls in the SNP call store
+    query_subparser = subparsers.add_parser(parents=[parent_parser],
+                                            name='query',
+                                            description='',
+                                            formatter_class=RawTextHelpFormatter,
+                                            help='Find calls in the SNP call store shared across projects')
+    query_subparser.add_argument('-st', '--store',
+                                 required=True,
+                                 help='Path of the SQLite database of the SNP call store')
+    query_subparser.add_argument('-r', '--region',
+                                 help='Region of the calls to report: CHROM, CHROM:POS, or CHROM:START-END e.g. '
+                                      'NC_002945.4:1473246. Default is every position')
+    query_subparser.add_argument('-s', '--strains',
+                                 nargs='+',
+                                 help='Names of the strains of the calls to report. Default is every strain')
+    query_subparser.add_argument('-fi', '--filters',
+                                 nargs='+',
+                                 choices=['PASS', 'INSERTION', 'DELETION'],
+                                 help='Filters of the calls to report. Default is every filter')
+    query_subparser.set_defaults(func=query)
+    # Create a subparser to report and collect the garbage of the cache shared across projects
+    cache_subparser = subparsers.add_parser(parents=[parent_parser],
+                                            name='cache',
+                                            description='',
+                                            formatter_class=RawTextHelpFormatter,
+                                            help='Report the contents of the cache shared across projects supplied '
+                                                 'with -p, and optionally collect its garbage')
+    cache_subparser.add_argument('-cs', '--cachesize',
+                                 type=float,
+                                 default=default_cache_size,
+                                 help='Maximum size of the cache in GB when collecting garbage. Default is {size}'
+                                 .format(size=default_cache_size))
+    cache_subparser.add_argument('-gc', '--garbage',
+                                 action='store_true',
+                                 help='Evict the least recently used entries beyond the maximum size, and remove '
+                                      'interrupted entries and the content hashes of missing files')
+    cache_subparser.set_defaults(func=cache)
     # Get the arguments into an object
     arguments = parser.parse_args()
     # Run the appropriate function for each sub-parser.
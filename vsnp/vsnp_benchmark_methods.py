@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import make_path
+from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from Bio import SeqIO
+from functools import wraps
+import tracemalloc
+import resource
+import random
+import gzip
+import json
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+class BenchmarkMethods(object):
+
+    @staticmethod
+    def reference_details(species_code, dependency_path):
+        """
+        Find the reference FASTA file, and its dependency folder, for the supplied species code
+        :param species_code: type STR: Species code of the reference genome to use e.g. suis1 or af
+        :param dependency_path: type STR: Absolute path to dependency folder
+        :return: reference_file: Name of the reference FASTA file e.g. NC_017251-NC_017250.fasta
+        :return: reference_link_path: Relative path of the folder containing the reference dependency files
+        """
+        # Parse the reference file: species code .csv file
+        accession_species_dict = VSNPTreeMethods.parse_accession_species(
+            ref_species_file=os.path.join(dependency_path, 'mash', 'species_accessions.csv'))
+        # Find the reference file corresponding to the species code
+        reference_files = [reference_file for reference_file, species in accession_species_dict.items()
+                           if species == species_code]
+        assert reference_files, 'Cannot find a reference genome for species code: {sc}'.format(sc=species_code)
+        reference_file = reference_files[0]
+        # Use the reference links file to find the dependency folder of the reference genome
+        reference_link_path_dict, reference_link_dict = \
+            VSNPTreeMethods.reference_folder(strain_best_ref_fasta_dict={'synthetic': reference_file},
+                                             dependency_path=dependency_path)
+        return reference_file, reference_link_path_dict['synthetic']
+
+    @staticmethod
+    def load_contigs(reference_fai):
+        """
+        Extract the name and length of each contig in the reference genome from the FASTA index file
+        :param reference_fai: type STR: Absolute path to the reference genome .fai file
+        :return: contig_dict: Dictionary of contig name: contig length
+        """
+        # Initialise a dictionary to store the contig lengths. Insertion order matches the order in the reference
+        contig_dict = dict()
+        with open(reference_fai, 'r') as fai:
+            for line in fai:
+                # The first two columns of the index are the contig name and the contig length
+                contig, length = line.rstrip().split('\t')[:2]
+                contig_dict[contig] = int(length)
+        return contig_dict
+
+    @staticmethod
+    def load_reference_bases(reference_fasta, contig_dict, seed=12345):
+        """
+        Load the reference genome sequence. If the FASTA file is not present in the dependencies folder (only the
+        index is required by the pipeline), create a random sequence of the same length for each contig
+        :param reference_fasta: type STR: Absolute path to the reference genome FASTA file
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param seed: type INT: Random seed to use when creating a random sequence
+        :return: reference_seq_dict: Dictionary of contig name: upper case sequence string
+        """
+        # Initialise a dictionary to store the sequence of each contig
+        reference_seq_dict = dict()
+        if os.path.isfile(reference_fasta):
+            # Use SeqIO to parse the FASTA file
+            for record in SeqIO.parse(reference_fasta, 'fasta'):
+                reference_seq_dict[record.id] = str(record.seq).upper()
+        else:
+            # Seed the random number generator so that the sequence is reproducible
+            generator = random.Random(seed)
+            for contig, length in contig_dict.items():
+                reference_seq_dict[contig] = ''.join(generator.choice('ACGT') for _ in range(length))
+        return reference_seq_dict
+
+    @staticmethod
+    def defining_snp_positions(species_code, reference_link_path, dependency_path):
+        """
+        Load the group-defining SNPs of the reference genome, so that synthetic strains can be placed into groups
+        :param species_code: type STR: Species code of the reference genome
+        :param reference_link_path: type STR: Relative path of the folder containing the reference dependency files
+        :param dependency_path: type STR: Absolute path to dependency folder
+        :return: defining_positions: Sorted list of tuples of (contig, position) of all defining SNPs
+        """
+        # Use the tree methods to parse the DefiningSNPsGroupDesignations.xlsx file
+        defining_snp_dict = \
+            VSNPTreeMethods.extract_defining_snps(reference_link_path_dict={'synthetic': reference_link_path},
+                                                  strain_species_dict={'synthetic': species_code},
+                                                  dependency_path=dependency_path)
+        # Initialise a set to store the positions
+        defining_positions = set()
+        for group, ref_snp_dict in defining_snp_dict.get(species_code, dict()).items():
+            for contig, position in ref_snp_dict.items():
+                # Inverted positions have a trailing '!'
+                defining_positions.add((contig, int(position.rstrip('!'))))
+        return sorted(defining_positions)
+
+    @staticmethod
+    def synthetic_population(contig_dict, reference_seq_dict, num_strains, snp_density, num_clades,
+                             deletion_blocks, deletion_length, defining_positions, mixed_fraction=0.02,
+                             insertion_fraction=0.02, seed=12345):
+        """
+        Simulate the variants of a population of strains. Each strain carries the SNPs of its clade, a set of private
+        SNPs, and a number of zero coverage (deletion) blocks. Group-defining SNPs are spread across the clades, so
+        that the group-specific analyses are exercised
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param reference_seq_dict: type DICT: Dictionary of contig name: sequence string
+        :param num_strains: type INT: Number of strains to simulate
+        :param snp_density: type FLOAT: Number of SNPs per megabase in each strain
+        :param num_clades: type INT: Number of clades in the population
+        :param deletion_blocks: type INT: Number of zero coverage blocks in each strain
+        :param deletion_length: type INT: Mean length of the zero coverage blocks
+        :param defining_positions: type LIST: List of tuples of (contig, position) of group-defining SNPs
+        :param mixed_fraction: type FLOAT: Fraction of SNPs that are called as mixed populations
+        :param insertion_fraction: type FLOAT: Fraction of variants that are called as insertions
+        :param seed: type INT: Random seed to use for the simulation
+        :return: strain_variant_dict: Dictionary of strain name: contig: dictionary of 'snps': position: (alt, mixed),
+        'insertions': set of positions, 'deletions': list of (start, end) tuples
+        """
+        # Seed the random number generator so that the population is reproducible
+        generator = random.Random(seed)
+        # Determine the total genome length, and the number of SNPs expected in each strain
+        genome_length = sum(contig_dict.values())
+        num_snps = max(int(genome_length / 1000000 * snp_density), 1)
+        # Clade-specific SNPs make up half of the SNPs of each strain. The remainder are private
+        clade_snps = int(num_snps / 2)
+        private_snps = num_snps - clade_snps
+        contigs = list(contig_dict)
+        weights = [contig_dict[contig] for contig in contigs]
+
+        def random_positions(count):
+            # Select random contig: position pairs. Weight the choice of contig by its length
+            positions = set()
+            for contig in generator.choices(contigs, weights=weights, k=count):
+                positions.add((contig, generator.randint(1, contig_dict[contig])))
+            return positions
+
+        def alternate_base(contig, position):
+            # Choose an alternate base that differs from the reference base
+            ref_base = reference_seq_dict[contig][position - 1]
+            return generator.choice([base for base in 'ACGT' if base != ref_base])
+        # Create the clade-specific SNPs. Assign the group-defining SNPs to the clades in a round-robin fashion
+        clade_positions = list()
+        for clade in range(num_clades):
+            positions = random_positions(clade_snps)
+            positions.update(defining_positions[clade::num_clades])
+            clade_positions.append({pos: alternate_base(*pos) for pos in positions})
+        # Initialise the dictionary to store the variants of each strain
+        strain_variant_dict = dict()
+        for i in range(num_strains):
+            strain_name = 'SYN-{num:06d}'.format(num=i + 1)
+            strain_variant_dict[strain_name] = {contig: {'snps': dict(), 'insertions': set(), 'deletions': list()}
+                                                for contig in contigs}
+            # Add the clade SNPs, followed by the private SNPs
+            snp_dict = dict(clade_positions[i % num_clades])
+            for pos in random_positions(private_snps):
+                snp_dict[pos] = alternate_base(*pos)
+            for (contig, position), alt in snp_dict.items():
+                # A small number of the SNPs are mixed populations, or insertions
+                draw = generator.random()
+                if draw < insertion_fraction:
+                    strain_variant_dict[strain_name][contig]['insertions'].add(position)
+                else:
+                    strain_variant_dict[strain_name][contig]['snps'][position] = (alt, draw < insertion_fraction +
+                                                                                  mixed_fraction)
+            # Add the zero coverage blocks
+            for contig, start in random_positions(deletion_blocks):
+                end = min(start + max(int(generator.expovariate(1 / deletion_length)), 1), contig_dict[contig])
+                strain_variant_dict[strain_name][contig]['deletions'].append((start, end))
+        return strain_variant_dict
+
+    @staticmethod
+    def reference_blocks(contig_dict, block_length, seed=12345):
+        """
+        deepvariant compresses stretches of reference calls into gVCF blocks. Determine the start positions of the
+        blocks once, so that the same layout can be used for every strain
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param block_length: type INT: Mean length of the gVCF reference blocks
+        :param seed: type INT: Random seed to use when choosing the block lengths
+        :return: contig_block_dict: Dictionary of contig name: sorted list of block start positions
+        """
+        # Seed the random number generator so that the layout is reproducible
+        generator = random.Random(seed)
+        # Initialise the dictionary to store the block starts
+        contig_block_dict = dict()
+        for contig, length in contig_dict.items():
+            contig_block_dict[contig] = list()
+            position = 1
+            while position <= length:
+                contig_block_dict[contig].append(position)
+                # Draw the length of the next block from an exponential distribution
+                position += max(int(generator.expovariate(1 / block_length)), 1)
+        return contig_block_dict
+
+    @staticmethod
+    def strain_records(variant_dict, contig_dict, reference_seq_dict, contig_block_dict):
+        """
+        Create an ordered list of the records in a strain gVCF file. Reference blocks are split at each variant
+        :param variant_dict: type DICT: Dictionary of contig: dictionary of 'snps', 'insertions', and 'deletions'
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param reference_seq_dict: type DICT: Dictionary of contig name: sequence string
+        :param contig_block_dict: type DICT: Dictionary of contig name: sorted list of block start positions. Only
+        used for deepvariant-style outputs; an empty dictionary yields records for variants only
+        :return: records: List of tuples of (record type, contig, start, end, ref, alt, mixed)
+        """
+        # Initialise the list of records
+        records = list()
+        for contig, length in contig_dict.items():
+            sequence = reference_seq_dict[contig]
+            # Create a dictionary of position: record for all the variants
+            variant_records = dict()
+            for position, (alt, mixed) in variant_dict[contig]['snps'].items():
+                variant_records[position] = ('snp', contig, position, position, sequence[position - 1], alt, mixed)
+            for position in variant_dict[contig]['insertions']:
+                variant_records[position] = ('insertion', contig, position, position, sequence[position - 1],
+                                             sequence[position - 1] + 'GA', False)
+            # Deletions overwrite any variants within their bounds
+            for start, end in variant_dict[contig]['deletions']:
+                for position in [pos for pos in variant_records if start <= pos <= end]:
+                    del variant_records[position]
+                variant_records[start] = ('deletion', contig, start, end, sequence[start - 1], '', False)
+            # Remove overlapping deletions
+            stop = 0
+            for position in sorted(variant_records):
+                if position <= stop:
+                    del variant_records[position]
+                else:
+                    stop = variant_records[position][3]
+            # Variant-only outputs do not have reference blocks
+            if contig not in contig_block_dict:
+                records.extend(variant_records[position] for position in sorted(variant_records))
+                continue
+            # Merge the reference blocks with the variants
+            starts = contig_block_dict[contig]
+            variant_positions = sorted(variant_records)
+            block_index = 0
+            position = 1
+            for variant_position in variant_positions + [length + 1]:
+                # Add reference blocks to fill the region between the current position and the variant
+                while position < variant_position:
+                    # Find the next block start after the current position
+                    while block_index < len(starts) and starts[block_index] <= position:
+                        block_index += 1
+                    next_start = starts[block_index] if block_index < len(starts) else length + 1
+                    end = min(next_start, variant_position) - 1
+                    records.append(('block', contig, position, end, sequence[position - 1], '', False))
+                    position = end + 1
+                if variant_position <= length:
+                    record = variant_records[variant_position]
+                    records.append(record)
+                    position = record[3] + 1
+        return records
+
+    @staticmethod
+    def write_deepvariant_gvcf(strain_name, records, contig_dict, output_file, seed=12345):
+        """
+        Write a gzip-compressed gVCF file in the format created by deepvariant
+        :param strain_name: type STR: Name of the strain
+        :param records: type LIST: List of tuples of (record type, contig, start, end, ref, alt, mixed)
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param output_file: type STR: Absolute path of the gVCF file to create
+        :param seed: type INT: Random seed to use when choosing the quality and depth values
+        """
+        # Seed the random number generator so that the file is reproducible
+        generator = random.Random(seed)
+        # Create the header
+        header = ['##fileformat=VCFv4.2',
+                  '##FILTER=<ID=PASS,Description="All filters passed">',
+                  '##FILTER=<ID=RefCall,Description="Genotyping model thinks this site is reference.">',
+                  '##FILTER=<ID=LowQual,Description="Confidence in this variant being real is below calling '
+                  'threshold.">',
+                  '##INFO=<ID=END,Number=1,Type=Integer,Description="End position (for use with symbolic alleles)">',
+                  '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+                  '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Conditional genotype quality">',
+                  '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+                  '##FORMAT=<ID=MIN_DP,Number=1,Type=Integer,Description="Minimum DP observed within the GVCF '
+                  'block.">',
+                  '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Read depth for each allele">',
+                  '##FORMAT=<ID=VAF,Number=A,Type=Float,Description="Variant allele fractions.">',
+                  '##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods rounded to '
+                  'the closest integer">']
+        header.extend('##contig=<ID={contig},length={length}>'.format(contig=contig, length=length)
+                      for contig, length in contig_dict.items())
+        header.append('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT',
+                                 strain_name]))
+        # Initialise a list to store the lines
+        lines = list()
+        for record_type, contig, start, end, ref, alt, mixed in records:
+            if record_type == 'block':
+                # random() is considerably faster than randint(), which matters for the many reference blocks
+                depth = 5 + int(generator.random() * 56)
+                lines.append('{contig}\t{start}\t.\t{ref}\t<*>\t0\t.\tEND={end}\tGT:GQ:MIN_DP:PL\t'
+                             '0/0:{gq}:{depth}:0,{gq},{pl}'
+                             .format(contig=contig, start=start, ref=ref, end=end, gq=min(depth * 3, 99),
+                                     depth=depth, pl=depth * 10))
+            elif record_type == 'deletion':
+                lines.append('{contig}\t{start}\t.\t{ref}\t<*>\t0\t.\tEND={end}\tGT:GQ:MIN_DP:PL\t./.:0:0:0,0,0'
+                             .format(contig=contig, start=start, ref=ref, end=end))
+            else:
+                depth = generator.randint(15, 60)
+                # Mixed populations have a variant allele fraction below the 0.8 cutoff used in the tree methods
+                vaf = round(generator.uniform(0.3, 0.7), 6) if mixed else 1
+                alt_depth = int(depth * vaf)
+                lines.append('{contig}\t{start}\t.\t{ref}\t{alt},<*>\t{qual}\tPASS\t.\tGT:GQ:DP:AD:VAF:PL\t'
+                             '{gt}:{gq}:{depth}:{ref_depth},{alt_depth},0:{vaf},0:{pl},{gq},0,990,990,990'
+                             .format(contig=contig, start=start, ref=ref, alt=alt,
+                                     qual=round(generator.uniform(35, 70), 1), gt='0/1' if mixed else '1/1',
+                                     gq=generator.randint(30, 60), depth=depth, ref_depth=depth - alt_depth,
+                                     alt_depth=alt_depth, vaf=vaf, pl=generator.randint(40, 70)))
+        # Write the header and the records to the compressed output file
+        with gzip.open(output_file, 'wt', compresslevel=6) as gvcf:
+            gvcf.write('\n'.join(header + lines) + '\n')
+
+    @staticmethod
+    def write_freebayes_gvcf(strain_name, records, contig_dict, output_file, seed=12345):
+        """
+        Write a gVCF file in the format produced by freebayes following filtering with VCFMethods.parse_vcf (SNPs with
+        QUAL >= 150, indels, and zero coverage regions)
+        :param strain_name: type STR: Name of the strain
+        :param records: type LIST: List of tuples of (record type, contig, start, end, ref, alt, mixed)
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param output_file: type STR: Absolute path of the gVCF file to create
+        :param seed: type INT: Random seed to use when choosing the quality and depth values
+        """
+        # Seed the random number generator so that the file is reproducible
+        generator = random.Random(seed)
+        # Create the header
+        header = ['##fileformat=VCFv4.2',
+                  '##source=freeBayes v1.3.1',
+                  '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth at the locus">',
+                  '##INFO=<ID=AC,Number=A,Type=Integer,Description="Total number of alternate alleles in called '
+                  'genotypes">']
+        header.extend('##contig=<ID={contig},length={length}>'.format(contig=contig, length=length)
+                      for contig, length in contig_dict.items())
+        header.append('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT',
+                                 strain_name]))
+        # Initialise a list to store the lines
+        lines = list()
+        for record_type, contig, start, end, ref, alt, mixed in records:
+            if record_type == 'deletion':
+                lines.append('{contig}\t{start}\t.\t{ref}\t<*>\t0\t.\tDP=0;END={end};MIN_DP=0\t'
+                             'GQ:DP:MIN_DP:QR:RO:QA:AO\t0:0:0:0:0:0:0'
+                             .format(contig=contig, start=start, ref=ref, end=end))
+            elif record_type == 'insertion':
+                depth = generator.randint(15, 60)
+                # freebayes reports indels with the flanking reference base
+                lines.append('{contig}\t{start}\t.\t{ref}C\t{alt}C\t{qual}\t.\tAC=2;AF=1;AN=2;AO={depth};DP={depth};'
+                             'RO=0;TYPE=ins\tGT:DP:AD:RO:QR:AO:QA:GL\t1/1:{depth}:0,{depth}:0:0:{depth}:{qa}:'
+                             '-100,-10,0'
+                             .format(contig=contig, start=start, ref=ref, alt=alt,
+                                     qual=round(generator.uniform(150, 900), 4), depth=depth, qa=depth * 35))
+            elif record_type == 'snp':
+                depth = generator.randint(15, 60)
+                alt_depth = int(depth / 2) if mixed else depth
+                lines.append('{contig}\t{start}\t.\t{ref}\t{alt}\t{qual}\t.\tAC={ac};AF={af};AN=2;AO={alt_depth};'
+                             'DP={depth};RO={ref_depth};TYPE=snp\tGT:DP:AD:RO:QR:AO:QA:GL\t'
+                             '{gt}:{depth}:{ref_depth},{alt_depth}:{ref_depth}:{qr}:{alt_depth}:{qa}:-100,-10,0'
+                             .format(contig=contig, start=start, ref=ref, alt=alt,
+                                     qual=round(generator.uniform(150, 1500), 4), ac=1 if mixed else 2,
+                                     af=0.5 if mixed else 1, alt_depth=alt_depth, depth=depth,
+                                     ref_depth=depth - alt_depth, gt='0/1' if mixed else '1/1',
+                                     qr=(depth - alt_depth) * 35, qa=alt_depth * 35))
+        # Write the header and the records to the output file
+        with open(output_file, 'w') as gvcf:
+            gvcf.write('\n'.join(header + lines) + '\n')
+
+    @staticmethod
+    def create_synthetic_gvcfs(strain_variant_dict, contig_dict, reference_seq_dict, output_path, variant_caller,
+                               block_length=15, seed=12345):
+        """
+        Create deepvariant- or freebayes-style gVCF files for every synthetic strain
+        :param strain_variant_dict: type DICT: Dictionary of strain name: contig: dictionary of variants
+        :param contig_dict: type DICT: Dictionary of contig name: contig length
+        :param reference_seq_dict: type DICT: Dictionary of contig name: sequence string
+        :param output_path: type STR: Absolute path of folder in which the gVCF files are to be created
+        :param variant_caller: type STR: Format of gVCF file to create: deepvariant or freebayes
+        :param block_length: type INT: Mean length of the reference blocks in deepvariant-style files
+        :param seed: type INT: Random seed to use
+        :return: strain_vcf_dict: Dictionary of strain name: absolute path to gVCF file
+        """
+        make_path(output_path)
+        # Only deepvariant outputs contain reference blocks
+        contig_block_dict = BenchmarkMethods.reference_blocks(contig_dict=contig_dict,
+                                                              block_length=block_length,
+                                                              seed=seed) \
+            if variant_caller == 'deepvariant' else dict()
+        # Initialise a dictionary to store the absolute path of the gVCF files
+        strain_vcf_dict = dict()
+        for i, (strain_name, variant_dict) in enumerate(sorted(strain_variant_dict.items())):
+            records = BenchmarkMethods.strain_records(variant_dict=variant_dict,
+                                                      contig_dict=contig_dict,
+                                                      reference_seq_dict=reference_seq_dict,
+                                                      contig_block_dict=contig_block_dict)
+            if variant_caller == 'deepvariant':
+                output_file = os.path.join(output_path, '{sn}.gvcf.gz'.format(sn=strain_name))
+                BenchmarkMethods.write_deepvariant_gvcf(strain_name=strain_name,
+                                                        records=records,
+                                                        contig_dict=contig_dict,
+                                                        output_file=output_file,
+                                                        seed=seed + i)
+            else:
+                output_file = os.path.join(output_path, '{sn}.gvcf'.format(sn=strain_name))
+                BenchmarkMethods.write_freebayes_gvcf(strain_name=strain_name,
+                                                      records=records,
+                                                      contig_dict=contig_dict,
+                                                      output_file=output_file,
+                                                      seed=seed + i)
+            strain_vcf_dict[strain_name] = output_file
+        return strain_vcf_dict
+
+    @staticmethod
+    def stub_raxml(group_fasta_dict, strain_consolidated_ref_dict, strain_groups, threads, logfile, **kwargs):
+        """
+        Stand-in for VSNPTreeMethods.run_raxml. Rather than calling RAxML, write a ladder tree of the sequences in each
+        alignment, so that the downstream methods can be timed without the runtime of RAxML
+        :param group_fasta_dict: type DICT: Dictionary of species code: group name: FASTA file created for the group
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param strain_groups: type DICT: Dictionary of strain name: list of group(s) for which the strain is a member
+        :param threads: type INT: Number of threads (unused)
+        :param logfile: type STR: Absolute path to logfile basename (unused)
+        :return: species_group_trees: Dictionary of species code: group name: dictionary of tree type: absolute path
+        to tree file
+        """
+        # Initialise a dictionary to store the absolute paths of the output trees
+        species_group_trees = dict()
+        for species, group_dict in group_fasta_dict.items():
+            species_group_trees[species] = dict()
+            for group, fasta_file in group_dict.items():
+                # Extract the names of the sequences in the alignment
+                names = [record.id for record in SeqIO.parse(fasta_file, 'fasta')]
+                # Nest the sequences into a ladder (caterpillar) tree e.g. (((A,B),C),D);
+                newick = names[0]
+                for name in names[1:]:
+                    newick = '({newick}:0.01,{name}:0.01)'.format(newick=newick, name=name)
+                output_dir = os.path.dirname(fasta_file)
+                best_tree = os.path.join(output_dir, 'RAxML_bestTree.{species}_{group}'
+                                         .format(species=species, group=group))
+                with open(best_tree, 'w') as tree:
+                    tree.write(newick + ';\n')
+                species_group_trees[species][group] = {'best_tree': best_tree}
+        return species_group_trees
+
+    @staticmethod
+    def instrument_methods(method_class, stage_metrics, track_memory=False, exclude=None):
+        """
+        Replace the static methods of a class with wrappers that record the wall clock time and the peak resident set
+        size of every call. Only the outermost call is recorded, so stages that call other stages are not counted
+        twice. Calls made within forked worker processes are not recorded; their cost is included in the metrics of the
+        method that created the pool
+        :param method_class: Class with static methods to wrap e.g. VSNPTreeMethods
+        :param stage_metrics: type DICT: Dictionary to populate with stage name: dictionary of metrics
+        :param track_memory: type BOOL: Boolean of whether tracemalloc should also be used to record the peak Python
+        heap allocation. Tracing slows allocation-heavy stages considerably, so the timings are less representative
+        :param exclude: type LIST: Names of methods that are not to be wrapped
+        :return: original_methods: Dictionary of method name: original static method
+        """
+        exclude = exclude if exclude else list()
+        # Initialise a dictionary to store the original methods, so they can be restored
+        original_methods = dict()
+        # Use a list to track the depth of nested calls
+        depth = [0]
+        # Workers forked by multiprocessing inherit the wrappers. Only record calls in the current process
+        parent_pid = os.getpid()
+
+        def timed(name, function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                # Nested calls are included in the metrics of the outermost call
+                if depth[0] or os.getpid() != parent_pid:
+                    return function(*args, **kwargs)
+                depth[0] += 1
+                # Reset the resident set size high-water mark, so that the peak of this stage can be determined
+                BenchmarkMethods.reset_peak_rss()
+                if track_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    heap_peak = 0
+                    if track_memory:
+                        heap_peak = tracemalloc.get_traced_memory()[1] / 1048576
+                        tracemalloc.stop()
+                    depth[0] -= 1
+                    # Update the stage-specific metrics
+                    if name not in stage_metrics:
+                        stage_metrics[name] = {'calls': 0, 'seconds': 0, 'peak_rss_mb': 0, 'peak_heap_mb': 0}
+                    stage_metrics[name]['calls'] += 1
+                    stage_metrics[name]['seconds'] += elapsed
+                    stage_metrics[name]['peak_rss_mb'] = max(stage_metrics[name]['peak_rss_mb'],
+                                                             BenchmarkMethods.peak_rss())
+                    stage_metrics[name]['peak_heap_mb'] = max(stage_metrics[name]['peak_heap_mb'], heap_peak)
+                    # Worker processes are accounted for with the high-water mark of all waited-for children
+                    stage_metrics[name]['max_child_rss_mb'] = \
+                        round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 2)
+            return staticmethod(wrapper)
+        for name, attribute in list(vars(method_class).items()):
+            if isinstance(attribute, staticmethod) and name not in exclude:
+                original_methods[name] = attribute
+                setattr(method_class, name, timed(name, attribute.__func__))
+        return original_methods
+
+    @staticmethod
+    def restore_methods(method_class, original_methods):
+        """
+        Restore the methods replaced by BenchmarkMethods.instrument_methods
+        :param method_class: Class with wrapped static methods
+        :param original_methods: type DICT: Dictionary of method name: original static method
+        """
+        for name, attribute in original_methods.items():
+            setattr(method_class, name, attribute)
+
+    @staticmethod
+    def reset_peak_rss():
+        """
+        Reset the peak resident set size (VmHWM) of the current process. Only supported on Linux; on other platforms,
+        the peak reported by BenchmarkMethods.peak_rss is the high-water mark of the process
+        """
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except (FileNotFoundError, PermissionError, OSError):
+            pass
+
+    @staticmethod
+    def peak_rss():
+        """
+        Determine the peak resident set size of the current process
+        :return: Peak resident set size in megabytes
+        """
+        try:
+            with open('/proc/self/status', 'r') as status:
+                for line in status:
+                    # e.g. VmHWM:\t   86876 kB
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 2)
+        except FileNotFoundError:
+            pass
+        # ru_maxrss is reported in kilobytes on Linux, and bytes on macOS
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+    @staticmethod
+    def write_report(benchmark_dict, report_file):
+        """
+        Write the benchmark results to a JSON file
+        :param benchmark_dict: type DICT: Dictionary of benchmark results
+        :param report_file: type STR: Absolute path of the JSON file to create
+        """
+        make_path(os.path.dirname(report_file))
+        with open(report_file, 'w') as report:
+            json.dump(benchmark_dict, report, indent=4, sort_keys=True)
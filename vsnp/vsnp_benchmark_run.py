@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
+from vsnp.vsnp_benchmark_methods import BenchmarkMethods
+from vsnp.install_dependencies import install_deps
+from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from vsnp.vsnp_tree_run import VSNPTree
+from datetime import datetime
+import logging
+import shutil
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+class VSNPBenchmark(object):
+
+    def main(self):
+        """
+        Create synthetic gVCF files at each of the requested scales, and time the tree creation methods
+        """
+        self.load_reference()
+        for num_strains in self.scales:
+            self.benchmark_scale(num_strains=num_strains)
+            # Write the report after every scale, so that partial results are available for long runs
+            BenchmarkMethods.write_report(benchmark_dict=self.benchmark_dict,
+                                          report_file=self.report_file)
+        logging.info('Benchmark results written to {report}'.format(report=self.report_file))
+
+    def load_reference(self):
+        logging.info('Loading reference genome details for species code {sc}'.format(sc=self.species))
+        reference_file, reference_link_path = \
+            BenchmarkMethods.reference_details(species_code=self.species,
+                                               dependency_path=self.dependency_path)
+        reference_fasta = os.path.join(self.dependency_path, reference_link_path, reference_file)
+        self.contig_dict = BenchmarkMethods.load_contigs(reference_fai=reference_fasta + '.fai')
+        self.reference_seq_dict = BenchmarkMethods.load_reference_bases(reference_fasta=reference_fasta,
+                                                                        contig_dict=self.contig_dict,
+                                                                        seed=self.seed)
+        self.defining_positions = \
+            BenchmarkMethods.defining_snp_positions(species_code=self.species,
+                                                    reference_link_path=reference_link_path,
+                                                    dependency_path=self.dependency_path)
+        logging.debug('Reference contigs: \n{results}'.format(
+            results='\n'.join(['{contig}: {length}'.format(contig=contig, length=length)
+                               for contig, length in self.contig_dict.items()])))
+        self.benchmark_dict['settings'] = {
+            'species': self.species,
+            'reference': reference_file,
+            'variant_caller': self.variant_caller,
+            'snp_density': self.snp_density,
+            'clades': self.clades,
+            'deletion_blocks': self.deletion_blocks,
+            'deletion_length': self.deletion_length,
+            'block_length': self.block_length,
+            'filter_positions': self.filter_positions,
+            'memory_bounded': self.memory_bounded,
+            'collapse_identical': self.collapse_identical,
+            'threads': self.threads,
+            'track_memory': self.track_memory,
+            'start_time': str(self.start_time)
+        }
+
+    def benchmark_scale(self, num_strains):
+        logging.info('Simulating {num} strains'.format(num=num_strains))
+        scale_path = os.path.join(self.path, '{vc}_{num}'.format(vc=self.variant_caller, num=num_strains))
+        # Clear out the outputs of any previous runs
+        try:
+            shutil.rmtree(scale_path)
+        except FileNotFoundError:
+            pass
+        start = time.perf_counter()
+        strain_variant_dict = \
+            BenchmarkMethods.synthetic_population(contig_dict=self.contig_dict,
+                                                  reference_seq_dict=self.reference_seq_dict,
+                                                  num_strains=num_strains,
+                                                  snp_density=self.snp_density,
+                                                  num_clades=self.clades,
+                                                  deletion_blocks=self.deletion_blocks,
+                                                  deletion_length=self.deletion_length,
+                                                  defining_positions=self.defining_positions,
+                                                  seed=self.seed)
+        logging.info('Creating synthetic {vc} gVCF files'.format(vc=self.variant_caller))
+        BenchmarkMethods.create_synthetic_gvcfs(strain_variant_dict=strain_variant_dict,
+                                                contig_dict=self.contig_dict,
+                                                reference_seq_dict=self.reference_seq_dict,
+                                                output_path=scale_path,
+                                                variant_caller=self.variant_caller,
+                                                block_length=self.block_length,
+                                                seed=self.seed)
+        generation_time = time.perf_counter() - start
+        # Replace RAxML with the stand-in, and wrap the tree methods with timers
+        stage_metrics = dict()
+        original_raxml = vars(VSNPTreeMethods)['run_raxml']
+        VSNPTreeMethods.run_raxml = staticmethod(BenchmarkMethods.stub_raxml)
+        original_methods = BenchmarkMethods.instrument_methods(method_class=VSNPTreeMethods,
+                                                               stage_metrics=stage_metrics,
+                                                               track_memory=self.track_memory)
+        logging.info('Running the tree creation methods on {num} strains'.format(num=num_strains))
+        start = time.perf_counter()
+        try:
+            vsnp_tree = VSNPTree(path=scale_path,
+                                 threads=self.threads,
+                                 debug=self.debug,
+                                 variant_caller=self.variant_caller,
+                                 filter_positions=self.filter_positions,
+                                 memory_bounded=self.memory_bounded,
+                                 collapse_identical=self.collapse_identical)
+            vsnp_tree.main()
+        finally:
+            # Always restore the original methods
+            BenchmarkMethods.restore_methods(method_class=VSNPTreeMethods,
+                                             original_methods=original_methods)
+            VSNPTreeMethods.run_raxml = original_raxml
+        total_time = time.perf_counter() - start
+        for stage, metrics in stage_metrics.items():
+            metrics['seconds'] = round(metrics['seconds'], 4)
+            metrics['peak_heap_mb'] = round(metrics['peak_heap_mb'], 2)
+            # The heap peak is only recorded when tracemalloc is enabled
+            if not self.track_memory:
+                del metrics['peak_heap_mb']
+        self.benchmark_dict['scales'][str(num_strains)] = {
+            'strains': num_strains,
+            'gvcf_generation_seconds': round(generation_time, 4),
+            'total_seconds': round(total_time, 4),
+            # Resetting the high-water mark between stages also resets ru_maxrss, so use the largest stage peak
+            'max_rss_mb': max([metrics['peak_rss_mb'] for metrics in stage_metrics.values()] + [0]),
+            'stages': stage_metrics
+        }
+        logging.info('Processed {num} strains in {time:.2f} seconds'.format(num=num_strains, time=total_time))
+        # Remove the synthetic files unless they are to be kept
+        if not self.keep_files:
+            shutil.rmtree(scale_path)
+
+    def __init__(self, path, threads, debug, variant_caller, scales, species='suis1', snp_density=100, clades=10,
+                 deletion_blocks=20, deletion_length=500, block_length=15, filter_positions=False, memory_bounded=False,
+                 track_memory=False, keep_files=False, seed=12345, collapse_identical=False):
+        """
+        :param path: type STR: Path of folder in which the synthetic files and the benchmark report are to be created
+        :param threads: type INT: Number of threads to use in the analyses
+        :param debug: type BOOL: Boolean of whether debug level logs are printed to terminal
+        :param variant_caller: type STR: Style of gVCF files to create: deepvariant or freebayes
+        :param scales: type LIST: Number of strains to simulate for each benchmark run
+        :param species: type STR: Species code of the reference genome to use for the simulation. Default is suis1
+        :param snp_density: type FLOAT: Number of SNPs per megabase in each strain. Default is 100
+        :param clades: type INT: Number of clades in the simulated population. Default is 10
+        :param deletion_blocks: type INT: Number of zero coverage blocks in each strain. Default is 20
+        :param deletion_length: type INT: Mean length of the zero coverage blocks. Default is 500
+        :param block_length: type INT: Mean length of the gVCF reference blocks. Default is 15
+        :param filter_positions: type BOOL: Boolean of whether SNPs should be filtered by proximity
+        :param memory_bounded: type BOOL: Boolean of whether the tree creation methods process each species/group in
+        turn
+        :param track_memory: type BOOL: Boolean of whether tracemalloc should also record the peak Python heap of each
+        stage. Tracing increases the runtime of the stages. Peak resident set size is always recorded
+        :param keep_files: type BOOL: Boolean of whether the synthetic files and tree outputs should be kept
+        :param seed: type INT: Random seed to use for the simulation
+        :param collapse_identical: type BOOL: Boolean of whether strains with identical SNP profiles are collapsed
+        before the trees are created
+        """
+        logging.info('vSNP tree benchmarking module')
+        SetupLogging(debug=debug)
+        self.debug = debug
+        # Determine the path in which the outputs are to be created. Allow for ~ expansion
+        if path.startswith('~'):
+            self.path = os.path.abspath(os.path.expanduser(os.path.join(path)))
+        else:
+            self.path = os.path.abspath(os.path.join(path))
+        self.threads = threads
+        self.variant_caller = variant_caller
+        self.scales = sorted(int(scale) for scale in scales)
+        self.species = species
+        self.snp_density = snp_density
+        self.clades = clades
+        self.deletion_blocks = deletion_blocks
+        self.deletion_length = deletion_length
+        self.block_length = block_length
+        self.filter_positions = filter_positions
+        self.memory_bounded = memory_bounded
+        self.track_memory = track_memory
+        self.keep_files = keep_files
+        self.seed = seed
+        self.collapse_identical = collapse_identical
+        self.report_file = os.path.join(self.path, 'benchmark_{vc}.json'.format(vc=self.variant_caller))
+        # Extract the path of the folder containing this script
+        self.script_path = os.path.abspath(os.path.dirname(__file__))
+        # Use the script path to set the absolute path of the dependencies folder
+        self.dependency_root = os.path.dirname(self.script_path)
+        self.dependency_path = os.path.join(self.dependency_root, 'dependencies')
+        # If the dependency folder is not present, download it
+        if not os.path.isdir(self.dependency_path):
+            install_deps(dependency_root=self.dependency_root)
+        self.start_time = datetime.now()
+        # Initialise variables
+        self.contig_dict = dict()
+        self.reference_seq_dict = dict()
+        self.defining_positions = list()
+        self.benchmark_dict = {'settings': dict(), 'scales': dict()}
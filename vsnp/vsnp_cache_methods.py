@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import make_path
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from contextlib import closing
+from datetime import datetime
+import hashlib
+import sqlite3
+import shutil
+import errno
+import json
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+# The per-strain steps whose outputs are stored in the cache: the MASH sketch and read quality histograms, the sorted
+# BAM file, and the freebayes gVCF file
+cache_steps = ('reads', 'mapping', 'freebayes')
+# Default maximum size of the cache in GB
+default_cache_size = 100.0
+# The entries table records the files of every cached step, and when the entry was last used, so that the least
+# recently used entries are evicted first. The digests table records the content hash of each file, so that a file is
+# only hashed once. Files are identified by their inode, so that files hard-linked from the cache are never hashed
+cache_schema = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    step TEXT NOT NULL,
+    strain TEXT NOT NULL,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS digests (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (device, inode)
+);
+"""
+
+
+class CacheMethods(object):
+
+    @staticmethod
+    def open_cache(cache_path):
+        """
+        Open the index of the cache, and create the tables if they do not exist
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :return: connection: sqlite3.Connection to the index
+        """
+        make_path(cache_path)
+        # Several projects may use the cache at once, so wait for their writes rather than failing
+        connection = sqlite3.connect(os.path.join(cache_path, 'cache.db'), timeout=300)
+        connection.executescript(cache_schema)
+        return connection
+
+    @staticmethod
+    def entry_path(cache_path, key):
+        """
+        Set the folder in which the files of a cache entry are stored
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param key: type STR: Key of the entry
+        :return: Absolute path to the folder of the entry
+        """
+        # The entries are split into subfolders on the first two characters of the key, to keep the folders small
+        return os.path.join(cache_path, 'objects', key[:2], key)
+
+    @staticmethod
+    def file_digest(cache_path, file_path, block_size=1 << 20):
+        """
+        Calculate the SHA-256 hash of the contents of a file. The hash is recorded in the cache, and reused while the
+        size and modification time of the file are unchanged
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param file_path: type STR: Absolute path to the file
+        :param block_size: type INT: Number of bytes read at once
+        :return: digest: Hexadecimal SHA-256 hash of the file contents
+        """
+        file_stat = os.stat(file_path)
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            row = connection.execute('SELECT digest FROM digests WHERE device = ? AND inode = ? AND size = ? AND '
+                                     'mtime = ?', (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+                                                   file_stat.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(block_size), b''):
+                file_hash.update(block)
+        digest = file_hash.hexdigest()
+        CacheMethods.record_digest(cache_path=cache_path,
+                                   file_path=file_path,
+                                   digest=digest)
+        return digest
+
+    @staticmethod
+    def record_digest(cache_path, file_path, digest):
+        """
+        Record the content hash of a file
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param file_path: type STR: Absolute path to the file
+        :param digest: type STR: Hexadecimal SHA-256 hash of the file contents
+        """
+        file_stat = os.stat(file_path)
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                                   (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns,
+                                    digest, file_path))
+
+    @staticmethod
+    def cache_key(cache_path, step, strain_name, inputs, parameters):
+        """
+        Create the key of the outputs of a step from the contents of its input files, rather than their paths, so
+        that the same strain analysed in different project folders has the same key. The strain name is part of the
+        key, as it is written into the outputs e.g. the read group of the BAM file and the sample of the gVCF file
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param step: type STR: Name of the step
+        :param strain_name: type STR: Name of the strain
+        :param inputs: type LIST: Absolute paths of the input files of the step
+        :param parameters: type DICT: Parameters and tool versions of the step. Values must be JSON serialisable
+        :return: key: Hexadecimal SHA-256 hash of the step, strain name, input contents, and parameters
+        """
+        return hashlib.sha256(json.dumps({'step': step,
+                                          'strain': strain_name,
+                                          'inputs': [CacheMethods.file_digest(cache_path=cache_path,
+                                                                              file_path=input_file)
+                                                     for input_file in inputs],
+                                          'parameters': parameters}, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def link_file(source, destination):
+        """
+        Hard link a file, or copy it if the destination is on a different file system. The file is linked to a
+        temporary path that is renamed once complete, so that the destination only ever holds a complete file
+        :param source: type STR: Absolute path to the file
+        :param destination: type STR: Absolute path of the link
+        """
+        make_path(os.path.dirname(destination))
+        temp_file = ManifestMethods.temp_output(output_file=destination)
+        if os.path.lexists(temp_file):
+            os.remove(temp_file)
+        try:
+            os.link(source, temp_file)
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copy2(source, temp_file)
+        ManifestMethods.commit_output(temp_file=temp_file,
+                                      output_file=destination)
+
+    @staticmethod
+    def restore_entry(cache_path, key, strain_folder):
+        """
+        Hard link the files of a cache entry into the working folder of a strain, and mark the entry as used
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param key: type STR: Key of the entry
+        :param strain_folder: type STR: Absolute path to the strain-specific working folder
+        :return: restored_files: List of the absolute paths of the restored files, or None if the entry is not in
+        the cache, or could not be restored
+        """
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            row = connection.execute('SELECT files FROM entries WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        entry_folder = CacheMethods.entry_path(cache_path=cache_path,
+                                               key=key)
+        files = json.loads(row[0])
+        # Entries with missing files e.g. removed by hand, are discarded, so that the step is redone and stored again
+        if not all(os.path.isfile(os.path.join(entry_folder, relative_path)) for relative_path in files):
+            CacheMethods.remove_entry(cache_path=cache_path,
+                                      key=key)
+            return None
+        restored_files = list()
+        try:
+            for relative_path in files:
+                destination = os.path.join(strain_folder, relative_path)
+                CacheMethods.link_file(source=os.path.join(entry_folder, relative_path),
+                                       destination=destination)
+                restored_files.append(destination)
+        # The entry may be evicted by another project after its files were found. Treat it as a miss, and remove any
+        # files that were already restored, so that the step is redone
+        except OSError:
+            for restored_file in restored_files:
+                if os.path.isfile(restored_file):
+                    os.remove(restored_file)
+            return None
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            with connection:
+                connection.execute('UPDATE entries SET hits = hits + 1, accessed = ? WHERE key = ?',
+                                   (time.time(), key))
+        return restored_files
+
+    @staticmethod
+    def store_entry(cache_path, key, step, strain_name, strain_folder, outputs):
+        """
+        Hard link the outputs of a step into the cache. Only the outputs within the working folder of the strain are
+        stored, as the remaining outputs e.g. the copies in the vcf_files folder, are recreated by the step. The
+        content hashes of the stored files are recorded, so that the steps using them as inputs do not hash them again
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param key: type STR: Key of the entry
+        :param step: type STR: Name of the step
+        :param strain_name: type STR: Name of the strain
+        :param strain_folder: type STR: Absolute path to the strain-specific working folder
+        :param outputs: type LIST: Absolute paths of the output files of the step. Paths may contain glob wildcards
+        :return: Boolean of whether the entry was added to the cache
+        """
+        output_files = [output_file for output_file in ManifestMethods.expand_outputs(outputs=outputs)
+                        if os.path.commonpath([output_file, strain_folder]) == strain_folder]
+        if not output_files:
+            return False
+        entry_folder = CacheMethods.entry_path(cache_path=cache_path,
+                                               key=key)
+        if os.path.isdir(entry_folder):
+            return False
+        # The files are linked into a temporary folder that is renamed once complete, so that an interrupted store
+        # never leaves a partial entry. Temporary folders are removed by collect_garbage
+        temp_folder = entry_folder + '.tmp.{pid}'.format(pid=os.getpid())
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        files = [os.path.relpath(output_file, strain_folder) for output_file in output_files]
+        for output_file, relative_path in zip(output_files, files):
+            CacheMethods.link_file(source=output_file,
+                                   destination=os.path.join(temp_folder, relative_path))
+        try:
+            os.rename(temp_folder, entry_folder)
+        except OSError:
+            # Another project stored the same entry first
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            return False
+        for relative_path in files:
+            CacheMethods.file_digest(cache_path=cache_path,
+                                     file_path=os.path.join(entry_folder, relative_path))
+        size = sum(os.path.getsize(output_file) for output_file in output_files)
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (key, step, strain_name, json.dumps(files), size, 0,
+                                    datetime.now().isoformat(timespec='seconds'), time.time()))
+        return True
+
+    @staticmethod
+    def remove_entry(cache_path, key):
+        """
+        Remove an entry and its files from the cache. Files hard-linked into projects are not affected
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param key: type STR: Key of the entry
+        """
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            with connection:
+                connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+        shutil.rmtree(CacheMethods.entry_path(cache_path=cache_path,
+                                              key=key), ignore_errors=True)
+
+    @staticmethod
+    def evict_entries(cache_path, max_size):
+        """
+        Remove the least recently used entries until the total size of the cache is within its maximum size
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param max_size: type FLOAT: Maximum size of the cache in GB
+        :return: evicted_keys: List of the keys of the removed entries
+        """
+        evicted_keys = list()
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            entry_list = connection.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall()
+        total_size = sum(size for _, size in entry_list)
+        for key, size in entry_list:
+            if total_size <= max_size * 1024 ** 3:
+                break
+            CacheMethods.remove_entry(cache_path=cache_path,
+                                      key=key)
+            total_size -= size
+            evicted_keys.append(key)
+        return evicted_keys
+
+    @staticmethod
+    def collect_garbage(cache_path, max_size):
+        """
+        Evict the least recently used entries, remove the folders of interrupted stores and of entries missing from
+        the index, and forget the content hashes of files that no longer exist
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :param max_size: type FLOAT: Maximum size of the cache in GB
+        :return: garbage_dict: Dictionary of 'evicted': number of evicted entries, 'orphans': number of removed
+        folders, 'digests': number of forgotten content hashes
+        """
+        evicted_keys = CacheMethods.evict_entries(cache_path=cache_path,
+                                                  max_size=max_size)
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            key_set = {row[0] for row in connection.execute('SELECT key FROM entries')}
+            digest_list = connection.execute('SELECT device, inode, size, mtime, path FROM digests').fetchall()
+        orphans = 0
+        objects_path = os.path.join(cache_path, 'objects')
+        for prefix in sorted(os.listdir(objects_path)) if os.path.isdir(objects_path) else list():
+            for entry in sorted(os.listdir(os.path.join(objects_path, prefix))):
+                if entry not in key_set:
+                    shutil.rmtree(os.path.join(objects_path, prefix, entry), ignore_errors=True)
+                    orphans += 1
+        stale_digests = list()
+        for device, inode, size, mtime, path in digest_list:
+            try:
+                file_stat = os.stat(path)
+            except FileNotFoundError:
+                file_stat = None
+            if file_stat is None or (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns) != \
+                    (device, inode, size, mtime):
+                stale_digests.append((device, inode))
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            with connection:
+                connection.executemany('DELETE FROM digests WHERE device = ? AND inode = ?', stale_digests)
+        return {'evicted': len(evicted_keys),
+                'orphans': orphans,
+                'digests': len(stale_digests)}
+
+    @staticmethod
+    def cache_stats(cache_path):
+        """
+        Summarise the contents of the cache
+        :param cache_path: type STR: Absolute path to the folder of the cache
+        :return: stats_dict: Dictionary of step name: dictionary of 'entries': number of entries, 'size': size in bytes,
+        'hits': number of times the entries were restored. The 'total' key summarises every step
+        """
+        stats_dict = {'total': {'entries': 0, 'size': 0, 'hits': 0}}
+        with closing(CacheMethods.open_cache(cache_path=cache_path)) as connection:
+            for step, entries, size, hits in connection.execute('SELECT step, COUNT(*), SUM(size), SUM(hits) FROM '
+                                                                'entries GROUP BY step ORDER BY step'):
+                stats_dict[step] = {'entries': entries, 'size': size, 'hits': hits}
+                for field, value in stats_dict[step].items():
+                    stats_dict['total'][field] += value
+        return stats_dict
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
+from vsnp.vsnp_cache_methods import CacheMethods, default_cache_size
+import logging
+import os
+
+__author__ = 'adamkoziol'
+
+
+class VSNPCache(object):
+
+    def main(self):
+        """
+        Optionally collect the garbage of the cache shared across projects, and report its contents
+        """
+        if self.garbage:
+            self.collect_garbage()
+        self.cache_stats()
+
+    def collect_garbage(self):
+        logging.info('Collecting garbage in the cache {cache}'.format(cache=self.cache_path))
+        garbage_dict = CacheMethods.collect_garbage(cache_path=self.cache_path,
+                                                    max_size=self.max_size)
+        logging.info('Evicted {evicted} least recently used entries, removed {orphans} orphaned folders, and forgot '
+                     '{digests} content hashes of missing files'.format(evicted=garbage_dict['evicted'],
+                                                                        orphans=garbage_dict['orphans'],
+                                                                        digests=garbage_dict['digests']))
+
+    def cache_stats(self):
+        stats_dict = CacheMethods.cache_stats(cache_path=self.cache_path)
+        for step, step_stats in stats_dict.items():
+            logging.info('{step}: {entries} entries, {size:.2f} GB, {hits} hits'
+                         .format(step=step,
+                                 entries=step_stats['entries'],
+                                 size=step_stats['size'] / 1024 ** 3,
+                                 hits=step_stats['hits']))
+
+    def __init__(self, path, debug, max_size=default_cache_size, garbage=False):
+        """
+        :param path: type STR: Path of the folder of the cache
+        :param debug: type BOOL: Boolean of whether debug level logs are printed to terminal
+        :param max_size: type FLOAT: Maximum size of the cache in GB. The least recently used entries are evicted when
+        collecting garbage
+        :param garbage: type BOOL: Boolean of whether the garbage of the cache is collected before it is reported
+        """
+        SetupLogging(debug=debug)
+        logging.info('vSNP cache module')
+        # Determine the path of the cache. Allow for ~ expansion
+        if path.startswith('~'):
+            self.cache_path = os.path.abspath(os.path.expanduser(os.path.join(path)))
+        else:
+            self.cache_path = os.path.abspath(os.path.join(path))
+        # Reporting must not create an empty cache
+        assert os.path.isfile(os.path.join(self.cache_path, 'cache.db')), 'Invalid cache specified: {path}'.format(
+            path=self.cache_path)
+        self.max_size = max_size
+        self.garbage = garbage
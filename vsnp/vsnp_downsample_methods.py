@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from vsnp.vsnp_spoligo_methods import SpoligoMethods
+import numpy
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+# Seed of the random numbers that select the retained read pairs, so that the same reads are always retained
+downsample_seed = 12345
+
+
+class DownsampleMethods(object):
+
+    @staticmethod
+    def genome_length(reference_file):
+        """
+        Find the total length of the sequences of a reference genome from its samtools faidx index, or from the
+        sequences if the reference genome has not been indexed
+        :param reference_file: type STR: Absolute path to the FASTA-formatted reference genome
+        :return: Integer of the number of bases in the reference genome
+        """
+        fai_file = reference_file + '.fai'
+        if not os.path.isfile(fai_file):
+            return SpoligoMethods.reference_length(reference_file=reference_file)
+        with open(fai_file, 'r') as fai:
+            # The second column of the index is the length of each sequence
+            return sum(int(line.split('\t')[1]) for line in fai if line.strip())
+
+    @staticmethod
+    def total_bases(stats_list):
+        """
+        Calculate the number of bases in the reads of a strain from the read length histograms of its FASTQ files
+        :param stats_list: type LIST: Statistics of each FASTQ file of the strain created with QCMethods.update_stats
+        :return: Integer of the number of bases
+        """
+        return sum(int(numpy.dot(numpy.arange(stats['length'].size), stats['length'])) for stats in stats_list)
+
+    @staticmethod
+    def downsample_reads(fastq_files, output_files, fraction, seed=downsample_seed, chunk_records=4096):
+        """
+        Stream a random fraction of the reads of a strain to new FASTQ files. The FASTQ files are read in lockstep, and
+        each read pair is retained or discarded as a whole. The random numbers are seeded, so the same reads are
+        retained every time the same files are downsampled. The outputs are written to temporary files that are
+        renamed once complete
+        :param fastq_files: type LIST: Absolute paths to the FASTQ files of the strain
+        :param output_files: type LIST: Absolute paths of the gzip-compressed FASTQ files to create, in the order of
+        the FASTQ files
+        :param fraction: type FLOAT: Fraction of the read pairs to retain
+        :param seed: type INT: Seed of the random numbers
+        :param chunk_records: type INT: Number of records of each file read at once
+        :return: kept_bases: Integer of the number of bases in the retained reads
+        """
+        # RandomState rather than default_rng, which requires numpy>=1.17
+        generator = numpy.random.RandomState(seed)
+        kept_bases = 0
+        # Fast compression, as the files are only read once more, by the reference mapper
+        outputs = [gzip.open(ManifestMethods.temp_output(output_file=output_file), 'wb', compresslevel=1)
+                   for output_file in output_files]
+        try:
+            for chunks in FanoutMethods.lockstep_chunks(fastq_files=fastq_files,
+                                                        chunk_records=chunk_records):
+                # The same random number is used for each read of a pair
+                retain = (generator.random_sample(max(len(chunk) for chunk in chunks)) < fraction).tolist()
+                for chunk, output in zip(chunks, outputs):
+                    kept_records = [record for record, retained in zip(chunk, retain) if retained]
+                    output.write(b''.join(kept_records))
+                    # The sequence is the second line of each record
+                    kept_bases += sum(len(record.split(b'\n', 2)[1]) for record in kept_records)
+        finally:
+            for output in outputs:
+                output.close()
+        for output_file in output_files:
+            ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=output_file),
+                                          output_file=output_file)
+        return kept_bases
+
+    @staticmethod
+    def write_coverage(coverage_file, estimated_coverage, target_coverage, fraction, effective_coverage):
+        """
+        Write the coverage of the reads of a strain before and after downsampling
+        :param coverage_file: type STR: Absolute path of the coverage file to create
+        :param estimated_coverage: type FLOAT: Coverage of all the reads
+        :param target_coverage: type FLOAT: Coverage requested after downsampling
+        :param fraction: type FLOAT: Fraction of the read pairs retained
+        :param effective_coverage: type FLOAT: Coverage of the retained reads
+        """
+        with open(ManifestMethods.temp_output(output_file=coverage_file), 'w') as coverage:
+            coverage.write('#Estimated\tTarget\tFraction\tEffective\n')
+            coverage.write('{estimated:.2f}\t{target:.2f}\t{fraction:.6f}\t{effective:.2f}\n'
+                           .format(estimated=estimated_coverage,
+                                   target=target_coverage,
+                                   fraction=fraction,
+                                   effective=effective_coverage))
+        ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=coverage_file),
+                                      output_file=coverage_file)
+
+    @staticmethod
+    def read_coverage(coverage_file):
+        """
+        Read the coverage of the reads of a strain before and after downsampling
+        :param coverage_file: type STR: Absolute path to the coverage file
+        :return: coverage_dict: Dictionary of 'estimated', 'target', 'fraction', and 'effective': float values
+        """
+        with open(coverage_file, 'r') as coverage:
+            header = next(coverage).lstrip('#').rstrip().lower().split('\t')
+            values = next(coverage).rstrip().split('\t')
+        return {field: float(value) for field, value in zip(header, values)}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+from itertools import islice, zip_longest
+import subprocess
+import threading
+import tempfile
+import queue
+import gzip
+
+__author__ = 'adamkoziol'
+
+
+class FanoutMethods(object):
+
+    @staticmethod
+    def read_chunks(fastq_file, chunk_records=4096):
+        """
+        Read a FASTQ file in chunks of records
+        :param fastq_file: type STR: Absolute path to the FASTQ file. Files ending in .gz are decompressed
+        :param chunk_records: type INT: Number of records in each chunk
+        :return: Generator of lists of the records in each chunk. Each record is the bytes of its four lines
+        """
+        opener = gzip.open if fastq_file.endswith('.gz') else open
+        with opener(fastq_file, 'rb') as fastq:
+            while True:
+                lines = list(islice(fastq, 4 * chunk_records))
+                if not lines:
+                    break
+                # Terminate the final line of a file without a trailing newline, so that records can be concatenated
+                if not lines[-1].endswith(b'\n'):
+                    lines[-1] += b'\n'
+                yield [b''.join(lines[index:index + 4]) for index in range(0, len(lines), 4)]
+
+    @staticmethod
+    def lockstep_chunks(fastq_files, chunk_records=4096):
+        """
+        Read the FASTQ files of a strain in lockstep, so that the chunks of paired reads hold the same read pairs
+        :param fastq_files: type LIST: Absolute paths to the FASTQ files of the strain
+        :param chunk_records: type INT: Number of records in each chunk
+        :return: Generator of tuples of the chunk of each file. The chunks of files that finish early are empty
+        """
+        for chunks in zip_longest(*[FanoutMethods.read_chunks(fastq_file=fastq_file,
+                                                              chunk_records=chunk_records)
+                                    for fastq_file in fastq_files],
+                                  fillvalue=list()):
+            yield chunks
+
+    @staticmethod
+    def consumer_data(chunks, files):
+        """
+        Create the data sent to a consumer from the chunks of the files it reads
+        :param chunks: type TUPLE: Lists of the records in the current chunk of each file
+        :param files: type TUPLE: Indexes of the files read by the consumer
+        :return: Bytes of the records of a single file, or of the records of several files interleaved e.g. R1, R2
+        """
+        if len(files) == 1:
+            return b''.join(chunks[files[0]])
+        return b''.join(record for records in zip_longest(*[chunks[index] for index in files])
+                        for record in records if record is not None)
+
+    @staticmethod
+    def fanout(fastq_files, consumers, chunk_records=4096, queue_chunks=8):
+        """
+        Read the FASTQ files of a strain once, and send the decompressed records to every consumer concurrently.
+        Each consumer has a bounded queue, so that the reader waits for the slowest consumer rather than holding the
+        reads in memory
+        :param fastq_files: type LIST: Absolute paths to the FASTQ files of the strain
+        :param consumers: type LIST: Consumer dictionaries of 'files': tuple of the indexes of the files it reads,
+        'write': callable receiving bytes of records, and 'close': callable called once all the records are sent
+        :param chunk_records: type INT: Number of records in each chunk
+        :param queue_chunks: type INT: Maximum number of chunks waiting to be processed by each consumer
+        """
+        if not consumers:
+            return
+        queues = [queue.Queue(maxsize=queue_chunks) for _ in consumers]
+        errors = list()
+        threads = [threading.Thread(target=FanoutMethods.consume,
+                                    args=(consumer, consumer_queue, errors))
+                   for consumer, consumer_queue in zip(consumers, queues)]
+        for thread in threads:
+            thread.start()
+        try:
+            for chunks in FanoutMethods.lockstep_chunks(fastq_files=fastq_files,
+                                                        chunk_records=chunk_records):
+                # Consumers reading the same files receive the same data, so only create it once per chunk
+                chunk_data = dict()
+                for consumer, consumer_queue in zip(consumers, queues):
+                    files = tuple(consumer['files'])
+                    if files not in chunk_data:
+                        chunk_data[files] = FanoutMethods.consumer_data(chunks=chunks,
+                                                                        files=files)
+                    consumer_queue.put(chunk_data[files])
+                if errors:
+                    break
+        finally:
+            # Signal the end of the records, and wait for the consumers to finish
+            for consumer_queue in queues:
+                consumer_queue.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def consume(consumer, consumer_queue, errors):
+        """
+        Send the queued records to a consumer until the end of the records is reached. A consumer that fails
+        continues to empty its queue, so that the reader never waits on it
+        :param consumer: type DICT: Consumer dictionary of 'files', 'write', and 'close'
+        :param consumer_queue: type queue.Queue: Queue of the bytes of records to send to the consumer
+        :param errors: type LIST: List to which errors raised by the consumer are appended
+        """
+        failed = False
+        while True:
+            data = consumer_queue.get()
+            if data is None:
+                break
+            if failed:
+                continue
+            try:
+                consumer['write'](data)
+            except BrokenPipeError:
+                # The process exited before reading all the records. Its outputs and logs show what went wrong
+                failed = True
+            except Exception as exception:
+                errors.append(exception)
+                failed = True
+        try:
+            consumer['close']()
+        except BrokenPipeError:
+            pass
+        except Exception as exception:
+            errors.append(exception)
+
+    @staticmethod
+    def process_consumer(command, files):
+        """
+        Start a system call that reads FASTQ records from stdin, and create its consumer dictionary. stdout and
+        stderr are written to temporary files, so that the process cannot block on a full pipe
+        :param command: type STR: System call reading FASTQ records from stdin
+        :param files: type TUPLE: Indexes of the files read by the consumer
+        :return: consumer: Consumer dictionary of 'files', 'write', 'close', and 'process', 'stdout', 'stderr'
+        """
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr)
+        return {'files': tuple(files),
+                'write': process.stdin.write,
+                'close': process.stdin.close,
+                'process': process,
+                'stdout': stdout,
+                'stderr': stderr}
+
+    @staticmethod
+    def finish_process(consumer):
+        """
+        Wait for the system call of a consumer to finish, and collect its outputs
+        :param consumer: type DICT: Consumer dictionary created with process_consumer
+        :return: out, err: Strings of the stdout and stderr of the system call
+        """
+        consumer['process'].wait()
+        outputs = list()
+        for output in (consumer['stdout'], consumer['stderr']):
+            output.seek(0)
+            outputs.append(output.read().decode('utf-8', 'replace'))
+            output.close()
+        return outputs[0], outputs[1]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import make_path
+import tempfile
+import numpy
+import os
+
+__author__ = 'adamkoziol'
+
+# Number of set bits in every possible byte, used to count the differences between bit-packed SNP profiles
+popcount_table = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.uint8)
+
+
+class IndexMethods(object):
+
+    @staticmethod
+    def index_file(index_path, reference):
+        """
+        Set the name of the SNP profile index of a reference genome
+        :param index_path: type STR: Absolute path to folder containing the indexes
+        :param reference: type STR: Name of the reference genome e.g. NC_002945v4
+        :return: Absolute path to the index file
+        """
+        return os.path.join(index_path, '{reference}_snp_index.npz'.format(reference=reference))
+
+    @staticmethod
+    def load_index(index_file):
+        """
+        Load a SNP profile index. The profiles of the strains are stored as rows of bits, with one column for every
+        PASS SNP position present in any indexed strain. Each position is stored as a single key of the chromosome
+        index and the position, so that the positions of all the chromosomes can be searched at once
+        :param index_file: type STR: Absolute path to the index file
+        :return: index_dict: Dictionary of 'strains': list of strain names, 'chromosomes': list of chromosome names,
+        'keys': sorted numpy.ndarray of position keys, 'bits': numpy.ndarray of bit-packed profiles with one row per
+        strain. An empty index is returned if the file does not exist
+        """
+        if not os.path.isfile(index_file):
+            return {'strains': list(),
+                    'chromosomes': list(),
+                    'keys': numpy.zeros(0, dtype=numpy.int64),
+                    'bits': numpy.zeros((0, 0), dtype=numpy.uint8)}
+        with numpy.load(index_file) as index_data:
+            index_dict = {'strains': index_data['strains'].tolist(),
+                          'chromosomes': index_data['chromosomes'].tolist(),
+                          'keys': index_data['keys'],
+                          'bits': index_data['bits']}
+        return index_dict
+
+    @staticmethod
+    def position_keys(chromosomes, snp_positions):
+        """
+        Convert the SNP positions of a strain to index keys
+        :param chromosomes: type LIST: Names of the chromosomes in the index. The position of the name in the list is
+        its chromosome index
+        :param snp_positions: type DICT: Dictionary of reference chromosome: list of SNP positions
+        :return: keys: Sorted numpy.ndarray of the keys of the positions on chromosomes in the index
+        :return: unknown: Number of positions on chromosomes that are not in the index
+        """
+        key_list = list()
+        unknown = 0
+        for chrom, positions in snp_positions.items():
+            if chrom not in chromosomes:
+                unknown += len(positions)
+                continue
+            # The chromosome index occupies the high bits of the key, so keys sort by chromosome, then position
+            key_list.append(numpy.asarray(positions, dtype=numpy.int64) + (chromosomes.index(chrom) << 32))
+        keys = numpy.unique(numpy.concatenate(key_list)) if key_list else numpy.zeros(0, dtype=numpy.int64)
+        return keys, unknown
+
+    @staticmethod
+    def update_index(index_dict, strain_snp_positions, row_chunk=1024):
+        """
+        Add the SNP profiles of strains to an index. Strains that are already indexed are replaced
+        :param index_dict: type DICT: Index loaded with load_index
+        :param strain_snp_positions: type DICT: Dictionary of strain name: reference chromosome: list of PASS SNP
+        positions
+        :param row_chunk: type INT: Number of existing profiles to re-pack at a time when new positions are added
+        :return: updated_index_dict: Index containing the existing and the new profiles
+        """
+        chromosomes = list(index_dict['chromosomes'])
+        # New chromosomes are appended, so that the keys of the indexed positions do not change
+        for snp_positions in strain_snp_positions.values():
+            for chrom in sorted(snp_positions):
+                if chrom not in chromosomes:
+                    chromosomes.append(chrom)
+        strain_keys = {strain_name: IndexMethods.position_keys(chromosomes=chromosomes,
+                                                               snp_positions=snp_positions)[0]
+                       for strain_name, snp_positions in strain_snp_positions.items()}
+        keys = numpy.unique(numpy.concatenate([index_dict['keys']] + list(strain_keys.values())))
+        # Retain the existing profiles of the strains that are not being replaced
+        retained_rows = [row for row, strain_name in enumerate(index_dict['strains'])
+                         if strain_name not in strain_snp_positions]
+        strains = [index_dict['strains'][row] for row in retained_rows] + list(strain_snp_positions)
+        bits = numpy.zeros((len(strains), (len(keys) + 7) // 8), dtype=numpy.uint8)
+        # Determine the column of every existing position in the updated index
+        old_columns = numpy.searchsorted(keys, index_dict['keys'])
+        for start in range(0, len(retained_rows), row_chunk):
+            rows = retained_rows[start:start + row_chunk]
+            # Slice off the padding bits of the final byte, rather than use the count argument of numpy>=1.17
+            old_profiles = numpy.unpackbits(index_dict['bits'][rows], axis=1)[:, :len(index_dict['keys'])]
+            new_profiles = numpy.zeros((len(rows), len(keys)), dtype=numpy.uint8)
+            new_profiles[:, old_columns] = old_profiles
+            bits[start:start + len(rows)] = numpy.packbits(new_profiles, axis=1)
+        for row, strain_name in enumerate(strain_snp_positions, start=len(retained_rows)):
+            profile = numpy.zeros(len(keys), dtype=numpy.uint8)
+            profile[numpy.searchsorted(keys, strain_keys[strain_name])] = 1
+            bits[row] = numpy.packbits(profile)
+        return {'strains': strains,
+                'chromosomes': chromosomes,
+                'keys': keys,
+                'bits': bits}
+
+    @staticmethod
+    def write_index(index_dict, index_file):
+        """
+        Write a SNP profile index. The index is written to a temporary file that replaces the existing index, so an
+        interrupted write cannot corrupt the index
+        :param index_dict: type DICT: Index created with update_index
+        :param index_file: type STR: Absolute path to the index file
+        """
+        make_path(os.path.dirname(index_file))
+        temp_handle, temp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(index_file))
+        try:
+            with os.fdopen(temp_handle, 'wb') as index:
+                numpy.savez_compressed(index,
+                                       strains=numpy.array(index_dict['strains']),
+                                       chromosomes=numpy.array(index_dict['chromosomes']),
+                                       keys=index_dict['keys'],
+                                       bits=index_dict['bits'])
+            os.replace(temp_file, index_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    @staticmethod
+    def query_index(index_dict, snp_positions, num_neighbours, exclude=None):
+        """
+        Find the indexed strains with the fewest differences in PASS SNP positions from a query strain. The distance
+        between two strains is the number of positions that are a SNP in only one of them
+        :param index_dict: type DICT: Index loaded with load_index
+        :param snp_positions: type DICT: Dictionary of reference chromosome: list of PASS SNP positions of the query
+        :param num_neighbours: type INT: Number of closest strains to return
+        :param exclude: type STR: Name of a strain to exclude from the results e.g. the query strain itself
+        :return: neighbours: List of tuples of strain name, SNP distance in order of increasing distance
+        """
+        query_keys, unknown = IndexMethods.position_keys(chromosomes=index_dict['chromosomes'],
+                                                         snp_positions=snp_positions)
+        columns = numpy.searchsorted(index_dict['keys'], query_keys)
+        # Positions that are not in the index are a SNP in the query strain only
+        found = (columns < len(index_dict['keys'])) & \
+            (index_dict['keys'][numpy.minimum(columns, len(index_dict['keys']) - 1)] == query_keys) \
+            if len(index_dict['keys']) else numpy.zeros(len(query_keys), dtype=bool)
+        unknown += int(numpy.count_nonzero(~found))
+        profile = numpy.zeros(len(index_dict['keys']), dtype=numpy.uint8)
+        profile[columns[found]] = 1
+        # Count the bits that differ between the query profile and every indexed profile
+        differences = numpy.bitwise_xor(index_dict['bits'], numpy.packbits(profile))
+        distances = popcount_table[differences].sum(axis=1, dtype=numpy.int64) + unknown
+        ranked = sorted((distance, strain_name) for strain_name, distance in zip(index_dict['strains'],
+                                                                                 distances.tolist())
+                        if strain_name != exclude)
+        return [(strain_name, distance) for distance, strain_name in ranked[:num_neighbours]]
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+from functools import lru_cache
+from datetime import datetime
+from glob import glob
+import subprocess
+import tempfile
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+
+class ManifestMethods(object):
+
+    @staticmethod
+    def file_signature(file_path):
+        """
+        Create a signature of a file from its size and modification time. Hashing the contents of multi-GB FASTQ and
+        BAM files would take as long as some of the steps they are used in, while any rewrite of a file changes its
+        modification time
+        :param file_path: type STR: Absolute path to the file
+        :return: Dictionary of 'size': size in bytes, 'mtime': modification time in nanoseconds, or None if the
+        file does not exist
+        """
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return {'size': file_stat.st_size,
+                'mtime': file_stat.st_mtime_ns}
+
+    @staticmethod
+    def expand_outputs(outputs):
+        """
+        Find the existing files that match a list of output paths
+        :param outputs: type LIST: Absolute paths of output files. Paths may contain glob wildcards e.g. sharded files
+        :return: Sorted list of the absolute paths of the existing files
+        """
+        output_set = set()
+        for output in outputs:
+            # Paths of existing files are used as is, so that file names containing wildcard characters are found
+            if os.path.isfile(output):
+                output_set.add(output)
+            else:
+                output_set.update(file_path for file_path in glob(output) if os.path.isfile(file_path))
+        return sorted(output_set)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def tool_version(command):
+        """
+        Determine the version of an external tool. The result is cached, as every strain requires the same versions
+        :param command: type STR: System call that prints the version of the tool e.g. samtools --version
+        :return: The first line of the output containing 'version', the first line of the output if no line
+        contains 'version', or 'unknown' if the tool could not be run
+        """
+        try:
+            process = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     timeout=60)
+        except subprocess.TimeoutExpired:
+            return 'unknown'
+        # The shell returns 127 if the tool is not installed
+        if process.returncode == 127:
+            return 'unknown'
+        lines = [line.strip() for line in process.stdout.decode('utf-8', 'replace').splitlines() if line.strip()]
+        for line in lines:
+            if 'version' in line.lower():
+                return line
+        return lines[0] if lines else 'unknown'
+
+    @staticmethod
+    def read_manifest(manifest_file):
+        """
+        Read a strain manifest. A missing or unreadable manifest is treated as empty, so every step is redone
+        :param manifest_file: type STR: Absolute path to the manifest JSON file
+        :return: manifest_dict: Dictionary of step name: step record
+        """
+        try:
+            with open(manifest_file, 'r') as manifest:
+                manifest_dict = json.load(manifest)
+        except (FileNotFoundError, ValueError):
+            return dict()
+        return manifest_dict if isinstance(manifest_dict, dict) else dict()
+
+    @staticmethod
+    def write_manifest(manifest_file, manifest_dict):
+        """
+        Write a strain manifest atomically: the manifest is written to a temporary file in the same folder, which
+        then replaces the manifest, so an interrupted write never leaves a truncated manifest
+        :param manifest_file: type STR: Absolute path to the manifest JSON file
+        :param manifest_dict: type DICT: Dictionary of step name: step record
+        """
+        handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(manifest_file),
+                                             prefix='.manifest',
+                                             suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as manifest:
+                json.dump(manifest_dict, manifest, indent=2, sort_keys=True)
+                manifest.flush()
+                os.fsync(manifest.fileno())
+            os.replace(temp_file, manifest_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    @staticmethod
+    def step_signature(inputs, parameters):
+        """
+        Create the signature of a step from its inputs and parameters
+        :param inputs: type LIST: Absolute paths of the input files of the step
+        :param parameters: type DICT: Parameters and tool versions of the step. Values must be JSON serialisable
+        :return: Dictionary of 'inputs': dictionary of input file: file signature, 'parameters': parameters. The
+        dictionary is passed through JSON, so that it compares equal to a signature read from the manifest
+        """
+        return json.loads(json.dumps({'inputs': {input_file: ManifestMethods.file_signature(input_file)
+                                                 for input_file in inputs},
+                                      'parameters': parameters}))
+
+    @staticmethod
+    def step_valid(step_record, step_signature):
+        """
+        Determine whether the recorded outputs of a step can be reused. The inputs and parameters must match the
+        record, and every recorded output must be unchanged since it was recorded
+        :param step_record: type DICT: Record of the step in the manifest, or None if the step is not recorded
+        :param step_signature: type DICT: Current signature of the step created with step_signature
+        :return: Boolean of whether the step is valid
+        """
+        if not step_record:
+            return False
+        if step_record.get('inputs') != step_signature['inputs'] or \
+                step_record.get('parameters') != step_signature['parameters']:
+            return False
+        return all(ManifestMethods.file_signature(output_file) == output_signature
+                   for output_file, output_signature in step_record.get('outputs', dict()).items())
+
+    @staticmethod
+    def step_record(step_signature, outputs):
+        """
+        Create the record of a completed step
+        :param step_signature: type DICT: Signature of the step created with step_signature before it was run
+        :param outputs: type LIST: Absolute paths of the output files of the step. Paths may contain glob wildcards
+        :return: Dictionary of the signature of the step, 'outputs': dictionary of output file: file signature,
+        and 'completed': time at which the step was recorded
+        """
+        step_record = dict(step_signature)
+        step_record['outputs'] = {output_file: ManifestMethods.file_signature(output_file)
+                                  for output_file in ManifestMethods.expand_outputs(outputs=outputs)}
+        step_record['completed'] = datetime.now().isoformat(timespec='seconds')
+        return step_record
+
+    @staticmethod
+    def remove_outputs(outputs):
+        """
+        Remove the outputs of an invalidated step, so that the step cannot reuse them
+        :param outputs: type LIST: Absolute paths of the output files of the step. Paths may contain glob wildcards
+        :return: List of the absolute paths of the removed files
+        """
+        removed_files = ManifestMethods.expand_outputs(outputs=outputs)
+        for file_path in removed_files:
+            os.remove(file_path)
+        return removed_files
+
+    @staticmethod
+    def temp_output(output_file):
+        """
+        Set the temporary path to which an output file is written before it is renamed to its final path. The
+        temporary path keeps the extension of the file, as some tools infer the output format from it
+        :param output_file: type STR: Absolute path of the output file
+        :return: Absolute path of the temporary file
+        """
+        folder, file_name = os.path.split(output_file)
+        return os.path.join(folder, '.tmp.' + file_name)
+
+    @staticmethod
+    def run_command(command):
+        """
+        Run a system call that writes an output file. The call is run with pipefail, so that the failure of any
+        command of a pipeline e.g. bwa mem | samtools sort, is reported rather than only the status of the final command
+        :param command: type STR: System call to run
+        :return: out: STDOUT of the system call
+        :return: err: STDERR of the system call
+        :return: returncode: Exit status of the system call
+        """
+        process = subprocess.run(['bash', '-o', 'pipefail', '-c', command], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        return process.stdout.decode('utf-8', 'replace'), process.stderr.decode('utf-8', 'replace'), \
+            process.returncode
+
+    @staticmethod
+    def commit_output(temp_file, output_file, returncode=0, command=None):
+        """
+        Rename a temporary output file to its final path once the step that created it has finished. The rename is
+        atomic, so the final path only ever holds a complete file. The temporary file of a failed system call is
+        removed rather than renamed, as shell redirection creates it even if the call fails
+        :param temp_file: type STR: Absolute path of the temporary file
+        :param output_file: type STR: Absolute path of the output file
+        :param returncode: type INT: Exit status of the system call that created the temporary file
+        :param command: type STR: System call that created the temporary file. Reported if the call failed
+        """
+        if returncode:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+            # Raise, so that the output is never recorded in the manifest or stored in the cache
+            raise subprocess.CalledProcessError(returncode=returncode,
+                                                cmd=command)
+        if os.path.isfile(temp_file):
+            os.replace(temp_file, output_file)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
+from vsnp.install_dependencies import install_deps
+from vsnp.vsnp_index_methods import IndexMethods
+from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from vsnp.vsnp_pool_methods import PoolMethods
+from datetime import datetime
+import logging
+import os
+
+__author__ = 'adamkoziol'
+
+
+class VSNPNearest(object):
+
+    def main(self):
+        """
+        Add the SNP profiles of the strains to the index, or find the closest indexed strains to each strain
+        """
+        own_pool = self.pool is None
+        if own_pool:
+            self.pool = PoolMethods.create_pool(threads=self.threads)
+        try:
+            self.vcf_load()
+        finally:
+            if own_pool:
+                # Close and join the pool
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        self.snp_positions()
+        if self.build:
+            self.build_index()
+        else:
+            self.query_index()
+
+    def vcf_load(self):
+        logging.info('Locating gVCF files')
+        file_list = VSNPTreeMethods.file_list(file_path=self.file_path)
+        self.strain_vcf_dict = VSNPTreeMethods.strain_list(vcf_files=file_list)
+        accession_species_dict = VSNPTreeMethods.parse_accession_species(ref_species_file=os.path.join(
+            self.dependency_path, 'mash', 'species_accessions.csv'))
+        logging.info('Parsing gVCF files')
+        # Only the positions that PASS filter are indexed
+        self.strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+            VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=self.strain_vcf_dict,
+                                             variant_caller=self.variant_caller,
+                                             threads=self.threads,
+                                             pool=self.pool)
+        logging.info('Linking extracted reference genome to species code and reference FASTA file')
+        strain_species_dict, strain_best_ref_fasta_dict = \
+            VSNPTreeMethods.determine_ref_species(strain_best_ref_dict=strain_best_ref_dict,
+                                                  accession_species_dict=accession_species_dict)
+        reference_link_path_dict, reference_link_dict = \
+            VSNPTreeMethods.reference_folder(strain_best_ref_fasta_dict=strain_best_ref_fasta_dict,
+                                             dependency_path=self.dependency_path)
+        self.strain_consolidated_ref_dict = \
+            VSNPTreeMethods.consolidate_group_ref_genomes(reference_link_dict=reference_link_dict,
+                                                          strain_best_ref_dict=strain_best_ref_dict)
+
+    def snp_positions(self):
+        logging.info('Loading SNP positions')
+        strain_snp_positions = \
+            VSNPTreeMethods.load_gvcf_snp_positions(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
+                                                    strain_consolidated_ref_dict=self.strain_consolidated_ref_dict)[1]
+        # Split the strains by the reference genome, as each reference genome has its own index
+        for strain_name, snp_positions in strain_snp_positions.items():
+            reference = self.strain_consolidated_ref_dict[strain_name]
+            if reference not in self.reference_strain_snp_positions:
+                self.reference_strain_snp_positions[reference] = dict()
+            self.reference_strain_snp_positions[reference][strain_name] = snp_positions
+        self.strain_parsed_vcf_dict = dict()
+
+    def build_index(self):
+        for reference, strain_snp_positions in self.reference_strain_snp_positions.items():
+            index_file = IndexMethods.index_file(index_path=self.index_path,
+                                                 reference=reference)
+            logging.info('Adding {num} strains to the {reference} SNP profile index'
+                         .format(num=len(strain_snp_positions),
+                                 reference=reference))
+            index_dict = IndexMethods.load_index(index_file=index_file)
+            index_dict = IndexMethods.update_index(index_dict=index_dict,
+                                                   strain_snp_positions=strain_snp_positions)
+            IndexMethods.write_index(index_dict=index_dict,
+                                     index_file=index_file)
+            logging.info('{reference} SNP profile index contains {num} strains and {positions} positions'
+                         .format(reference=reference,
+                                 num=len(index_dict['strains']),
+                                 positions=len(index_dict['keys'])))
+
+    def query_index(self):
+        logging.info('Finding the closest indexed strains')
+        with open(self.report_file, 'w') as report:
+            report.write('Strain\tReference\tRank\tNearest\tSNPDistance\n')
+            for reference, strain_snp_positions in self.reference_strain_snp_positions.items():
+                index_dict = IndexMethods.load_index(index_file=IndexMethods.index_file(index_path=self.index_path,
+                                                                                        reference=reference))
+                if not index_dict['strains']:
+                    logging.warning('No SNP profile index for {reference} in {path}'.format(reference=reference,
+                                                                                            path=self.index_path))
+                for strain_name, snp_positions in strain_snp_positions.items():
+                    neighbours = IndexMethods.query_index(index_dict=index_dict,
+                                                          snp_positions=snp_positions,
+                                                          num_neighbours=self.num_neighbours,
+                                                          exclude=strain_name)
+                    for rank, (neighbour, distance) in enumerate(neighbours, start=1):
+                        report.write('{strain}\t{reference}\t{rank}\t{neighbour}\t{distance}\n'
+                                     .format(strain=strain_name,
+                                             reference=reference,
+                                             rank=rank,
+                                             neighbour=neighbour,
+                                             distance=distance))
+                    logging.debug('{strain}: {neighbours}'.format(strain=strain_name,
+                                                                  neighbours=neighbours))
+        logging.info('Closest strains written to {report}'.format(report=self.report_file))
+
+    def __init__(self, path, threads, debug, variant_caller, index_path, num_neighbours=10, build=False, pool=None):
+        """
+        :param path: type STR: Path of folder containing gVCF files
+        :param threads: type INT: Number of threads to use in the analyses
+        :param debug: type BOOL: Boolean of whether debug level logs are printed to terminal
+        :param variant_caller: type STR: Variant calling software used to create the gVCF files
+        :param index_path: type STR: Path of folder containing the SNP profile indexes
+        :param num_neighbours: type INT: Number of closest strains to report for each strain. Default is 10
+        :param build: type BOOL: Boolean of whether the strains are added to the indexes rather than queried against
+        them
+        :param pool: type multiprocessing.Pool: Pool created with PoolMethods.create_pool. If not supplied, a pool is
+        created for, and closed after, parsing the gVCF files
+        """
+        logging.info('vSNP SNP profile index module')
+        SetupLogging(debug=debug)
+        self.debug = debug
+        # Determine the path in which the gVCF files are located. Allow for ~ expansion
+        if path.startswith('~'):
+            self.file_path = os.path.abspath(os.path.expanduser(os.path.join(path)))
+        else:
+            self.file_path = os.path.abspath(os.path.join(path))
+        # Ensure that the path exists
+        assert os.path.isdir(self.file_path), 'Invalid path specified: {path}'.format(path=self.file_path)
+        if index_path.startswith('~'):
+            self.index_path = os.path.abspath(os.path.expanduser(os.path.join(index_path)))
+        else:
+            self.index_path = os.path.abspath(os.path.join(index_path))
+        self.threads = threads
+        self.variant_caller = variant_caller
+        self.num_neighbours = num_neighbours
+        self.build = build
+        self.pool = pool
+        self.report_file = os.path.join(self.file_path, 'nearest_strains.tsv')
+        # Extract the path of the folder containing this script
+        self.script_path = os.path.abspath(os.path.dirname(__file__))
+        # Use the script path to set the absolute path of the dependencies folder
+        self.dependency_root = os.path.dirname(self.script_path)
+        self.dependency_path = os.path.join(self.dependency_root, 'dependencies')
+        # If the dependency folder is not present, download it
+        if not os.path.isdir(self.dependency_path):
+            install_deps(dependency_root=self.dependency_root)
+        self.start_time = datetime.now()
+        # Initialise variables
+        self.strain_vcf_dict = dict()
+        self.strain_parsed_vcf_dict = dict()
+        self.strain_consolidated_ref_dict = dict()
+        self.reference_strain_snp_positions = dict()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+from contextlib import contextmanager
+import multiprocessing
+
+__author__ = 'adamkoziol'
+
+# Read-only context of the current stage. Populated in each worker process of the pool, so that variables shared by
+# every task are sent to each worker once rather than being pickled with every task
+worker_context = dict()
+
+
+class PoolMethods(object):
+
+    @staticmethod
+    def create_pool(threads):
+        """
+        Create a multiprocessing pool that can be re-used by every stage of the tree creation
+        :param threads: type INT: Number of processes to run concurrently
+        :return: pool: multiprocessing.Pool with an initialised worker context
+        """
+        # The barrier ensures that every worker receives exactly one copy of the context of each stage
+        barrier = multiprocessing.Barrier(threads)
+        pool = multiprocessing.Pool(processes=threads,
+                                    initializer=PoolMethods.initialise_worker,
+                                    initargs=(barrier, threads))
+        return pool
+
+    @staticmethod
+    def initialise_worker(barrier, threads):
+        """
+        Store the broadcast barrier in the context of a newly started worker process
+        :param barrier: type multiprocessing.Barrier: Barrier shared by all the workers of the pool
+        :param threads: type INT: Number of processes in the pool
+        """
+        worker_context.clear()
+        worker_context['barrier'] = barrier
+        worker_context['threads'] = threads
+
+    @staticmethod
+    @contextmanager
+    def worker_pool(threads, pool=None):
+        """
+        Yield the supplied pipeline-wide pool. If no pool was supplied, create a pool that is closed and joined once
+        the calling stage is complete
+        :param threads: type INT: Number of processes to run concurrently
+        :param pool: type multiprocessing.Pool: Pool created with create_pool, or None
+        :return: pool: multiprocessing.Pool to use for the stage
+        """
+        if pool is not None:
+            yield pool
+        else:
+            pool = PoolMethods.create_pool(threads=threads)
+            try:
+                yield pool
+            finally:
+                # Close and join the pool
+                pool.close()
+                pool.join()
+
+    @staticmethod
+    def broadcast(pool, context):
+        """
+        Send the read-only context of a stage to every worker in the pool
+        :param pool: type multiprocessing.Pool: Pool created with create_pool
+        :param context: type DICT: Dictionary of variable name: value shared by every task of the stage
+        """
+        # Each worker blocks at the barrier until all the workers have received the context, so no worker can
+        # receive two copies while another receives none
+        threads = pool.apply(PoolMethods.pool_size)
+        pool.map(PoolMethods.update_context, [context] * threads, chunksize=1)
+
+    @staticmethod
+    def pool_size():
+        """
+        Return the number of processes in the pool of the current worker
+        """
+        return worker_context['threads']
+
+    @staticmethod
+    def update_context(context):
+        """
+        Replace the stage-specific context of the current worker
+        :param context: type DICT: Dictionary of variable name: value shared by every task of the stage
+        """
+        barrier = worker_context['barrier']
+        threads = worker_context['threads']
+        worker_context.clear()
+        worker_context.update(context)
+        worker_context['barrier'] = barrier
+        worker_context['threads'] = threads
+        barrier.wait()
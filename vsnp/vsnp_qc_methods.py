@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from functools import partial
+import numpy
+
+__author__ = 'adamkoziol'
+
+# FASTQ quality strings are Phred+33 encoded
+quality_offset = 33
+
+
+class QCMethods(object):
+
+    @staticmethod
+    def empty_stats():
+        """
+        Create the statistics of a FASTQ file before any reads are counted
+        :return: stats: Dictionary of 'reads': number of reads, 'quality': array of the number of bases with each
+        quality score, 'length': array of the number of reads of each length
+        """
+        return {'reads': 0,
+                'quality': numpy.zeros(0, dtype=numpy.int64),
+                'length': numpy.zeros(0, dtype=numpy.int64)}
+
+    @staticmethod
+    def add_counts(histogram, counts):
+        """
+        Add counts to a histogram, extending the histogram as required
+        :param histogram: type numpy.ndarray: Counts of each value
+        :param counts: type numpy.ndarray: Counts of each value to add
+        :return: The updated histogram
+        """
+        if counts.size > histogram.size:
+            histogram = numpy.concatenate([histogram, numpy.zeros(counts.size - histogram.size, dtype=numpy.int64)])
+        histogram[:counts.size] += counts
+        return histogram
+
+    @staticmethod
+    def update_stats(stats, data):
+        """
+        Count the base qualities and the read lengths of a chunk of FASTQ records
+        :param stats: type DICT: Statistics of the FASTQ file created with empty_stats, updated in place
+        :param data: type BYTES: Complete four-line FASTQ records
+        """
+        lines = data.split(b'\n')
+        sequences = lines[1::4]
+        if not sequences:
+            return
+        # Count the quality scores of every base in the chunk at once
+        qualities = numpy.frombuffer(b''.join(lines[3::4]), dtype=numpy.uint8)
+        stats['quality'] = QCMethods.add_counts(histogram=stats['quality'],
+                                                counts=numpy.bincount(qualities - quality_offset))
+        lengths = numpy.fromiter(map(len, sequences), dtype=numpy.int64, count=len(sequences))
+        stats['length'] = QCMethods.add_counts(histogram=stats['length'],
+                                               counts=numpy.bincount(lengths))
+        stats['reads'] += len(sequences)
+
+    @staticmethod
+    def qc_consumer(qual_histo, length_histo, files):
+        """
+        Create a fan-out consumer that counts the base qualities and read lengths of a FASTQ file, and writes the
+        histograms once all the reads are counted
+        :param qual_histo: type STR: Absolute path of the quality histogram to create
+        :param length_histo: type STR: Absolute path of the length histogram to create
+        :param files: type TUPLE: Index of the FASTQ file read by the consumer
+        :return: consumer: Consumer dictionary of 'files', 'write', 'close', and 'stats'
+        """
+        stats = QCMethods.empty_stats()
+        return {'files': tuple(files),
+                'write': partial(QCMethods.update_stats, stats),
+                'close': partial(QCMethods.write_histograms, stats, qual_histo, length_histo),
+                'stats': stats}
+
+    @staticmethod
+    def write_histograms(stats, qual_histo, length_histo):
+        """
+        Write the quality and length histograms in the format of the qchist and lhist outputs of reformat.sh. The
+        histograms are written to temporary files that are renamed once complete
+        :param stats: type DICT: Statistics of the FASTQ file
+        :param qual_histo: type STR: Absolute path of the quality histogram
+        :param length_histo: type STR: Absolute path of the length histogram
+        """
+        total_bases = max(int(stats['quality'].sum()), 1)
+        with open(ManifestMethods.temp_output(output_file=qual_histo), 'w') as histo:
+            histo.write('#Quality\tcount\tfraction\n')
+            for quality, count in enumerate(stats['quality'].tolist()):
+                histo.write('{quality}\t{count}\t{fraction:.5f}\n'.format(quality=quality,
+                                                                          count=count,
+                                                                          fraction=count / total_bases))
+        with open(ManifestMethods.temp_output(output_file=length_histo), 'w') as histo:
+            histo.write('#Length\tCount\n')
+            for length, count in enumerate(stats['length'].tolist()):
+                histo.write('{length}\t{count}\n'.format(length=length,
+                                                         count=count))
+        for output_file in (qual_histo, length_histo):
+            ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=output_file),
+                                          output_file=output_file)
+
+    @staticmethod
+    def read_histograms(qual_histo, length_histo):
+        """
+        Load the statistics of a FASTQ file from the histograms of a previous run
+        :param qual_histo: type STR: Absolute path of the quality histogram
+        :param length_histo: type STR: Absolute path of the length histogram
+        :return: stats: Dictionary of 'reads', 'quality', and 'length' as created by update_stats
+        """
+        stats = QCMethods.empty_stats()
+        for histo_file, key in ((qual_histo, 'quality'), (length_histo, 'length')):
+            with open(histo_file, 'r') as histo:
+                # Skip the header line. The first two columns are the value and its count
+                next(histo)
+                values = [tuple(int(field) for field in line.split('\t')[:2]) for line in histo if line.strip()]
+            histogram = numpy.zeros(max((value for value, _ in values), default=-1) + 1, dtype=numpy.int64)
+            for value, count in values:
+                histogram[value] += count
+            stats[key] = histogram
+        stats['reads'] = int(stats['length'].sum())
+        return stats
+
+    @staticmethod
+    def summarise_stats(strain_read_stats_dict):
+        """
+        Calculate the read quality and length values of the report from the statistics of each FASTQ file. The values
+        are the same as those calculated by parse_quality_histogram and parse_length_histograms of VCFMethods
+        :param strain_read_stats_dict: type DICT: Dictionary of strain name: list of the statistics of each FASTQ file
+        :return: strain_average_quality_dict: Dictionary of strain name: list of read set-specific average quality
+        scores
+        :return: strain_qual_over_thirty_dict: Dictionary of strain name: list of read set-specific percentage of
+        bases with a Phred quality-score greater or equal to 30
+        :return: strain_avg_read_lengths: Dictionary of strain name: average read length of all the read sets
+        """
+        strain_average_quality_dict = dict()
+        strain_qual_over_thirty_dict = dict()
+        strain_avg_read_lengths = dict()
+        for strain_name, stats_list in strain_read_stats_dict.items():
+            strain_average_quality_dict[strain_name] = list()
+            strain_qual_over_thirty_dict[strain_name] = list()
+            total_reads = 0
+            total_bases = 0
+            for stats in stats_list:
+                quality_counts = stats['quality']
+                total_count = int(quality_counts.sum())
+                # Sum of quality score * number of bases with that score
+                total_read_quality = int(numpy.dot(numpy.arange(quality_counts.size), quality_counts))
+                strain_average_quality_dict[strain_name].append(total_read_quality / total_count)
+                strain_qual_over_thirty_dict[strain_name].append(int(quality_counts[30:].sum()) / total_count * 100)
+                # The average read length is calculated from the reads of all the read sets
+                total_reads += int(stats['length'].sum())
+                total_bases += int(numpy.dot(numpy.arange(stats['length'].size), stats['length']))
+            strain_avg_read_lengths[strain_name] = total_bases / total_reads
+        return strain_average_quality_dict, strain_qual_over_thirty_dict, strain_avg_read_lengths
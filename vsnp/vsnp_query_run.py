@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
+from vsnp.vsnp_store_methods import StoreMethods
+import logging
+import os
+
+__author__ = 'adamkoziol'
+
+
+class VSNPQuery(object):
+
+    def main(self):
+        """
+        Find the calls in the SNP call store that match the supplied region, strains, and filters
+        """
+        self.parse_region()
+        self.query_store()
+
+    def parse_region(self):
+        # The region is supplied as CHROM, CHROM:POS, or CHROM:START-END
+        if not self.region:
+            return
+        self.chrom, _, positions = self.region.partition(':')
+        if positions:
+            start, _, end = positions.replace(',', '').partition('-')
+            self.start = int(start)
+            self.end = int(end) if end else self.start
+
+    def query_store(self):
+        logging.info('Querying the SNP call store {store}'.format(store=self.store_file))
+        call_list = StoreMethods.query_calls(store_file=self.store_file,
+                                             chrom=self.chrom,
+                                             start=self.start,
+                                             end=self.end,
+                                             strain_list=self.strains,
+                                             filter_list=self.filters)
+        with open(self.report_file, 'w') as report:
+            report.write('Strain\tChromosome\tPosition\tREF\tALT\tQUAL\tLength\tFilter\tAdded\n')
+            for call in call_list:
+                report.write('\t'.join(str(value) for value in call) + '\n')
+        logging.info('{num} calls in {strains} strains written to {report}'
+                     .format(num=len(call_list),
+                             strains=len({call[0] for call in call_list}),
+                             report=self.report_file))
+
+    def __init__(self, path, debug, store_file, region=None, strains=None, filters=None):
+        """
+        :param path: type STR: Path of folder in which the report is written
+        :param debug: type BOOL: Boolean of whether debug level logs are printed to terminal
+        :param store_file: type STR: Path of the SQLite database of the SNP call store
+        :param region: type STR: Region of the calls to report: CHROM, CHROM:POS, or CHROM:START-END. Calls at every
+        position are reported if not supplied
+        :param strains: type LIST: Names of the strains of the calls to report. Calls of every strain are reported if
+        not supplied
+        :param filters: type LIST: Filters of the calls to report e.g. PASS, INSERTION, DELETION. Calls with any
+        filter are reported if not supplied
+        """
+        logging.info('vSNP SNP call store query module')
+        SetupLogging(debug=debug)
+        self.debug = debug
+        # Determine the path in which the report is written. Allow for ~ expansion
+        if path.startswith('~'):
+            self.file_path = os.path.abspath(os.path.expanduser(os.path.join(path)))
+        else:
+            self.file_path = os.path.abspath(os.path.join(path))
+        # Ensure that the path exists
+        assert os.path.isdir(self.file_path), 'Invalid path specified: {path}'.format(path=self.file_path)
+        if store_file.startswith('~'):
+            self.store_file = os.path.abspath(os.path.expanduser(store_file))
+        else:
+            self.store_file = os.path.abspath(store_file)
+        # Querying must not create an empty store
+        assert os.path.isfile(self.store_file), 'Invalid SNP call store specified: {store}'.format(
+            store=self.store_file)
+        self.region = region
+        self.strains = strains
+        self.filters = filters
+        self.report_file = os.path.join(self.file_path, 'snp_store_query.tsv')
+        # Initialise variables
+        self.chrom = None
+        self.start = None
+        self.end = None
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+class SchedulerMethods(object):
+
+    @staticmethod
+    def system_memory():
+        """
+        Determine the total physical memory of the system
+        :return: Total memory in GB
+        """
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+
+    @staticmethod
+    def add_task(task_dict, name, function, depends=None, threads=1, memory=1.0):
+        """
+        Add a task to a dependency graph of tasks
+        :param task_dict: type DICT: Dictionary of task name: task dictionary to which the task is added
+        :param name: type STR: Unique name of the task
+        :param function: type CALLABLE: Function to call (without arguments) to run the task
+        :param depends: type LIST: Names of the tasks that must finish before this task starts
+        :param threads: type INT: Number of threads the task uses
+        :param memory: type FLOAT: Memory in GB the task uses
+        """
+        if name in task_dict:
+            raise ValueError('Duplicate task name: {name}'.format(name=name))
+        task_dict[name] = {'function': function,
+                           'depends': list(depends) if depends else list(),
+                           'threads': max(1, int(threads)),
+                           'memory': float(memory)}
+
+    @staticmethod
+    def validate_tasks(task_dict):
+        """
+        Ensure that every dependency of the tasks exists, and that the dependencies do not contain a cycle
+        :param task_dict: type DICT: Dictionary of task name: task dictionary created with add_task
+        """
+        for name, task in task_dict.items():
+            for dependency in task['depends']:
+                if dependency not in task_dict:
+                    raise ValueError('Task {name} depends on unknown task {dependency}'.format(name=name,
+                                                                                                dependency=dependency))
+        # Remove the tasks without unmet dependencies until none remain. Any remaining tasks are part of a cycle
+        unmet = {name: len(task['depends']) for name, task in task_dict.items()}
+        dependents = SchedulerMethods.task_dependents(task_dict=task_dict)
+        ready = [name for name, count in unmet.items() if not count]
+        while ready:
+            name = ready.pop()
+            for dependent in dependents[name]:
+                unmet[dependent] -= 1
+                if not unmet[dependent]:
+                    ready.append(dependent)
+            del unmet[name]
+        if unmet:
+            raise ValueError('Task dependencies contain a cycle: {tasks}'.format(tasks=', '.join(sorted(unmet))))
+
+    @staticmethod
+    def task_dependents(task_dict):
+        """
+        Find the tasks that depend on each task
+        :param task_dict: type DICT: Dictionary of task name: task dictionary created with add_task
+        :return: dependents: Dictionary of task name: list of the names of the tasks that depend on it
+        """
+        dependents = {name: list() for name in task_dict}
+        for name, task in task_dict.items():
+            for dependency in task['depends']:
+                dependents[dependency].append(name)
+        return dependents
+
+    @staticmethod
+    def run_tasks(task_dict, threads, memory):
+        """
+        Run a dependency graph of tasks concurrently within a budget of threads and memory. A task starts once all
+        of its dependencies have finished, and the threads and memory it requires are available. Ready tasks start in
+        the order in which they were added, so the tasks of the first strains are favoured over those of later
+        strains, but smaller tasks fill any unused budget. A task that requires more than the whole budget runs on
+        its own. If a task fails, no further tasks are started, and the error is raised once the running tasks finish
+        :param task_dict: type DICT: Dictionary of task name: task dictionary created with add_task
+        :param threads: type INT: Total number of threads available to the tasks
+        :param memory: type FLOAT: Total memory in GB available to the tasks
+        :return: task_results: Dictionary of task name: value returned by the task
+        :return: task_seconds: Dictionary of task name: run time of the task in seconds
+        """
+        SchedulerMethods.validate_tasks(task_dict=task_dict)
+        threads = max(1, int(threads))
+        dependents = SchedulerMethods.task_dependents(task_dict=task_dict)
+        unmet = {name: len(task['depends']) for name, task in task_dict.items()}
+        # Record the order in which the tasks were added, as their priority
+        priority = {name: index for index, name in enumerate(task_dict)}
+        ready = [name for name in task_dict if not unmet[name]]
+        task_results = dict()
+        task_seconds = dict()
+        running = dict()
+        used_threads = 0
+        used_memory = 0.0
+        error = None
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            while ready or running:
+                # Start every ready task that fits in the remaining budget
+                if error is None:
+                    for name in sorted(ready, key=priority.get):
+                        # Requirements larger than the whole budget are reduced to the budget, and a task always
+                        # starts if nothing else is running
+                        task_threads = min(task_dict[name]['threads'], threads)
+                        task_memory = min(task_dict[name]['memory'], memory)
+                        if running and (used_threads + task_threads > threads or used_memory + task_memory > memory):
+                            continue
+                        ready.remove(name)
+                        used_threads += task_threads
+                        used_memory += task_memory
+                        future = executor.submit(SchedulerMethods.timed_task,
+                                                 function=task_dict[name]['function'])
+                        running[future] = (name, task_threads, task_memory)
+                else:
+                    ready = list()
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, task_threads, task_memory = running.pop(future)
+                    used_threads -= task_threads
+                    used_memory -= task_memory
+                    try:
+                        task_results[name], task_seconds[name] = future.result()
+                    except Exception as exception:
+                        # Retain the first error, and let the running tasks finish
+                        if error is None:
+                            error = exception
+                        continue
+                    for dependent in dependents[name]:
+                        unmet[dependent] -= 1
+                        if not unmet[dependent]:
+                            ready.append(dependent)
+        if error is not None:
+            raise error
+        return task_results, task_seconds
+
+    @staticmethod
+    def timed_task(function):
+        """
+        Run a task, and time it
+        :param function: type CALLABLE: Function to call (without arguments) to run the task
+        :return: Value returned by the task, and the run time of the task in seconds
+        """
+        start = time.time()
+        result = function()
+        return result, time.time() - start
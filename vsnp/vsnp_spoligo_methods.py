@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from functools import partial
+from Bio import SeqIO
+import numpy
+
+__author__ = 'adamkoziol'
+
+# 2-bit encoding of the nucleotides. Every other base, including N, is flagged with 4 and breaks the k-mers
+base_codes = numpy.full(256, 4, dtype=numpy.uint64)
+for code, bases in enumerate([b'Aa', b'Cc', b'Gg', b'Tt']):
+    for base in bases:
+        base_codes[base] = code
+complements = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+# The k-mers of the reads are first filtered on their last 11 bases, so that only the few candidate k-mers are
+# encoded in full, and searched for in the table
+filter_bases = 11
+filter_mask = (1 << 2 * filter_bases) - 1
+# Species codes of the reference genomes of the Mycobacterium tuberculosis complex, the only species that are
+# spoligotyped
+spoligo_species = ('af', 'h37')
+
+
+class SpoligoMethods(object):
+
+    @staticmethod
+    def encode_kmer(sequence):
+        """
+        Encode a k-mer as an integer of two bits per nucleotide, with the first base in the most significant bits
+        :param sequence: type STR: Sequence of the k-mer
+        :return: encoded: Integer of the encoded k-mer
+        """
+        encoded = 0
+        for base in sequence.upper().encode():
+            encoded = (encoded << 2) | int(base_codes[base])
+        return encoded
+
+    @staticmethod
+    def hamming_variants(sequence):
+        """
+        Create every sequence within a Hamming distance of one of a sequence, including the sequence itself
+        :param sequence: type STR: Nucleotide sequence
+        :return: variants: List of the sequence, and each of its single-substitution variants
+        """
+        variants = [sequence]
+        for position, base in enumerate(sequence):
+            for substitute in 'ACGT':
+                if substitute != base:
+                    variants.append(sequence[:position] + substitute + sequence[position + 1:])
+        return variants
+
+    @staticmethod
+    def spacer_table(spoligo_file, kmer=25):
+        """
+        Create the lookup table of the k-mers matching the spacer sequences with up to one mismatch. As with
+        bbduk.sh ref= k= hdist=1 maskmiddle=f, the k-mers of both strands of each spacer are included
+        :param spoligo_file: type STR: Absolute path to FASTA-formatted file of spacer sequences
+        :param kmer: type INT: kmer size to use for read baiting
+        :return: spacer_dict: Dictionary of 'names': list of spacer names, 'kmers': sorted array of encoded k-mers,
+        'spacers': array of the index of the spacer matched by each k-mer, 'filter': boolean array of the last bases
+        of the k-mers, and 'kmer': kmer size
+        """
+        names = list()
+        kmer_dict = dict()
+        for record in SeqIO.parse(spoligo_file, 'fasta'):
+            sequence = str(record.seq).upper()
+            reverse_complement = ''.join(complements.get(base, 'N') for base in reversed(sequence))
+            for strand in (sequence, reverse_complement):
+                for start in range(len(strand) - kmer + 1):
+                    for variant in SpoligoMethods.hamming_variants(sequence=strand[start:start + kmer]):
+                        # k-mers with ambiguous bases never match a read. A k-mer shared by several spacers is
+                        # assigned to the first one
+                        if 'N' not in variant:
+                            kmer_dict.setdefault(SpoligoMethods.encode_kmer(sequence=variant), len(names))
+            names.append(record.id)
+        kmers = numpy.array(sorted(kmer_dict), dtype=numpy.uint64)
+        kmer_filter = numpy.zeros(filter_mask + 1, dtype=bool)
+        kmer_filter[kmers & numpy.uint64(filter_mask)] = True
+        return {'names': names,
+                'kmers': kmers,
+                'spacers': numpy.array([kmer_dict[encoded] for encoded in kmers.tolist()], dtype=numpy.int64),
+                'filter': kmer_filter,
+                'kmer': kmer}
+
+    @staticmethod
+    def empty_counts(spacer_dict):
+        """
+        Create the spacer counts of a read set before any reads are baited
+        :param spacer_dict: type DICT: Lookup table created with spacer_table
+        :return: counts: Dictionary of 'reads': number of reads, 'matched': number of reads matching a spacer,
+        'kmers': number of k-mers without ambiguous bases, and 'spacers': array of the number of reads matching each
+        spacer
+        """
+        return {'reads': 0,
+                'matched': 0,
+                'kmers': 0,
+                'spacers': numpy.zeros(len(spacer_dict['names']), dtype=numpy.int64)}
+
+    @staticmethod
+    def count_spacers(spacer_dict, counts, data):
+        """
+        Count the reads in a chunk of FASTQ records that contain a k-mer of each spacer. The k-mers of all the reads
+        are encoded at once with a rolling 2-bit encoding, and the k-mers passing the filter of the table are looked
+        up in its sorted k-mers
+        :param spacer_dict: type DICT: Lookup table created with spacer_table
+        :param counts: type DICT: Spacer counts created with empty_counts, updated in place
+        :param data: type BYTES: Complete four-line FASTQ records
+        """
+        sequences = data.split(b'\n')[1::4]
+        if not sequences:
+            return
+        counts['reads'] += len(sequences)
+        kmer = spacer_dict['kmer']
+        # Separate the reads with an N, so that no k-mer spans two reads
+        codes = base_codes[numpy.frombuffer(b'N'.join(sequences), dtype=numpy.uint8)]
+        windows = codes.size - kmer + 1
+        if windows <= 0 or not spacer_dict['kmers'].size:
+            return
+        # The number of invalid bases in each window is calculated from the cumulative count of invalid bases
+        invalid = numpy.concatenate([[0], numpy.cumsum(codes == 4)])
+        valid = invalid[kmer:] == invalid[:windows]
+        counts['kmers'] += int(numpy.count_nonzero(valid))
+        codes[codes == 4] = 0
+        # Encode the last bases of every k-mer, and keep the k-mers whose last bases are in the filter
+        suffixes = numpy.zeros(windows, dtype=numpy.uint32)
+        small_codes = codes.astype(numpy.uint32)
+        for offset in range(max(0, kmer - filter_bases), kmer):
+            suffixes = (suffixes << numpy.uint32(2)) | small_codes[offset:offset + windows]
+        candidates = numpy.flatnonzero(valid & spacer_dict['filter'][suffixes])
+        # Encode the candidate k-mers in full, and search for them in the table
+        encoded = numpy.zeros(candidates.size, dtype=numpy.uint64)
+        for offset in range(kmer):
+            encoded = (encoded << numpy.uint64(2)) | codes[candidates + offset]
+        positions = numpy.searchsorted(spacer_dict['kmers'], encoded)
+        numpy.minimum(positions, spacer_dict['kmers'].size - 1, out=positions)
+        matches = spacer_dict['kmers'][positions] == encoded
+        hits = candidates[matches]
+        if not hits.size:
+            return
+        # Find the read of each matching k-mer. Each read is counted once for each spacer that it matches
+        read_starts = numpy.cumsum([0] + [len(sequence) + 1 for sequence in sequences[:-1]])
+        reads = numpy.searchsorted(read_starts, hits, side='right') - 1
+        spacer_count = len(spacer_dict['names'])
+        read_spacers = numpy.unique(reads * spacer_count + spacer_dict['spacers'][positions[matches]])
+        counts['spacers'] += numpy.bincount(read_spacers % spacer_count, minlength=spacer_count)
+        counts['matched'] += numpy.unique(read_spacers // spacer_count).size
+
+    @staticmethod
+    def reference_length(reference_file):
+        """
+        Calculate the total length of the sequences of a reference genome
+        :param reference_file: type STR: Absolute path to the FASTA-formatted reference genome
+        :return: Integer of the number of bases in the reference genome
+        """
+        return sum(len(record.seq) for record in SeqIO.parse(reference_file, 'fasta'))
+
+    @staticmethod
+    def bait_spacers(fastq_files, spacer_dict, stats_file, genome_length, min_count=5, expected_hits=20.0,
+                     chunk_records=4096):
+        """
+        Bait the spacer sequences from the reads of a strain, stopping once the presence or absence of every spacer is
+        resolved. A present spacer is found in a read covering all of its bases, so each k-mer of the reads matches
+        a present spacer with a probability of 1 / genome length. Once the examined k-mers are expected to hold
+        expected_hits matches to each present spacer, the spacers without a match are absent (the probability of
+        missing a present spacer is exp(-expected_hits)). Reading also stops once every spacer is matched by min_count
+        reads. Strains sequenced to a lower depth than expected_hits are read in full
+        :param fastq_files: type LIST: Absolute paths to the FASTQ files of the strain
+        :param spacer_dict: type DICT: Lookup table created with spacer_table
+        :param stats_file: type STR: Absolute path of the stats file to create
+        :param genome_length: type INT: Number of bases in the reference genome of the strain
+        :param min_count: type INT: Number of matching reads after which a spacer is resolved as present
+        :param expected_hits: type FLOAT: Expected number of matches to each present spacer after which the unmatched
+        spacers are resolved as absent
+        :param chunk_records: type INT: Number of records of each file examined between the checks
+        :return: counts: Spacer counts created with empty_counts. 'reads' is the number of reads examined
+        """
+        counts = SpoligoMethods.empty_counts(spacer_dict=spacer_dict)
+        files = tuple(range(len(fastq_files)))
+        for chunks in FanoutMethods.lockstep_chunks(fastq_files=fastq_files,
+                                                    chunk_records=chunk_records):
+            SpoligoMethods.count_spacers(spacer_dict=spacer_dict,
+                                         counts=counts,
+                                         data=FanoutMethods.consumer_data(chunks=chunks,
+                                                                          files=files))
+            if counts['kmers'] >= expected_hits * genome_length or counts['spacers'].min() >= min_count:
+                break
+        SpoligoMethods.write_stats(spacer_dict=spacer_dict,
+                                   counts=counts,
+                                   stats_file=stats_file)
+        return counts
+
+    @staticmethod
+    def read_examined(stats_file):
+        """
+        Extract the number of reads examined from a stats file
+        :param stats_file: type STR: Absolute path of the stats file
+        :return: Integer of the number of reads examined, or None if the file does not record it
+        """
+        with open(stats_file, 'r') as stats:
+            for line in stats:
+                if line.startswith('#Total'):
+                    return int(line.rstrip().split('\t')[1])
+        return None
+
+    @staticmethod
+    def spoligo_consumer(spacer_dict, stats_file, files):
+        """
+        Create a fan-out consumer that baits the spacer sequences from the reads of a strain, and writes the stats
+        file once all the reads are counted
+        :param spacer_dict: type DICT: Lookup table created with spacer_table
+        :param stats_file: type STR: Absolute path of the stats file to create
+        :param files: type TUPLE: Indexes of the FASTQ files read by the consumer
+        :return: consumer: Consumer dictionary of 'files', 'write', 'close', and 'counts'
+        """
+        counts = SpoligoMethods.empty_counts(spacer_dict=spacer_dict)
+        return {'files': tuple(files),
+                'write': partial(SpoligoMethods.count_spacers, spacer_dict, counts),
+                'close': partial(SpoligoMethods.write_stats, spacer_dict, counts, stats_file),
+                'counts': counts}
+
+    @staticmethod
+    def write_stats(spacer_dict, counts, stats_file):
+        """
+        Write the spacer counts in the format of the stats file of bbduk.sh. Only the spacers matched by at least one
+        read are listed, in decreasing order of the number of reads. The file is written to a temporary file that is
+        renamed once complete
+        :param spacer_dict: type DICT: Lookup table created with spacer_table
+        :param counts: type DICT: Spacer counts created with empty_counts
+        :param stats_file: type STR: Absolute path of the stats file
+        """
+        total_reads = max(counts['reads'], 1)
+        with open(ManifestMethods.temp_output(output_file=stats_file), 'w') as stats:
+            stats.write('#File\tstdin.fq\n')
+            stats.write('#Total\t{reads}\n'.format(reads=counts['reads']))
+            stats.write('#Matched\t{matched}\t{percent:.5f}%\n'.format(matched=counts['matched'],
+                                                                      percent=counts['matched'] / total_reads * 100))
+            stats.write('#Name\tReads\tReadsPct\n')
+            spacer_counts = counts['spacers'].tolist()
+            for index in sorted(range(len(spacer_counts)), key=lambda spacer: -spacer_counts[spacer]):
+                if spacer_counts[index]:
+                    stats.write('{name}\t{reads}\t{percent:.5f}%\n'
+                                .format(name=spacer_dict['names'][index],
+                                        reads=spacer_counts[index],
+                                        percent=spacer_counts[index] / total_reads * 100))
+        ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=stats_file),
+                                      output_file=stats_file)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+from olctools.accessoryFunctions.accessoryFunctions import make_path
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from contextlib import closing
+from datetime import datetime
+import sqlite3
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+# The strains table records the reference genomes, and the source file and its signature, of every stored strain. The
+# calls table stores one row for every retained position of a strain, and is clustered on the strain, so that the calls
+# of a strain are read together. The secondary index on the reference chromosome and position serves the position
+# lookups
+store_schema = """
+CREATE TABLE IF NOT EXISTS strains (
+    strain_id INTEGER PRIMARY KEY,
+    strain TEXT NOT NULL UNIQUE,
+    reference TEXT NOT NULL,
+    chromosomes TEXT NOT NULL,
+    variant_caller TEXT NOT NULL,
+    source TEXT NOT NULL,
+    signature TEXT NOT NULL DEFAULT '',
+    added TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    strain_id INTEGER NOT NULL REFERENCES strains (strain_id),
+    chrom TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    alt TEXT NOT NULL,
+    qual TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    filter TEXT NOT NULL,
+    stats TEXT NOT NULL,
+    PRIMARY KEY (strain_id, chrom, pos)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS calls_position ON calls (chrom, pos);
+"""
+
+
+class StoreMethods(object):
+
+    @staticmethod
+    def open_store(store_file):
+        """
+        Open the SNP call store, and create the tables and indexes if they do not exist
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :return: connection: sqlite3.Connection to the store
+        """
+        make_path(os.path.dirname(store_file))
+        connection = sqlite3.connect(store_file)
+        connection.executescript(store_schema)
+        # Stores created before the signatures were recorded lack the column. Their strains are stored again the next
+        # time they are added, as the empty signature never matches the signature of a file
+        if 'signature' not in [column[1] for column in connection.execute('PRAGMA table_info(strains)')]:
+            with connection:
+                connection.execute('ALTER TABLE strains ADD COLUMN signature TEXT NOT NULL DEFAULT \'\'')
+        return connection
+
+    @staticmethod
+    def source_signature(vcf_file):
+        """
+        Create the signature of the gVCF file of a strain that is recorded in the store
+        :param vcf_file: type STR: Absolute path to the gVCF file
+        :return: JSON-formatted string of the size and modification time of the file
+        """
+        return json.dumps(ManifestMethods.file_signature(file_path=vcf_file), sort_keys=True)
+
+    @staticmethod
+    def current_strain(strain_dict, vcf_file, variant_caller):
+        """
+        Determine whether the stored calls of a strain were parsed from the supplied gVCF file in its current state
+        :param strain_dict: type DICT: Dictionary of the stored fields of the strain from stored_strains
+        :param vcf_file: type STR: Absolute path to the gVCF file of the strain
+        :param variant_caller: type STR: Variant calling software used to create the file: deepvariant or freebayes
+        :return: Boolean of whether the source, signature, and variant caller of the stored strain match
+        """
+        return strain_dict['source'] == vcf_file and strain_dict['variant_caller'] == variant_caller and \
+            strain_dict['signature'] == StoreMethods.source_signature(vcf_file=vcf_file)
+
+    @staticmethod
+    def stored_strains(store_file, strain_list=None):
+        """
+        Find the strains that are already in the store
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param strain_list: type LIST: Names of the strains of interest. All stored strains are returned if not
+        supplied
+        :return: strain_dict: Dictionary of strain name: dictionary of the 'reference', 'chromosomes',
+        'variant_caller', 'source', 'signature', and 'added' fields of the strain
+        """
+        strain_dict = dict()
+        strain_set = set(strain_list) if strain_list is not None else None
+        with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+            for strain, reference, chromosomes, variant_caller, source, signature, added in connection.execute(
+                    'SELECT strain, reference, chromosomes, variant_caller, source, signature, added FROM strains'):
+                if strain_set is not None and strain not in strain_set:
+                    continue
+                strain_dict[strain] = {'reference': reference,
+                                       'chromosomes': chromosomes.split(','),
+                                       'variant_caller': variant_caller,
+                                       'source': source,
+                                       'signature': signature,
+                                       'added': added}
+        return strain_dict
+
+    @staticmethod
+    def add_strains(store_file, strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict,
+                    strain_vcf_dict, variant_caller):
+        """
+        Append the calls of parsed strains to the store. Strains that are already stored from the same gVCF file, with
+        the same signature and variant caller, are not replaced. The stored calls of strains whose gVCF file has
+        changed are replaced. Each strain is added in a single transaction, so an interrupted run never leaves a
+        partially stored strain
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: reference chromosome: position: parsed
+        VCF dictionary of every call of the strain
+        :param strain_best_ref_dict: type DICT: Dictionary of strain name: reference genome parsed from gVCF file
+        :param strain_best_ref_set_dict: type DICT: Dictionary of strain name: all reference genomes parsed from gVCF
+        file
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
+        :param variant_caller: type STR: Variant calling software used to create the files: deepvariant or freebayes
+        :return: added_strains: List of the names of the strains added to, or replaced in, the store
+        """
+        added_strains = list()
+        with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+            for strain_name, ref_dict in strain_parsed_vcf_dict.items():
+                # The connection context commits the transaction, or rolls it back on an error
+                with connection:
+                    signature = StoreMethods.source_signature(vcf_file=strain_vcf_dict[strain_name])
+                    stored = connection.execute(
+                        'SELECT strain_id, variant_caller, source, signature FROM strains WHERE strain = ?',
+                        (strain_name,)).fetchone()
+                    if stored is not None:
+                        # The strain is already stored from the same file
+                        if stored[1:] == (variant_caller, strain_vcf_dict[strain_name], signature):
+                            continue
+                        # The stored calls are stale, so remove them before the strain is stored again
+                        connection.execute('DELETE FROM calls WHERE strain_id = ?', (stored[0],))
+                        connection.execute('DELETE FROM strains WHERE strain_id = ?', (stored[0],))
+                    cursor = connection.execute(
+                        'INSERT INTO strains (strain, reference, chromosomes, variant_caller, source, signature, '
+                        'added) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (strain_name,
+                         strain_best_ref_dict[strain_name],
+                         ','.join(StoreMethods.chromosome_order(ref_dict=ref_dict,
+                                                                ref_set=strain_best_ref_set_dict[strain_name])),
+                         variant_caller,
+                         strain_vcf_dict[strain_name],
+                         signature,
+                         datetime.now().isoformat(timespec='seconds')))
+                    strain_id = cursor.lastrowid
+                    connection.executemany(
+                        'INSERT INTO calls (strain_id, chrom, pos, ref, alt, qual, length, filter, stats) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        ((strain_id, ref_chrom, pos, pos_dict['REF'], pos_dict['ALT'], pos_dict['QUAL'],
+                          pos_dict['LENGTH'], pos_dict['FILTER'], json.dumps(pos_dict['STATS']))
+                         for ref_chrom, vcf_dict in ref_dict.items()
+                         for pos, pos_dict in vcf_dict.items()))
+                added_strains.append(strain_name)
+        return added_strains
+
+    @staticmethod
+    def chromosome_order(ref_dict, ref_set):
+        """
+        Order the reference chromosomes of a strain as they were parsed from the gVCF file, so that the loaded calls
+        are iterated in the same order as the parsed calls
+        :param ref_dict: type DICT: Dictionary of reference chromosome: position: parsed VCF dictionary of the strain
+        :param ref_set: type SET: All reference genomes parsed from the gVCF file of the strain
+        :return: List of the names of the reference chromosomes. Chromosomes without calls follow those with calls
+        """
+        return list(ref_dict) + sorted(ref_set.difference(ref_dict))
+
+    @staticmethod
+    def load_strains(store_file, strain_list, position_dict=None, pass_only=False):
+        """
+        Load the calls of stored strains into the same format as the parsed gVCF files, so that the stored strains
+        do not have to be parsed again
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param strain_list: type LIST: Names of the stored strains to load
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions. If supplied, only
+        the calls at these positions are loaded
+        :param pass_only: type BOOL: Boolean of whether only the SNP calls that PASS filter are loaded
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        strain_parsed_vcf_dict = dict()
+        strain_best_ref_dict = dict()
+        strain_best_ref_set_dict = dict()
+        query = 'SELECT calls.chrom, calls.pos, ref, alt, qual, length, filter, stats FROM calls'
+        # Join the calls to a temporary table of the required positions, so the positions are searched in the store
+        if position_dict is not None:
+            query += ' JOIN temp.positions ON calls.chrom = temp.positions.chrom AND calls.pos = temp.positions.pos'
+        query += ' WHERE strain_id = ?'
+        if pass_only:
+            query += ' AND filter = \'PASS\''
+        with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+            if position_dict is not None:
+                connection.execute('CREATE TEMP TABLE positions (chrom TEXT, pos INTEGER, PRIMARY KEY (chrom, pos))')
+                connection.executemany('INSERT INTO temp.positions VALUES (?, ?)',
+                                       ((ref_chrom, pos) for ref_chrom, pos_set in position_dict.items()
+                                        for pos in pos_set))
+            for strain_name in strain_list:
+                strain_id, reference, chromosomes = connection.execute(
+                    'SELECT strain_id, reference, chromosomes FROM strains WHERE strain = ?', (strain_name,)).fetchone()
+                strain_best_ref_dict[strain_name] = reference
+                chromosome_list = chromosomes.split(',')
+                strain_best_ref_set_dict[strain_name] = set(chromosome_list)
+                ref_dict = dict()
+                for ref_chrom, pos, ref, alt, qual, length, filter_stat, stats in connection.execute(query,
+                                                                                                      (strain_id,)):
+                    if ref_chrom not in ref_dict:
+                        ref_dict[ref_chrom] = dict()
+                    ref_dict[ref_chrom][pos] = {
+                        'CHROM': ref_chrom,
+                        'REF': ref,
+                        'ALT': alt,
+                        'QUAL': qual,
+                        'LENGTH': length,
+                        'FILTER': filter_stat,
+                        'STATS': json.loads(stats)
+                    }
+                # The calls are read in the order of the index, so restore the order of the chromosomes in the file
+                strain_parsed_vcf_dict[strain_name] = {ref_chrom: ref_dict[ref_chrom] for ref_chrom in chromosome_list
+                                                       if ref_chrom in ref_dict}
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def query_calls(store_file, chrom=None, start=None, end=None, strain_list=None, filter_list=None):
+        """
+        Find the stored calls that match all of the supplied criteria
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param chrom: type STR: Name of the reference chromosome of the calls
+        :param start: type INT: First position of the calls. Requires chrom
+        :param end: type INT: Final position of the calls. Defaults to start. Requires chrom
+        :param strain_list: type LIST: Names of the strains of the calls
+        :param filter_list: type LIST: Filters of the calls e.g. PASS, INSERTION, DELETION
+        :return: call_list: List of tuples of strain name, reference chromosome, position, reference base, alt base,
+        quality score, length, filter, and the date the strain was added to the store, sorted by reference
+        chromosome, position, and strain name
+        """
+        conditions = list()
+        values = list()
+        if chrom is not None:
+            conditions.append('calls.chrom = ?')
+            values.append(chrom)
+            if start is not None:
+                conditions.append('calls.pos BETWEEN ? AND ?')
+                values.extend([start, end if end is not None else start])
+        if strain_list:
+            conditions.append('strains.strain IN ({})'.format(', '.join('?' * len(strain_list))))
+            values.extend(strain_list)
+        if filter_list:
+            conditions.append('calls.filter IN ({})'.format(', '.join('?' * len(filter_list))))
+            values.extend(filter_list)
+        query = 'SELECT strains.strain, calls.chrom, calls.pos, ref, alt, qual, length, filter, added FROM calls ' \
+                'JOIN strains ON calls.strain_id = strains.strain_id'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY calls.chrom, calls.pos, strains.strain'
+        with closing(StoreMethods.open_store(store_file=store_file)) as connection:
+            call_list = connection.execute(query, values).fetchall()
+        return call_list
@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import make_path, run_subprocess, write_to_logfile
+from vsnp.vsnp_pool_methods import PoolMethods, worker_context
+from vsnp.vsnp_store_methods import StoreMethods
 from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import IUPAC
 from Bio.Seq import Seq
 from Bio import SeqIO
-import multiprocessing
+from bisect import bisect_left, bisect_right
+from contextlib import closing, ExitStack
+from array import array
 from ete3 import Tree
 from glob import glob
 import xlsxwriter
+import subprocess
+import tempfile
 import shutil
+import json
+import time
 import pandas
+import numpy
 import gzip
 import xlrd
+import mmap
 import os
 import re
 
@@ -27,8 +37,9 @@ class VSNPTreeMethods(object):
         :param file_path: type STR: absolute path of folder containing VCF files
         :return vcf_files: sorted list of all VCF files present in the supplied path
         """
-        # Use glob to find the acceptable extensions of VCF files in the supplied path
-        vcf_files = glob(os.path.join(file_path, '*.gvcf*'))
+        # Use glob to find the acceptable extensions of VCF files in the supplied path. Ignore tabix indexes
+        vcf_files = [vcf_file for vcf_file in glob(os.path.join(file_path, '*.gvcf*'))
+                     if not vcf_file.endswith(('.tbi', '.csi'))]
         # Sort the list of VCF files
         vcf_files = sorted(vcf_files)
         # Ensure that there are actually files present in the path
@@ -72,46 +83,204 @@ class VSNPTreeMethods(object):
         return accession_species_dict
 
     @staticmethod
-    def load_gvcf(strain_vcf_dict, threads, qual_cutoff=20):
+    def load_gvcf(strain_vcf_dict, threads, qual_cutoff=20, pool=None):
         """
         Create a multiprocessing pool to parse gVCF files concurrently
         :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
         :param qual_cutoff: type INT: Quality cutoff value to use. Default is 20
         :param threads: type INT: Number of processes to run concurrently
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for this stage
         :return:
         """
-        # Initialise dictionaries to store the parsed gVCF outputs and the closest reference genome
+        # Create a folder for the scratch files used to transfer the parsed outputs from the workers
+        scratch_path = tempfile.mkdtemp(prefix='vsnp_')
+        try:
+            with PoolMethods.worker_pool(threads=threads, pool=pool) as p:
+                # Send the variables shared by every strain to each worker once, rather than with every strain
+                PoolMethods.broadcast(pool=p,
+                                      context={'strain_vcf_dict': strain_vcf_dict,
+                                               'qual_cutoff': qual_cutoff,
+                                               'scratch_path': scratch_path})
+                # The workers write the packed outputs to scratch files, and only return their layout
+                strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+                    VSNPTreeMethods.unpack_parsed_vcf(packed_vcf_list=VSNPTreeMethods.read_packed_vcf(
+                        descriptor_list=p.imap(VSNPTreeMethods.load_gvcf_worker, strain_vcf_dict)))
+                # Release the broadcast variables held by the workers
+                PoolMethods.broadcast(pool=p,
+                                      context=dict())
+        finally:
+            # Remove any scratch files left behind by an error
+            shutil.rmtree(scratch_path, ignore_errors=True)
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def load_gvcf_worker(strain_name):
+        """
+        Parse a single gVCF file using the variables broadcast to the worker, and write the packed outputs to a
+        scratch file
+        :param strain_name: type STR: Name of strain being processed
+        :return: Layout of the scratch file containing the packed outputs of load_gvcf_multiprocessing (see
+        write_packed_vcf)
+        """
+        packed_vcf = VSNPTreeMethods.pack_parsed_vcf(*VSNPTreeMethods.load_gvcf_multiprocessing(
+            strain_name=strain_name,
+            strain_vcf_dict=worker_context['strain_vcf_dict'],
+            qual_cutoff=worker_context['qual_cutoff']))
+        return VSNPTreeMethods.write_packed_vcf(packed_vcf=packed_vcf,
+                                                scratch_path=worker_context['scratch_path'])
+
+    @staticmethod
+    def pack_parsed_vcf(strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict):
+        """
+        Pack the parsed outputs of a single strain into a compact format to return to the main process. Positions and
+        lengths are stored in integer arrays, and the remaining fields of every entry are stored in a single
+        encoded string per reference chromosome, rather than as one dictionary per entry
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: reference chromosome: position: parsed
+        VCF dictionary
+        :param strain_best_ref_dict: type DICT: Dictionary of strain name: reference genome parsed from gVCF file
+        :param strain_best_ref_set_dict: type DICT: Dictionary of strain name: all reference genomes parsed from gVCF
+        file
+        :return: packed_vcf: Tuple of strain name, best reference genome, sorted list of all reference genomes, list of
+        (reference chromosome, positions bytes, lengths bytes, encoded entries bytes)
+        """
+        strain_name = list(strain_parsed_vcf_dict)[0]
+        packed_chroms = list()
+        for ref_chrom, vcf_dict in strain_parsed_vcf_dict[strain_name].items():
+            # Store each entry as REF, ALT, QUAL, FILTER, followed by the STATS keys and values, separated by tabs.
+            # None of these fields can contain tabs or newlines, as they were parsed from tab-delimited lines
+            entries = '\n'.join('\t'.join([pos_dict['REF'], pos_dict['ALT'], pos_dict['QUAL'], pos_dict['FILTER']] +
+                                          [field for item in pos_dict['STATS'].items() for field in item])
+                                for pos_dict in vcf_dict.values())
+            packed_chroms.append((ref_chrom,
+                                  array('q', vcf_dict).tobytes(),
+                                  array('q', [pos_dict['LENGTH'] for pos_dict in vcf_dict.values()]).tobytes(),
+                                  entries.encode()))
+        return strain_name, strain_best_ref_dict.get(strain_name), \
+            sorted(strain_best_ref_set_dict.get(strain_name, set())), packed_chroms
+
+    @staticmethod
+    def unpack_parsed_vcf(packed_vcf_list):
+        """
+        Restore the dictionaries of parsed outputs from the packed outputs of each strain
+        :param packed_vcf_list: type ITERABLE: Packed outputs of each strain (see pack_parsed_vcf)
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        # Initialise dictionaries to store the parsed outputs and the closest reference genome
         strain_parsed_vcf_dict = dict()
         strain_best_ref_dict = dict()
         strain_best_ref_set_dict = dict()
-        # Create a multiprocessing pool. Limit the number of processes to the number of threads
-        p = multiprocessing.Pool(processes=threads)
-        # Create a list of all the strain names
-        strain_list = [strain_name for strain_name in strain_vcf_dict]
-        # Determine the number of strains present in the analyses
-        list_length = len(strain_list)
-        # Use multiprocessing.Pool.starmap to process the samples in parallel
-        # Supply the list of strains, as well as a list the length of the number of strains of each required variable
-        for parsed_vcf, strain_best_ref, strain_best_ref_set in p.starmap(VSNPTreeMethods.load_gvcf_multiprocessing,
-                                                                          zip(strain_list,
-                                                                              [strain_vcf_dict] * list_length,
-                                                                              [qual_cutoff] * list_length)):
-            # Update the dictionaries
-            strain_parsed_vcf_dict.update(parsed_vcf)
-            strain_best_ref_dict.update(strain_best_ref)
-            strain_best_ref_set_dict.update(strain_best_ref_set)
-        # Close and join the pool
-        p.close()
-        p.join()
+        for strain_name, best_ref, best_ref_list, packed_chroms in packed_vcf_list:
+            strain_parsed_vcf_dict[strain_name] = dict()
+            # Strains without any entries in the file do not have a reference genome
+            if best_ref is not None:
+                strain_best_ref_dict[strain_name] = best_ref
+                strain_best_ref_set_dict[strain_name] = set(best_ref_list)
+            for ref_chrom, positions, lengths, entries in packed_chroms:
+                vcf_dict = dict()
+                # The buffers may be bytes, or views of a memory-mapped scratch file. Read the integers directly from
+                # the buffers, and release the views once the entries have been restored
+                with memoryview(positions).cast('q') as position_array, \
+                        memoryview(lengths).cast('q') as length_array:
+                    # An empty string would otherwise be split into a single empty entry
+                    entry_list = str(entries, 'utf-8').split('\n') if len(position_array) else list()
+                    for pos, length, entry in zip(position_array, length_array, entry_list):
+                        fields = entry.split('\t')
+                        vcf_dict[pos] = {
+                            'CHROM': ref_chrom,
+                            'REF': fields[0],
+                            'ALT': fields[1],
+                            'QUAL': fields[2],
+                            'LENGTH': length,
+                            'FILTER': fields[3],
+                            'STATS': dict(zip(fields[4::2], fields[5::2]))
+                        }
+                strain_parsed_vcf_dict[strain_name][ref_chrom] = vcf_dict
         return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
 
     @staticmethod
-    def load_gvcf_multiprocessing(strain_name, strain_vcf_dict, qual_cutoff):
+    def write_packed_vcf(packed_vcf, scratch_path):
+        """
+        Write the buffers of the packed outputs of a strain to a scratch file, so that only the small description of
+        the file layout needs to be returned to the main process
+        :param packed_vcf: type TUPLE: Packed outputs of a strain (see pack_parsed_vcf)
+        :param scratch_path: type STR: Absolute path to folder in which the scratch file is to be created
+        :return: descriptor: Tuple of strain name, best reference genome, sorted list of all reference genomes,
+        absolute path to scratch file, list of (reference chromosome, offset, positions size, lengths size,
+        entries size)
+        """
+        strain_name, best_ref, best_ref_list, packed_chroms = packed_vcf
+        # Use a unique file name, as strain names are not guaranteed to be valid file names
+        scratch_handle, scratch_file = tempfile.mkstemp(suffix='.vcf.bin', dir=scratch_path)
+        chrom_layout = list()
+        offset = 0
+        with os.fdopen(scratch_handle, 'wb') as scratch:
+            for ref_chrom, positions, lengths, entries in packed_chroms:
+                # Pad the encoded entries, so that the integer arrays of the next chromosome are 8-byte aligned
+                padding = -len(entries) % 8
+                scratch.write(positions)
+                scratch.write(lengths)
+                scratch.write(entries + b'\0' * padding)
+                chrom_layout.append((ref_chrom, offset, len(positions), len(lengths), len(entries)))
+                offset += len(positions) + len(lengths) + len(entries) + padding
+        return strain_name, best_ref, best_ref_list, scratch_file, chrom_layout
+
+    @staticmethod
+    def read_packed_vcf(descriptor_list):
+        """
+        Memory-map the scratch file of each strain, and yield its packed outputs as views of the mapped file rather
+        than as copies. The views are released, and the scratch file is removed, once the next strain is requested
+        :param descriptor_list: type ITERABLE: Scratch file layout of each strain (see write_packed_vcf)
+        :return: packed_vcf: Packed outputs of each strain (see pack_parsed_vcf) with buffers that are views of the
+        scratch file
+        """
+        for strain_name, best_ref, best_ref_list, scratch_file, chrom_layout in descriptor_list:
+            try:
+                with open(scratch_file, 'rb') as scratch:
+                    # Empty files cannot be memory-mapped
+                    mapped = mmap.mmap(scratch.fileno(), 0, access=mmap.ACCESS_READ) if chrom_layout else bytes(0)
+                    view = memoryview(mapped)
+                    chrom_views = list()
+                    for ref_chrom, offset, positions_size, lengths_size, entries_size in chrom_layout:
+                        lengths_offset = offset + positions_size
+                        entries_offset = lengths_offset + lengths_size
+                        chrom_views.append((ref_chrom,
+                                            view[offset:lengths_offset],
+                                            view[lengths_offset:entries_offset],
+                                            view[entries_offset:entries_offset + entries_size]))
+                    try:
+                        yield strain_name, best_ref, best_ref_list, chrom_views
+                    finally:
+                        # All the views must be released before the file can be unmapped
+                        for ref_chrom, *buffer_views in chrom_views:
+                            for buffer_view in buffer_views:
+                                buffer_view.release()
+                        view.release()
+                        if chrom_layout:
+                            mapped.close()
+            finally:
+                # The folder of scratch files may already have been removed following an error
+                try:
+                    os.remove(scratch_file)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def load_gvcf_multiprocessing(strain_name, strain_vcf_dict, qual_cutoff, position_dict=None, pass_only=False,
+                                  regions_file=None):
         """
         Load the gVCF files into a dictionary
         :param strain_name: type STR: Name of strain being processed
         :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
         :param qual_cutoff: type INT: Quality cutoff value to use.
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions. If supplied, only
+        entries at these positions are retained, and parsing stops once every chromosome is past its last position
+        :param pass_only: type BOOL: Boolean of whether only the SNP calls that PASS filter are retained
+        :param regions_file: type STR: Absolute path to BED file of the regions to read. Only used if the gVCF file
+        has a tabix index
         :return: parsed_vcf_dict: Dictionary of strain name: key: value pairs CHROM': ref_genome, 'REF': ref base,
             'ALT': alt base, 'QUAL': quality score, 'LENGTH': length of feature, 'FILTER': deepvariant filter call,
             'STATS': dictionary of format data
@@ -144,27 +313,20 @@ class VSNPTreeMethods(object):
         strain_best_ref_set_dict = dict()
         vcf_file = strain_vcf_dict[strain_name]
         strain_parsed_vcf_dict[strain_name] = dict()
-        # Use gzip to open the compressed file
-        with gzip.open(vcf_file, 'r') as gvcf:
+        # Sort the positions to retain, so that the positions covered by gVCF blocks can be found with a bisection
+        sorted_position_dict = VSNPTreeMethods.sort_positions(position_dict=position_dict)
+        # Set of reference chromosomes that still have positions to retain further along the file
+        open_chroms = set(sorted_position_dict)
+        # Read the lines of the compressed file (restricted to the regions of interest if the file is indexed)
+        with closing(VSNPTreeMethods.read_vcf_lines(vcf_file=vcf_file,
+                                                    regions_file=regions_file)) as gvcf:
             for line in gvcf:
-                # Convert the line to string from bytes
-                line = line.decode()
                 # Skip all the headers
                 if line.startswith('#CHROM'):
                     for subline in gvcf:
-                        # Convert to string
-                        subline = subline.decode()
                         # Split the line on tabs. The components correspond to the #CHROM comment above
                         ref_genome, pos, id_stat, ref, alt_string, qual, filter_stat, info_string, format_stat, \
                             strain = subline.split('\t')
-                        # The 'Format' entry consists of several components: GT:GQ:DP:AD:VAF:PL for SNP positions,
-                        # and GT:GQ:MIN_DP:PL for all other entries (see quoted information above)
-                        # Perform a dictionary comprehension to associate each format component with its
-                        # corresponding 'strain' component e.g. FORMAT: GT:GQ:DP:AD:VAF:PL
-                        # 'STRAIN' 1/1:54:18:0,18,0:1,0:60,55,0,990,990,990 yields'GT': '1/1', 'GQ': 54, 'DP': '18',
-                        # 'AD': 18:0,18,0, 'VAF': 1,0, 'PL': 60,55,0,990,990,990
-                        format_dict = {value: strain.split(':')[i].rstrip()
-                                       for i, value in enumerate(format_stat.split(':'))}
                         # Initialise the dictionary as required
                         if strain_name not in strain_best_ref_dict:
                             strain_best_ref_dict[strain_name] = ref_genome
@@ -177,6 +339,26 @@ class VSNPTreeMethods(object):
                             info = info_string.split('END=')[1]
                         else:
                             info = pos
+                        # Skip the entries that are not required before performing any further parsing
+                        if pass_only and filter_stat != 'PASS':
+                            continue
+                        if position_dict is not None:
+                            # Stop reading once every chromosome is past its final required position
+                            if ref_genome in open_chroms and int(pos) > sorted_position_dict[ref_genome][-1]:
+                                open_chroms.remove(ref_genome)
+                                if not open_chroms:
+                                    break
+                            if not VSNPTreeMethods.positions_in_range(sorted_positions=sorted_position_dict.get(
+                                    ref_genome, list()), start=int(pos), end=int(info)):
+                                continue
+                        # The 'Format' entry consists of several components: GT:GQ:DP:AD:VAF:PL for SNP positions,
+                        # and GT:GQ:MIN_DP:PL for all other entries (see quoted information above)
+                        # Perform a dictionary comprehension to associate each format component with its
+                        # corresponding 'strain' component e.g. FORMAT: GT:GQ:DP:AD:VAF:PL
+                        # 'STRAIN' 1/1:54:18:0,18,0:1,0:60,55,0,990,990,990 yields'GT': '1/1', 'GQ': 54, 'DP': '18',
+                        # 'AD': 18:0,18,0, 'VAF': 1,0, 'PL': 60,55,0,990,990,990
+                        format_dict = {value: strain.split(':')[i].rstrip()
+                                       for i, value in enumerate(format_stat.split(':'))}
                         # Initialise a string to store the sanitised 'ALT" call
                         alt = str()
                         # For SNP calls, the alt_string will look like this: G,<*>, or A,G,<*>, while matches are
@@ -215,7 +397,7 @@ class VSNPTreeMethods(object):
                             }
                         # Insertions must still have a deepvariant filter of 'PASS', but must have a length
                         # greater than one
-                        elif filter_stat == 'PASS' and alt_length > 1:
+                        elif filter_stat == 'PASS' and alt_length > 1 and not pass_only:
                             strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
                                 'CHROM': ref_genome,
                                 'REF': ref,
@@ -233,7 +415,13 @@ class VSNPTreeMethods(object):
                             # Iterate through the range of the deletion, and populate the dictionary for each
                             # position encompassed by this range (add +1 due to needing to include the final
                             # position in the dictionary)
-                            for i in range(int(pos), int(info) + 1):
+                            # Only populate the required positions if a set of positions was supplied
+                            if position_dict is not None:
+                                deletion_range = VSNPTreeMethods.positions_in_range(
+                                    sorted_positions=sorted_position_dict[ref_genome], start=pos, end=int(info))
+                            else:
+                                deletion_range = range(int(pos), int(info) + 1)
+                            for i in deletion_range:
                                 strain_parsed_vcf_dict[strain_name][ref_genome][i] = {
                                     'CHROM': ref_genome,
                                     'REF': ref,
@@ -243,14 +431,21 @@ class VSNPTreeMethods(object):
                                     'FILTER': 'DELETION',
                                     'STATS': format_dict
                                 }
+                    # All the entries were processed (or skipped) in the nested loop
+                    break
         return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
 
     @staticmethod
-    def load_vcf(strain_vcf_dict):
+    def load_vcf(strain_vcf_dict, position_dict=None, pass_only=False, regions_file=None):
         """
         Using vcf.Reader(), load the VCF files. Store the Reader objects, as well as the extracted reference sequence,
         and its associated species code in dictionaries
         :param strain_vcf_dict: type DICT: Dictionary of strain name: list of absolute path to VCF file
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions. If supplied, only
+        entries at these positions are retained, and parsing stops once every chromosome is past its last position
+        :param pass_only: type BOOL: Boolean of whether only the SNP calls that PASS filter are retained
+        :param regions_file: type STR: Absolute path to BED file of the regions to read. Only used for VCF files with a
+        tabix index
         :return: strain_vcf_object_dict: Dictionary of strain name: VCF Reader object
         :return: strain_best_ref_dict: Dictionary of strain name: extracted reference genome name
         """
@@ -258,9 +453,15 @@ class VSNPTreeMethods(object):
         strain_parsed_vcf_dict = dict()
         strain_best_ref_dict = dict()
         strain_best_ref_set_dict = dict()
+        # Sort the positions to retain, so that the final required position of each chromosome is known
+        sorted_position_dict = VSNPTreeMethods.sort_positions(position_dict=position_dict)
         for strain_name, vcf_file in strain_vcf_dict.items():
             strain_parsed_vcf_dict[strain_name] = dict()
-            with open(vcf_file, 'r') as filtered:
+            # Set of reference chromosomes that still have positions to retain further along the file
+            open_chroms = set(sorted_position_dict)
+            # Read the lines of the (optionally bgzip-compressed) file
+            with closing(VSNPTreeMethods.read_vcf_lines(vcf_file=vcf_file,
+                                                        regions_file=regions_file)) as filtered:
                 for line in filtered:
                     # Add the VCF file header information to the filtered file
                     if line.startswith('#'):
@@ -278,6 +479,15 @@ class VSNPTreeMethods(object):
                             strain_best_ref_set_dict[strain_name] = {ref_genome}
                         else:
                             strain_best_ref_set_dict[strain_name].add(ref_genome)
+                        # Skip the entries that are not required before performing any further parsing
+                        if position_dict is not None:
+                            # Stop reading once every chromosome is past its final required position
+                            if ref_genome in open_chroms and int(pos) > sorted_position_dict[ref_genome][-1]:
+                                open_chroms.remove(ref_genome)
+                                if not open_chroms:
+                                    break
+                            if int(pos) not in position_dict.get(ref_genome, set()):
+                                continue
                         # Find the depth entry. e.g. DP=11
                         depth_group = re.search('(DP=[0-9]+)', info_string)
                         # Split the depth matching group on '=' and convert the depth to an int
@@ -293,7 +503,7 @@ class VSNPTreeMethods(object):
                             category, value = entry.split('=')
                             format_dict[category] = value
                         # Store the zero coverage entries
-                        if depth == 0:
+                        if depth == 0 and not pass_only:
                             strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
                                 'CHROM': ref_genome,
                                 'REF': ref,
@@ -303,7 +513,7 @@ class VSNPTreeMethods(object):
                                 'FILTER': 'DELETION',
                                 'STATS': format_dict
                             }
-                        else:
+                        elif depth != 0:
                             #
                             if len(ref) == 1:
                                 # Only store SNPs with a quality score greater or equal to 150
@@ -319,7 +529,7 @@ class VSNPTreeMethods(object):
                                         'STATS': format_dict
                                     }
                             # Store all indels
-                            else:
+                            elif not pass_only:
                                 strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
                                     'CHROM': ref_genome,
                                     'REF': ref,
@@ -331,6 +541,346 @@ class VSNPTreeMethods(object):
                                 }
         return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
 
+    @staticmethod
+    def load_reduced_vcf(strain_vcf_dict, variant_caller, threads, position_dict=None, qual_cutoff=30, pool=None,
+                         pass_only=None):
+        """
+        Create a multiprocessing pool to parse gVCF (deepvariant) or VCF (FreeBayes) files concurrently, and only
+        retain the entries required for the current stage of the analyses. This keeps the memory footprint of
+        parsing bounded by the number of retained positions rather than the size of the gVCF files
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
+        :param variant_caller: type STR: Variant calling software used to create the files: deepvariant or freebayes
+        :param threads: type INT: Number of processes to run concurrently
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions to retain. If not
+        supplied, only the entries that PASS filter are retained
+        :param qual_cutoff: type INT: Quality cutoff value to use for gVCF files. Default is 30
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for this stage
+        :param pass_only: type BOOL: Boolean of whether only the SNP calls that PASS filter are retained. If not
+        supplied, only these calls are retained when no positions are supplied. Set to False with no positions to
+        retain every call
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary for retained positions
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        # Write the positions to a BED file, so that only these regions are read from files with a tabix index
+        regions_file = None
+        if position_dict is not None:
+            regions_handle, regions_file = tempfile.mkstemp(suffix='.bed')
+            os.close(regions_handle)
+            VSNPTreeMethods.positions_to_regions(position_dict=position_dict,
+                                                 regions_file=regions_file)
+        # Create a folder for the scratch files used to transfer the parsed outputs from the workers
+        scratch_path = tempfile.mkdtemp(prefix='vsnp_')
+        try:
+            with PoolMethods.worker_pool(threads=threads, pool=pool) as p:
+                # Send the variables shared by every strain, including the (potentially large) dictionary of positions
+                # to retain, to each worker once rather than with every strain
+                PoolMethods.broadcast(pool=p,
+                                      context={'strain_vcf_dict': strain_vcf_dict,
+                                               'variant_caller': variant_caller,
+                                               'qual_cutoff': qual_cutoff,
+                                               'position_dict': position_dict,
+                                               'pass_only': pass_only,
+                                               'regions_file': regions_file,
+                                               'scratch_path': scratch_path})
+                # The workers write the packed outputs to scratch files, and only return their layout
+                strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+                    VSNPTreeMethods.unpack_parsed_vcf(packed_vcf_list=VSNPTreeMethods.read_packed_vcf(
+                        descriptor_list=p.imap(VSNPTreeMethods.load_reduced_vcf_worker, strain_vcf_dict)))
+                # Release the broadcast variables held by the workers
+                PoolMethods.broadcast(pool=p,
+                                      context=dict())
+        finally:
+            # Remove the temporary regions file, and any scratch files left behind by an error
+            if regions_file is not None:
+                os.remove(regions_file)
+            shutil.rmtree(scratch_path, ignore_errors=True)
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def load_reduced_vcf_multiprocessing(strain_name, strain_vcf_dict, variant_caller, qual_cutoff, position_dict,
+                                         regions_file=None, pass_only=None):
+        """
+        Parse a single gVCF or VCF file, and reduce the parsed outputs before returning them to the main process
+        :param strain_name: type STR: Name of strain being processed
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
+        :param variant_caller: type STR: Variant calling software used to create the files: deepvariant or freebayes
+        :param qual_cutoff: type INT: Quality cutoff value to use for gVCF files
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions to retain. None retains
+        only the entries that PASS filter
+        :param regions_file: type STR: Absolute path to BED file of the regions to read from files with a tabix index
+        :param pass_only: type BOOL: Boolean of whether only the SNP calls that PASS filter are retained. If not
+        supplied, only these calls are retained when no positions are supplied
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary for retained positions
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        # Only the SNP calls are required if no positions were supplied
+        if pass_only is None:
+            pass_only = position_dict is None
+        if variant_caller == 'deepvariant':
+            strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+                VSNPTreeMethods.load_gvcf_multiprocessing(strain_name=strain_name,
+                                                          strain_vcf_dict=strain_vcf_dict,
+                                                          qual_cutoff=qual_cutoff,
+                                                          position_dict=position_dict,
+                                                          pass_only=pass_only,
+                                                          regions_file=regions_file)
+        else:
+            strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+                VSNPTreeMethods.load_vcf(strain_vcf_dict={strain_name: strain_vcf_dict[strain_name]},
+                                         position_dict=position_dict,
+                                         pass_only=pass_only,
+                                         regions_file=regions_file)
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def load_reduced_vcf_worker(strain_name):
+        """
+        Parse and reduce a single gVCF or VCF file using the variables broadcast to the worker, and write the packed
+        outputs to a scratch file
+        :param strain_name: type STR: Name of strain being processed
+        :return: Layout of the scratch file containing the packed outputs of load_reduced_vcf_multiprocessing (see
+        write_packed_vcf)
+        """
+        packed_vcf = VSNPTreeMethods.pack_parsed_vcf(*VSNPTreeMethods.load_reduced_vcf_multiprocessing(
+            strain_name=strain_name,
+            strain_vcf_dict=worker_context['strain_vcf_dict'],
+            variant_caller=worker_context['variant_caller'],
+            qual_cutoff=worker_context['qual_cutoff'],
+            position_dict=worker_context['position_dict'],
+            regions_file=worker_context['regions_file'],
+            pass_only=worker_context['pass_only']))
+        return VSNPTreeMethods.write_packed_vcf(packed_vcf=packed_vcf,
+                                                scratch_path=worker_context['scratch_path'])
+
+    @staticmethod
+    def load_gvcf_union(strain_vcf_dict, variant_caller, threads, qual_cutoff=30, pool=None):
+        """
+        Parse the gVCF (deepvariant) or VCF (FreeBayes) files in two passes. The first pass only collects the SNP
+        positions that PASS filter in each strain. The second pass only retains the calls at the union of these
+        positions, as no other positions are considered when creating the trees
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
+        :param variant_caller: type STR: Variant calling software used to create the files: deepvariant or freebayes
+        :param threads: type INT: Number of processes to run concurrently
+        :param qual_cutoff: type INT: Quality cutoff value to use for gVCF files. Default is 30
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for each pass
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary for the union of SNP positions
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        # First pass: extract the SNP positions and the reference genomes of every strain
+        strain_pass_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+            VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=strain_vcf_dict,
+                                             variant_caller=variant_caller,
+                                             threads=threads,
+                                             qual_cutoff=qual_cutoff,
+                                             pool=pool)
+        position_dict = VSNPTreeMethods.union_snp_positions(strain_parsed_vcf_dict=strain_pass_vcf_dict)
+        # Release the first pass outputs before starting the second pass
+        strain_pass_vcf_dict.clear()
+        # Second pass: retain all the calls at the union of SNP positions. The reference genomes were already
+        # extracted in the first pass, which read the whole of every file
+        strain_parsed_vcf_dict = \
+            VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=strain_vcf_dict,
+                                             variant_caller=variant_caller,
+                                             threads=threads,
+                                             position_dict=position_dict,
+                                             qual_cutoff=qual_cutoff,
+                                             pool=pool)[0]
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def store_vcf(store_file, strain_vcf_dict, variant_caller, threads, qual_cutoff=30, pool=None, chunk_size=64):
+        """
+        Parse every call of the gVCF (deepvariant) or VCF (FreeBayes) files of the strains that are not yet in the SNP
+        call store, or whose file or variant caller has changed since they were stored, and add the calls to the store.
+        The strains are parsed and stored in chunks, so only the calls of a single chunk are held in memory
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
+        :param variant_caller: type STR: Variant calling software used to create the files: deepvariant or freebayes
+        :param threads: type INT: Number of processes to run concurrently
+        :param qual_cutoff: type INT: Quality cutoff value to use for gVCF files. Default is 30
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for each chunk
+        :param chunk_size: type INT: Number of strains to parse before their calls are stored. Default is 64
+        :return: added_strains: List of the names of the strains added to, or replaced in, the store
+        """
+        stored_strains = StoreMethods.stored_strains(store_file=store_file,
+                                                     strain_list=list(strain_vcf_dict))
+        new_strains = list()
+        for strain_name, vcf_file in strain_vcf_dict.items():
+            # Strains stored from a different or since rewritten file, or with another variant caller, are parsed again
+            if strain_name in stored_strains and StoreMethods.current_strain(strain_dict=stored_strains[strain_name],
+                                                                             vcf_file=vcf_file,
+                                                                             variant_caller=variant_caller):
+                continue
+            new_strains.append(strain_name)
+        added_strains = list()
+        for start in range(0, len(new_strains), chunk_size):
+            chunk_vcf_dict = {strain_name: strain_vcf_dict[strain_name]
+                              for strain_name in new_strains[start:start + chunk_size]}
+            # Retain every call, not just the calls that PASS filter, as the store is shared across projects
+            strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+                VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=chunk_vcf_dict,
+                                                 variant_caller=variant_caller,
+                                                 threads=threads,
+                                                 qual_cutoff=qual_cutoff,
+                                                 pool=pool,
+                                                 pass_only=False)
+            added_strains.extend(StoreMethods.add_strains(store_file=store_file,
+                                                          strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                                                          strain_best_ref_dict=strain_best_ref_dict,
+                                                          strain_best_ref_set_dict=strain_best_ref_set_dict,
+                                                          strain_vcf_dict=chunk_vcf_dict,
+                                                          variant_caller=variant_caller))
+        return added_strains
+
+    @staticmethod
+    def load_store_union(store_file, strain_list):
+        """
+        Load the calls of strains from the SNP call store in two passes, as in load_gvcf_union. The first pass only
+        loads the SNP positions that PASS filter, and the second pass only loads the calls at the union of these
+        positions
+        :param store_file: type STR: Absolute path to the SQLite database of the store
+        :param strain_list: type LIST: Names of the stored strains to load
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary for the union of SNP positions
+        :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file
+        :return: strain_best_ref_set_dict: Dictionary of strain name: all reference genomes parsed from gVCF file
+        """
+        strain_pass_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
+            StoreMethods.load_strains(store_file=store_file,
+                                      strain_list=strain_list,
+                                      pass_only=True)
+        position_dict = VSNPTreeMethods.union_snp_positions(strain_parsed_vcf_dict=strain_pass_vcf_dict)
+        # Release the first pass outputs before starting the second pass
+        strain_pass_vcf_dict.clear()
+        strain_parsed_vcf_dict = StoreMethods.load_strains(store_file=store_file,
+                                                           strain_list=strain_list,
+                                                           position_dict=position_dict)[0]
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def union_snp_positions(strain_parsed_vcf_dict):
+        """
+        Find the union of the SNP positions that PASS filter in all the strains
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: reference chromosome: position: parsed
+        VCF dictionary
+        :return: position_dict: Dictionary of reference chromosome: set of SNP positions
+        """
+        # Initialise a dictionary to store the positions
+        position_dict = dict()
+        for strain_name, ref_dict in strain_parsed_vcf_dict.items():
+            for ref_chrom, vcf_dict in ref_dict.items():
+                # Initialise the reference chromosome key as required
+                if ref_chrom not in position_dict:
+                    position_dict[ref_chrom] = set()
+                for pos, pos_dict in vcf_dict.items():
+                    if pos_dict['FILTER'] == 'PASS':
+                        position_dict[ref_chrom].add(pos)
+        return position_dict
+
+    @staticmethod
+    def sort_positions(position_dict):
+        """
+        Sort the positions of each reference chromosome
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions. Can be None
+        :return: sorted_position_dict: Dictionary of reference chromosome: sorted list of positions. Chromosomes
+        without positions are not included
+        """
+        # Initialise a dictionary to store the sorted positions
+        sorted_position_dict = dict()
+        if position_dict is not None:
+            for ref_chrom, pos_set in position_dict.items():
+                if pos_set:
+                    sorted_position_dict[ref_chrom] = sorted(pos_set)
+        return sorted_position_dict
+
+    @staticmethod
+    def positions_in_range(sorted_positions, start, end):
+        """
+        Find all the positions that fall within a range
+        :param sorted_positions: type LIST: Sorted list of positions
+        :param start: type INT: First position of the range
+        :param end: type INT: Final position of the range (inclusive)
+        :return: List of the positions within the range
+        """
+        return sorted_positions[bisect_left(sorted_positions, start):bisect_right(sorted_positions, end)]
+
+    @staticmethod
+    def positions_to_regions(position_dict, regions_file):
+        """
+        Write the positions of interest to a BED file, merging runs of consecutive positions into a single region
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions
+        :param regions_file: type STR: Absolute path to the BED file to create
+        :return: num_regions: Number of regions written to the file
+        """
+        num_regions = 0
+        with open(regions_file, 'w') as regions:
+            for ref_chrom, sorted_positions in VSNPTreeMethods.sort_positions(position_dict=position_dict).items():
+                # Initialise the first region with the first position
+                start = end = sorted_positions[0]
+                for pos in sorted_positions[1:]:
+                    # Extend the region with consecutive positions
+                    if pos == end + 1:
+                        end = pos
+                    else:
+                        # BED files use zero-based, half-open coordinates
+                        regions.write('{chrom}\t{start}\t{end}\n'.format(chrom=ref_chrom,
+                                                                         start=start - 1,
+                                                                         end=end))
+                        num_regions += 1
+                        start = end = pos
+                regions.write('{chrom}\t{start}\t{end}\n'.format(chrom=ref_chrom,
+                                                                 start=start - 1,
+                                                                 end=end))
+                num_regions += 1
+        return num_regions
+
+    @staticmethod
+    def read_vcf_lines(vcf_file, regions_file=None):
+        """
+        Yield the lines of a plain text or compressed VCF file. If a regions file is supplied, the VCF file has a tabix
+        index, and tabix is installed, only the header and the records overlapping the regions are read. gVCF
+        blocks are returned if any part of the block overlaps a region. Otherwise, the whole file is read
+        :param vcf_file: type STR: Absolute path to VCF file
+        :param regions_file: type STR: Absolute path to BED file of regions to read
+        :return: Lines of the VCF file as strings
+        """
+        if regions_file is not None and os.path.isfile(vcf_file + '.tbi') and shutil.which('tabix'):
+            # -h: include the header, -R: restrict the records to the regions in the BED file
+            tabix_cmd = ['tabix', '-h', '-R', regions_file, vcf_file]
+            process = subprocess.Popen(tabix_cmd, stdout=subprocess.PIPE, universal_newlines=True)
+            finished = False
+            try:
+                for line in process.stdout:
+                    yield line
+                finished = True
+            finally:
+                process.stdout.close()
+                # Stop tabix if the caller stopped reading early
+                if not finished and process.poll() is None:
+                    process.kill()
+                returncode = process.wait()
+            # A failed region query would silently drop calls, so raise an error rather than continue
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode=returncode,
+                                                    cmd=' '.join(tabix_cmd))
+        elif vcf_file.endswith('.gz'):
+            with gzip.open(vcf_file, 'rt') as vcf:
+                for line in vcf:
+                    yield line
+        else:
+            with open(vcf_file, 'r') as vcf:
+                for line in vcf:
+                    yield line
+
     @staticmethod
     def summarise_gvcf_outputs(strain_parsed_vcf_dict):
         """
@@ -484,27 +1034,36 @@ class VSNPTreeMethods(object):
         return defining_snp_dict
 
     @staticmethod
-    def load_gvcf_snp_positions(strain_parsed_vcf_dict, strain_consolidated_ref_dict):
+    def load_gvcf_snp_positions(strain_parsed_vcf_dict, strain_consolidated_ref_dict, reference_fasta_dict=None):
         """
         Parse the gVCF files, and extract all the query and reference genome-specific SNP locations as well as the
-        reference sequence
+        reference sequence. The reference sequence is read from the reference genome FASTA file if it is available,
+        otherwise the REF base of the gVCF records is used
         :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
         :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param reference_fasta_dict: type DICT: Dictionary of reference name: absolute path to reference genome FASTA
+        file
         :return: consolidated_ref_snp_positions: Dictionary of reference name: reference chromosome: pos: ref sequence
         :return: ref_snp_positions: Dictionary of reference chromosome name: absolute position: reference base call
         :return: strain_snp_positions: Dictionary of strain name: reference chromosome: list of strain-specific
         SNP positions
         """
+        reference_fasta_dict = reference_fasta_dict if reference_fasta_dict is not None else dict()
         # Initialise dictionaries to store the SNP positions
         consolidated_ref_snp_positions = dict()
         strain_snp_positions = dict()
         ref_snp_positions = dict()
+        # Dictionary of reference name: reference chromosome: set of positions to look up in the reference genome
+        ref_position_dict = dict()
         for strain_name, ref_dict in strain_parsed_vcf_dict.items():
             best_ref = strain_consolidated_ref_dict[strain_name]
+            # Determine whether the reference sequence is to be read from the reference genome
+            from_fasta = best_ref in reference_fasta_dict
             strain_snp_positions[strain_name] = dict()
             # Initialise the reference genome key as required
             if best_ref not in consolidated_ref_snp_positions:
                 consolidated_ref_snp_positions[best_ref] = dict()
+                ref_position_dict[best_ref] = dict()
             # Iterate through all the positions
             for ref_chrom, vcf_dict in ref_dict.items():
                 for pos, pos_dict in vcf_dict.items():
@@ -515,14 +1074,131 @@ class VSNPTreeMethods(object):
                         strain_snp_positions[strain_name][chrom] = list()
                     if chrom not in consolidated_ref_snp_positions[best_ref]:
                         consolidated_ref_snp_positions[best_ref][chrom] = dict()
+                        ref_position_dict[best_ref][chrom] = set()
                     # Only consider locations that are called 'PASS' in the dictionary
                     if pos_dict['FILTER'] == 'PASS':
-                        # Populate the dictionary with the position and the reference sequence at that position
-                        consolidated_ref_snp_positions[best_ref][chrom][pos] = pos_dict['REF']
-                        ref_snp_positions[chrom][pos] = pos_dict['REF']
+                        if from_fasta:
+                            # Only record the position. The sequence is extracted in a single batch below
+                            ref_position_dict[best_ref][chrom].add(pos)
+                        else:
+                            # Populate the dictionary with the position and the reference sequence at that position
+                            consolidated_ref_snp_positions[best_ref][chrom][pos] = pos_dict['REF']
+                            ref_snp_positions[chrom][pos] = pos_dict['REF']
                         strain_snp_positions[strain_name][chrom].append(pos)
+        # Extract the reference sequence at all the SNP positions from the reference genome FASTA files
+        for best_ref, position_dict in ref_position_dict.items():
+            if best_ref in reference_fasta_dict:
+                ref_base_dict = VSNPTreeMethods.reference_bases(reference_fasta=reference_fasta_dict[best_ref],
+                                                                position_dict=position_dict)
+                for chrom, base_dict in ref_base_dict.items():
+                    consolidated_ref_snp_positions[best_ref][chrom].update(base_dict)
+                    ref_snp_positions[chrom].update(base_dict)
         return consolidated_ref_snp_positions, strain_snp_positions, ref_snp_positions
 
+    @staticmethod
+    def reference_fasta_files(strain_consolidated_ref_dict, strain_best_ref_fasta_dict, reference_link_dict,
+                              dependency_path):
+        """
+        Find the reference genome FASTA file of each consolidated reference genome in the dependency folder
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param strain_best_ref_fasta_dict: type DICT: Dictionary of strain name: closest reference genome FASTA file
+        :param reference_link_dict: type DICT: Dictionary of reference file name: relative path to reference file
+        :param dependency_path: type STR: Absolute path to dependency folder
+        :return: reference_fasta_dict: Dictionary of reference name: absolute path to reference genome FASTA file.
+        References without a FASTA file in the dependency folder are not included
+        """
+        # Initialise a dictionary to store the path to the reference genome FASTA files
+        reference_fasta_dict = dict()
+        for strain_name, best_ref in strain_consolidated_ref_dict.items():
+            try:
+                reference_fasta = os.path.join(dependency_path,
+                                               reference_link_dict[strain_best_ref_fasta_dict[strain_name]])
+            except KeyError:
+                continue
+            # Only the index of some reference genomes is included in the dependencies
+            if os.path.isfile(reference_fasta):
+                reference_fasta_dict[best_ref] = reference_fasta
+        return reference_fasta_dict
+
+    @staticmethod
+    def load_fasta_index(reference_fasta):
+        """
+        Load the samtools faidx-formatted index of a FASTA file. If the index does not exist, create it
+        :param reference_fasta: type STR: Absolute path to FASTA file
+        :return: fasta_index_dict: Dictionary of contig name: (contig length, offset of the first base, bases per line,
+        bytes per line)
+        """
+        # Initialise a dictionary to store the index
+        fasta_index_dict = dict()
+        fasta_index = reference_fasta + '.fai'
+        if os.path.isfile(fasta_index):
+            with open(fasta_index, 'r') as index:
+                for line in index:
+                    contig, length, offset, line_bases, line_width = line.rstrip().split('\t')[:5]
+                    fasta_index_dict[contig] = (int(length), int(offset), int(line_bases), int(line_width))
+            return fasta_index_dict
+        # Scan the FASTA file to determine the length and layout of each contig
+        with open(reference_fasta, 'rb') as fasta:
+            contig = None
+            offset = 0
+            for line in fasta:
+                offset += len(line)
+                if line.startswith(b'>'):
+                    # The contig name is the first word of the header
+                    contig = line[1:].split()[0].decode()
+                    # The length of the contig, the offset of the first base, and the line lengths are set below
+                    fasta_index_dict[contig] = [0, offset, 0, 0]
+                elif contig is not None:
+                    # The first sequence line of the contig sets the number of bases and bytes per line
+                    if not fasta_index_dict[contig][2]:
+                        fasta_index_dict[contig][2] = len(line.rstrip())
+                        fasta_index_dict[contig][3] = len(line)
+                    fasta_index_dict[contig][0] += len(line.rstrip())
+        fasta_index_dict = {contig: tuple(index) for contig, index in fasta_index_dict.items()}
+        # Write the index, so that the file does not have to be scanned again. The dependency folder may not be
+        # writable, in which case the index is simply recreated next time
+        try:
+            with open(fasta_index, 'w') as index:
+                for contig, (length, offset, line_bases, line_width) in fasta_index_dict.items():
+                    index.write('{contig}\t{length}\t{offset}\t{line_bases}\t{line_width}\n'
+                                .format(contig=contig,
+                                        length=length,
+                                        offset=offset,
+                                        line_bases=line_bases,
+                                        line_width=line_width))
+        except OSError:
+            pass
+        return fasta_index_dict
+
+    @staticmethod
+    def reference_bases(reference_fasta, position_dict):
+        """
+        Extract the reference genome sequence at the supplied positions. The FASTA file is memory-mapped, and the
+        location of each base is calculated from the FASTA index, so the genome is never loaded into memory
+        :param reference_fasta: type STR: Absolute path to reference genome FASTA file
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of positions
+        :return: ref_base_dict: Dictionary of reference chromosome: position: upper case reference base
+        """
+        # Initialise a dictionary to store the reference bases
+        ref_base_dict = dict()
+        fasta_index_dict = VSNPTreeMethods.load_fasta_index(reference_fasta=reference_fasta)
+        with open(reference_fasta, 'rb') as fasta:
+            with closing(mmap.mmap(fasta.fileno(), 0, access=mmap.ACCESS_READ)) as genome:
+                for chrom, sorted_positions in VSNPTreeMethods.sort_positions(position_dict=position_dict).items():
+                    ref_base_dict[chrom] = dict()
+                    # Chromosomes absent from the reference genome have no bases to extract
+                    if chrom not in fasta_index_dict:
+                        continue
+                    length, offset, line_bases, line_width = fasta_index_dict[chrom]
+                    # Visit the positions in order, so that the pages of the file are read sequentially
+                    for pos in sorted_positions:
+                        if 0 < pos <= length:
+                            # Convert the one-based position to the byte offset, accounting for the line breaks
+                            line, column = divmod(pos - 1, line_bases)
+                            base_offset = offset + line * line_width + column
+                            ref_base_dict[chrom][pos] = chr(genome[base_offset]).upper()
+        return ref_base_dict
+
     @staticmethod
     def determine_groups(strain_snp_positions, defining_snp_dict):
         """
@@ -622,6 +1298,27 @@ class VSNPTreeMethods(object):
                             filtered_group_positions[species][group][ref_chrom].add(pos)
         return filtered_group_positions
 
+    @staticmethod
+    def species_snp_positions(group_positions_set):
+        """
+        Combine the group-specific SNP positions of each species
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        group-specific SNP positions
+        :return: species_positions: Dictionary of species code: reference chromosome: set of SNP positions of all
+        the groups in the species
+        """
+        # Initialise a dictionary to store the species-specific positions
+        species_positions = dict()
+        for species, group_dict in group_positions_set.items():
+            species_positions[species] = dict()
+            for group, ref_dict in group_dict.items():
+                for ref_chrom, pos_set in ref_dict.items():
+                    # Initialise the reference chromosome key as required
+                    if ref_chrom not in species_positions[species]:
+                        species_positions[species][ref_chrom] = set()
+                    species_positions[species][ref_chrom].update(pos_set)
+        return species_positions
+
     @staticmethod
     def load_snp_sequence(strain_parsed_vcf_dict, strain_consolidated_ref_dict, group_positions_set, strain_groups,
                           strain_species_dict, consolidated_ref_snp_positions):
@@ -687,6 +1384,10 @@ class VSNPTreeMethods(object):
                     if ref_chrom not in group_strain_snp_sequence[species][group][best_ref]:
                         group_strain_snp_sequence[species][group][best_ref][ref_chrom] = dict()
                         write_ref = True
+                    # Initialise the reference chromosome key before iterating through the positions, otherwise
+                    # reference calls preceding the first gVCF record of the strain would be dropped
+                    if ref_chrom not in group_strain_snp_sequence[species][group][strain_name]:
+                        group_strain_snp_sequence[species][group][strain_name][ref_chrom] = dict()
                     for pos in sorted(position_set):
                         # Include the reference position if necessary
                         if write_ref:
@@ -816,7 +1517,206 @@ class VSNPTreeMethods(object):
         return non_ident_group_snp_seq, non_ident_group_positions
 
     @staticmethod
-    def create_multifasta(group_strain_snp_sequence, fasta_path, group_positions_set, nested=True):
+    def load_group_snp_sequences(strain_parsed_vcf_dict, strain_consolidated_ref_dict, group_positions_set,
+                                 strain_groups, strain_species_dict, consolidated_ref_snp_positions, threads,
+                                 pool=None):
+        """
+        Determine the sequence of every strain at the SNP positions of every group, and remove the positions that are
+        identical in all the strains of a group. The sequence of each strain is determined once per species, at the
+        SNP positions of all the groups of the species, and the alignment of each group is sliced from these
+        sequences. Both the strain sequences (in chunks of strains) and the groups are processed concurrently
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        group-specific SNP positions
+        :param strain_groups: type DICT: Dictionary of strain name: list of group(s) for which the strain contains the
+        defining SNP
+        :param strain_species_dict: type DICT: Dictionary of strain name: species code
+        :param consolidated_ref_snp_positions: type DICT: Dictionary of reference name: absolute position: reference
+        base call
+        :param threads: type INT: Number of processes to run concurrently
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for this stage
+        :return: non_ident_group_snp_seq: Dictionary of species: group: strain name: reference chromosome:
+        position: sequence for positions that are not identical in all strains
+        :return: species_group_best_ref: Dictionary of species code: group name; best ref
+        :return: non_ident_group_positions: Dictionary of species: group: reference chromosome: set of non-identical
+        positions
+        """
+        # Initialise dictionaries to store the outputs
+        non_ident_group_snp_seq = dict()
+        species_group_best_ref = dict()
+        non_ident_group_positions = dict()
+        species_positions = VSNPTreeMethods.species_snp_positions(group_positions_set=group_positions_set)
+        # Split the strains of each species into chunks, so that the sequences are determined concurrently
+        row_args = list()
+        for species, position_dict in species_positions.items():
+            species_strains = [strain_name for strain_name in strain_parsed_vcf_dict
+                               if strain_species_dict[strain_name] == species]
+            num_chunks = max(1, min(threads, len(species_strains)))
+            for chunk in range(num_chunks):
+                row_args.append(VSNPTreeMethods.strain_snp_sequence_args(
+                    species=species,
+                    strain_list=species_strains[chunk::num_chunks],
+                    strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                    strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                    position_dict=position_dict,
+                    consolidated_ref_snp_positions=consolidated_ref_snp_positions))
+        # Sending a single task to a worker has no benefit
+        use_pool = len(row_args) > 1 or sum(len(group_dict) for group_dict in group_positions_set.values()) > 1
+        with PoolMethods.worker_pool(threads=threads, pool=pool) if use_pool else ExitStack() as p:
+            # Dictionary of species: strain name: reference chromosome: position: sequence
+            species_rows = {species: dict() for species in species_positions}
+            row_outputs = p.imap(VSNPTreeMethods.strain_snp_sequence, row_args) if use_pool \
+                else map(VSNPTreeMethods.strain_snp_sequence, row_args)
+            for species, strain_rows in row_outputs:
+                species_rows[species].update(strain_rows)
+            # Slice the alignment of each group from the strain sequences of its species
+            group_args = list()
+            for species, group_dict in group_positions_set.items():
+                for group, ref_dict in group_dict.items():
+                    # Only the member strains of the group, in the original order, are included
+                    group_strains = [strain_name for strain_name in strain_parsed_vcf_dict
+                                     if strain_species_dict[strain_name] == species and
+                                     group in strain_groups[strain_name]]
+                    # Groups without any member strains are not included in the outputs
+                    if not group_strains:
+                        continue
+                    group_snp_seq = VSNPTreeMethods.slice_group_snp_sequence(
+                        strain_rows=species_rows[species],
+                        group_strains=group_strains,
+                        strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                        group_positions=ref_dict,
+                        consolidated_ref_snp_positions=consolidated_ref_snp_positions)
+                    if species not in species_group_best_ref:
+                        species_group_best_ref[species] = dict()
+                    # The best reference of the group is that of its first strain
+                    species_group_best_ref[species][group] = strain_consolidated_ref_dict[group_strains[0]]
+                    group_args.append((species, group, group_snp_seq,
+                                       {strain_consolidated_ref_dict[strain_name] for strain_name in group_strains}))
+            # Release the strain sequences, as the group alignments have been created
+            species_rows.clear()
+            group_outputs = p.imap(VSNPTreeMethods.group_identical_calls, group_args) if use_pool \
+                else map(VSNPTreeMethods.group_identical_calls, group_args)
+            for species, group, group_snp_seq, group_positions in group_outputs:
+                if species not in non_ident_group_snp_seq:
+                    non_ident_group_snp_seq[species] = dict()
+                    non_ident_group_positions[species] = dict()
+                non_ident_group_snp_seq[species][group] = group_snp_seq
+                non_ident_group_positions[species][group] = group_positions
+        return non_ident_group_snp_seq, species_group_best_ref, non_ident_group_positions
+
+    @staticmethod
+    def strain_snp_sequence_args(species, strain_list, strain_parsed_vcf_dict, strain_consolidated_ref_dict,
+                                 position_dict, consolidated_ref_snp_positions):
+        """
+        Extract the subset of the project-wide dictionaries required to determine the sequence of a chunk of strains
+        :param species: type STR: Species code
+        :param strain_list: type LIST: Names of the strains in the chunk
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param position_dict: type DICT: Dictionary of reference chromosome: set of SNP positions of the species
+        :param consolidated_ref_snp_positions: type DICT: Dictionary of reference name: absolute position: reference
+        base call
+        :return: row_args: Tuple of species, dictionary of strain name: reference chromosome: position: parsed VCF
+        dictionary at the species positions, dictionary of strain name: reference genome name, dictionary of
+        reference chromosome: set of species positions, dictionary of reference name: reference chromosome:
+        position: reference base at the species positions
+        """
+        chunk_vcf_dict = dict()
+        for strain_name in strain_list:
+            chunk_vcf_dict[strain_name] = dict()
+            for ref_chrom, vcf_dict in strain_parsed_vcf_dict[strain_name].items():
+                # Only the calls at the species positions are required
+                positions = position_dict.get(ref_chrom, set())
+                chunk_vcf_dict[strain_name][ref_chrom] = {pos: pos_dict for pos, pos_dict in vcf_dict.items()
+                                                          if pos in positions}
+        chunk_ref_dict = {strain_name: strain_consolidated_ref_dict[strain_name] for strain_name in strain_list}
+        chunk_ref_snp_positions = dict()
+        for best_ref in set(chunk_ref_dict.values()):
+            chunk_ref_snp_positions[best_ref] = dict()
+            for ref_chrom, base_dict in consolidated_ref_snp_positions[best_ref].items():
+                positions = position_dict.get(ref_chrom, set())
+                chunk_ref_snp_positions[best_ref][ref_chrom] = {pos: base for pos, base in base_dict.items()
+                                                                if pos in positions}
+        return species, chunk_vcf_dict, chunk_ref_dict, position_dict, chunk_ref_snp_positions
+
+    @staticmethod
+    def strain_snp_sequence(row_args):
+        """
+        Determine the sequence of a chunk of strains at all the SNP positions of their species
+        :param row_args: type TUPLE: Arguments of the chunk (see strain_snp_sequence_args)
+        :return: species: Species code
+        :return: strain_rows: Dictionary of strain name: reference chromosome: position: sequence
+        """
+        species, chunk_vcf_dict, chunk_ref_dict, position_dict, chunk_ref_snp_positions = row_args
+        # Treat the species as a single group containing every strain in the chunk
+        group_strain_snp_sequence = \
+            VSNPTreeMethods.load_snp_sequence(strain_parsed_vcf_dict=chunk_vcf_dict,
+                                              strain_consolidated_ref_dict=chunk_ref_dict,
+                                              group_positions_set={species: {species: position_dict}},
+                                              strain_groups={strain_name: [species] for strain_name in chunk_vcf_dict},
+                                              strain_species_dict={strain_name: species
+                                                                   for strain_name in chunk_vcf_dict},
+                                              consolidated_ref_snp_positions=chunk_ref_snp_positions)[0]
+        # The reference sequences are added to the group alignments when they are sliced
+        strain_rows = {strain_name: group_strain_snp_sequence[species][species][strain_name]
+                       for strain_name in chunk_vcf_dict}
+        return species, strain_rows
+
+    @staticmethod
+    def slice_group_snp_sequence(strain_rows, group_strains, strain_consolidated_ref_dict, group_positions,
+                                 consolidated_ref_snp_positions):
+        """
+        Create the alignment of a group from the rows of its member strains, and the columns of its SNP positions. The
+        reference genome of each strain follows the first strain that uses it, as in load_snp_sequence
+        :param strain_rows: type DICT: Dictionary of strain name: reference chromosome: position: sequence at all the
+        SNP positions of the species
+        :param group_strains: type LIST: Ordered list of the member strains of the group
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param group_positions: type DICT: Dictionary of reference chromosome: set of group-specific SNP positions
+        :param consolidated_ref_snp_positions: type DICT: Dictionary of reference name: absolute position: reference
+        base call
+        :return: group_snp_seq: Dictionary of strain name: reference chromosome: position: sequence
+        """
+        group_snp_seq = dict()
+        # Sort the positions once, rather than once per strain
+        sorted_position_dict = {ref_chrom: sorted(position_set) for ref_chrom, position_set in group_positions.items()}
+        for strain_name in group_strains:
+            group_snp_seq[strain_name] = dict()
+            best_ref = strain_consolidated_ref_dict[strain_name]
+            add_ref = best_ref not in group_snp_seq
+            if add_ref:
+                group_snp_seq[best_ref] = dict()
+            for ref_chrom, sorted_positions in sorted_position_dict.items():
+                strain_row = strain_rows[strain_name].get(ref_chrom, dict())
+                # Positions without a sequence are not included in the alignment
+                group_snp_seq[strain_name][ref_chrom] = {pos: strain_row[pos] for pos in sorted_positions
+                                                         if pos in strain_row}
+                if add_ref:
+                    group_snp_seq[best_ref][ref_chrom] = {pos: consolidated_ref_snp_positions[best_ref][ref_chrom][pos]
+                                                          for pos in sorted_positions}
+        return group_snp_seq
+
+    @staticmethod
+    def group_identical_calls(group_args):
+        """
+        Remove the positions that are identical in all the strains of a single group
+        :param group_args: type TUPLE: Species code, group name, dictionary of strain name: reference chromosome:
+        position: sequence, set of the names of the reference genomes included in the alignment
+        :return: species: Species code
+        :return: group: Group name
+        :return: group_snp_seq: Dictionary of strain name: reference chromosome: position: sequence
+        :return: group_positions: Dictionary of reference chromosome: set of non-identical positions
+        """
+        species, group, group_snp_seq, best_refs = group_args
+        non_ident_group_snp_seq, non_ident_group_positions = \
+            VSNPTreeMethods.remove_identical_calls(group_strain_snp_sequence={species: {group: group_snp_seq}},
+                                                   consolidated_ref_snp_positions=dict.fromkeys(best_refs))
+        return species, group, non_ident_group_snp_seq[species][group], non_ident_group_positions[species][group]
+
+    @staticmethod
+    def create_multifasta(group_strain_snp_sequence, fasta_path, group_positions_set, nested=True, clear_path=True):
         """
         Create a multiple sequence alignment in FASTA format for each group from all the SNP positions for the group
         :param group_strain_snp_sequence: type DICT: Dictionary of species: group: strain name: reference chromosome:
@@ -826,6 +1726,8 @@ class VSNPTreeMethods(object):
         group-specific SNP positions
         :param nested: type BOOL: Boolean on whether the multi-FASTA files should be created in the normal directory
         structure, or within the fasta_path
+        :param clear_path: type BOOL: Boolean on whether the whole fasta_path is cleared before creating the files.
+        Otherwise, only the outputs of the groups being processed are cleared
         :return: group_fasta_dict: Dictionary of species code: group name: FASTA file created for the group
         :return: group_folders: Set of absolute paths to folders for each group
         :return: species_folders: Set of absolute path to folders for each species
@@ -836,10 +1738,11 @@ class VSNPTreeMethods(object):
         species_folders = set()
         # Clear out the fasta_path to ensure that no previously processed FASTA files are present, as new outputs will
         # be appended to the old outputs
-        try:
-            shutil.rmtree(fasta_path)
-        except FileNotFoundError:
-            pass
+        if clear_path:
+            try:
+                shutil.rmtree(fasta_path)
+            except FileNotFoundError:
+                pass
         for species, group_dict in group_strain_snp_sequence.items():
             # Initialise the species key
             group_fasta_dict[species] = dict()
@@ -851,6 +1754,18 @@ class VSNPTreeMethods(object):
                     output_dir = os.path.join(fasta_path, species, group)
                 else:
                     output_dir = fasta_path
+                # Clear out only the previous outputs of this group if the fasta_path was not cleared
+                if not clear_path:
+                    if nested:
+                        try:
+                            shutil.rmtree(output_dir)
+                        except FileNotFoundError:
+                            pass
+                    else:
+                        try:
+                            os.remove(os.path.join(output_dir, '{group}_alignment.fasta'.format(group=group)))
+                        except FileNotFoundError:
+                            pass
                 make_path(output_dir)
                 # Add the group-specific folder to the set of all group folders
                 group_folders.add(output_dir)
@@ -880,6 +1795,354 @@ class VSNPTreeMethods(object):
                     group_fasta_dict[species][group] = group_fasta
         return group_folders, species_folders, group_fasta_dict
 
+    @staticmethod
+    def encode_alignment(group_snp_seq, group_positions):
+        """
+        Encode the sequences of a group as a matrix of the ASCII codes of the bases in the multi-FASTA alignment.
+        Positions without a sequence are encoded as '-', as in create_multifasta
+        :param group_snp_seq: type DICT: Dictionary of strain name: reference chromosome: position: sequence
+        :param group_positions: type DICT: Dictionary of reference chromosome: set of group-specific SNP positions
+        :return: strain_list: List of strain names in the order of the rows of the matrix
+        :return: alignment: numpy.ndarray of shape (strains, positions) of type uint8
+        """
+        # Sort the positions once, rather than once per strain
+        sorted_position_dict = {ref_chrom: sorted(position_set) for ref_chrom, position_set in group_positions.items()}
+        strain_list = list(group_snp_seq)
+        alignment = numpy.zeros((len(strain_list), sum(len(positions) for positions in sorted_position_dict.values())),
+                                dtype=numpy.uint8)
+        for row, strain_name in enumerate(strain_list):
+            chrom_dict = group_snp_seq[strain_name]
+            strain_group_seq = str()
+            for ref_chrom, sorted_positions in sorted_position_dict.items():
+                sequence_dict = chrom_dict.get(ref_chrom, dict())
+                strain_group_seq += ''.join(sequence_dict.get(pos, '-') for pos in sorted_positions)
+            alignment[row] = numpy.frombuffer(strain_group_seq.encode('ascii'), dtype=numpy.uint8)
+        return strain_list, alignment
+
+    @staticmethod
+    def snp_distance_matrix(alignment, gap_mode='ignore', ambiguity_mode='ignore', block_size=1024, rows=None):
+        """
+        Calculate the number of SNPs between every pair of strains in an encoded alignment. The number of positions at
+        which two strains share a base is the product of the base indicator matrices, so the distances of all the
+        pairs are calculated with matrix multiplications rather than by comparing each pair in turn
+        :param alignment: type numpy.ndarray: Encoded alignment of shape (strains, positions) from encode_alignment
+        :param gap_mode: type STR: 'ignore' to skip positions at which either strain has a '-', or 'count' to treat '-'
+        as a fifth base
+        :param ambiguity_mode: type STR: 'ignore' to skip positions at which either strain has an IUPAC ambiguity code,
+        or 'count' to treat each ambiguity code as a distinct base
+        :param block_size: type INT: Number of positions to process at a time, which bounds the size of the indicator
+        matrices
+        :param rows: type LIST: Rows of the alignment for which the distances to every strain are to be calculated. If
+        not supplied, the distances between all the strains are calculated
+        :return: distances: numpy.ndarray of shape (rows, strains) of the number of SNPs between each pair of strains
+        :return: compared: numpy.ndarray of shape (rows, strains) of the number of positions compared for each pair
+        """
+        if gap_mode not in ('ignore', 'count'):
+            raise ValueError('Unsupported gap mode: {mode}'.format(mode=gap_mode))
+        if ambiguity_mode not in ('ignore', 'count'):
+            raise ValueError('Unsupported ambiguity mode: {mode}'.format(mode=ambiguity_mode))
+        num_strains = alignment.shape[0]
+        # Selecting every row with a slice avoids copying the indicator matrices
+        rows = slice(None) if rows is None else list(rows)
+        shape = (num_strains if isinstance(rows, slice) else len(rows), num_strains)
+        distances = numpy.zeros(shape, dtype=numpy.int64)
+        compared = numpy.zeros(shape, dtype=numpy.int64)
+        bases = set(b'ACGT')
+        for start in range(0, alignment.shape[1], block_size):
+            block = alignment[:, start:start + block_size]
+            # Determine which of the codes in this block are compared
+            block_codes = numpy.unique(block).tolist()
+            codes = [code for code in block_codes
+                     if code in bases or
+                     (code == ord('-') and gap_mode == 'count') or
+                     (code not in bases and code != ord('-') and ambiguity_mode == 'count')]
+            # Counts within a block are exact in float32, and the BLAS matrix multiplication is much faster than
+            # integer products
+            block_matches = numpy.zeros(shape, dtype=numpy.float32)
+            valid = numpy.zeros(block.shape, dtype=numpy.float32)
+            for code in codes:
+                indicator = (block == code).astype(numpy.float32)
+                # Strains that share the code at a position match at that position
+                block_matches += indicator[rows] @ indicator.T
+                valid += indicator
+            # Positions are compared only if both strains have a code that is compared. When every code is compared,
+            # every pair is compared at every position of the block
+            if len(codes) == len(block_codes):
+                block_compared = numpy.full(shape, block.shape[1], dtype=numpy.int64)
+            else:
+                block_compared = numpy.rint(valid[rows] @ valid.T).astype(numpy.int64)
+            compared += block_compared
+            distances += block_compared - numpy.rint(block_matches).astype(numpy.int64)
+        return distances, compared
+
+    @staticmethod
+    def create_distance_matrices(group_strain_snp_sequence, group_positions_set, distance_path, gap_mode='ignore',
+                                 ambiguity_mode='ignore'):
+        """
+        Create a pairwise SNP distance matrix for each group as both a tab-delimited file and a compressed NumPy file.
+        The NumPy file contains the strain names, the distances, and the number of positions compared for each pair
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name: reference
+        chromosome: position: sequence
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        group-specific SNP positions
+        :param distance_path: type STR: Absolute path to folder in which the distance matrices are to be created
+        :param gap_mode: type STR: Handling of '-' (see snp_distance_matrix)
+        :param ambiguity_mode: type STR: Handling of IUPAC ambiguity codes (see snp_distance_matrix)
+        :return: species_group_distances: Dictionary of species code: group name: dictionary of file type: absolute
+        path to distance matrix
+        """
+        # Initialise a dictionary to store the absolute paths of the distance matrices
+        species_group_distances = dict()
+        make_path(distance_path)
+        for species, group_dict in group_strain_snp_sequence.items():
+            species_group_distances[species] = dict()
+            for group, group_snp_seq in group_dict.items():
+                strain_list, alignment = \
+                    VSNPTreeMethods.encode_alignment(group_snp_seq=group_snp_seq,
+                                                     group_positions=group_positions_set[species][group])
+                distances, compared = VSNPTreeMethods.snp_distance_matrix(alignment=alignment,
+                                                                          gap_mode=gap_mode,
+                                                                          ambiguity_mode=ambiguity_mode)
+                basename = os.path.join(distance_path, '{species}_{group}_snp_distances'.format(species=species,
+                                                                                                group=group))
+                distance_table = basename + '.tsv'
+                pandas.DataFrame(distances, index=strain_list, columns=strain_list)\
+                    .to_csv(distance_table, sep='\t', index_label='Strain')
+                distance_array = basename + '.npz'
+                numpy.savez_compressed(distance_array,
+                                       strains=numpy.array(strain_list),
+                                       distances=distances,
+                                       compared=compared)
+                species_group_distances[species][group] = {'tsv': distance_table,
+                                                           'npz': distance_array}
+        return species_group_distances
+
+    @staticmethod
+    def load_cluster_state(cluster_file, thresholds, gap_mode='ignore', ambiguity_mode='ignore'):
+        """
+        Load the SNP cluster assignments of a group from a previous run. A new state is returned if there is no previous
+        run, or if the previous run used different thresholds or distance settings
+        :param cluster_file: type STR: Absolute path to JSON file of the cluster state
+        :param thresholds: type LIST: SNP thresholds at which the clusters are created
+        :param gap_mode: type STR: Handling of '-' (see snp_distance_matrix)
+        :param ambiguity_mode: type STR: Handling of IUPAC ambiguity codes (see snp_distance_matrix)
+        :return: cluster_state: Dictionary of 'thresholds': list of thresholds, 'gap_mode', 'ambiguity_mode',
+        'strains': list of clustered strains, 'parents': dictionary of threshold: list of the union-find parent of
+        each strain
+        """
+        thresholds = sorted(set(int(threshold) for threshold in thresholds))
+        new_state = {'thresholds': thresholds,
+                     'gap_mode': gap_mode,
+                     'ambiguity_mode': ambiguity_mode,
+                     'strains': list(),
+                     'parents': {str(threshold): list() for threshold in thresholds}}
+        try:
+            with open(cluster_file, 'r') as cluster_json:
+                cluster_state = json.load(cluster_json)
+        except FileNotFoundError:
+            return new_state
+        # The previous assignments cannot be re-used if the clusters were defined differently
+        if cluster_state.get('thresholds') != thresholds or cluster_state.get('gap_mode') != gap_mode or \
+                cluster_state.get('ambiguity_mode') != ambiguity_mode:
+            return new_state
+        return cluster_state
+
+    @staticmethod
+    def find_cluster_root(parents, node):
+        """
+        Find the root of the cluster of a strain in a union-find forest, halving the path to the root along the way
+        :param parents: type LIST: Union-find parent of each strain
+        :param node: type INT: Index of the strain
+        :return: node: Index of the root of the cluster
+        """
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    @staticmethod
+    def update_clusters(cluster_state, strain_list, alignment):
+        """
+        Add strains to single-linkage SNP clusters. Only the distances between the new strains and all the strains are
+        calculated, and each new strain is joined to the clusters of the strains within each threshold. If any
+        previously clustered strain is no longer present, all the strains are clustered again
+        :param cluster_state: type DICT: Cluster state loaded with load_cluster_state
+        :param strain_list: type LIST: Names of the strains to cluster, in the order of the rows of the alignment
+        :param alignment: type numpy.ndarray: Encoded alignment of the strains from encode_alignment
+        :return: cluster_state: Updated cluster state
+        :return: metrics: Dictionary of metric: value for the update
+        """
+        start = time.perf_counter()
+        row_dict = {strain_name: row for row, strain_name in enumerate(strain_list)}
+        if not all(strain_name in row_dict for strain_name in cluster_state['strains']):
+            cluster_state['strains'] = list()
+            cluster_state['parents'] = {threshold: list() for threshold in cluster_state['parents']}
+        num_existing = len(cluster_state['strains'])
+        clustered_strains = set(cluster_state['strains'])
+        new_strains = [strain_name for strain_name in strain_list if strain_name not in clustered_strains]
+        cluster_state['strains'].extend(new_strains)
+        # Re-order the alignment rows to match the order of the clustered strains
+        order = [row_dict[strain_name] for strain_name in cluster_state['strains']]
+        distances = VSNPTreeMethods.snp_distance_matrix(alignment=alignment[order],
+                                                        gap_mode=cluster_state['gap_mode'],
+                                                        ambiguity_mode=cluster_state['ambiguity_mode'],
+                                                        rows=range(num_existing, len(order)))[0]
+        distance_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for threshold, parents in cluster_state['parents'].items():
+            # Each new strain starts in its own cluster
+            parents.extend(range(num_existing, len(order)))
+            for offset, distance_row in enumerate(distances):
+                new_row = num_existing + offset
+                # Only the strains preceding the new strain are considered, so each pair is joined once
+                for row in numpy.flatnonzero(distance_row[:new_row] <= int(threshold)).tolist():
+                    root = VSNPTreeMethods.find_cluster_root(parents=parents, node=row)
+                    new_root = VSNPTreeMethods.find_cluster_root(parents=parents, node=new_row)
+                    if root != new_root:
+                        # The earlier strain is always the root, so the cluster names are stable between runs
+                        parents[max(root, new_root)] = min(root, new_root)
+        metrics = {'strains': len(order),
+                   'new_strains': len(new_strains),
+                   'distance_seconds': round(distance_seconds, 4),
+                   'cluster_seconds': round(time.perf_counter() - start, 4)}
+        return cluster_state, metrics
+
+    @staticmethod
+    def cluster_names(parents):
+        """
+        Name the clusters of a union-find forest in the order of their first strains
+        :param parents: type LIST: Union-find parent of each strain
+        :return: names: List of the cluster number of each strain
+        """
+        root_names = dict()
+        names = list()
+        for node in range(len(parents)):
+            root = VSNPTreeMethods.find_cluster_root(parents=parents, node=node)
+            if root not in root_names:
+                root_names[root] = len(root_names) + 1
+            names.append(root_names[root])
+        return names
+
+    @staticmethod
+    def create_clusters(group_strain_snp_sequence, group_positions_set, strain_consolidated_ref_dict, thresholds,
+                        cluster_path, gap_mode='ignore', ambiguity_mode='ignore'):
+        """
+        Update the single-linkage SNP clusters of the strains in each group, and write the cluster assignments. The
+        cluster state of each group is stored, so that subsequent runs only calculate the distances of new strains
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name: reference
+        chromosome: position: sequence
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        group-specific SNP positions
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param thresholds: type LIST: SNP thresholds at which the clusters are created
+        :param cluster_path: type STR: Absolute path to folder in which the cluster assignments are to be created
+        :param gap_mode: type STR: Handling of '-' (see snp_distance_matrix)
+        :param ambiguity_mode: type STR: Handling of IUPAC ambiguity codes (see snp_distance_matrix)
+        :return: species_group_clusters: Dictionary of species code: group name: absolute path to cluster assignments
+        :return: species_group_metrics: Dictionary of species code: group name: dictionary of metric: value of the
+        cluster update
+        """
+        # Initialise dictionaries to store the absolute paths of the cluster assignments, and the update metrics
+        species_group_clusters = dict()
+        species_group_metrics = dict()
+        make_path(cluster_path)
+        # The reference genomes are not clustered
+        best_refs = set(strain_consolidated_ref_dict.values())
+        for species, group_dict in group_strain_snp_sequence.items():
+            species_group_clusters[species] = dict()
+            species_group_metrics[species] = dict()
+            for group, group_snp_seq in group_dict.items():
+                basename = os.path.join(cluster_path, '{species}_{group}_clusters'.format(species=species,
+                                                                                          group=group))
+                cluster_state = VSNPTreeMethods.load_cluster_state(cluster_file=basename + '.json',
+                                                                   thresholds=thresholds,
+                                                                   gap_mode=gap_mode,
+                                                                   ambiguity_mode=ambiguity_mode)
+                strain_list, alignment = \
+                    VSNPTreeMethods.encode_alignment(group_snp_seq={strain_name: chrom_dict for strain_name, chrom_dict
+                                                                    in group_snp_seq.items()
+                                                                    if strain_name not in best_refs},
+                                                     group_positions=group_positions_set[species][group])
+                cluster_state, metrics = VSNPTreeMethods.update_clusters(cluster_state=cluster_state,
+                                                                         strain_list=strain_list,
+                                                                         alignment=alignment)
+                cluster_state['metrics'] = metrics
+                species_group_metrics[species][group] = metrics
+                # Write the cluster assignments of the strains present in this run
+                cluster_table = basename + '.tsv'
+                names = {threshold: VSNPTreeMethods.cluster_names(parents=parents)
+                         for threshold, parents in cluster_state['parents'].items()}
+                with open(cluster_table, 'w') as cluster_tsv:
+                    cluster_tsv.write('\t'.join(['Strain'] + ['Cluster_{threshold}SNPs'.format(threshold=threshold)
+                                                              for threshold in names]) + '\n')
+                    for row, strain_name in enumerate(cluster_state['strains']):
+                        cluster_tsv.write('\t'.join([strain_name] + [str(name_list[row])
+                                                                     for name_list in names.values()]) + '\n')
+                # Replace the state of the previous run only once it is completely written
+                temp_file = basename + '.json.tmp'
+                with open(temp_file, 'w') as cluster_json:
+                    json.dump(cluster_state, cluster_json)
+                os.replace(temp_file, basename + '.json')
+                species_group_clusters[species][group] = cluster_table
+        return species_group_clusters, species_group_metrics
+
+    @staticmethod
+    def collapse_identical_sequences(group_fasta_dict, strain_consolidated_ref_dict, min_sequences=4):
+        """
+        Remove the duplicate sequences from each group alignment, so that the phylogenetic trees are created from the
+        unique SNP profiles. The de-duplicated alignments are created in the 'collapsed' sub-folder of the folder
+        containing each alignment, and a tab-delimited file linking each strain to the strain representing its
+        profile is written next to each alignment
+        :param group_fasta_dict: type DICT: Dictionary of species code: group name: FASTA file created for the group
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param min_sequences: type INT: Minimum number of unique sequences required to collapse an alignment, as RAxML
+        requires at least four sequences. Alignments with fewer unique sequences are not collapsed
+        :return: unique_fasta_dict: Dictionary of species code: group name: de-duplicated FASTA file
+        :return: species_group_identical: Dictionary of species code: group name: representative name: list of the
+        names of the strains with the identical sequence
+        """
+        # Initialise dictionaries to store outputs
+        unique_fasta_dict = dict()
+        species_group_identical = dict()
+        # The reference genomes are used as outgroups, so they must always represent their profiles
+        best_refs = set(strain_consolidated_ref_dict.values())
+        for species, group_dict in group_fasta_dict.items():
+            unique_fasta_dict[species] = dict()
+            species_group_identical[species] = dict()
+            for group, fasta_file in group_dict.items():
+                records = list(SeqIO.parse(fasta_file, 'fasta'))
+                # Dictionary of sequence: representative record
+                profile_dict = dict()
+                for record in sorted(records, key=lambda rec: rec.id not in best_refs):
+                    profile_dict.setdefault(str(record.seq), record)
+                # Dictionary of representative name: list of strains with identical sequences
+                identical_dict = dict()
+                if len(profile_dict) >= min_sequences:
+                    for record in records:
+                        representative = profile_dict[str(record.seq)].id
+                        if record.id != representative:
+                            identical_dict.setdefault(representative, list()).append(record.id)
+                # Maintain the order of the original alignment
+                representatives = {record.id for record in profile_dict.values()}
+                unique_records = [record for record in records
+                                  if record.id in representatives or not identical_dict]
+                collapsed_dir = os.path.join(os.path.dirname(fasta_file), 'collapsed')
+                make_path(collapsed_dir)
+                unique_fasta = os.path.join(collapsed_dir, os.path.basename(fasta_file))
+                with open(unique_fasta, 'w') as fasta:
+                    SeqIO.write(unique_records, fasta, 'fasta')
+                # Write the mapping of every strain to the representative of its profile
+                mapping_file = os.path.join(os.path.dirname(fasta_file),
+                                            '{group}_identical_profiles.tsv'.format(group=group))
+                with open(mapping_file, 'w') as mapping:
+                    mapping.write('Strain\tRepresentative\n')
+                    for record in records:
+                        representative = profile_dict[str(record.seq)].id if identical_dict else record.id
+                        mapping.write('{strain}\t{rep}\n'.format(strain=record.id, rep=representative))
+                unique_fasta_dict[species][group] = unique_fasta
+                species_group_identical[species][group] = identical_dict
+        return unique_fasta_dict, species_group_identical
+
     @staticmethod
     def run_raxml(group_fasta_dict, strain_consolidated_ref_dict, strain_groups, threads, logfile):
         """
@@ -966,6 +2229,194 @@ class VSNPTreeMethods(object):
                                              logfile=logfile)
         return species_group_trees
 
+    @staticmethod
+    def expand_identical_sequences(species_group_trees, species_group_identical, group_fasta_dict):
+        """
+        Graft the strains removed by collapse_identical_sequences back onto the trees created from the de-duplicated
+        alignments. Each representative is replaced by a polytomy of zero-length branches to the representative and to
+        every strain with the identical sequence. The expanded trees are written to the folder of the original
+        alignment, with the names of the RAxML outputs
+        :param species_group_trees: type DICT: Dictionary of species code: group name: dictionary of tree type:
+        absolute path to tree created from the de-duplicated alignment
+        :param species_group_identical: type DICT: Dictionary of species code: group name: representative name: list
+        of the names of the strains with the identical sequence
+        :param group_fasta_dict: type DICT: Dictionary of species code: group name: FASTA file created for the group
+        :return: expanded_group_trees: Dictionary of species code: group name: dictionary of tree type: absolute path
+        to expanded tree
+        """
+        # Initialise a dictionary to store the absolute paths of the expanded trees
+        expanded_group_trees = dict()
+        for species, group_dict in species_group_trees.items():
+            expanded_group_trees[species] = dict()
+            for group, options_dict in group_dict.items():
+                expanded_group_trees[species][group] = dict()
+                identical_dict = species_group_identical[species][group]
+                output_dir = os.path.dirname(group_fasta_dict[species][group])
+                for tree_type, tree_file in options_dict.items():
+                    # Maintain the relative location of the tree e.g. the bootstrapping folder
+                    expanded_tree = os.path.join(output_dir,
+                                                 os.path.relpath(tree_file,
+                                                                 os.path.join(output_dir, 'collapsed')))
+                    expanded_group_trees[species][group][tree_type] = expanded_tree
+                    # Only expand the tree if the output doesn't already exist
+                    if os.path.isfile(expanded_tree):
+                        continue
+                    make_path(os.path.dirname(expanded_tree))
+                    tree = Tree(tree_file)
+                    for leaf in tree.get_leaves():
+                        if leaf.name in identical_dict:
+                            # Convert the leaf into a polytomy containing the representative and its identical strains
+                            for strain_name in [leaf.name] + identical_dict[leaf.name]:
+                                leaf.add_child(name=strain_name, dist=0)
+                            leaf.name = str()
+                    # Write the leaf names and all branch lengths
+                    tree.write(format=5, outfile=expanded_tree)
+        return expanded_group_trees
+
+    @staticmethod
+    def placement_base_tree(tree_path, species, group):
+        """
+        Find the most recent tree of a group from a previous run. This is either the RAxML best tree, or the tree
+        created by placing strains onto a previous tree
+        :param tree_path: type STR: Absolute path to folder containing the tree files of previous runs
+        :param species: type STR: Species code
+        :param group: type STR: Group name
+        :return: base_tree: Absolute path to the most recent tree, or None if there is no previous tree
+        """
+        tree_files = [tree_file for tree_file in
+                      [os.path.join(tree_path, 'RAxML_bestTree.{species}_{group}'.format(species=species, group=group)),
+                       os.path.join(tree_path, 'vSNP_placementTree.{species}_{group}'.format(species=species,
+                                                                                           group=group))]
+                      if os.path.isfile(tree_file)]
+        return max(tree_files, key=os.path.getmtime) if tree_files else None
+
+    @staticmethod
+    def state_masks(alignment):
+        """
+        Convert an encoded alignment to Fitch parsimony state sets. Each base is a bit of the set, and IUPAC ambiguity
+        codes are the sets of their bases. Gaps and unknown codes are compatible with every base
+        :param alignment: type numpy.ndarray: Encoded alignment from encode_alignment
+        :return: masks: numpy.ndarray of the same shape as the alignment of type uint8
+        """
+        base_bits = {'A': 1, 'C': 2, 'G': 4, 'T': 8}
+        codes = {'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT',
+                 'M': 'AC', 'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG'}
+        mask_table = numpy.full(256, 15, dtype=numpy.uint8)
+        for code, bases in codes.items():
+            mask_table[ord(code)] = sum(base_bits[base] for base in bases)
+        return mask_table[alignment]
+
+    @staticmethod
+    def fitch_combine(first, second):
+        """
+        Combine two Fitch parsimony state sets: the intersection of the sets where it is not empty, otherwise the union
+        :param first: type numpy.ndarray: State sets
+        :param second: type numpy.ndarray: State sets
+        :return: numpy.ndarray of the combined state sets
+        """
+        intersection = first & second
+        return numpy.where(intersection != 0, intersection, first | second)
+
+    @staticmethod
+    def place_strains(tree, strain_masks):
+        """
+        Add strains to a tree by parsimony insertion. Each strain is attached to the branch that requires the fewest
+        additional changes, using the Fitch state sets on either side of every branch. The strains are added in turn,
+        so later strains can be attached to the branches of earlier strains
+        :param tree: type ete3.Tree: Tree to which the strains are to be added. The tree is modified in place
+        :param strain_masks: type DICT: Dictionary of strain name: state sets of the strain. The leaves of the tree
+        must also be present
+        :return: placements: Dictionary of strain name: number of additional changes required to place the strain
+        """
+        placements = dict()
+        tree_strains = set(tree.get_leaf_names())
+        new_strains = [strain_name for strain_name in strain_masks if strain_name not in tree_strains]
+        num_sites = len(next(iter(strain_masks.values()))) if strain_masks else 0
+        for strain_name in new_strains:
+            # Calculate the state sets below every node
+            down = dict()
+            for node in tree.traverse('postorder'):
+                if node.is_leaf():
+                    down[node] = strain_masks[node.name]
+                else:
+                    down[node] = down[node.children[0]]
+                    for child in node.children[1:]:
+                        down[node] = VSNPTreeMethods.fitch_combine(down[node], down[child])
+            # Calculate the state sets of the rest of the tree above every node. Every state is possible above the root
+            up = {tree: numpy.full(num_sites, 15, dtype=numpy.uint8)}
+            edges = list()
+            edge_masks = list()
+            for node in tree.traverse('preorder'):
+                if node.is_root():
+                    continue
+                up[node] = up[node.up]
+                for sibling in node.up.children:
+                    if sibling is not node:
+                        up[node] = VSNPTreeMethods.fitch_combine(up[node], down[sibling])
+                edges.append(node)
+                edge_masks.append(VSNPTreeMethods.fitch_combine(down[node], up[node]))
+            # Count the sites at which the strain is incompatible with the states of each branch
+            costs = numpy.count_nonzero((numpy.array(edge_masks) & strain_masks[strain_name]) == 0, axis=1)
+            best_edge = int(numpy.argmin(costs))
+            node = edges[best_edge]
+            # Split the branch, and attach the strain to the new internal node
+            parent = node.up
+            dist = node.dist
+            node.detach()
+            junction = parent.add_child(dist=dist / 2)
+            junction.add_child(child=node, dist=dist / 2)
+            junction.add_child(name=strain_name, dist=int(costs[best_edge]) / num_sites if num_sites else 0)
+            placements[strain_name] = int(costs[best_edge])
+        return placements
+
+    @staticmethod
+    def placement_trees(group_fasta_dict, tree_path, min_strains=3):
+        """
+        Create the trees of groups with a tree from a previous run by placing the new strains onto the previous tree.
+        Strains that are no longer present are removed from the tree. Groups without a previous tree are returned so
+        that their trees can be created with RAxML
+        :param group_fasta_dict: type DICT: Dictionary of species code: group name: FASTA file created for the group
+        :param tree_path: type STR: Absolute path to folder containing the tree files of previous runs
+        :param min_strains: type INT: Minimum number of strains of the previous tree that must be present in the
+        alignment in order to place strains onto the tree
+        :return: species_group_trees: Dictionary of species code: group name: dictionary of tree type: absolute path
+        to placement tree
+        :return: raxml_fasta_dict: Dictionary of species code: group name: FASTA file of groups that require RAxML
+        :return: species_group_placements: Dictionary of species code: group name: strain name: number of additional
+        changes required to place the strain
+        """
+        species_group_trees = dict()
+        raxml_fasta_dict = dict()
+        species_group_placements = dict()
+        for species, group_dict in group_fasta_dict.items():
+            for group, fasta_file in group_dict.items():
+                base_tree = VSNPTreeMethods.placement_base_tree(tree_path=tree_path,
+                                                                species=species,
+                                                                group=group)
+                records = list(SeqIO.parse(fasta_file, 'fasta'))
+                tree = Tree(base_tree) if base_tree else None
+                present = [leaf for leaf in tree.get_leaf_names() if leaf in {record.id for record in records}] \
+                    if tree else list()
+                if len(present) < min_strains:
+                    raxml_fasta_dict.setdefault(species, dict())[group] = fasta_file
+                    continue
+                # Remove the strains that are no longer present
+                if len(present) < len(tree.get_leaves()):
+                    tree.prune(present, preserve_branch_length=True)
+                alignment = numpy.array([numpy.frombuffer(str(record.seq).encode('ascii'), dtype=numpy.uint8)
+                                         for record in records])
+                masks = VSNPTreeMethods.state_masks(alignment=alignment)
+                strain_masks = {record.id: masks[row] for row, record in enumerate(records)}
+                placements = VSNPTreeMethods.place_strains(tree=tree,
+                                                           strain_masks=strain_masks)
+                placement_tree = os.path.join(os.path.dirname(fasta_file),
+                                              'vSNP_placementTree.{species}_{group}'.format(species=species,
+                                                                                            group=group))
+                tree.write(format=5, outfile=placement_tree)
+                species_group_trees.setdefault(species, dict())[group] = {'best_tree': placement_tree}
+                species_group_placements.setdefault(species, dict())[group] = placements
+        return species_group_trees, raxml_fasta_dict, species_group_placements
+
     @staticmethod
     def parse_tree_order(species_group_trees):
         """
@@ -1010,8 +2461,9 @@ class VSNPTreeMethods(object):
                     tree_name = os.path.basename(tree_file)
                     # Set the name of the destination file
                     destination_file = os.path.join(tree_path, tree_name)
-                    # Copy the file to the destination folder
-                    if not os.path.isfile(destination_file):
+                    # Copy the file to the destination folder if it is missing, or older than the new tree
+                    if not os.path.isfile(destination_file) or \
+                            os.path.getmtime(tree_file) > os.path.getmtime(destination_file):
                         shutil.copyfile(src=tree_file,
                                         dst=destination_file)
 
@@ -2,8 +2,11 @@
 from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
 from vsnp.install_dependencies import install_deps
 from vsnp.vsnp_tree_methods import VSNPTreeMethods
+from vsnp.vsnp_store_methods import StoreMethods
+from vsnp.vsnp_pool_methods import PoolMethods
 from datetime import datetime
 import logging
+import shutil
 import os
 
 __author__ = 'adamkoziol'
@@ -15,12 +18,29 @@ class VSNPTree(object):
         """
         Run all the vSNP tree-specific methods
         """
-        self.vcf_load()
-        self.load_snp_sequence()
-        self.phylogenetic_trees()
-        self.annotate_snps()
-        self.order_snps()
-        self.create_report()
+        # Create the worker pool before any large dictionaries are loaded, so that the workers do not inherit them.
+        # A pool supplied by the full pipeline is re-used, and is closed by the pipeline
+        own_pool = self.pool is None
+        if own_pool:
+            self.pool = PoolMethods.create_pool(threads=self.threads)
+        try:
+            self.vcf_load()
+            self.determine_groups()
+            # Process each species/group in turn to bound the memory usage to that of the largest group
+            if self.memory_bounded:
+                self.species_group_analyses()
+            else:
+                self.load_snp_sequence()
+                self.phylogenetic_trees()
+                self.annotate_snps()
+                self.order_snps()
+                self.create_report()
+        finally:
+            if own_pool:
+                # Close and join the pool
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
 
     def vcf_load(self):
         logging.info('Locating gVCF files')
@@ -32,16 +52,43 @@ class VSNPTree(object):
                              for sn, gf in self.strain_vcf_dict.items()])))
         self.accession_species_dict = VSNPTreeMethods.parse_accession_species(ref_species_file=os.path.join(
             self.dependency_path, 'mash', 'species_accessions.csv'))
-        logging.info('Parsing gVCF files')
-        if self.variant_caller == 'deepvariant':
+        if self.store_file:
+            logging.info('Adding new strains to the SNP call store')
+            added_strains = VSNPTreeMethods.store_vcf(store_file=self.store_file,
+                                                      strain_vcf_dict=self.strain_vcf_dict,
+                                                      variant_caller=self.variant_caller,
+                                                      threads=self.threads,
+                                                      pool=self.pool)
+            logging.info('Added or replaced {added} strains in {store}. Loading the calls of {num} strains from '
+                         'the store'.format(added=len(added_strains),
+                                                    store=self.store_file,
+                                                    num=len(self.strain_vcf_dict)))
+        else:
+            logging.info('Parsing gVCF files')
+        # Only the SNP positions are required to determine group membership. Retain nothing else in the first pass
+        if self.memory_bounded and self.store_file:
+            self.strain_parsed_vcf_dict, self.strain_best_ref_dict, self.strain_best_ref_set_dict = \
+                StoreMethods.load_strains(store_file=self.store_file,
+                                          strain_list=list(self.strain_vcf_dict),
+                                          pass_only=True)
+        elif self.memory_bounded:
+            self.strain_parsed_vcf_dict, self.strain_best_ref_dict, self.strain_best_ref_set_dict = \
+                VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict=self.strain_vcf_dict,
+                                                 variant_caller=self.variant_caller,
+                                                 threads=self.threads,
+                                                 pool=self.pool)
+        # Otherwise, only retain the calls at the union of the SNP positions of all the strains
+        elif self.store_file:
             self.strain_parsed_vcf_dict, self.strain_best_ref_dict, self.strain_best_ref_set_dict = \
-                VSNPTreeMethods.load_gvcf(strain_vcf_dict=self.strain_vcf_dict,
-                                          threads=self.threads,
-                                          qual_cutoff=30)
+                VSNPTreeMethods.load_store_union(store_file=self.store_file,
+                                                 strain_list=list(self.strain_vcf_dict))
         else:
             self.strain_parsed_vcf_dict, self.strain_best_ref_dict, self.strain_best_ref_set_dict = \
-                VSNPTreeMethods.load_vcf(strain_vcf_dict=self.strain_vcf_dict)
-        logging.debug('Parsed gVCF summaries:')
+                VSNPTreeMethods.load_gvcf_union(strain_vcf_dict=self.strain_vcf_dict,
+                                                variant_caller=self.variant_caller,
+                                                threads=self.threads,
+                                                pool=self.pool)
+        logging.debug('Parsed gVCF summaries of retained positions:')
         if self.debug:
             pass_dict, insertion_dict, deletion_dict = \
                 VSNPTreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict)
@@ -59,7 +106,7 @@ class VSNPTree(object):
             results='\n'.join(['{strain_name}: {ref_set}'.format(strain_name=sn, ref_set=rs) for sn, rs in
                                self.strain_best_ref_set_dict.items()])))
 
-    def load_snp_sequence(self):
+    def determine_groups(self):
         logging.info('Linking extracted reference genome to species code and reference FASTA file')
         self.strain_species_dict, strain_best_ref_fasta_dict = \
             VSNPTreeMethods.determine_ref_species(strain_best_ref_dict=self.strain_best_ref_dict,
@@ -81,10 +128,19 @@ class VSNPTree(object):
             VSNPTreeMethods.extract_defining_snps(reference_link_path_dict=self.reference_link_path_dict,
                                                   strain_species_dict=self.strain_species_dict,
                                                   dependency_path=self.dependency_path)
+        reference_fasta_dict = \
+            VSNPTreeMethods.reference_fasta_files(strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                                                  strain_best_ref_fasta_dict=strain_best_ref_fasta_dict,
+                                                  reference_link_dict=reference_link_dict,
+                                                  dependency_path=self.dependency_path)
+        logging.debug('Reference genome FASTA files: \n{results}'.format(
+            results='\n'.join(['{ref}: {ref_file}'.format(ref=ref, ref_file=rf)
+                               for ref, rf in reference_fasta_dict.items()])))
         logging.info('Loading SNP positions')
-        consolidated_ref_snp_positions, strain_snp_positions, self.ref_snp_positions = \
+        self.consolidated_ref_snp_positions, strain_snp_positions, self.ref_snp_positions = \
             VSNPTreeMethods.load_gvcf_snp_positions(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
-                                                    strain_consolidated_ref_dict=self.strain_consolidated_ref_dict)
+                                                    strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                                                    reference_fasta_dict=reference_fasta_dict)
         logging.info('Determining to which groups strains are members using defining SNPs')
         self.strain_groups = VSNPTreeMethods.determine_groups(strain_snp_positions=strain_snp_positions,
                                                               defining_snp_dict=defining_snp_dict)
@@ -92,35 +148,64 @@ class VSNPTree(object):
             results='\n'.join(['{strain_name}: {group_list}'.format(strain_name=sn, group_list=gl)
                                for sn, gl in self.strain_groups.items()])))
         logging.info('Determining group-specific SNP positions')
-        group_positions_set = \
+        self.group_positions_set = \
             VSNPTreeMethods.determine_group_snp_positions(strain_snp_positions=strain_snp_positions,
                                                           strain_groups=self.strain_groups,
                                                           strain_species_dict=self.strain_species_dict)
         # Filter the positions if desired
         if self.filter_positions:
-            group_positions_set = VSNPTreeMethods.filter_snps(group_positions_set)
+            self.group_positions_set = VSNPTreeMethods.filter_snps(self.group_positions_set)
         if self.debug:
             logging.debug('Number of SNPs per group:')
-            for species_code, group_dict in group_positions_set.items():
+            for species_code, group_dict in self.group_positions_set.items():
                 for group, ref_dict in group_dict.items():
                     for ref_chrom, pos_set in ref_dict.items():
                         print(species_code, group, ref_chrom, len(pos_set))
+
+    def load_snp_sequence(self):
         logging.info('Loading group-specific SNP sequence')
-        group_strain_snp_sequence, self.species_group_best_ref = \
-            VSNPTreeMethods.load_snp_sequence(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
-                                              strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
-                                              group_positions_set=group_positions_set,
-                                              strain_groups=self.strain_groups,
-                                              strain_species_dict=self.strain_species_dict,
-                                              consolidated_ref_snp_positions=consolidated_ref_snp_positions)
-        self.group_strain_snp_sequence, non_identical_group_positions = \
-            VSNPTreeMethods.remove_identical_calls(group_strain_snp_sequence=group_strain_snp_sequence,
-                                                   consolidated_ref_snp_positions=consolidated_ref_snp_positions)
+        # Each group is processed concurrently
+        self.group_strain_snp_sequence, self.species_group_best_ref, non_identical_group_positions = \
+            VSNPTreeMethods.load_group_snp_sequences(
+                strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
+                strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                group_positions_set=self.group_positions_set,
+                strain_groups=self.strain_groups,
+                strain_species_dict=self.strain_species_dict,
+                consolidated_ref_snp_positions=self.consolidated_ref_snp_positions,
+                threads=self.threads,
+                pool=self.pool)
         logging.info('Creating multi-FASTA files of group-specific core SNPs')
         group_folders, species_folders, self.group_fasta_dict = \
             VSNPTreeMethods.create_multifasta(group_strain_snp_sequence=self.group_strain_snp_sequence,
                                               group_positions_set=non_identical_group_positions,
-                                              fasta_path=self.fasta_path)
+                                              fasta_path=self.fasta_path,
+                                              clear_path=not self.memory_bounded)
+        logging.info('Calculating pairwise SNP distances')
+        VSNPTreeMethods.create_distance_matrices(group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                                 group_positions_set=non_identical_group_positions,
+                                                 distance_path=self.summary_path,
+                                                 gap_mode=self.gap_mode,
+                                                 ambiguity_mode=self.ambiguity_mode)
+        if self.cluster_thresholds:
+            logging.info('Updating SNP clusters')
+            species_group_clusters, species_group_metrics = \
+                VSNPTreeMethods.create_clusters(group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                                group_positions_set=non_identical_group_positions,
+                                                strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                                                thresholds=self.cluster_thresholds,
+                                                cluster_path=self.summary_path,
+                                                gap_mode=self.gap_mode,
+                                                ambiguity_mode=self.ambiguity_mode)
+            for species_code, group_dict in species_group_metrics.items():
+                for group, metrics in group_dict.items():
+                    logging.info('Clustered {new} new of {num} {species} {group} strains. Distances: {ds} s, '
+                                 'clusters: {cs} s'.format(new=metrics['new_strains'],
+                                                           num=metrics['strains'],
+                                                           species=species_code,
+                                                           group=group,
+                                                           ds=metrics['distance_seconds'],
+                                                           cs=metrics['cluster_seconds']))
         logging.debug('Multi-FASTA alignment files created:')
         if self.debug:
             for species_code, group_dict in self.group_fasta_dict.items():
@@ -128,12 +213,39 @@ class VSNPTree(object):
                     print(species_code, group, fasta_file)
 
     def phylogenetic_trees(self):
+        group_fasta_dict = self.group_fasta_dict
+        placed_group_trees = dict()
+        if self.placement:
+            logging.info('Placing new strains onto the phylogenetic trees of previous runs')
+            placed_group_trees, group_fasta_dict, species_group_placements = \
+                VSNPTreeMethods.placement_trees(group_fasta_dict=self.group_fasta_dict,
+                                                tree_path=self.tree_path)
+            for species_code, group_dict in species_group_placements.items():
+                for group, placements in group_dict.items():
+                    logging.info('Placed {num} strains onto the {species} {group} tree'.format(num=len(placements),
+                                                                                              species=species_code,
+                                                                                              group=group))
+        if self.collapse_identical:
+            logging.info('Collapsing identical SNP profiles')
+            group_fasta_dict, species_group_identical = \
+                VSNPTreeMethods.collapse_identical_sequences(
+                    group_fasta_dict=group_fasta_dict,
+                    strain_consolidated_ref_dict=self.strain_consolidated_ref_dict)
         logging.info('Creating phylogenetic trees with RAxML')
-        species_group_trees = VSNPTreeMethods.run_raxml(group_fasta_dict=self.group_fasta_dict,
+        species_group_trees = VSNPTreeMethods.run_raxml(group_fasta_dict=group_fasta_dict,
                                                         strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
                                                         strain_groups=self.strain_groups,
                                                         threads=self.threads,
                                                         logfile=self.logfile)
+        if self.collapse_identical:
+            logging.info('Grafting identical strains onto phylogenetic trees')
+            species_group_trees = \
+                VSNPTreeMethods.expand_identical_sequences(species_group_trees=species_group_trees,
+                                                           species_group_identical=species_group_identical,
+                                                           group_fasta_dict=self.group_fasta_dict)
+        # Add the trees of the groups onto which strains were placed
+        for species_code, group_dict in placed_group_trees.items():
+            species_group_trees.setdefault(species_code, dict()).update(group_dict)
         logging.debug('Tree files:')
         if self.debug:
             for species_code, group_dict in species_group_trees.items():
@@ -151,15 +263,17 @@ class VSNPTree(object):
                                    tree_path=self.tree_path)
 
     def annotate_snps(self):
-        logging.info('Loading GenBank files for closest reference genomes')
-        full_best_ref_gbk_dict = \
-            VSNPTreeMethods.load_genbank_file(reference_link_path_dict=self.reference_link_path_dict,
-                                              strain_best_ref_set_dict=self.strain_best_ref_set_dict,
-                                              dependency_path=self.dependency_path)
+        # The GenBank files only need to be loaded once per species in the memory-bounded mode
+        if not self.full_best_ref_gbk_dict:
+            logging.info('Loading GenBank files for closest reference genomes')
+            self.full_best_ref_gbk_dict = \
+                VSNPTreeMethods.load_genbank_file(reference_link_path_dict=self.reference_link_path_dict,
+                                                  strain_best_ref_set_dict=self.strain_best_ref_set_dict,
+                                                  dependency_path=self.dependency_path)
         logging.info('Annotating SNPs')
         self.species_group_annotated_snps_dict = \
             VSNPTreeMethods.annotate_snps(group_strain_snp_sequence=self.group_strain_snp_sequence,
-                                          full_best_ref_gbk_dict=full_best_ref_gbk_dict,
+                                          full_best_ref_gbk_dict=self.full_best_ref_gbk_dict,
                                           strain_best_ref_set_dict=self.strain_best_ref_set_dict,
                                           ref_snp_positions=self.ref_snp_positions)
 
@@ -188,13 +302,96 @@ class VSNPTree(object):
                                              species_group_num_snps=self.species_group_num_snps,
                                              summary_path=self.summary_path)
 
-    def __init__(self, path, threads, debug, variant_caller, filter_positions):
+    def species_group_analyses(self):
+        # Store the project-wide dictionaries, as they are replaced with species- and group-specific subsets below
+        strain_groups = self.strain_groups
+        group_positions_set = self.group_positions_set
+        strain_consolidated_ref_dict = self.strain_consolidated_ref_dict
+        reference_link_path_dict = self.reference_link_path_dict
+        species_positions = VSNPTreeMethods.species_snp_positions(group_positions_set=group_positions_set)
+        # Clear out the alignments from previous runs here, as each group only clears its own outputs
+        try:
+            shutil.rmtree(self.fasta_path)
+        except FileNotFoundError:
+            pass
+        for species, position_dict in species_positions.items():
+            # Extract the strains belonging to the current species
+            species_strains = [strain_name for strain_name in self.strain_vcf_dict
+                               if self.strain_species_dict[strain_name] == species]
+            logging.info('Parsing gVCF files of {num} {species} strains'.format(num=len(species_strains),
+                                                                                 species=species))
+            # Only retain the positions that are SNPs in at least one group of the species. The reference genomes
+            # were already extracted in the first pass
+            if self.store_file:
+                self.strain_parsed_vcf_dict = StoreMethods.load_strains(store_file=self.store_file,
+                                                                        strain_list=species_strains,
+                                                                        position_dict=position_dict)[0]
+            else:
+                self.strain_parsed_vcf_dict = \
+                    VSNPTreeMethods.load_reduced_vcf(strain_vcf_dict={strain_name: self.strain_vcf_dict[strain_name]
+                                                                      for strain_name in species_strains},
+                                                     variant_caller=self.variant_caller,
+                                                     threads=self.threads,
+                                                     position_dict=position_dict,
+                                                     pool=self.pool)[0]
+            self.strain_consolidated_ref_dict = {strain_name: strain_consolidated_ref_dict[strain_name]
+                                                 for strain_name in species_strains}
+            self.reference_link_path_dict = {strain_name: reference_link_path_dict[strain_name]
+                                             for strain_name in species_strains}
+            for group, ref_dict in group_positions_set[species].items():
+                logging.info('Processing {species} group {group}'.format(species=species,
+                                                                         group=group))
+                self.group_positions_set = {species: {group: ref_dict}}
+                # Strains that are not members of the group are left with an empty list of groups
+                self.strain_groups = {strain_name: [group] if group in strain_groups[strain_name] else list()
+                                      for strain_name in species_strains}
+                self.load_snp_sequence()
+                self.phylogenetic_trees()
+                self.annotate_snps()
+                self.order_snps()
+                self.create_report()
+                # Release the group-specific outputs before processing the next group
+                self.group_strain_snp_sequence = dict()
+                self.group_fasta_dict = dict()
+                self.species_group_order_dict = dict()
+                self.species_group_annotated_snps_dict = dict()
+                self.species_group_sorted_snps = dict()
+            # Release the species-specific outputs before processing the next species
+            self.strain_parsed_vcf_dict = dict()
+            self.full_best_ref_gbk_dict = dict()
+        # Restore the project-wide dictionaries
+        self.strain_groups = strain_groups
+        self.group_positions_set = group_positions_set
+        self.strain_consolidated_ref_dict = strain_consolidated_ref_dict
+        self.reference_link_path_dict = reference_link_path_dict
+
+    def __init__(self, path, threads, debug, variant_caller, filter_positions, memory_bounded=False, pool=None,
+                 collapse_identical=False, gap_mode='ignore', ambiguity_mode='ignore', cluster_thresholds=None,
+                 placement=False, store_file=None):
         """
         :param path: type STR: Path of folder containing VCF files
         :param threads: type INT: Number of threads to use in the analyses
         :param debug: type BOOL: Boolean of whether debug level logs are printed to terminal
         :param filter_positions: type BOOL: Boolean of whether the calculated SNPs should be filtered with the
         Filtered_Regions.xlsx file
+        :param memory_bounded: type BOOL: Boolean of whether each species/group is processed and released in turn,
+        so that peak memory usage is bounded by the largest group rather than the whole project. The gVCF files are
+        parsed twice in this mode
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for, and closed at the end of, the tree creation methods
+        :param collapse_identical: type BOOL: Boolean of whether strains with identical SNP profiles are collapsed
+        before the phylogenetic trees are created, and grafted back onto the trees afterwards
+        :param gap_mode: type STR: Whether positions with a '-' are ignored or counted in the SNP distance matrices
+        :param ambiguity_mode: type STR: Whether positions with an IUPAC ambiguity code are ignored or counted in the
+        SNP distance matrices
+        :param cluster_thresholds: type LIST: SNP thresholds at which single-linkage clusters of the strains in each
+        group are maintained. No clusters are created if not supplied
+        :param placement: type BOOL: Boolean of whether new strains are placed onto the trees of previous runs in the
+        tree_files folder by parsimony, rather than creating new trees with RAxML. Groups without a previous tree are
+        still processed with RAxML
+        :param store_file: type STR: Absolute path to the SQLite database of the SNP call store shared across projects.
+        Strains that are not in the store are added to it, and the calls of all the strains are loaded from the store
+        rather than parsed from the gVCF files
         """
         logging.info('vSNP phylogenetic tree creation module')
         SetupLogging(debug=debug)
@@ -225,6 +422,18 @@ class VSNPTree(object):
                                                     'dependencies folder in: {sp}'.format(sp=self.script_path)
         self.variant_caller = variant_caller
         self.filter_positions = filter_positions
+        self.memory_bounded = memory_bounded
+        self.pool = pool
+        self.collapse_identical = collapse_identical
+        self.gap_mode = gap_mode
+        self.ambiguity_mode = ambiguity_mode
+        self.cluster_thresholds = cluster_thresholds if cluster_thresholds else list()
+        self.placement = placement
+        # Allow for ~ expansion of the path of the store
+        if store_file and store_file.startswith('~'):
+            self.store_file = os.path.abspath(os.path.expanduser(store_file))
+        else:
+            self.store_file = os.path.abspath(store_file) if store_file else None
         self.logfile = os.path.join(self.file_path, 'log')
         self.start_time = datetime.now()
         # initialise variables
@@ -237,11 +446,14 @@ class VSNPTree(object):
         self.reference_link_path_dict = dict()
         self.strain_consolidated_ref_dict = dict()
         self.ref_snp_positions = dict()
+        self.consolidated_ref_snp_positions = dict()
         self.strain_groups = dict()
+        self.group_positions_set = dict()
         self.group_strain_snp_sequence = dict()
         self.species_group_best_ref = dict()
         self.group_fasta_dict = dict()
         self.species_group_order_dict = dict()
+        self.full_best_ref_gbk_dict = dict()
         self.species_group_annotated_snps_dict = dict()
         self.species_group_num_snps = dict()
         self.species_group_sorted_snps = dict()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import filer, make_path, relative_symlink, run_subprocess, \
     write_to_logfile
+from vsnp.vsnp_downsample_methods import DownsampleMethods
+from vsnp.vsnp_fanout_methods import FanoutMethods
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_pool_methods import PoolMethods, worker_context
+from vsnp.vsnp_spoligo_methods import SpoligoMethods, spoligo_species
+from vsnp.vsnp_qc_methods import QCMethods
 from Bio import SeqIO
-import multiprocessing
-from glob import glob
+from glob import escape as glob_escape, glob
+import subprocess
 import xlsxwriter
+import tempfile
 import shutil
 import gzip
 import os
@@ -12,6 +19,10 @@ import re
 
 __author__ = 'adamkoziol'
 
+# Species codes of the Brucella reference genomes, the only species typed with the Brucella MLST scheme
+mlst_species = ('ab1', 'ab3', 'canis', 'ceti1', 'ceti2', 'mel1', 'mel1b', 'mel2', 'mel3', 'ovis', 'suis1', 'suis2',
+                'suis3', 'suis4')
+
 
 class VCFMethods(object):
     @staticmethod
@@ -91,6 +102,252 @@ class VCFMethods(object):
                     strain_fastq_dict[strain_name] = [symlink_path]
         return strain_fastq_dict
 
+    @staticmethod
+    def strain_step_resources(threads, variant_caller):
+        """
+        Size the threads and memory of each per-strain step to the parallelism of the tool that performs it, so that
+        the scheduler can run the steps of several strains at once. The multi-threaded steps receive half of the
+        threads (up to 16), so that at least two strains are processed concurrently, while the steps performed by
+        single-threaded tools receive a single thread
+        :param threads: type INT: Total number of threads available to the analyses
+        :param variant_caller: type STR: Variant calling software to use: deepvariant, deepvariant-gpu, or freebayes
+        :return: step_resources: Dictionary of step name: {'threads': number of threads, 'memory': memory in GB}
+        """
+        threads = max(1, threads)
+        # bwa mem, freebayes-parallel, and deepvariant scale well to this number of threads on bacterial genomes
+        heavy_threads = max(1, min(16, threads // 2))
+        step_resources = {
+            # The reads are streamed to mash sketch, and to the in-process read statistics at once
+            'reads': {'threads': min(threads, 2), 'memory': 1.0},
+            # The sketches of every strain are compared to the reference genomes in a single multi-threaded mash dist
+            'mash_dist': {'threads': threads, 'memory': 1.0},
+            # Indexing the reference genome is quick, as is the individual mash dist of sketches without a strain ID
+            'reference': {'threads': 1, 'memory': 1.0},
+            # The spacer sequences are baited in-process
+            'spoligo': {'threads': 1, 'memory': 1.0},
+            # The retained reads are compressed in-process
+            'downsample': {'threads': 1, 'memory': 1.0},
+            # samtools sort uses 768 MB per thread by default
+            'mapping': {'threads': heavy_threads, 'memory': 1.0 + 0.8 * heavy_threads},
+            'assembly': {'threads': min(threads, 4), 'memory': 2.0},
+            # The default Java heap of qualimap is 1200 MB
+            'qualimap': {'threads': min(threads, 2), 'memory': 1.5},
+            'freebayes': {'threads': heavy_threads, 'memory': 0.5 + 0.5 * heavy_threads},
+            'make_examples': {'threads': heavy_threads, 'memory': 1.5 * heavy_threads},
+            # A single GPU is shared by every strain, so GPU variant calling is never run concurrently
+            'call_variants': {'threads': threads if variant_caller == 'deepvariant-gpu' else heavy_threads,
+                              'memory': 4.0},
+            # Parsing, compressing and indexing the VCF file are part of the final variant calling step
+            'postprocess_variants': {'threads': 1, 'memory': 2.0}
+        }
+        return step_resources
+
+    @staticmethod
+    def strain_step_outputs(strain_name, strain_folder, vcf_path):
+        """
+        Set the output files of each per-strain step. The outputs are recorded in the strain manifest once a step
+        finishes, and are removed if the step is invalidated, so that the step cannot reuse partial or stale outputs
+        :param strain_name: type STR: Name of the strain
+        :param strain_folder: type STR: Absolute path to the strain-specific working directory
+        :param vcf_path: type STR: Absolute path to the folder to which the gVCF files are copied
+        :return: step_outputs: Dictionary of step name: list of absolute paths of output files. Sharded outputs are
+        supplied as glob patterns
+        """
+        # Escape the fixed parts of the glob patterns, in case the strain name contains wildcard characters
+        strain_prefix = glob_escape(os.path.join(strain_folder, strain_name))
+        deepvariant_prefix = os.path.join(strain_folder, 'deepvariant', strain_name)
+        copied_vcf = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
+        step_outputs = {
+            'reads': [os.path.join(strain_folder, 'mash', '{sn}_sketch.msh'.format(sn=strain_name)),
+                      strain_prefix + '_R*_qchist.csv',
+                      strain_prefix + '_R*_lhist.csv'],
+            'reference': [os.path.join(strain_folder, 'mash', '{sn}_mash.tab'.format(sn=strain_name))],
+            'spoligo': [os.path.join(strain_folder, 'spoligotyping', '{sn}_stats.txt'.format(sn=strain_name))],
+            'downsample': [os.path.join(glob_escape(os.path.join(strain_folder, 'downsampled')), '*.gz'),
+                           os.path.join(strain_folder, 'downsampled', '{sn}_coverage.tsv'.format(sn=strain_name))],
+            'mapping': [os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name)),
+                        os.path.join(strain_folder, '{sn}_sorted.bam.bai'.format(sn=strain_name))],
+            'assembly': [os.path.join(strain_folder, '{sn}_unmapped.fastq.gz'.format(sn=strain_name)),
+                         os.path.join(strain_folder, 'skesa', '{sn}_unmapped.fasta'.format(sn=strain_name))],
+            'qualimap': [os.path.join(strain_folder, 'qualimap', 'genome_results.txt')],
+            # The uncompressed gVCF file is compressed in place once it is filtered
+            'freebayes': [os.path.join(strain_folder, 'freebayes', '{sn}.gvcf'.format(sn=strain_name)),
+                          os.path.join(strain_folder, 'freebayes', '{sn}.gvcf.gz'.format(sn=strain_name)),
+                          os.path.join(strain_folder, 'freebayes', '{sn}.gvcf.gz.tbi'.format(sn=strain_name)),
+                          copied_vcf,
+                          copied_vcf + '.tbi'],
+            'make_examples': [glob_escape(deepvariant_prefix) + '_tfrecord-*.gz',
+                              glob_escape(deepvariant_prefix) + '_gvcf-*.gz'],
+            'call_variants': [deepvariant_prefix + '_call_variants_output_tfrecord.gz'],
+            'postprocess_variants': [deepvariant_prefix + '.vcf.gz',
+                                     deepvariant_prefix + '.gvcf.gz',
+                                     deepvariant_prefix + '.gvcf.gz.tbi',
+                                     copied_vcf,
+                                     copied_vcf + '.tbi']
+        }
+        return step_outputs
+
+    @staticmethod
+    def fanout_reads(strain_fastq_dict, strain_name_dict, logfile):
+        """
+        Read the FASTQ files of each strain once, and stream the reads concurrently to MASH sketch, and to the
+        in-process counting of the base qualities and read lengths of each file. The outputs are the same as those of
+        call_mash_sketch and run_reformat_reads, which each read the files again. Only the analyses whose outputs do
+        not exist are run
+        :param strain_fastq_dict: type DICT: Dictionary of strain name: list of absolute path(s) of FASTQ file(s)
+        :param strain_name_dict: type DICT: Dictionary of base strain name: strain folder path
+        :param logfile: type STR: Absolute path to logfile basename
+        :return: fastq_sketch_dict: Dictionary of strain name: absolute path to MASH sketch file
+        :return: strain_read_stats_dict: Dictionary of strain name: list of the read statistics of each FASTQ file
+        (see QCMethods.update_stats)
+        """
+        fastq_sketch_dict = dict()
+        strain_read_stats_dict = dict()
+        for strain_name, fastq_files in strain_fastq_dict.items():
+            strain_folder = strain_name_dict[strain_name]
+            # Every consumer reads all the files, except the read statistics, which are calculated for each file
+            all_files = tuple(range(len(fastq_files)))
+            commands = list()
+            qc_consumers = list()
+            # MASH sketch reads the records of all the files from stdin
+            make_path(os.path.join(strain_folder, 'mash'))
+            fastq_sketch_no_ext = os.path.join(strain_folder, 'mash', '{sn}_sketch'.format(sn=strain_name))
+            fastq_sketch_dict[strain_name] = fastq_sketch_no_ext + '.msh'
+            if not os.path.isfile(fastq_sketch_dict[strain_name]):
+                # The strain name is used as the ID of the sketch, so that the strains can be told apart when their
+                # sketches are compared to the reference genomes in a single MASH dist
+                commands.append(('mash sketch -m 2 -I {sn} - -o {output_file}'.format(sn=strain_name,
+                                                                                     output_file=fastq_sketch_no_ext),
+                                 all_files))
+            # The base qualities and read lengths of each file are counted in-process. The histograms are written
+            # in the format of reformat.sh, and the statistics of existing histograms are read from them
+            strain_read_stats_dict[strain_name] = list()
+            for index in all_files:
+                qual_histo = os.path.join(strain_folder, '{sn}_R{count}_qchist.csv'.format(sn=strain_name,
+                                                                                           count=index + 1))
+                length_histo = os.path.join(strain_folder, '{sn}_R{count}_lhist.csv'.format(sn=strain_name,
+                                                                                            count=index + 1))
+                if os.path.isfile(qual_histo) and os.path.isfile(length_histo):
+                    strain_read_stats_dict[strain_name].append(QCMethods.read_histograms(qual_histo=qual_histo,
+                                                                                         length_histo=length_histo))
+                else:
+                    qc_consumers.append(QCMethods.qc_consumer(qual_histo=qual_histo,
+                                                              length_histo=length_histo,
+                                                              files=(index,)))
+                    strain_read_stats_dict[strain_name].append(qc_consumers[-1]['stats'])
+            consumers = [FanoutMethods.process_consumer(command=command,
+                                                        files=files)
+                         for command, files in commands]
+            try:
+                FanoutMethods.fanout(fastq_files=fastq_files,
+                                     consumers=consumers + qc_consumers)
+            finally:
+                for consumer in consumers:
+                    out, err = FanoutMethods.finish_process(consumer=consumer)
+                    # Write the stdout, and stderr to the main logfile, as well as to the strain-specific logs
+                    write_to_logfile(out=out,
+                                     err=err,
+                                     logfile=logfile,
+                                     samplelog=os.path.join(strain_folder, 'log.out'),
+                                     sampleerr=os.path.join(strain_folder, 'log.err'))
+        return fastq_sketch_dict, strain_read_stats_dict
+
+    @staticmethod
+    def spoligo_reads(strain_fastq_dict, strain_name_dict, strain_reference_abs_path_dict, spoligo_file,
+                      full_spoligo=False, kmer=25):
+        """
+        Bait the spoligotyping spacer sequences from the reads of each strain in-process. Reading stops once the
+        presence or absence of every spacer is resolved at the depth of the strain (see SpoligoMethods.bait_spacers),
+        unless every read is requested. Only the presence of each spacer is used for the spoligotype, so duplicate
+        reads do not need to be removed first. Strains with an existing stats file are not baited again
+        :param strain_fastq_dict: type DICT: Dictionary of strain name: list of absolute path(s) of FASTQ file(s)
+        :param strain_name_dict: type DICT: Dictionary of base strain name: strain folder path
+        :param strain_reference_abs_path_dict: type DICT: Dictionary of strain name: absolute path to reference genome
+        :param spoligo_file: type STR: Absolute path to FASTA-formatted file of spacer sequences
+        :param full_spoligo: type BOOL: Boolean of whether every read is examined
+        :param kmer: type INT: kmer size to use for read baiting
+        :return: strain_spoligo_stats_dict: Dictionary of strain name: absolute path to bbduk-formatted stats file
+        :return: strain_spoligo_reads_dict: Dictionary of strain name: number of reads examined
+        """
+        strain_spoligo_stats_dict = dict()
+        strain_spoligo_reads_dict = dict()
+        spacer_dict = None
+        for strain_name, fastq_files in strain_fastq_dict.items():
+            spoligo_path = os.path.join(strain_name_dict[strain_name], 'spoligotyping')
+            make_path(spoligo_path)
+            strain_spoligo_stats_dict[strain_name] = os.path.join(spoligo_path, '{sn}_stats.txt'.format(sn=strain_name))
+            if not os.path.isfile(strain_spoligo_stats_dict[strain_name]):
+                # The lookup table is only created once for all the strains
+                if spacer_dict is None:
+                    spacer_dict = SpoligoMethods.spacer_table(spoligo_file=spoligo_file,
+                                                              kmer=kmer)
+                genome_length = SpoligoMethods.reference_length(
+                    reference_file=strain_reference_abs_path_dict[strain_name])
+                # Examining every read is the same as never reaching the thresholds for stopping
+                SpoligoMethods.bait_spacers(fastq_files=fastq_files,
+                                            spacer_dict=spacer_dict,
+                                            stats_file=strain_spoligo_stats_dict[strain_name],
+                                            genome_length=genome_length,
+                                            min_count=float('inf') if full_spoligo else 5,
+                                            expected_hits=float('inf') if full_spoligo else 20.0)
+            strain_spoligo_reads_dict[strain_name] = \
+                SpoligoMethods.read_examined(stats_file=strain_spoligo_stats_dict[strain_name])
+        return strain_spoligo_stats_dict, strain_spoligo_reads_dict
+
+    @staticmethod
+    def downsample_strain_reads(strain_fastq_dict, strain_name_dict, strain_reference_abs_path_dict,
+                                strain_read_stats_dict, coverage=None):
+        """
+        Estimate the coverage of the reads of each strain from the number of bases in its reads and the length of its
+        reference genome. The reads of strains with a greater coverage than requested are downsampled to the requested
+        coverage, so that mapping, variant calling, and qualimap do not process reads that do not improve the calls.
+        The original FASTQ files are not modified. Strains with an existing coverage file are not downsampled again
+        :param strain_fastq_dict: type DICT: Dictionary of strain name: list of absolute path(s) of FASTQ file(s)
+        :param strain_name_dict: type DICT: Dictionary of base strain name: strain folder path
+        :param strain_reference_abs_path_dict: type DICT: Dictionary of strain name: absolute path to reference genome
+        :param strain_read_stats_dict: type DICT: Dictionary of strain name: list of the statistics of each FASTQ file
+        :param coverage: type FLOAT: Coverage to which the reads are downsampled. The reads are not downsampled if
+        not supplied
+        :return: strain_coverage_dict: Dictionary of strain name: dictionary of 'estimated': coverage of all the
+        reads, and 'effective': coverage of the reads used for mapping
+        :return: strain_mapping_fastq_dict: Dictionary of strain name: list of absolute paths of the downsampled FASTQ
+        files. Strains that are not downsampled are not included
+        """
+        strain_coverage_dict = dict()
+        strain_mapping_fastq_dict = dict()
+        for strain_name, fastq_files in strain_fastq_dict.items():
+            # Strains without a reference genome cannot be mapped
+            if strain_name not in strain_reference_abs_path_dict:
+                continue
+            genome_length = DownsampleMethods.genome_length(reference_file=strain_reference_abs_path_dict[strain_name])
+            estimated_coverage = DownsampleMethods.total_bases(stats_list=strain_read_stats_dict[strain_name]) / \
+                genome_length
+            if coverage is None or estimated_coverage <= coverage:
+                strain_coverage_dict[strain_name] = {'estimated': estimated_coverage,
+                                                     'effective': estimated_coverage}
+                continue
+            downsample_path = os.path.join(strain_name_dict[strain_name], 'downsampled')
+            coverage_file = os.path.join(downsample_path, '{sn}_coverage.tsv'.format(sn=strain_name))
+            # The downsampled files are always gzip-compressed
+            output_files = [os.path.join(downsample_path, os.path.basename(fastq_file) +
+                                         ('' if fastq_file.endswith('.gz') else '.gz'))
+                            for fastq_file in fastq_files]
+            # The coverage file is written once the FASTQ files are complete
+            if not os.path.isfile(coverage_file):
+                make_path(downsample_path)
+                fraction = coverage / estimated_coverage
+                kept_bases = DownsampleMethods.downsample_reads(fastq_files=fastq_files,
+                                                                output_files=output_files,
+                                                                fraction=fraction)
+                DownsampleMethods.write_coverage(coverage_file=coverage_file,
+                                                 estimated_coverage=estimated_coverage,
+                                                 target_coverage=coverage,
+                                                 fraction=fraction,
+                                                 effective_coverage=kept_bases / genome_length)
+            strain_coverage_dict[strain_name] = DownsampleMethods.read_coverage(coverage_file=coverage_file)
+            strain_mapping_fastq_dict[strain_name] = output_files
+        return strain_coverage_dict, strain_mapping_fastq_dict
+
     @staticmethod
     def run_reformat_reads(strain_fastq_dict, strain_name_dict, logfile):
         """
@@ -319,17 +576,24 @@ class VCFMethods(object):
             # required to pass noise filter for reads to 2 (ignores single copy kmers). MASH outputs are piped to
             # the sort function, which sorts the data as follows: g: general numeric sort, K: keydef, 5: second column
             # (num matching hashes), r: reversed
+            # The table is written to a temporary file, and renamed once MASH succeeds, so that an interrupted or
+            # failed run never leaves a truncated table
             mash_dist_command = 'mash dist -m 2 {ref_sketch_file} {fastq_sketch} > {out}' \
                 .format(ref_sketch_file=ref_sketch_file,
                         fastq_sketch=fastq_sketch_file,
-                        out=out_tab)
+                        out=ManifestMethods.temp_output(output_file=out_tab))
             if not os.path.isfile(out_tab):
-                out, err = run_subprocess(command=mash_dist_command)
+                out, err, returncode = ManifestMethods.run_command(command=mash_dist_command)
                 write_to_logfile(out=out,
                                  err=err,
                                  logfile=logfile,
                                  samplelog=os.path.join(strain_folder, 'log.out'),
                                  sampleerr=os.path.join(strain_folder, 'log.err'))
+                # The output of a failed system call is removed rather than committed
+                ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=out_tab),
+                                              output_file=out_tab,
+                                              returncode=returncode,
+                                              command=mash_dist_command)
             strain_mash_outputs[strain_name] = out_tab
         return strain_mash_outputs
 
@@ -369,24 +633,178 @@ class VCFMethods(object):
         strain_ref_matches_dict = dict()
         strain_species_dict = dict()
         for strain_name, mash_dist_table in mash_dist_dict.items():
-            # Create a variable to determine the best reference match
-            best_matching_hashes = 0
             with open(mash_dist_table, 'r') as mash_dist:
                 # Extract all the data included on each line of the table outputs
                 for line in mash_dist:
-                    # Split the line on tabs
-                    best_ref, query_id, mash_distance, p_value, matching_hashes = line.rstrip().split('\t')
-                    # Split the total of matching hashes from the total number of hashes
-                    matching_hashes = int(matching_hashes.split('/')[0])
-                    # Populate the dictionaries appropriately
-                    if matching_hashes >= min_matches and matching_hashes > best_matching_hashes:
-                        strain_best_ref_dict[strain_name] = best_ref
-                        strain_ref_matches_dict[strain_name] = matching_hashes
-                        strain_species_dict[strain_name] = accession_species_dict[best_ref]
-                        # Update the best number of matching hashes with the current value
-                        best_matching_hashes = matching_hashes
+                    VCFMethods.parse_mash_dist_line(line=line,
+                                                    strain_name=strain_name,
+                                                    accession_species_dict=accession_species_dict,
+                                                    min_matches=min_matches,
+                                                    strain_best_ref_dict=strain_best_ref_dict,
+                                                    strain_ref_matches_dict=strain_ref_matches_dict,
+                                                    strain_species_dict=strain_species_dict)
         return strain_best_ref_dict, strain_ref_matches_dict, strain_species_dict
 
+    @staticmethod
+    def parse_mash_dist_line(line, strain_name, accession_species_dict, min_matches, strain_best_ref_dict,
+                             strain_ref_matches_dict, strain_species_dict):
+        """
+        Parse a line of MASH dist output, and update the closest reference genome of the strain if the reference
+        genome of the line shares more hashes with the strain than the current closest reference genome
+        :param line: type STR: Line of MASH dist output
+        :param strain_name: type STR: Name of the strain. If None, the query ID of the line is used
+        :param accession_species_dict: type DICT: Dictionary of reference accession: species code
+        :param min_matches: type INT: Minimum number of matching hashes required for a match to pass
+        :param strain_best_ref_dict: type DICT: Dictionary of strain name: closest reference genome, updated in place
+        :param strain_ref_matches_dict: type DICT: Dictionary of strain name: number of matching hashes with the
+        closest reference genome, updated in place
+        :param strain_species_dict: type DICT: Dictionary of strain name: species code, updated in place
+        :return: strain_name: Name of the strain of the line
+        """
+        # Split the line on tabs
+        best_ref, query_id, mash_distance, p_value, matching_hashes = line.rstrip().split('\t')
+        strain_name = strain_name if strain_name is not None else query_id
+        # Split the total of matching hashes from the total number of hashes
+        matching_hashes = int(matching_hashes.split('/')[0])
+        # Populate the dictionaries appropriately
+        if matching_hashes >= min_matches and matching_hashes > strain_ref_matches_dict.get(strain_name, 0):
+            strain_best_ref_dict[strain_name] = best_ref
+            strain_ref_matches_dict[strain_name] = matching_hashes
+            strain_species_dict[strain_name] = accession_species_dict[best_ref]
+        return strain_name
+
+    @staticmethod
+    def batch_mash_dist(fastq_sketch_dict, ref_sketch_file, accession_species_dict, min_matches, threads, logfile,
+                        debug_tables=False):
+        """
+        Compare the sketches of all the strains to the reference genomes in a single multi-threaded MASH dist, so that
+        the reference sketch file is only loaded once. The output is parsed as it is streamed from MASH, rather than
+        written to a table for each strain. The sketches must use the strain name as their ID (see fanout_reads).
+        Strains missing from the output e.g. sketches created without an ID, are not returned, and must be compared
+        with call_mash_dist
+        :param fastq_sketch_dict: type DICT: Dictionary of strain name: absolute path to MASH sketch file
+        :param ref_sketch_file: type STR: Absolute path to the custom sketch file of reference sequences
+        :param accession_species_dict: type DICT: Dictionary of reference accession: species code
+        :param min_matches: type INT: Minimum number of matching hashes required for a match to pass
+        :param threads: type INT: Number of threads to request for MASH dist
+        :param logfile: type STR: Absolute path to logfile basename
+        :param debug_tables: type BOOL: Boolean of whether the lines of MASH dist output of each strain are kept, so
+        that they can be written to a table with write_mash_table
+        :return: strain_best_ref_dict: Dictionary of strain name: closest MASH-calculated reference genome
+        :return: strain_ref_matches_dict: Dictionary of strain name: number of matching hashes between query and
+        closest reference genome
+        :return: strain_species_dict: Dictionary of strain name: species code
+        :return: compared_strains: Set of the names of the strains in the MASH dist output
+        :return: strain_mash_lines_dict: Dictionary of strain name: list of the lines of MASH dist output. Empty unless
+        debug_tables is True
+        """
+        strain_best_ref_dict = dict()
+        strain_ref_matches_dict = dict()
+        strain_species_dict = dict()
+        compared_strains = set()
+        strain_mash_lines_dict = dict()
+        if not fastq_sketch_dict:
+            return strain_best_ref_dict, strain_ref_matches_dict, strain_species_dict, compared_strains, \
+                strain_mash_lines_dict
+        # MASH reads the paths of the query sketches from a list file
+        list_handle, sketch_list = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(list_handle, 'w') as sketches:
+            sketches.write('\n'.join(fastq_sketch_dict.values()) + '\n')
+        mash_dist_command = 'mash dist -p {threads} {ref_sketch_file} -l {sketch_list}' \
+            .format(threads=max(1, threads),
+                    ref_sketch_file=ref_sketch_file,
+                    sketch_list=sketch_list)
+        # stderr is written to a temporary file, so that MASH cannot block on a full pipe while stdout is parsed
+        with tempfile.TemporaryFile() as stderr:
+            process = None
+            try:
+                process = subprocess.Popen(mash_dist_command, shell=True, stdout=subprocess.PIPE, stderr=stderr,
+                                           universal_newlines=True)
+                for line in process.stdout:
+                    strain_name = VCFMethods.parse_mash_dist_line(line=line,
+                                                                  strain_name=None,
+                                                                  accession_species_dict=accession_species_dict,
+                                                                  min_matches=min_matches,
+                                                                  strain_best_ref_dict=strain_best_ref_dict,
+                                                                  strain_ref_matches_dict=strain_ref_matches_dict,
+                                                                  strain_species_dict=strain_species_dict)
+                    compared_strains.add(strain_name)
+                    if debug_tables:
+                        strain_mash_lines_dict.setdefault(strain_name, list()).append(line)
+                process.wait()
+            finally:
+                # Do not leave MASH running if the output could not be parsed
+                if process is not None and process.poll() is None:
+                    process.kill()
+                    process.wait()
+                os.remove(sketch_list)
+            stderr.seek(0)
+            err = stderr.read().decode('utf-8', 'replace')
+        write_to_logfile(out=mash_dist_command,
+                         err=err,
+                         logfile=logfile)
+        # A failed MASH dist may have been interrupted, so none of the strains are returned, and they are all compared
+        # individually. Only the strains of the sketches are returned, in case a sketch has an unexpected ID
+        compared_strains = compared_strains.intersection(fastq_sketch_dict) if not process.returncode else set()
+        return [{strain_name: value for strain_name, value in strain_dict.items() if strain_name in compared_strains}
+                for strain_dict in (strain_best_ref_dict, strain_ref_matches_dict, strain_species_dict)] + \
+            [compared_strains,
+             {strain_name: lines for strain_name, lines in strain_mash_lines_dict.items()
+              if strain_name in compared_strains}]
+
+    @staticmethod
+    def write_mash_table(mash_lines, mash_dist_table):
+        """
+        Write the lines of MASH dist output of a strain to a table in the format of call_mash_dist. Existing tables
+        are not overwritten
+        :param mash_lines: type LIST: Lines of MASH dist output of the strain
+        :param mash_dist_table: type STR: Absolute path of the MASH dist table to create
+        """
+        if os.path.isfile(mash_dist_table):
+            return
+        os.makedirs(os.path.dirname(mash_dist_table), exist_ok=True)
+        try:
+            with open(ManifestMethods.temp_output(output_file=mash_dist_table), 'w') as mash_dist:
+                mash_dist.write(''.join(mash_lines))
+        # A partially written table is never committed
+        except BaseException:
+            if os.path.isfile(ManifestMethods.temp_output(output_file=mash_dist_table)):
+                os.remove(ManifestMethods.temp_output(output_file=mash_dist_table))
+            raise
+        ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=mash_dist_table),
+                                      output_file=mash_dist_table)
+
+    @staticmethod
+    def route_strains(strain_names, strain_species_dict, strain_best_ref_dict):
+        """
+        Determine the strains that are passed to each species-specific stage of the analyses, based on the species of
+        their MASH-calculated closest reference genome
+        :param strain_names: type iterable: Names of the strains
+        :param strain_species_dict: type DICT: Dictionary of strain name: species code
+        :param strain_best_ref_dict: type DICT: Dictionary of strain name: closest MASH-calculated reference genome
+        :return: strain_route_dict: Dictionary of stage name: sorted list of the names of the strains passed to the
+        stage. 'unmatched': strains without a sufficiently close reference genome, 'mapping': strains mapped to their
+        reference genome, 'spoligo': strains of the Mycobacterium tuberculosis complex, 'mlst': Brucella strains
+        """
+        strain_route_dict = {
+            'unmatched': list(),
+            'mapping': list(),
+            'spoligo': list(),
+            'mlst': list()
+        }
+        for strain_name in sorted(strain_names):
+            # Strains without a reference genome are not mapped, and are not typed, as their species is unknown
+            if strain_name not in strain_best_ref_dict:
+                strain_route_dict['unmatched'].append(strain_name)
+                continue
+            strain_route_dict['mapping'].append(strain_name)
+            species = strain_species_dict[strain_name]
+            if species in spoligo_species:
+                strain_route_dict['spoligo'].append(strain_name)
+            if species in mlst_species:
+                strain_route_dict['mlst'].append(strain_name)
+        return strain_route_dict
+
     @staticmethod
     def reference_folder(strain_best_ref_dict, dependency_path):
         """
@@ -471,50 +889,56 @@ class VCFMethods(object):
         # Initialise a dictionary to store the absolute path of the sorted BAM files
         strain_sorted_bam_dict = dict()
         for strain_name, fastq_files in strain_fastq_dict.items():
-            try:
-                # Extract the required variables from the appropriate dictionaries
-                strain_folder = strain_name_dict[strain_name]
-                reference_index = strain_mapper_index_dict[strain_name]
-                # Set the absolute path of the sorted BAM file
-                sorted_bam = os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name))
-                if reference_mapper == 'bowtie2':
-                    # Compound mapping command: bowtie2 (with read groups enabled: --rg-id  and --rg flags)|
-                    map_cmd = 'bowtie2 --rg-id {sn} --rg SM:{sn} --rg PL:ILLUMINA --rg PI:250 -x {ref_index} ' \
-                              '-U {fastq} -p {threads}'.format(sn=strain_name,
-                                                               ref_index=reference_index,
-                                                               fastq=','.join(fastq_files),
-                                                               threads=threads)
-                else:
-                    # bwa mem mapping. Set the read group header to include the sample name in the ID and SM fields
-                    map_cmd = 'bwa mem -M -R \"@RG\\tID:{sn}\\tSM:{sn}\\tPL:ILLUMINA\\tPI:250\" -t {threads} ' \
-                              '{abs_ref_link} {fastq}'\
-                        .format(sn=strain_name,
-                                fastq=' '.join(fastq_files),
-                                threads=threads,
-                                abs_ref_link=reference_index)
-                # Add the SAM-BAM conversion, duplicate read removal, and sorting commands to the mapping command
-                # samtools view (-h: include headers, -b: out BAM, -T: target file)
-                # samtools rmdup to remove duplicate reads
-                # samtools sort
-                map_cmd += ' | samtools view -@ {threads} -h -bT {abs_ref_link} -' \
-                           ' | samtools rmdup - -S -' \
-                           ' | samtools sort - -@ {threads} -o {sorted_bam}'\
-                    .format(threads=threads,
-                            abs_ref_link=reference_index,
-                            sorted_bam=sorted_bam)
-                # Only run the system call if the sorted BAM file doesn't already exist
-                if not os.path.isfile(sorted_bam):
-                    out, err = run_subprocess(map_cmd)
-                    # Write STDOUT and STDERR to the logfile
-                    write_to_logfile(out=out,
-                                     err=err,
-                                     logfile=logfile,
-                                     samplelog=os.path.join(strain_folder, 'log.out'),
-                                     sampleerr=os.path.join(strain_folder, 'log.err'))
-                # Populate the dictionary with the absolute path to the sorted BAM file
-                strain_sorted_bam_dict[strain_name] = sorted_bam
-            except KeyError:
-                pass
+            # Strains without a sufficiently close reference genome are not mapped
+            if strain_name not in strain_mapper_index_dict:
+                continue
+            # Extract the required variables from the appropriate dictionaries
+            strain_folder = strain_name_dict[strain_name]
+            reference_index = strain_mapper_index_dict[strain_name]
+            # Set the absolute path of the sorted BAM file
+            sorted_bam = os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name))
+            if reference_mapper == 'bowtie2':
+                # Compound mapping command: bowtie2 (with read groups enabled: --rg-id  and --rg flags)|
+                map_cmd = 'bowtie2 --rg-id {sn} --rg SM:{sn} --rg PL:ILLUMINA --rg PI:250 -x {ref_index} ' \
+                          '-U {fastq} -p {threads}'.format(sn=strain_name,
+                                                           ref_index=reference_index,
+                                                           fastq=','.join(fastq_files),
+                                                           threads=threads)
+            else:
+                # bwa mem mapping. Set the read group header to include the sample name in the ID and SM fields
+                map_cmd = 'bwa mem -M -R \"@RG\\tID:{sn}\\tSM:{sn}\\tPL:ILLUMINA\\tPI:250\" -t {threads} ' \
+                          '{abs_ref_link} {fastq}'\
+                    .format(sn=strain_name,
+                            fastq=' '.join(fastq_files),
+                            threads=threads,
+                            abs_ref_link=reference_index)
+            # Add the SAM-BAM conversion, duplicate read removal, and sorting commands to the mapping command
+            # samtools view (-h: include headers, -b: out BAM, -T: target file)
+            # samtools rmdup to remove duplicate reads
+            # samtools sort. The sorted BAM file is written to a temporary file, and renamed once every command of
+            # the pipeline succeeds, so that an interrupted or failed run never leaves a truncated BAM file
+            map_cmd += ' | samtools view -@ {threads} -h -bT {abs_ref_link} -' \
+                       ' | samtools rmdup - -S -' \
+                       ' | samtools sort - -@ {threads} -o {sorted_bam}'\
+                .format(threads=threads,
+                        abs_ref_link=reference_index,
+                        sorted_bam=ManifestMethods.temp_output(output_file=sorted_bam))
+            # Only run the system call if the sorted BAM file doesn't already exist
+            if not os.path.isfile(sorted_bam):
+                out, err, returncode = ManifestMethods.run_command(command=map_cmd)
+                # Write STDOUT and STDERR to the logfile
+                write_to_logfile(out=out,
+                                 err=err,
+                                 logfile=logfile,
+                                 samplelog=os.path.join(strain_folder, 'log.out'),
+                                 sampleerr=os.path.join(strain_folder, 'log.err'))
+                # The output of a failed system call is removed rather than committed
+                ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=sorted_bam),
+                                              output_file=sorted_bam,
+                                              returncode=returncode,
+                                              command=map_cmd)
+            # Populate the dictionary with the absolute path to the sorted BAM file
+            strain_sorted_bam_dict[strain_name] = sorted_bam
         return strain_sorted_bam_dict
 
     @staticmethod
@@ -534,20 +958,26 @@ class VCFMethods(object):
             strain_folder = strain_name_dict[strain_name]
             # Set the absolute path of the unmapped reads FASTQ file
             unmapped_reads = os.path.join(strain_folder, '{sn}_unmapped.fastq.gz'.format(sn=strain_name))
-            # Create the system call to samtools bam2fq. Use -f4 to specify unmapped reads. Pipe output to gzip
+            # Create the system call to samtools bam2fq. Use -f4 to specify unmapped reads. Pipe output to gzip, and
+            # write to a temporary file that is renamed once both commands succeed
             unmapped_cmd = 'samtools bam2fq -@ {threads} -f4 {sorted_bam} | gzip > {unmapped_reads}' \
                 .format(threads=threads,
                         sorted_bam=sorted_bam,
-                        unmapped_reads=unmapped_reads)
+                        unmapped_reads=ManifestMethods.temp_output(output_file=unmapped_reads))
             # Run the system call if the reads file does not exist
             if not os.path.isfile(unmapped_reads):
-                out, err = run_subprocess(unmapped_cmd)
+                out, err, returncode = ManifestMethods.run_command(command=unmapped_cmd)
                 # Write STDOUT and STDERR to the logfile
                 write_to_logfile(out=out,
                                  err=err,
                                  logfile=logfile,
                                  samplelog=os.path.join(strain_folder, 'log.out'),
                                  sampleerr=os.path.join(strain_folder, 'log.err'))
+                # The output of a failed system call is removed rather than committed
+                ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=unmapped_reads),
+                                              output_file=unmapped_reads,
+                                              returncode=returncode,
+                                              command=unmapped_cmd)
             strain_unmapped_reads_dict[strain_name] = unmapped_reads
         return strain_unmapped_reads_dict
 
@@ -641,12 +1071,14 @@ class VCFMethods(object):
                                  sampleerr=os.path.join(strain_folder, 'log.err'))
 
     @staticmethod
-    def run_qualimap(strain_sorted_bam_dict, strain_name_dict, logfile):
+    def run_qualimap(strain_sorted_bam_dict, strain_name_dict, logfile, threads=None):
         """
         Run qualimap on the sorted BAM files
         :param strain_sorted_bam_dict: type DICT: Dictionary of strain name: absolute path of sorted BAM file
         :param strain_name_dict: type DICT: Dictionary of strain name: absolute path of strain-specific working folder
         :param logfile: type STR: Absolute path of logfile basename
+        :param threads: type INT: Number of threads to request for the analyses. If not supplied, qualimap uses all
+        the available cores
         :return: strain_qualimap_report_dict: Dictionary of strain name: absolute path of qualimap report
         """
         # Initialise the dictionary to store the absolute path of the qualimap report
@@ -663,6 +1095,8 @@ class VCFMethods(object):
             qualimap_cmd = 'qualimap bamqc -bam {sorted_bam} -outdir {qualimap_out_dir}' \
                 .format(sorted_bam=sorted_bam,
                         qualimap_out_dir=qualimap_output_dir)
+            if threads is not None:
+                qualimap_cmd += ' -nt {threads}'.format(threads=threads)
             # Run the system call if the qualimap report does not exist
             if not os.path.isfile(qualimap_report):
                 out, err = run_subprocess(qualimap_cmd)
@@ -899,7 +1333,7 @@ class VCFMethods(object):
     def deepvariant_postprocess_variants_multiprocessing(strain_call_variants_dict, strain_variant_path_dict,
                                                          strain_name_dict, strain_reference_abs_path_dict,
                                                          strain_gvcf_tfrecords_dict, vcf_path, home, logfile, threads,
-                                                         deepvariant_version, working_path=None):
+                                                         deepvariant_version, working_path=None, pool=None):
         """
         Create .gvcf.gz outputs
         :param strain_call_variants_dict: type DICT: Dictionary of strain name: absolute path to deepvariant
@@ -916,37 +1350,54 @@ class VCFMethods(object):
         :param threads: type INT: Number of concurrent processes to spawn
         :param deepvariant_version: type STR: Version number of deepvariant docker image to use
         :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param pool: type multiprocessing.Pool: Pipeline-wide pool created with PoolMethods.create_pool. If not
+        supplied, a pool is created for this stage
         :return: strain_vcf_dict: Dictionary of strain name: absolute path to deepvariant output VCF file
         """
         # Initialise a dictionary to store the absolute path of the .vcf.gz output files
         strain_vcf_dict = dict()
-        # Create a multiprocessing pool. Limit the number of processes to the number of threads
-        p = multiprocessing.Pool(processes=threads)
-        # Create a list of all the strain names
-        strain_list = [strain_name for strain_name in strain_call_variants_dict]
-        # Determine the number of strains present in the analyses
-        list_length = len(strain_list)
-        # Use multiprocessing.Pool.starmap to process the samples in parallel
-        # Supply the list of strains, as well as a list the length of the number of strains of each required variable
-        for vcf_dict in p.starmap(VCFMethods.deepvariant_postprocess_variants,
-                                  zip(strain_list,
-                                      [strain_call_variants_dict] * list_length,
-                                      [strain_variant_path_dict] * list_length,
-                                      [strain_name_dict] * list_length,
-                                      [strain_reference_abs_path_dict] * list_length,
-                                      [strain_gvcf_tfrecords_dict] * list_length,
-                                      [vcf_path] * list_length,
-                                      [home] * list_length,
-                                      [logfile] * list_length,
-                                      [deepvariant_version] * list_length,
-                                      [working_path] * list_length)):
-            # Update the dictionaries
-            strain_vcf_dict.update(vcf_dict)
-        # Close and join the pool
-        p.close()
-        p.join()
+        with PoolMethods.worker_pool(threads=threads, pool=pool) as p:
+            # Send the variables shared by every strain to each worker once, rather than with every strain
+            PoolMethods.broadcast(pool=p,
+                                  context={'strain_call_variants_dict': strain_call_variants_dict,
+                                           'strain_variant_path_dict': strain_variant_path_dict,
+                                           'strain_name_dict': strain_name_dict,
+                                           'strain_reference_abs_path_dict': strain_reference_abs_path_dict,
+                                           'strain_gvcf_tfrecords_dict': strain_gvcf_tfrecords_dict,
+                                           'vcf_path': vcf_path,
+                                           'home': home,
+                                           'logfile': logfile,
+                                           'deepvariant_version': deepvariant_version,
+                                           'working_path': working_path})
+            # Process the samples in parallel
+            for vcf_dict in p.imap(VCFMethods.deepvariant_postprocess_variants_worker, strain_call_variants_dict):
+                # Update the dictionaries
+                strain_vcf_dict.update(vcf_dict)
+            # Release the broadcast variables held by the workers
+            PoolMethods.broadcast(pool=p,
+                                  context=dict())
         return strain_vcf_dict
 
+    @staticmethod
+    def deepvariant_postprocess_variants_worker(strain_name):
+        """
+        Run deepvariant_postprocess_variants on a single strain using the variables broadcast to the worker
+        :param strain_name: type STR: Name of strain being processed
+        :return: strain_vcf_dict: Dictionary of strain name: absolute path to deepvariant output VCF file
+        """
+        return VCFMethods.deepvariant_postprocess_variants(
+            strain_name=strain_name,
+            strain_call_variants_dict=worker_context['strain_call_variants_dict'],
+            strain_variant_path_dict=worker_context['strain_variant_path_dict'],
+            strain_name_dict=worker_context['strain_name_dict'],
+            strain_reference_abs_path_dict=worker_context['strain_reference_abs_path_dict'],
+            strain_gvcf_tfrecords_dict=worker_context['strain_gvcf_tfrecords_dict'],
+            vcf_path=worker_context['vcf_path'],
+            home=worker_context['home'],
+            logfile=worker_context['logfile'],
+            deepvariant_version=worker_context['deepvariant_version'],
+            working_path=worker_context['working_path'])
+
     @staticmethod
     def deepvariant_postprocess_variants(strain_name, strain_call_variants_dict, strain_variant_path_dict,
                                          strain_name_dict, strain_reference_abs_path_dict, strain_gvcf_tfrecords_dict,
@@ -1104,11 +1555,13 @@ class VCFMethods(object):
             # Set the absolute path to, and create the freebayes working directory
             freebayes_out_dir = os.path.join(strain_folder, 'freebayes')
             make_path(freebayes_out_dir)
-            # Set the name of the output .vcf file
+            # Set the name of the output .vcf file, as well as the name of the file once it has been compressed
             freebayes_out_vcf = os.path.join(freebayes_out_dir, '{sn}.gvcf'.format(sn=strain_name))
+            compressed_vcf = freebayes_out_vcf + '.gz'
             # Create the system call to freebayes-parallel
             # Use the regions file to allow for parallelism
-            # Output in gVCF format with --gvcf, and emit records for all bases with --gvcf-dont-use-chunk true
+            # Output in gVCF format with --gvcf, and emit records for all bases with --gvcf-dont-use-chunk true.
+            # Write to a temporary file that is renamed once freebayes-parallel succeeds
             freebayes_cmd = 'freebayes-parallel {ref_regions} {threads} --strict-vcf --gvcf ' \
                             '--gvcf-dont-use-chunk true --use-best-n-alleles 1 -f {ref_genome} {sorted_bam} ' \
                             '> {out_vcf}' \
@@ -1116,19 +1569,26 @@ class VCFMethods(object):
                         ref_genome=ref_genome,
                         threads=threads,
                         sorted_bam=sorted_bam,
-                        out_vcf=freebayes_out_vcf)
-            # Run the system call if the .vcf file does not exist
-            if not os.path.isfile(freebayes_out_vcf):
-                out, err = run_subprocess(freebayes_cmd)
+                        out_vcf=ManifestMethods.temp_output(output_file=freebayes_out_vcf))
+            # Run the system call if neither the .vcf file nor the compressed .vcf file exist
+            if not os.path.isfile(freebayes_out_vcf) and not os.path.isfile(compressed_vcf):
+                out, err, returncode = ManifestMethods.run_command(command=freebayes_cmd)
                 # Write STDOUT and STDERR to the logfile
                 write_to_logfile(out=out,
                                  err=err,
                                  logfile=logfile,
                                  samplelog=os.path.join(strain_folder, 'log.out'),
                                  sampleerr=os.path.join(strain_folder, 'log.err'))
+                # The output of a failed system call is removed rather than committed
+                ManifestMethods.commit_output(temp_file=ManifestMethods.temp_output(output_file=freebayes_out_vcf),
+                                              output_file=freebayes_out_vcf,
+                                              returncode=returncode,
+                                              command=freebayes_cmd)
             if os.path.isfile(freebayes_out_vcf):
                 # Populate the dictionary with the path to the .vcf file
                 strain_vcf_dict[strain_name] = freebayes_out_vcf
+            elif os.path.isfile(compressed_vcf):
+                strain_vcf_dict[strain_name] = compressed_vcf
         return strain_vcf_dict
 
     @staticmethod
@@ -1136,7 +1596,8 @@ class VCFMethods(object):
         """
         Parse the .vcf file. Filter positions with QUAL < 150, and count the number of high
         quality SNPs (QUAL >= 150, and reference length = 1 (not an indel)). Also store indels and zero coverage
-        regions. Overwrite the original file
+        regions. Overwrite the original file. Files that were already compressed with bgzip have been filtered, so
+        the high quality SNPs are only counted
         :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to .vcf file
         :return: strain_num_high_quality_snps_dict: Dictionary of strain name: number of high quality SNPs
         """
@@ -1144,6 +1605,24 @@ class VCFMethods(object):
         # .vcf file
         strain_num_high_quality_snps_dict = dict()
         for strain_name, vcf_file in strain_vcf_dict.items():
+            # Compressed files were filtered before being compressed
+            if vcf_file.endswith('.gz'):
+                strain_num_high_quality_snps_dict[strain_name] = 0
+                try:
+                    with gzip.open(vcf_file, 'rt') as filtered:
+                        for line in filtered:
+                            if not line.startswith('#'):
+                                ref_genome, pos, id_stat, ref, alt_string, qual, filter_stat, info_string, \
+                                    format_stat, strain = line.rstrip().split('\t')
+                                # Find the depth entry. e.g. DP=11
+                                depth_group = re.search('(DP=[0-9]+)', info_string)
+                                depth = int(str(depth_group.group()).split('=')[1])
+                                # Count the high quality SNPs with the same criteria used when filtering
+                                if depth != 0 and len(ref) == 1 and float(qual) >= 150:
+                                    strain_num_high_quality_snps_dict[strain_name] += 1
+                except FileNotFoundError:
+                    pass
+                continue
             try:
                 # Set the absolute path of the filtered .vcf file (replace the .vcf extension with _filtered.vcf)
                 filtered_vcf = vcf_file.replace('.gvcf', '_filtered.gvcf')
@@ -1187,10 +1666,50 @@ class VCFMethods(object):
                 pass
         return strain_num_high_quality_snps_dict
 
+    @staticmethod
+    def index_vcf_files(strain_vcf_dict, logfile):
+        """
+        Compress the .vcf files with bgzip, and index them with tabix, so that only the regions of interest need to be
+        read when creating phylogenetic trees. deepvariant gVCF files are already BGZF-compressed, and only need to be
+        indexed
+        :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to .vcf files
+        :param logfile: type STR: Absolute path to logfile basename
+        :return: strain_indexed_vcf_dict: Dictionary of strain name: absolute path to compressed .vcf file. The
+        uncompressed file is retained if it could not be compressed
+        """
+        # Initialise a dictionary to store the absolute path to the compressed .vcf files
+        strain_indexed_vcf_dict = dict()
+        for strain_name, vcf_file in strain_vcf_dict.items():
+            # Set the name of the compressed file
+            compressed_vcf = vcf_file if vcf_file.endswith('.gz') else vcf_file + '.gz'
+            # Compress the file with bgzip (which removes the uncompressed file). Use -f to overwrite any partial
+            # outputs of previous attempts
+            if not os.path.isfile(compressed_vcf) and os.path.isfile(vcf_file):
+                bgzip_cmd = 'bgzip -f {vcf_file}'.format(vcf_file=vcf_file)
+                out, err = run_subprocess(bgzip_cmd)
+                # Write STDOUT and STDERR to the logfile
+                write_to_logfile(out=out,
+                                 err=err,
+                                 logfile=logfile)
+            # Create the tabix index (-p vcf uses the END tag of gVCF blocks to determine their span)
+            if os.path.isfile(compressed_vcf) and not os.path.isfile(compressed_vcf + '.tbi'):
+                tabix_cmd = 'tabix -f -p vcf {compressed_vcf}'.format(compressed_vcf=compressed_vcf)
+                out, err = run_subprocess(tabix_cmd)
+                # Write STDOUT and STDERR to the logfile
+                write_to_logfile(out=out,
+                                 err=err,
+                                 logfile=logfile)
+            # Populate the dictionary with the compressed file if it exists, otherwise keep the original file
+            if os.path.isfile(compressed_vcf):
+                strain_indexed_vcf_dict[strain_name] = compressed_vcf
+            else:
+                strain_indexed_vcf_dict[strain_name] = vcf_file
+        return strain_indexed_vcf_dict
+
     @staticmethod
     def copy_vcf_files(strain_vcf_dict, vcf_path):
         """
-        Create a folder with copies of the .vcf files
+        Create a folder with copies of the .vcf files, as well as their tabix indexes if present
         :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to .vcf files
         :param vcf_path: type STR: Absolute path to folder in which all .gvcf.gz files are to be copied
         :return:
@@ -1202,6 +1721,10 @@ class VCFMethods(object):
             if os.path.isfile(vcf_file):
                 shutil.copyfile(src=vcf_file,
                                 dst=os.path.join(vcf_path, vcf_file_name))
+                # Copy the index after the file, so that the index is never older than the file it indexes
+                if os.path.isfile(vcf_file + '.tbi'):
+                    shutil.copyfile(src=vcf_file + '.tbi',
+                                    dst=os.path.join(vcf_path, vcf_file_name + '.tbi'))
 
     @staticmethod
     def bait_spoligo(strain_fastq_dict, strain_name_dict, spoligo_file, threads, logfile, kmer=25):
@@ -1390,9 +1913,10 @@ class VCFMethods(object):
         """
         # Initialise the dictionary to store the extracted sbcode
         strain_sbcode_dict = dict()
-        for strain_name, reference_abs_path in strain_reference_dep_path_dict.items():
-            # Extract the octal code from the dictionary
-            strain_octal_code = strain_octal_code_dict[strain_name]
+        # Only the spoligotyped strains have an octal code
+        for strain_name, strain_octal_code in strain_octal_code_dict.items():
+            # Extract the reference dependency folder from the dictionary
+            reference_abs_path = strain_reference_dep_path_dict[strain_name]
             # Set the absolute path of the spoligotype db file
             spoligo_db_file = os.path.join(reference_abs_path, 'spoligotype_db.txt')
             # Create a dictionary to store the octal code: sbcode pairs extracted from the file
@@ -1410,6 +1934,22 @@ class VCFMethods(object):
                 strain_sbcode_dict[strain_name] = 'ND'
         return strain_sbcode_dict
 
+    @staticmethod
+    def mlst_reads_folder(strain_fastq_dict, mlst_strains, mlst_path):
+        """
+        Create a folder of relative symlinks to the FASTQ files of the strains to type with MLST, so that the MLST
+        analyses are only performed on those strains
+        :param strain_fastq_dict: type DICT: Dictionary of strain name: list of absolute path(s) of FASTQ file(s)
+        :param mlst_strains: type LIST: Names of the strains to type
+        :param mlst_path: type STR: Absolute path of the folder to create
+        """
+        make_path(mlst_path)
+        for strain_name in mlst_strains:
+            for fastq_file in strain_fastq_dict[strain_name]:
+                # The links keep the names of the original files, so that the strain names are unchanged
+                relative_symlink(src_file=fastq_file,
+                                 output_dir=mlst_path)
+
     @staticmethod
     def brucella_mlst(seqpath, mlst_db_path, logfile):
         """
@@ -1441,19 +1981,21 @@ class VCFMethods(object):
         """
         # Initialise a dictionary to store the parsed MLST results
         strain_mlst_dict = dict()
-        # Open the MLST report file
-        with open(mlst_report, 'r') as report:
-            # Skip the header line
-            next(report)
-            for line in report:
-                # Split the line on commas
-                data = line.rstrip().split(',')
-                # Extract the sequence type and the number of matches to the sequence type from the line. Populate the
-                # dictionary with these values
-                strain_mlst_dict[data[0]] = {
-                    'sequence_type': data[2],
-                    'matches': data[3],
-                }
+        # The report is absent if none of the strains were typed
+        if os.path.isfile(mlst_report):
+            # Open the MLST report file
+            with open(mlst_report, 'r') as report:
+                # Skip the header line
+                next(report)
+                for line in report:
+                    # Split the line on commas
+                    data = line.rstrip().split(',')
+                    # Extract the sequence type and the number of matches to the sequence type from the line. Populate
+                    # the dictionary with these values
+                    strain_mlst_dict[data[0]] = {
+                        'sequence_type': data[2],
+                        'matches': data[3],
+                    }
         # If the strain did not have MLST outputs, populate negative 'ND' values for the sequence type and number
         # of matches
         for strain in strain_name_dict:
@@ -1470,7 +2012,7 @@ class VCFMethods(object):
                           strain_average_quality_dict, strain_qual_over_thirty_dict, strain_qualimap_outputs_dict,
                           strain_avg_read_lengths, strain_unmapped_contigs_dict, strain_num_high_quality_snps_dict,
                           strain_mlst_dict, strain_octal_code_dict, strain_sbcode_dict, strain_hexadecimal_code_dict,
-                          strain_binary_code_dict, report_path):
+                          strain_binary_code_dict, report_path, strain_coverage_dict=None):
         """
         Create an Excel report of the vcf outputs
         :param start_time: type datetime.now(): Datetime object
@@ -1497,6 +2039,8 @@ class VCFMethods(object):
         :param strain_binary_code_dict: type DICT: Dictionary of strain name: string of presence/absence of all spacer
         sequences
         :param report_path: type STR: Absolute path to path in which reports are to be created
+        :param strain_coverage_dict: type DICT: Dictionary of strain name: dictionary of 'estimated' and 'effective'
+        coverage of the reads. The effective coverage is the coverage of the (optionally downsampled) mapped reads
         :return: vcf_report: Absolute path to the Excel report
         """
         # Create a date string consistent with classic vSNP
@@ -1508,7 +2052,8 @@ class VCFMethods(object):
         header_list = ['time_stamp', 'sample_name', 'species', 'reference_sequence_name', 'R1size', 'R2size',
                        'Q_ave_R1', 'Q_ave_R2', 'Q30_R1', 'Q30_R2', 'allbam_mapped_reads', 'genome_coverage',
                        'ave_coverage', 'ave_read_length', 'unmapped_reads', 'unmapped_assembled_contigs',
-                       'good_snp_count', 'mlst_type', 'octalcode', 'sbcode', 'hexadecimal_code', 'binarycode']
+                       'good_snp_count', 'mlst_type', 'octalcode', 'sbcode', 'hexadecimal_code', 'binarycode',
+                       'effective_coverage']
         # Create a workbook to store the report using xlsxwriter.
         workbook = xlsxwriter.Workbook(vcf_report)
         # New worksheet to store the data
@@ -1550,12 +2095,13 @@ class VCFMethods(object):
                 num_unmapped_contigs = strain_unmapped_contigs_dict[strain_name]
                 high_quality_snps = strain_num_high_quality_snps_dict[strain_name]
                 ml_seq_type = strain_mlst_dict[strain_name]['sequence_type']
-                octal_code = strain_octal_code_dict[strain_name]
-                sbcode = strain_sbcode_dict[strain_name]
-                hex_code = strain_hexadecimal_code_dict[strain_name]
-                binary_code = strain_binary_code_dict[strain_name]
-                # Brucella will not have a 'real' octal code. Find this string and replace it with 'ND'. Set
-                # the hex_code and binary codes to for this Brucella strain to 'ND'
+                # Only strains of the Mycobacterium tuberculosis complex are spoligotyped
+                octal_code = strain_octal_code_dict.get(strain_name, 'ND')
+                sbcode = strain_sbcode_dict.get(strain_name, 'ND')
+                hex_code = strain_hexadecimal_code_dict.get(strain_name, 'ND')
+                binary_code = strain_binary_code_dict.get(strain_name, 'ND')
+                # Strains without any of the spacers will not have a 'real' octal code. Find this string and replace it
+                # with 'ND'. Set the hex_code and binary codes for this strain to 'ND'
                 octal_code = octal_code if octal_code != '000000000000000' else 'ND'
                 hex_code = hex_code if octal_code != 'ND' else 'ND'
                 binary_code = binary_code if octal_code != 'ND' else 'ND'
@@ -1583,12 +2129,15 @@ class VCFMethods(object):
                 reverse_size = 'ND'
                 reverse_avg_quality = 'ND'
                 reverse_perc_reads_over_thirty = 'ND'
+            # The coverage is only estimated for strains with a reference genome
+            effective_coverage = '{:.2f}'.format(strain_coverage_dict[strain_name]['effective']) \
+                if strain_coverage_dict and strain_name in strain_coverage_dict else 'ND'
             # Populate the list with the required data
             data_list = [start, strain_name, strain_species, best_ref, forward_size, reverse_size, forward_avg_quality,
                          reverse_avg_quality, forward_perc_reads_over_thirty, reverse_perc_reads_over_thirty,
                          mapped_reads,
                          genome_coverage, avg_cov_depth, avg_read_length, unmapped_reads, num_unmapped_contigs,
-                         high_quality_snps, ml_seq_type, octal_code, sbcode, hex_code, binary_code]
+                         high_quality_snps, ml_seq_type, octal_code, sbcode, hex_code, binary_code, effective_coverage]
             # Write out the data to the spreadsheet
             for results in data_list:
                 worksheet.write(row, col, results, courier)
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
 from vsnp.install_dependencies import install_deps
+from vsnp.vsnp_cache_methods import CacheMethods, cache_steps, default_cache_size
+from vsnp.vsnp_downsample_methods import downsample_seed
+from vsnp.vsnp_manifest_methods import ManifestMethods
+from vsnp.vsnp_qc_methods import QCMethods
+from vsnp.vsnp_scheduler_methods import SchedulerMethods
 from vsnp.vsnp_vcf_methods import VCFMethods
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 import subprocess
+import threading
 import logging
 import os
 
@@ -17,10 +24,9 @@ class VCF(object):
         Run all the VCF-specific methods
         """
         self.fastq_manipulation()
-        self.best_reference_calculation()
-        self.reference_mapping()
+        self.strain_pipelines()
+        self.strain_routing()
         self.stat_calculation()
-        self.snp_calling()
         self.typing()
         self.report()
 
@@ -42,37 +48,49 @@ class VCF(object):
                 symlinks='\n'.join(['{strain_name}: {fastq_files}'.format(strain_name=sn, fastq_files=ff)
                                     for sn, ff in self.strain_fastq_dict.items()])))
 
-    def best_reference_calculation(self):
+    def strain_pipelines(self):
         """
-        Determine the best reference using MASH
+        Run the per-strain steps as a dependency graph. The steps of several strains run at once, within the budget
+        of threads and memory of the analyses
         """
-        logging.info('Running MASH analyses')
-        fastq_sketch_dict = VCFMethods.call_mash_sketch(strain_fastq_dict=self.strain_fastq_dict,
-                                                        strain_name_dict=self.strain_name_dict,
-                                                        logfile=self.logfile)
-        logging.debug(
-            'Strain-specific MASH sketch files: \n{files}'.format(
-                files='\n'.join(['{strain_name}: {sketch_file}'.format(strain_name=sn, sketch_file=sf)
-                                 for sn, sf in fastq_sketch_dict.items()])))
-        logging.info('Parsing MASH outputs to determine closest reference genomes')
-        mash_dist_dict = VCFMethods.call_mash_dist(strain_fastq_dict=self.strain_fastq_dict,
-                                                   strain_name_dict=self.strain_name_dict,
-                                                   fastq_sketch_dict=fastq_sketch_dict,
-                                                   ref_sketch_file=os.path.join(
-                                                       self.dependency_path, 'mash', 'vsnp_reference.msh'),
-                                                   logfile=self.logfile)
-        logging.debug(
-            'Strain-specific MASH output tables: \n{files}'.format(
-                files='\n'.join(['{strain_name}: {table}'.format(strain_name=sn, table=tf)
-                                 for sn, tf in mash_dist_dict.items()])))
         logging.info('Loading reference genome: species dictionary')
-        accession_species_dict = VCFMethods.parse_mash_accession_species(mash_species_file=os.path.join(
+        self.accession_species_dict = VCFMethods.parse_mash_accession_species(mash_species_file=os.path.join(
             self.dependency_path, 'mash', 'species_accessions.csv'))
-        logging.info('Determining closest reference genome and extracting corresponding species from MASH outputs')
-        self.strain_best_ref_dict, self.strain_ref_matches_dict, self.strain_species_dict = \
-            VCFMethods.mash_best_ref(mash_dist_dict=mash_dist_dict,
-                                     accession_species_dict=accession_species_dict,
-                                     min_matches=self.matching_hashes)
+        task_dict = dict()
+        # The sketches of all the strains are compared to the reference genomes at once, after every strain is sketched
+        SchedulerMethods.add_task(task_dict=task_dict,
+                                  name='mash_dist',
+                                  function=self.batch_reference,
+                                  depends=['{sn}:reads'.format(sn=strain_name)
+                                           for strain_name in self.strain_fastq_dict],
+                                  threads=self.step_resources['mash_dist']['threads'],
+                                  memory=self.step_resources['mash_dist']['memory'])
+        for strain_name in self.strain_fastq_dict:
+            # Each task is named with the strain name and the step e.g. 13-1941:mapping
+            for step, function, depends in self.strain_steps(strain_name=strain_name):
+                SchedulerMethods.add_task(task_dict=task_dict,
+                                          name='{sn}:{step}'.format(sn=strain_name,
+                                                                    step=step),
+                                          function=partial(self.run_step, strain_name, step, function),
+                                          depends=['{sn}:{step}'.format(sn=strain_name,
+                                                                        step=dependency) for dependency in depends] +
+                                          (['mash_dist'] if step == 'reference' else list()),
+                                          threads=self.step_resources[step]['threads'],
+                                          memory=self.step_resources[step]['memory'])
+        logging.info('Running {num} analyses of {strains} strains with {threads} threads and {memory:.1f} GB of memory'
+                     .format(num=len(task_dict),
+                             strains=len(self.strain_fastq_dict),
+                             threads=self.threads,
+                             memory=self.memory))
+        if self.cache_path:
+            logging.info('Reusing and storing sketches, BAM files, and gVCF files in the cache {cache}'
+                         .format(cache=self.cache_path))
+        task_seconds = SchedulerMethods.run_tasks(task_dict=task_dict,
+                                                  threads=self.threads,
+                                                  memory=self.memory)[1]
+        logging.debug('Analysis run times: \n{times}'.format(
+            times='\n'.join(['{task}: {seconds:.1f} s'.format(task=task, seconds=seconds)
+                             for task, seconds in task_seconds.items()])))
         logging.debug(
             'Strain-specific MASH-calculated best reference file: \n{files}'.format(
                 files='\n'.join(['{strain_name}: {best_ref}'.format(strain_name=sn, best_ref=br)
@@ -81,71 +99,527 @@ class VCF(object):
             'Number of matches to strain-specific MASH-calculated best reference file: \n{files}'.format(
                 files='\n'.join(['{strain_name}: {num_matches}'.format(strain_name=sn, num_matches=nm)
                                  for sn, nm in self.strain_ref_matches_dict.items()])))
-        logging.debug(
-            'Species code for best reference file: \n{files}'.format(
-                files='\n'.join(['{strain_name}: {species_code}'.format(strain_name=sn, species_code=sc)
-                                 for sn, sc in self.strain_species_dict.items()])))
-
-    def reference_mapping(self):
-        """
-        Perform reference mapping with bowtie2, and attempt to assemble any unmapped reads into contigs with SKESA
-        """
-        logging.info('Extracting paths to reference genomes')
-        reference_link_path_dict, reference_link_dict \
-            = VCFMethods.reference_folder(strain_best_ref_dict=self.strain_best_ref_dict,
-                                          dependency_path=self.dependency_path)
-        logging.info('Indexing reference file for {rm} analyses'.format(rm=self.reference_mapper))
-        strain_mapper_index_dict, self.strain_reference_abs_path_dict, self.strain_reference_dep_path_dict = \
-            VCFMethods.index_ref_genome(reference_link_path_dict=reference_link_path_dict,
-                                        dependency_path=self.dependency_path,
-                                        logfile=self.logfile,
-                                        reference_mapper=self.reference_mapper)
-        logging.info('Performing reference mapping using {rm}'.format(rm=self.reference_mapper))
-        self.strain_sorted_bam_dict = VCFMethods.map_ref_genome(
-            strain_fastq_dict=self.strain_fastq_dict,
-            strain_name_dict=self.strain_name_dict,
-            strain_mapper_index_dict=strain_mapper_index_dict,
-            reference_mapper=self.reference_mapper,
-            threads=self.threads,
-            logfile=self.logfile)
         logging.debug('Sorted BAM files: \n{files}'.format(
                 files='\n'.join(['{strain_name}: {bam_file}'.format(strain_name=sn, bam_file=bf)
                                  for sn, bf in self.strain_sorted_bam_dict.items()])))
-        logging.info('Extracting unmapped reads')
+        logging.debug('Number high quality SNPs: \n{files}'.format(
+            files='\n'.join(['{strain_name}: {num_snps}'.format(strain_name=sn, num_snps=ns)
+                             for sn, ns in self.strain_num_high_quality_snps_dict.items()])))
+
+    def strain_steps(self, strain_name):
+        """
+        Set the steps of the analyses of a strain
+        :param strain_name: type STR: Name of the strain
+        :return: List of tuples of step name, method performing the step, and list of the steps it depends on. The
+        final variant calling step also filters, compresses, and indexes the gVCF file
+        """
+        steps = [('reads', self.strain_reads, list()),
+                 ('reference', self.strain_reference, ['reads']),
+                 ('spoligo', self.strain_spoligo, ['reference']),
+                 ('downsample', self.strain_downsample, ['reference']),
+                 ('mapping', self.strain_mapping, ['downsample']),
+                 ('assembly', self.strain_assembly, ['mapping']),
+                 ('qualimap', self.strain_qualimap, ['mapping'])]
+        if 'deepvariant' in self.variant_caller:
+            steps.extend([('make_examples', self.strain_make_examples, ['mapping']),
+                          ('call_variants', self.strain_call_variants, ['make_examples']),
+                          ('postprocess_variants', self.strain_postprocess_variants, ['call_variants'])])
+        else:
+            steps.append(('freebayes', self.strain_freebayes, ['mapping']))
+        return steps
+
+    def dependent_steps(self, strain_name, step):
+        """
+        Find every step of a strain that depends, directly or through other steps, on a step
+        :param strain_name: type STR: Name of the strain
+        :param step: type STR: Name of the step
+        :return: dependent_steps: List of the names of the dependent steps
+        """
+        dependent_steps = list()
+        for dependent, _, depends in self.strain_steps(strain_name=strain_name):
+            # The steps are listed after the steps they depend on, so a single pass finds the indirect dependents
+            if step in depends or set(depends).intersection(dependent_steps):
+                dependent_steps.append(dependent)
+        return dependent_steps
+
+    def run_step(self, strain_name, step, function):
+        """
+        Run a per-strain step, using the strain manifest to decide whether its existing outputs can be reused. If the
+        inputs, parameters, or tool versions of the step have changed since its outputs were recorded, or if the
+        outputs were never recorded (e.g. the previous run was interrupted), the outputs of the step and of every
+        step that depends on it are removed, so that they are recreated rather than reused
+        :param strain_name: type STR: Name of the strain
+        :param step: type STR: Name of the step
+        :param function: type CALLABLE: Method performing the step
+        """
+        step_checkpoint = self.step_checkpoint(strain_name=strain_name,
+                                               step=step)
+        # The strain does not have the inputs of the step e.g. no reference genome could be found
+        if step_checkpoint is None:
+            return function(strain_name)
+        inputs, parameters = step_checkpoint
+        step_outputs = VCFMethods.strain_step_outputs(strain_name=strain_name,
+                                                      strain_folder=self.strain_name_dict[strain_name],
+                                                      vcf_path=self.vcf_path)
+        manifest_file = os.path.join(self.strain_name_dict[strain_name], 'manifest.json')
+        step_signature = ManifestMethods.step_signature(inputs=inputs,
+                                                        parameters=parameters)
+        with self.manifest_lock:
+            manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+            step_valid = ManifestMethods.step_valid(step_record=manifest_dict.get(step),
+                                                    step_signature=step_signature)
+            if not step_valid:
+                invalid_steps = [step] + self.dependent_steps(strain_name=strain_name,
+                                                              step=step)
+                removed_files = ManifestMethods.remove_outputs(
+                    outputs=[output for invalid_step in invalid_steps for output in step_outputs[invalid_step]])
+                if removed_files:
+                    logging.debug('Removed outputs of invalidated step {sn}:{step}: \n{files}'
+                                  .format(sn=strain_name,
+                                          step=step,
+                                          files='\n'.join(removed_files)))
+                for invalid_step in invalid_steps:
+                    manifest_dict.pop(invalid_step, None)
+                ManifestMethods.write_manifest(manifest_file=manifest_file,
+                                               manifest_dict=manifest_dict)
+        cache_key = self.step_cache_key(strain_name=strain_name,
+                                        step=step,
+                                        inputs=inputs,
+                                        parameters=parameters)
+        # The outputs of the step are restored from the shared cache, so that the step finds them rather than
+        # recreating them
+        if cache_key and not step_valid:
+            restored_files = CacheMethods.restore_entry(cache_path=self.cache_path,
+                                                        key=cache_key,
+                                                        strain_folder=self.strain_name_dict[strain_name])
+            if restored_files:
+                logging.debug('Restored outputs of step {sn}:{step} from the cache: \n{files}'
+                              .format(sn=strain_name,
+                                      step=step,
+                                      files='\n'.join(restored_files)))
+        result = function(strain_name)
+        if cache_key and CacheMethods.store_entry(cache_path=self.cache_path,
+                                                  key=cache_key,
+                                                  step=step,
+                                                  strain_name=strain_name,
+                                                  strain_folder=self.strain_name_dict[strain_name],
+                                                  outputs=step_outputs[step]):
+            CacheMethods.evict_entries(cache_path=self.cache_path,
+                                       max_size=self.cache_size)
+        # Record the completed step. The manifest is read again, as the other steps of the strain may have updated it
+        with self.manifest_lock:
+            manifest_dict = ManifestMethods.read_manifest(manifest_file=manifest_file)
+            manifest_dict[step] = ManifestMethods.step_record(step_signature=step_signature,
+                                                              outputs=step_outputs[step])
+            ManifestMethods.write_manifest(manifest_file=manifest_file,
+                                           manifest_dict=manifest_dict)
+        return result
+
+    def step_cache_key(self, strain_name, step, inputs, parameters):
+        """
+        Create the key of the outputs of a per-strain step in the shared cache
+        :param strain_name: type STR: Name of the strain
+        :param step: type STR: Name of the step
+        :param inputs: type LIST: Absolute paths of the input files of the step
+        :param parameters: type DICT: Parameters and tool versions of the step
+        :return: Key of the outputs of the step, or None if the cache is not used, or the step is not cached
+        """
+        if not self.cache_path or step not in cache_steps:
+            return None
+        return CacheMethods.cache_key(cache_path=self.cache_path,
+                                      step=step,
+                                      strain_name=strain_name,
+                                      inputs=inputs,
+                                      parameters=parameters)
+
+    def step_checkpoint(self, strain_name, step):
+        """
+        Set the input files and the parameters of a per-strain step, which together determine whether the recorded
+        outputs of the step are still valid. The parameters include the versions of the tools used in the step
+        :param strain_name: type STR: Name of the strain
+        :param step: type STR: Name of the step
+        :return: Tuple of list of the absolute paths of the input files, and dictionary of the parameters, or None if
+        the strain does not have the inputs of the step
+        """
+        fastq_files = self.strain_fastq_dict[strain_name]
+        if step == 'reads':
+            return fastq_files, {'versions': [ManifestMethods.tool_version('mash --version')]}
+        if step == 'reference':
+            return [self.fastq_sketch_dict[strain_name],
+                    os.path.join(self.dependency_path, 'mash', 'vsnp_reference.msh')], \
+                {'versions': [ManifestMethods.tool_version('mash --version')]}
+        if step == 'spoligo':
+            if 'spoligo' not in self.strain_stages(strain_name=strain_name):
+                return None
+            return fastq_files + [os.path.join(self.dependency_path, 'mycobacterium', 'spacers.fasta'),
+                                  self.strain_reference_abs_path_dict[strain_name]], \
+                {'kmer': 25,
+                 'full_spoligo': self.full_spoligo}
+        if step == 'downsample':
+            if self.coverage is None or strain_name not in self.strain_reference_abs_path_dict:
+                return None
+            return fastq_files + [self.strain_reference_abs_path_dict[strain_name]], \
+                {'coverage': self.coverage,
+                 'seed': downsample_seed}
+        if step == 'mapping':
+            if strain_name not in self.strain_reference_abs_path_dict:
+                return None
+            # bwa does not have a version option, but prints its version in its usage
+            mapper_version = 'bowtie2 --version' if self.reference_mapper == 'bowtie2' else 'bwa'
+            # The downsampled reads are mapped if the reads of the strain were downsampled
+            return self.strain_mapping_fastq_dict.get(strain_name, fastq_files) + \
+                [self.strain_reference_abs_path_dict[strain_name]], \
+                {'reference_mapper': self.reference_mapper,
+                 'versions': [ManifestMethods.tool_version(mapper_version),
+                              ManifestMethods.tool_version('samtools --version')]}
+        # The remaining steps use the sorted BAM file
+        if strain_name not in self.strain_sorted_bam_dict:
+            return None
+        sorted_bam = self.strain_sorted_bam_dict[strain_name]
+        reference = self.strain_reference_abs_path_dict[strain_name]
+        if step == 'assembly':
+            return [sorted_bam], {'versions': [ManifestMethods.tool_version('samtools --version'),
+                                               ManifestMethods.tool_version('skesa --version')]}
+        if step == 'qualimap':
+            return [sorted_bam], {'versions': [ManifestMethods.tool_version('qualimap --version')]}
+        if step == 'freebayes':
+            return [sorted_bam, reference, self.strain_ref_regions_dict[strain_name]], \
+                {'versions': [ManifestMethods.tool_version('freebayes --version'),
+                              ManifestMethods.tool_version('bgzip --version')]}
+        step_outputs = VCFMethods.strain_step_outputs(strain_name=strain_name,
+                                                      strain_folder=self.strain_name_dict[strain_name],
+                                                      vcf_path=self.vcf_path)
+        if step == 'make_examples':
+            # The examples are split into one shard per thread
+            return [sorted_bam, reference], {'deepvariant_version': self.deepvariant_version,
+                                             'shards': self.step_resources['make_examples']['threads']}
+        if step == 'call_variants':
+            return ManifestMethods.expand_outputs(outputs=step_outputs['make_examples'][:1]), \
+                {'deepvariant_version': self.deepvariant_version,
+                 'variant_caller': self.variant_caller}
+        return ManifestMethods.expand_outputs(outputs=step_outputs['call_variants'] +
+                                              step_outputs['make_examples'][1:]) + [reference], \
+            {'deepvariant_version': self.deepvariant_version}
+
+    def batch_reference(self):
+        """
+        Compare the MASH sketches of all the strains to the reference genomes in a single MASH dist. The MASH dist
+        tables of the strains are only written in debug runs
+        """
+        self.batch_best_ref_dict, self.batch_ref_matches_dict, self.batch_species_dict, self.batch_mash_strains, \
+            self.batch_mash_lines_dict = \
+            VCFMethods.batch_mash_dist(fastq_sketch_dict=self.fastq_sketch_dict,
+                                       ref_sketch_file=os.path.join(self.dependency_path, 'mash', 'vsnp_reference.msh'),
+                                       accession_species_dict=self.accession_species_dict,
+                                       min_matches=self.matching_hashes,
+                                       threads=self.step_resources['mash_dist']['threads'],
+                                       logfile=self.logfile,
+                                       debug_tables=self.debug)
+        logging.debug('Strains compared to the reference genomes in a single MASH dist: \n{strains}'.format(
+            strains='\n'.join(sorted(self.batch_mash_strains))))
+
+    def strain_reference(self, strain_name):
+        """
+        Determine the closest reference genome of a strain from its MASH sketch, and index the reference genome
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name in self.batch_mash_strains:
+            strain_best_ref_dict, strain_ref_matches_dict, strain_species_dict = \
+                [{sn: value for sn, value in batch_dict.items() if sn == strain_name}
+                 for batch_dict in (self.batch_best_ref_dict, self.batch_ref_matches_dict, self.batch_species_dict)]
+            # The MASH dist table of the strain is written in debug runs. It is written here rather than with the
+            # single MASH dist, as the outputs of an invalidated step are removed immediately before the step runs
+            if strain_name in self.batch_mash_lines_dict:
+                VCFMethods.write_mash_table(mash_lines=self.batch_mash_lines_dict[strain_name],
+                                            mash_dist_table=os.path.join(self.strain_name_dict[strain_name], 'mash',
+                                                                         '{sn}_mash.tab'.format(sn=strain_name)))
+        else:
+            # Sketches created by previous versions do not have the strain name as their ID, so they are compared to
+            # the reference genomes individually
+            mash_dist_dict = \
+                VCFMethods.call_mash_dist(strain_fastq_dict={strain_name: self.strain_fastq_dict[strain_name]},
+                                          strain_name_dict=self.strain_name_dict,
+                                          fastq_sketch_dict=self.fastq_sketch_dict,
+                                          ref_sketch_file=os.path.join(
+                                              self.dependency_path, 'mash', 'vsnp_reference.msh'),
+                                          logfile=self.logfile)
+            strain_best_ref_dict, strain_ref_matches_dict, strain_species_dict = \
+                VCFMethods.mash_best_ref(mash_dist_dict=mash_dist_dict,
+                                         accession_species_dict=self.accession_species_dict,
+                                         min_matches=self.matching_hashes)
+        self.strain_best_ref_dict.update(strain_best_ref_dict)
+        self.strain_ref_matches_dict.update(strain_ref_matches_dict)
+        self.strain_species_dict.update(strain_species_dict)
+        # Strains without a sufficiently close reference genome are not mapped
+        if strain_name not in strain_best_ref_dict:
+            return
+        reference_link_path_dict = VCFMethods.reference_folder(strain_best_ref_dict=strain_best_ref_dict,
+                                                               dependency_path=self.dependency_path)[0]
+        # Strains sharing a reference genome must not create its index files at the same time
+        with self.reference_lock(reference=reference_link_path_dict[strain_name]):
+            strain_mapper_index_dict, strain_reference_abs_path_dict, strain_reference_dep_path_dict = \
+                VCFMethods.index_ref_genome(reference_link_path_dict=reference_link_path_dict,
+                                            dependency_path=self.dependency_path,
+                                            logfile=self.logfile,
+                                            reference_mapper=self.reference_mapper)
+            if 'deepvariant' not in self.variant_caller:
+                self.strain_ref_regions_dict.update(
+                    VCFMethods.reference_regions(strain_reference_abs_path_dict=strain_reference_abs_path_dict,
+                                                 logfile=self.logfile))
+        self.strain_mapper_index_dict.update(strain_mapper_index_dict)
+        self.strain_reference_abs_path_dict.update(strain_reference_abs_path_dict)
+        self.strain_reference_dep_path_dict.update(strain_reference_dep_path_dict)
+
+    def reference_lock(self, reference):
+        """
+        Find the lock of a reference genome, creating it as required
+        :param reference: type STR: Relative path to the reference genome
+        :return: threading.Lock of the reference genome
+        """
+        with self.reference_locks_lock:
+            if reference not in self.reference_locks:
+                self.reference_locks[reference] = threading.Lock()
+            return self.reference_locks[reference]
+
+    def strain_reads(self, strain_name):
+        """
+        Read the FASTQ files of a strain once, and stream the reads to MASH sketch, and to the counting of the base
+        qualities and read lengths
+        :param strain_name: type STR: Name of the strain
+        """
+        fastq_sketch_dict, strain_read_stats_dict = \
+            VCFMethods.fanout_reads(strain_fastq_dict={strain_name: self.strain_fastq_dict[strain_name]},
+                                    strain_name_dict=self.strain_name_dict,
+                                    logfile=self.logfile)
+        self.fastq_sketch_dict.update(fastq_sketch_dict)
+        self.strain_read_stats_dict.update(strain_read_stats_dict)
+
+    def strain_stages(self, strain_name):
+        """
+        Determine the species-specific stages of the analyses to which a strain is passed. Before its reference
+        genome is determined, a strain is not passed to any of the stages
+        :param strain_name: type STR: Name of the strain
+        :return: List of the names of the stages e.g. ['mapping', 'spoligo']
+        """
+        strain_route_dict = VCFMethods.route_strains(strain_names=[strain_name],
+                                                     strain_species_dict=self.strain_species_dict,
+                                                     strain_best_ref_dict=self.strain_best_ref_dict)
+        return [stage for stage, strains in strain_route_dict.items() if strains and stage != 'unmatched']
+
+    def strain_spoligo(self, strain_name):
+        """
+        Bait the spoligotyping spacer sequences from the reads of a strain of the Mycobacterium tuberculosis complex.
+        The spoligotype of other species is irrelevant, so they are skipped
+        :param strain_name: type STR: Name of the strain
+        """
+        if 'spoligo' not in self.strain_stages(strain_name=strain_name):
+            return
+        strain_spoligo_stats_dict, strain_spoligo_reads_dict = \
+            VCFMethods.spoligo_reads(strain_fastq_dict={strain_name: self.strain_fastq_dict[strain_name]},
+                                     strain_name_dict=self.strain_name_dict,
+                                     strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+                                     spoligo_file=os.path.join(self.dependency_path, 'mycobacterium', 'spacers.fasta'),
+                                     full_spoligo=self.full_spoligo,
+                                     kmer=25)
+        self.strain_spoligo_stats_dict.update(strain_spoligo_stats_dict)
+        self.strain_spoligo_reads_dict.update(strain_spoligo_reads_dict)
+
+    def strain_downsample(self, strain_name):
+        """
+        Estimate the coverage of the reads of a strain, and downsample the reads to the requested coverage
+        :param strain_name: type STR: Name of the strain
+        """
+        if 'mapping' not in self.strain_stages(strain_name=strain_name):
+            return
+        strain_coverage_dict, strain_mapping_fastq_dict = \
+            VCFMethods.downsample_strain_reads(strain_fastq_dict={strain_name: self.strain_fastq_dict[strain_name]},
+                                               strain_name_dict=self.strain_name_dict,
+                                               strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+                                               strain_read_stats_dict=self.strain_read_stats_dict,
+                                               coverage=self.coverage)
+        self.strain_coverage_dict.update(strain_coverage_dict)
+        self.strain_mapping_fastq_dict.update(strain_mapping_fastq_dict)
+
+    def strain_mapping(self, strain_name):
+        """
+        Map the reads of a strain to its closest reference genome, and index the sorted BAM file
+        :param strain_name: type STR: Name of the strain
+        """
+        if 'mapping' not in self.strain_stages(strain_name=strain_name):
+            return
+        strain_sorted_bam_dict = VCFMethods.map_ref_genome(
+            strain_fastq_dict={strain_name: self.strain_mapping_fastq_dict.get(strain_name,
+                                                                               self.strain_fastq_dict[strain_name])},
+            strain_name_dict=self.strain_name_dict,
+            strain_mapper_index_dict=self.strain_mapper_index_dict,
+            reference_mapper=self.reference_mapper,
+            threads=self.step_resources['mapping']['threads'],
+            logfile=self.logfile)
+        VCFMethods.samtools_index(strain_sorted_bam_dict=strain_sorted_bam_dict,
+                                  strain_name_dict=self.strain_name_dict,
+                                  threads=self.step_resources['mapping']['threads'],
+                                  logfile=self.logfile)
+        self.strain_sorted_bam_dict.update(strain_sorted_bam_dict)
+
+    def strain_assembly(self, strain_name):
+        """
+        Extract the unmapped reads of a strain, and attempt to assemble them with SKESA
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_sorted_bam_dict:
+            return
         strain_unmapped_reads_dict = VCFMethods.extract_unmapped_reads(
-            strain_sorted_bam_dict=self.strain_sorted_bam_dict,
+            strain_sorted_bam_dict={strain_name: self.strain_sorted_bam_dict[strain_name]},
             strain_name_dict=self.strain_name_dict,
-            threads=self.threads,
+            threads=self.step_resources['assembly']['threads'],
             logfile=self.logfile)
-        logging.info('Attempting to assemble unmapped reads with SKESA')
-        self.strain_skesa_output_fasta_dict = VCFMethods.assemble_unmapped_reads(
+        self.strain_skesa_output_fasta_dict.update(VCFMethods.assemble_unmapped_reads(
             strain_unmapped_reads_dict=strain_unmapped_reads_dict,
             strain_name_dict=self.strain_name_dict,
-            threads=self.threads,
-            logfile=self.logfile)
-        logging.debug('SKESA assemblies: \n{files}'.format(
-            files='\n'.join(['{strain_name}: {assembly}'.format(strain_name=sn, assembly=af)
-                             for sn, af in self.strain_skesa_output_fasta_dict.items()])))
+            threads=self.step_resources['assembly']['threads'],
+            logfile=self.logfile))
+
+    def strain_qualimap(self, strain_name):
+        """
+        Run qualimap on the sorted BAM file of a strain
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_sorted_bam_dict:
+            return
+        self.strain_qualimap_report_dict.update(VCFMethods.run_qualimap(
+            strain_sorted_bam_dict={strain_name: self.strain_sorted_bam_dict[strain_name]},
+            strain_name_dict=self.strain_name_dict,
+            logfile=self.logfile,
+            threads=self.step_resources['qualimap']['threads']))
+
+    def strain_make_examples(self, strain_name):
+        """
+        Prepare the sorted BAM file of a strain for SNP calling with deepvariant make_examples
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_sorted_bam_dict:
+            return
+        strain_examples_dict, strain_variant_path_dict, strain_gvcf_tfrecords_dict = \
+            VCFMethods.deepvariant_make_examples(
+                strain_sorted_bam_dict={strain_name: self.strain_sorted_bam_dict[strain_name]},
+                strain_name_dict=self.strain_name_dict,
+                strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+                vcf_path=self.vcf_path,
+                home=self.home,
+                threads=self.step_resources['make_examples']['threads'],
+                logfile=self.logfile,
+                deepvariant_version=self.deepvariant_version)
+        self.strain_variant_path_dict.update(strain_variant_path_dict)
+        self.strain_gvcf_tfrecords_dict.update(strain_gvcf_tfrecords_dict)
+
+    def strain_call_variants(self, strain_name):
+        """
+        Call the variants of a strain with deepvariant call_variants
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_variant_path_dict:
+            return
+        # The examples are split into one shard per make_examples thread
+        self.strain_call_variants_dict.update(VCFMethods.deepvariant_call_variants(
+            strain_variant_path_dict={strain_name: self.strain_variant_path_dict[strain_name]},
+            strain_name_dict=self.strain_name_dict,
+            dependency_path=self.dependency_path,
+            vcf_path=self.vcf_path,
+            home=self.home,
+            threads=self.step_resources['make_examples']['threads'],
+            logfile=self.logfile,
+            variant_caller=self.variant_caller,
+            deepvariant_version=self.deepvariant_version))
+
+    def strain_postprocess_variants(self, strain_name):
+        """
+        Create the gVCF file of a strain with deepvariant postprocess_variants, and index and copy the file
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_call_variants_dict:
+            return
+        self.strain_vcf_dict.update(VCFMethods.deepvariant_postprocess_variants(
+            strain_name=strain_name,
+            strain_call_variants_dict=self.strain_call_variants_dict,
+            strain_variant_path_dict=self.strain_variant_path_dict,
+            strain_name_dict=self.strain_name_dict,
+            strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+            strain_gvcf_tfrecords_dict=self.strain_gvcf_tfrecords_dict,
+            vcf_path=self.vcf_path,
+            home=self.home,
+            logfile=self.logfile,
+            deepvariant_version=self.deepvariant_version))
+        self.strain_vcf(strain_name=strain_name)
+
+    def strain_freebayes(self, strain_name):
+        """
+        Create the gVCF file of a strain with freebayes-parallel, and filter, compress, index, and copy the file
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_sorted_bam_dict:
+            return
+        self.strain_vcf_dict.update(VCFMethods.freebayes(
+            strain_sorted_bam_dict={strain_name: self.strain_sorted_bam_dict[strain_name]},
+            strain_name_dict=self.strain_name_dict,
+            strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+            strain_ref_regions_dict=self.strain_ref_regions_dict,
+            threads=self.step_resources['freebayes']['threads'],
+            logfile=self.logfile))
+        self.strain_vcf(strain_name=strain_name)
+
+    def strain_vcf(self, strain_name):
+        """
+        Count the high quality SNPs in the gVCF file of a strain, then compress, index, and copy the file to the
+        vcf_files folder
+        :param strain_name: type STR: Name of the strain
+        """
+        if strain_name not in self.strain_vcf_dict:
+            return
+        strain_vcf_dict = {strain_name: self.strain_vcf_dict[strain_name]}
+        if 'deepvariant' in self.variant_caller:
+            self.strain_num_high_quality_snps_dict.update(VCFMethods.parse_gvcf(strain_vcf_dict=strain_vcf_dict))
+        else:
+            self.strain_num_high_quality_snps_dict.update(VCFMethods.parse_vcf(strain_vcf_dict=strain_vcf_dict))
+        strain_vcf_dict = VCFMethods.index_vcf_files(strain_vcf_dict=strain_vcf_dict,
+                                                     logfile=self.logfile)
+        VCFMethods.copy_vcf_files(strain_vcf_dict=strain_vcf_dict,
+                                  vcf_path=self.vcf_path)
+
+    def strain_routing(self):
+        """
+        Determine the strains passed to each species-specific stage of the analyses from the species of their closest
+        reference genome
+        """
+        logging.info('Routing strains to species-specific analyses')
+        self.strain_route_dict = VCFMethods.route_strains(strain_names=self.strain_fastq_dict,
+                                                          strain_species_dict=self.strain_species_dict,
+                                                          strain_best_ref_dict=self.strain_best_ref_dict)
+        if self.strain_route_dict['unmatched']:
+            logging.warning('Strains without a sufficiently close reference genome were not mapped: {strains}'
+                            .format(strains=', '.join(self.strain_route_dict['unmatched'])))
+        logging.debug('Strains routed to each analysis: \n{stages}'.format(
+            stages='\n'.join(['{stage}: {strains}'.format(stage=stage, strains=', '.join(strains))
+                              for stage, strains in self.strain_route_dict.items()])))
 
     def stat_calculation(self):
         """
         Calculate raw stats on FASTQ file size, quality and length distributions of FASTQ reads, and qualimap-generated
         statistics on reference mapping
         """
-        logging.info('Calculating quality and length distributions of FASTQ reads')
-        self.strain_qhist_dict, \
-            self.strain_lhist_dict = VCFMethods.run_reformat_reads(strain_fastq_dict=self.strain_fastq_dict,
-                                                                   strain_name_dict=self.strain_name_dict,
-                                                                   logfile=self.logfile)
-        self.strain_average_quality_dict, self.strain_qual_over_thirty_dict = \
-            VCFMethods.parse_quality_histogram(strain_qhist_dict=self.strain_qhist_dict)
+        logging.info('Summarising quality and length distributions of FASTQ reads')
+        self.strain_average_quality_dict, self.strain_qual_over_thirty_dict, self.strain_avg_read_lengths = \
+            QCMethods.summarise_stats(strain_read_stats_dict=self.strain_read_stats_dict)
         logging.debug('Average strain quality score: \n{files}'.format(
             files='\n'.join(['{strain_name}: {quality}'.format(strain_name=sn, quality=qs)
                              for sn, qs in self.strain_average_quality_dict.items()])))
-        self.strain_avg_read_lengths = VCFMethods.parse_length_histograms(strain_lhist_dict=self.strain_lhist_dict)
         logging.debug('Average strain read lengths: \n{files}'.format(
             files='\n'.join(['{strain_name}: {read_lengths}'.format(strain_name=sn, read_lengths=rl)
                              for sn, rl in self.strain_avg_read_lengths.items()])))
+        logging.debug('Estimated and effective coverage of the reads of each strain: \n{files}'.format(
+            files='\n'.join(['{strain_name}: {estimated:.2f} {effective:.2f}'.format(strain_name=sn,
+                                                                                     estimated=cov['estimated'],
+                                                                                     effective=cov['effective'])
+                             for sn, cov in self.strain_coverage_dict.items()])))
         logging.info('Calculating size of FASTQ files')
         self.strain_fastq_size_dict = VCFMethods.find_fastq_size(self.strain_fastq_dict)
         logging.debug('FASTQ file size: \n{files}'.format(
@@ -154,100 +628,26 @@ class VCF(object):
         logging.info('Counting of contigs in assemblies of unmapped reads')
         self.strain_unmapped_contigs_dict = VCFMethods.assembly_stats(
             strain_skesa_output_fasta_dict=self.strain_skesa_output_fasta_dict)
-        VCFMethods.samtools_index(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                  strain_name_dict=self.strain_name_dict,
-                                  threads=self.threads,
-                                  logfile=self.logfile)
         logging.debug('Number of contigs in SKESA assemblies: \n{files}'.format(
             files='\n'.join(['{strain_name}: {num_contigs}'.format(strain_name=sn, num_contigs=nc)
                              for sn, nc in self.strain_unmapped_contigs_dict.items()])))
-        logging.info('Running qualimap analyses on sorted BAM files')
-        strain_qualimap_report_dict = VCFMethods.run_qualimap(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                                              strain_name_dict=self.strain_name_dict,
-                                                              logfile=self.logfile)
+        logging.info('Parsing qualimap reports')
         self.strain_qualimap_outputs_dict = VCFMethods.parse_qualimap(
-            strain_qualimap_report_dict=strain_qualimap_report_dict)
-
-    def snp_calling(self):
-        """
-        Prep files for SNP calling. Use deepvariant to call SNPs. Parse the outputs from deepvariant
-        """
-        if 'deepvariant' in self.variant_caller:
-            logging.info('Preparing files for SNP calling with deepvariant make_examples')
-            strain_examples_dict, strain_variant_path_dict, strain_gvcf_tfrecords_dict = \
-                VCFMethods.deepvariant_make_examples(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                                     strain_name_dict=self.strain_name_dict,
-                                                     strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                                                     vcf_path=os.path.join(self.path, 'vcf_files'),
-                                                     home=self.home,
-                                                     threads=self.threads,
-                                                     logfile=self.logfile,
-                                                     deepvariant_version=self.deepvariant_version)
-            logging.info('Calling variants with deepvariant call_variants')
-            strain_call_variants_dict = \
-                VCFMethods.deepvariant_call_variants(strain_variant_path_dict=strain_variant_path_dict,
-                                                     strain_name_dict=self.strain_name_dict,
-                                                     dependency_path=self.dependency_path,
-                                                     vcf_path=os.path.join(self.path, 'vcf_files'),
-                                                     home=self.home,
-                                                     threads=self.threads,
-                                                     logfile=self.logfile,
-                                                     variant_caller=self.variant_caller,
-                                                     deepvariant_version=self.deepvariant_version)
-            logging.info('Creating VCF files with deepvariant postprocess_variants')
-            strain_vcf_dict = \
-                VCFMethods.deepvariant_postprocess_variants_multiprocessing(
-                    strain_call_variants_dict=strain_call_variants_dict,
-                    strain_variant_path_dict=strain_variant_path_dict,
-                    strain_name_dict=self.strain_name_dict,
-                    strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                    strain_gvcf_tfrecords_dict=strain_gvcf_tfrecords_dict,
-                    vcf_path=os.path.join(self.path, 'vcf_files'),
-                    home=self.home,
-                    logfile=self.logfile,
-                    deepvariant_version=self.deepvariant_version,
-                    threads=self.threads)
-            logging.info('Parsing gVCF files to find high quality SNPs')
-            self.strain_num_high_quality_snps_dict = VCFMethods.parse_gvcf(strain_vcf_dict=strain_vcf_dict)
-        else:
-            logging.info('Creating regions file for freebayes-parallel')
-            strain_ref_regions_dict = \
-                VCFMethods.reference_regions(strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                                             logfile=self.logfile)
-            logging.info('Creating gVCF files with freebayes-parallel')
-            strain_vcf_dict = VCFMethods.freebayes(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                                   strain_name_dict=self.strain_name_dict,
-                                                   strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                                                   strain_ref_regions_dict=strain_ref_regions_dict,
-                                                   threads=self.threads,
-                                                   logfile=self.logfile)
-            logging.info('Parsing gVCF files to find high quality SNPs')
-            self.strain_num_high_quality_snps_dict = VCFMethods.parse_vcf(strain_vcf_dict=strain_vcf_dict)
-        VCFMethods.copy_vcf_files(strain_vcf_dict=strain_vcf_dict,
-                                  vcf_path=os.path.join(self.path, 'vcf_files'))
-        logging.debug('Number high quality SNPs: \n{files}'.format(
-            files='\n'.join(['{strain_name}: {num_snps}'.format(strain_name=sn, num_snps=ns)
-                             for sn, ns in self.strain_num_high_quality_snps_dict.items()])))
+            strain_qualimap_report_dict=self.strain_qualimap_report_dict)
 
     def typing(self):
         """
         Perform typing analyses including spoligotyping, and the subsequence extraction of binary, octal, hexadecimal,
-        and sb codes. Also determine MLST profiles of samples
-        """
-        logging.info('Searching for matches to spoligo sequences')
-        strain_spoligo_stats_dict = VCFMethods.bait_spoligo(strain_fastq_dict=self.strain_fastq_dict,
-                                                            strain_name_dict=self.strain_name_dict,
-                                                            spoligo_file=os.path.join(self.dependency_path,
-                                                                                      'mycobacterium',
-                                                                                      'spacers.fasta'),
-                                                            threads=self.threads,
-                                                            logfile=self.logfile,
-                                                            kmer=25)
+        and sb codes of Mycobacterium tuberculosis complex strains. Also determine MLST profiles of Brucella strains
+        """
+        logging.debug('Number of reads examined for spoligotyping: \n{files}'.format(
+            files='\n'.join(['{strain_name}: {num_reads}'.format(strain_name=sn, num_reads=nr)
+                             for sn, nr in self.strain_spoligo_reads_dict.items()])))
         logging.info('Calculating binary, octal, and hexadecimal codes')
         self.strain_binary_code_dict, \
             self.strain_octal_code_dict, \
             self.strain_hexadecimal_code_dict = \
-            VCFMethods.parse_spoligo(strain_spoligo_stats_dict=strain_spoligo_stats_dict)
+            VCFMethods.parse_spoligo(strain_spoligo_stats_dict=self.strain_spoligo_stats_dict)
         logging.debug('Strain binary codes: \n{files}'.format(
             files='\n'.join(['{strain_name}: {binary_code}'.format(strain_name=sn, binary_code=bc)
                              for sn, bc in self.strain_binary_code_dict.items()])))
@@ -264,13 +664,20 @@ class VCF(object):
         logging.debug('Strain sb codes: \n{files}'.format(
             files='\n'.join(['{strain_name}: {sb_code}'.format(strain_name=sn, sb_code=sc)
                              for sn, sc in self.strain_sbcode_dict.items()])))
-        logging.info('Performing MLST analyses')
-        VCFMethods.brucella_mlst(seqpath=self.path,
-                                 mlst_db_path=os.path.join(self.dependency_path, 'brucella', 'MLST'),
-                                 logfile=self.logfile)
+        # Only Brucella strains are typed with MLST. Their FASTQ files are linked into a separate folder, so that the
+        # other strains are not analysed
+        mlst_path = os.path.join(self.path, 'mlst')
+        if self.strain_route_dict['mlst']:
+            logging.info('Performing MLST analyses')
+            VCFMethods.mlst_reads_folder(strain_fastq_dict=self.strain_fastq_dict,
+                                         mlst_strains=self.strain_route_dict['mlst'],
+                                         mlst_path=mlst_path)
+            VCFMethods.brucella_mlst(seqpath=mlst_path,
+                                     mlst_db_path=os.path.join(self.dependency_path, 'brucella', 'MLST'),
+                                     logfile=self.logfile)
         logging.info('Parsing MLST outputs')
         self.strain_mlst_dict = VCFMethods.parse_mlst_report(strain_name_dict=self.strain_name_dict,
-                                                             mlst_report=os.path.join(self.path, 'reports', 'mlst.csv'))
+                                                             mlst_report=os.path.join(mlst_path, 'reports', 'mlst.csv'))
         logging.debug('MLST results: \n{files}'.format(
             files='\n'.join(['{strain_name}: {mlst_result}'.format(strain_name=sn, mlst_result=mr)
                              for sn, mr in self.strain_mlst_dict.items()])))
@@ -296,9 +703,11 @@ class VCF(object):
             strain_sbcode_dict=self.strain_sbcode_dict,
             strain_hexadecimal_code_dict=self.strain_hexadecimal_code_dict,
             strain_binary_code_dict=self.strain_binary_code_dict,
-            report_path=self.report_path)
+            report_path=self.report_path,
+            strain_coverage_dict=self.strain_coverage_dict)
 
-    def __init__(self, path, threads, debug, reference_mapper, variant_caller, matching_hashes):
+    def __init__(self, path, threads, debug, reference_mapper, variant_caller, matching_hashes, memory=None,
+                 full_spoligo=False, cache_path=None, cache_size=default_cache_size, coverage=None):
         """
         :param path: type STR: Path of folder containing FASTQ files
         :param threads: type INT: Number of threads to use in the analyses
@@ -308,6 +717,14 @@ class VCF(object):
         freebayes)
         :param matching_hashes: type INT: Minimum number of matching hashes in MASH analyses in order for a match
         to be declared successful
+        :param memory: type FLOAT: Memory in GB available to the analyses. Defaults to the total memory of the system
+        :param full_spoligo: type BOOL: Boolean of whether the spacer sequences are baited from every read, rather than
+        from the reads required to resolve the presence or absence of every spacer
+        :param cache_path: type STR: Path of the folder of the cache of sketches, BAM files, and gVCF files shared
+        across projects. The cache is not used if not supplied
+        :param cache_size: type FLOAT: Maximum size of the cache in GB. The least recently used entries are evicted
+        :param coverage: type FLOAT: Coverage to which the reads of strains are downsampled before mapping. The reads
+        are not downsampled if not supplied
         """
         SetupLogging(debug=debug)
         # Determine the path in which the sequence files are located. Allow for ~ expansion
@@ -320,6 +737,7 @@ class VCF(object):
         logging.debug('Supplied sequence path: \n{path}'.format(path=self.path))
         # Initialise class variables
         self.threads = threads
+        self.memory = memory if memory else SchedulerMethods.system_memory()
         self.report_path = os.path.join(self.path, 'reports')
         # Extract the path of the folder containing this script
         self.script_path = os.path.abspath(os.path.dirname(__file__))
@@ -354,20 +772,52 @@ class VCF(object):
             if not cmd_sts:
                 raise subprocess.CalledProcessError(return_code, cmd=cmd)
         self.matching_hashes = matching_hashes
+        self.full_spoligo = full_spoligo
+        if cache_path and cache_path.startswith('~'):
+            self.cache_path = os.path.abspath(os.path.expanduser(cache_path))
+        else:
+            self.cache_path = os.path.abspath(cache_path) if cache_path else None
+        self.cache_size = cache_size
+        self.coverage = coverage
+        self.debug = debug
+        # Set the threads and memory used by each of the per-strain steps
+        self.step_resources = VCFMethods.strain_step_resources(threads=self.threads,
+                                                               variant_caller=self.variant_caller)
+        # Strains that share a reference genome must not index it concurrently, so each reference genome has a lock
+        self.reference_locks = dict()
+        self.reference_locks_lock = threading.Lock()
+        # The steps of a strain run concurrently, so updates to the strain manifests are serialised
+        self.manifest_lock = threading.Lock()
         self.logfile = os.path.join(self.path, 'log')
+        self.vcf_path = os.path.join(self.path, 'vcf_files')
         self.start_time = datetime.now()
         self.home = str(Path.home())
         self.strain_name_dict = dict()
         self.strain_fastq_dict = dict()
+        self.fastq_sketch_dict = dict()
         self.strain_best_ref_dict = dict()
         self.strain_ref_matches_dict = dict()
         self.strain_species_dict = dict()
+        self.batch_mash_strains = set()
+        self.batch_mash_lines_dict = dict()
+        self.batch_best_ref_dict = dict()
+        self.batch_ref_matches_dict = dict()
+        self.batch_species_dict = dict()
+        self.accession_species_dict = dict()
+        self.strain_mapper_index_dict = dict()
         self.strain_sorted_bam_dict = dict()
         self.strain_reference_abs_path_dict = dict()
         self.strain_reference_dep_path_dict = dict()
+        self.strain_ref_regions_dict = dict()
         self.strain_skesa_output_fasta_dict = dict()
-        self.strain_qhist_dict = dict()
-        self.strain_lhist_dict = dict()
+        self.strain_qualimap_report_dict = dict()
+        self.strain_spoligo_stats_dict = dict()
+        self.strain_spoligo_reads_dict = dict()
+        self.strain_variant_path_dict = dict()
+        self.strain_gvcf_tfrecords_dict = dict()
+        self.strain_call_variants_dict = dict()
+        self.strain_vcf_dict = dict()
+        self.strain_read_stats_dict = dict()
         self.strain_average_quality_dict = dict()
         self.strain_qual_over_thirty_dict = dict()
         self.strain_avg_read_lengths = dict()
@@ -380,6 +830,9 @@ class VCF(object):
         self.strain_hexadecimal_code_dict = dict()
         self.strain_sbcode_dict = dict()
         self.strain_mlst_dict = dict()
+        self.strain_route_dict = dict()
+        self.strain_coverage_dict = dict()
+        self.strain_mapping_fastq_dict = dict()
 
 
 def run_cmd(cmd):